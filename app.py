@@ -5,6 +5,7 @@ import random
 import calendar
 import logging
 import io
+import tempfile
 from io import BytesIO
 from datetime import datetime, date, timedelta, timezone
 from decimal import Decimal
@@ -30,6 +31,7 @@ from flask_login import (
     login_required, current_user
 )
 from flask_caching import Cache
+from markupsafe import Markup
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -50,7 +52,20 @@ from utils import db
 from utils.db import (
     get_schedule_table,
     get_schedules_with_formatting,
-    get_schedules_with_formatting_all 
+    get_schedules_by_date,
+    get_schedules_for_month,
+)
+from utils.user_directory import user_directory
+from utils.user_snapshot import user_snapshot
+from uguu.analytics_engine import analytics_engine
+from game.court_state import court_state_stats
+from game.pair_history import pair_history_stats
+from utils.fragment_cache import fragment_cache, schedule_stamp
+from utils.shared_cache import shared_cache
+from utils.points import delete_ledger_item, ledger_tx_items, put_ledger_item
+from utils.seat_reservation import (
+    ALREADY_JOINED, FULL, NOT_FOUND, NOT_JOINED, SeatConflict,
+    read_seats, release_seat, remove_from_list, repair_participants_count, reserve_seat,
 )
 
 from uguu.post import post
@@ -91,11 +106,18 @@ def create_app():
     )
 
     # --- Cache ---
-    app.config["CACHE_TYPE"] = "SimpleCache"
+    # gunicorn の複数ワーカーで共有できる backend を使う（既定は同じホスト内で共有する FileSystemCache）
+    #   CACHE_TYPE=RedisCache + CACHE_REDIS_URL=unix:///path/to/redis.sock でローカルソケットの Redis も可
+    #   CACHE_TYPE=SimpleCache ならプロセス内（従来どおり）
+    app.config["CACHE_TYPE"] = os.getenv("CACHE_TYPE", "FileSystemCache")
+    app.config["CACHE_DIR"] = os.getenv("CACHE_DIR", os.path.join(tempfile.gettempdir(), "uguis-cache"))
     app.config["CACHE_DEFAULT_TIMEOUT"] = 600
-    app.config["CACHE_THRESHOLD"] = 900
+    app.config["CACHE_THRESHOLD"] = int(os.getenv("CACHE_THRESHOLD", "5000"))
     app.config["CACHE_KEY_PREFIX"] = "uguis_"
+    if os.getenv("CACHE_REDIS_URL"):
+        app.config["CACHE_REDIS_URL"] = os.getenv("CACHE_REDIS_URL")
     cache.init_app(app)
+    shared_cache.init_app(app, cache)
 
     # --- CSRF（★ここが今回の核心） ---
     csrf.init_app(app)
@@ -633,9 +655,6 @@ class User(UserMixin):
 def get_participants_info(schedule):
     participants_info = []
     try:
-        table_name = current_app.config.get("TABLE_NAME_USER")
-        dynamodb = current_app.dynamodb
-
         raw = schedule.get("participants") or []
 
         ids = []
@@ -651,28 +670,7 @@ def get_participants_info(schedule):
         if not ids:
             return participants_info
 
-        batch_request = {
-            table_name: {
-                "Keys": [{"user#user_id": id} for id in ids],
-                "ProjectionExpression": "#uid, display_name, profile_image_url, skill_score, practice_count, gender",
-                "ExpressionAttributeNames": {"#uid": "user#user_id"}
-            }
-        }
-
-        responses = []
-        unprocessed = batch_request
-
-        client = dynamodb.meta.client if hasattr(dynamodb, "meta") else dynamodb
-
-        for attempt in range(5):
-            resp = client.batch_get_item(RequestItems=unprocessed)
-            responses.extend(resp.get("Responses", {}).get(table_name, []))
-            unprocessed = resp.get("UnprocessedKeys") or {}
-            if not unprocessed:
-                break
-            time.sleep(0.1 * (attempt + 1))
-
-        by_id = {it["user#user_id"]: it for it in responses}
+        by_id = user_directory.get_many(ids)
 
         # 修正後：1つのループに統合
         for uid in ids:
@@ -695,6 +693,7 @@ def get_participants_info(schedule):
                     "join_count": join_count,
                     "profile_image_url": profile_image_url,
                     "gender": user.get("gender", ""),
+                    "first_participation_date": user.get("first_participation_date"),
                     "is_valid": True,
                 })
             else:
@@ -717,38 +716,32 @@ def get_participants_info(schedule):
     return participants_info
 
 
-# さらに最適化版: バッチ取得
-@cache.memoize(timeout=600) 
 def get_all_users_dict():
-    """全ユーザーを1回のscanで取得し辞書として返す"""
+    """全ユーザーの {user_id: {user_id, display_name, skill_score}}（差分更新スナップショットから）"""
     try:
-        user_table = app.dynamodb.Table(app.table_name)
-        response = user_table.scan()  # 1回だけscan
-        
-        users_dict = {}
-        for user in response.get('Items', []):
-            user_id = user.get('user#user_id')
-            if user_id:
-                raw_score = user.get('skill_score')
-                if isinstance(raw_score, Decimal):
-                    skill_score = int(raw_score)
-                elif isinstance(raw_score, (int, float)):
-                    skill_score = int(raw_score)
-                else:
-                    skill_score = None
-                
-                users_dict[user_id] = {
-                    'user_id': user_id,
-                    'display_name': user.get('display_name', '名前なし'),
-                    'skill_score': skill_score
-                }
-        
-        logger.info(f"ユーザー辞書を作成: {len(users_dict)}人")
-        return users_dict
+        return user_snapshot.as_dict()
     except Exception as e:
         app.logger.error(f"ユーザー一括取得エラー: {str(e)}")
         return {}
 
+
+@app.route("/metrics/user_snapshot", methods=["GET"])
+@login_required
+def user_snapshot_metrics():
+    """ユーザースナップショット / UserDirectory のメモリ・更新コスト"""
+    if not getattr(current_user, "administrator", False):
+        return jsonify({"status": "error", "message": "権限がありません"}), 403
+    return jsonify({
+        "status": "ok",
+        "user_snapshot": user_snapshot.metrics(),
+        "user_directory": user_directory.stats(),
+        "fragment_cache": fragment_cache.stats(),
+        "shared_cache": shared_cache.stats(),
+        "analytics_engine": analytics_engine.metrics(),
+        "court_state": court_state_stats(),
+        "pair_history": pair_history_stats(),
+    })
+
 @app.template_filter('linkify')
 def linkify_filter(text):
     import re
@@ -801,15 +794,25 @@ def index():
     try:
         schedules = get_schedules_with_formatting()
 
-        table_name = (
-            current_app.config.get("TABLE_NAME_USER")
-            or getattr(current_app, "table_name", None)
-        )
-        if not table_name:
-            raise RuntimeError("TABLE_NAME_USER is not configured")
+        # =========================================================
+        # 0) 参加者アイコン欄の断片キャッシュ（updated_at と参加者の並びが同じなら描画済みを使う）
+        # =========================================================
+        pending = []
+        for schedule in schedules:
+            stamp = schedule_stamp(schedule)
+            key = f"{schedule.get('schedule_id')}#{schedule.get('date')}"
+            cached = fragment_cache.get("index_participants", key, stamp)
+            if cached is None:
+                pending.append((schedule, key, stamp))
+                continue
+            schedule["participants_html"] = cached["html"]
+            schedule["participants_count"] = cached["participants_count"]
+            schedule["tara_participants_info"] = cached["tara_participants_info"]
+            schedule["tara_participants"] = cached["tara_participants"]
+            schedule["tara_count"] = len(cached["tara_participants"])
 
         # =========================================================
-        # 1) 全スケジュールから user_id(UUID) を集める
+        # 1) キャッシュに無いスケジュールから user_id(UUID) を集める
         # =========================================================
         all_user_ids = set()
 
@@ -825,7 +828,7 @@ def index():
                 return item
             return None
 
-        for schedule in schedules:
+        for schedule, _key, _stamp in pending:
             for item in schedule.get("participants", []) or []:
                 uid = _extract_uid(item)
                 if uid:
@@ -839,54 +842,19 @@ def index():
         current_app.logger.info("[index] 取得するユーザー数: %d", len(all_user_ids))
 
         # =========================================================
-        # 2) DynamoDB BatchGet（100件ずつ）
-        #    - user# は使わない（UUIDのみ）
-        #    - UnprocessedKeys をリトライして取りこぼし防止
+        # 2) ユーザー情報を一括取得（UserDirectory）
+        #    - 100件ずつの BatchGet / UnprocessedKeys の再試行は UserDirectory 側
+        #    - キャッシュ済みのユーザーは DynamoDB に問い合わせない
         # =========================================================
-        user_cache = {}
-        user_ids_list = list(all_user_ids)
-
-        # current_app.dynamodb が resource / client どちらでも動くようにする
-        dynamo_client = getattr(current_app.dynamodb, "meta", None)
-        dynamo_client = dynamo_client.client if dynamo_client else current_app.dynamodb
-
-        batch_count = 0
         batch_start = time.time()
+        round_trips_before = user_directory.round_trips
 
-        def _cache_user(user_item: dict):
-            pk = user_item.get("user#user_id")  # この属性名はそのまま（値はUUIDのみ）
-            if pk:
-                user_cache[pk] = user_item
-
-        for i in range(0, len(user_ids_list), 100):
-            batch_ids = user_ids_list[i:i + 100]
-            keys = [{"user#user_id": uid} for uid in batch_ids if uid]
-
-            request_items = {table_name: {"Keys": keys}}
-            tries = 0
-
-            while request_items and tries < 5:
-                tries += 1
-                try:
-                    resp = dynamo_client.batch_get_item(RequestItems=request_items)
-                    batch_count += 1
-
-                    for user_item in resp.get("Responses", {}).get(table_name, []):
-                        _cache_user(user_item)
-
-                    # 取りこぼしがある場合は再試行
-                    request_items = resp.get("UnprocessedKeys", {})
-                    if request_items:
-                        time.sleep(min(0.2 * tries, 1.0))
-
-                except Exception as e:
-                    current_app.logger.error("[index] バッチ取得エラー: %s", e, exc_info=True)
-                    break
+        user_cache = user_directory.get_many(all_user_ids) if all_user_ids else {}
 
         batch_time = time.time() - batch_start
         current_app.logger.info(
-            "[index] DynamoDBバッチ取得: %d回, %.3f秒, キャッシュ件数: %d",
-            batch_count, batch_time, len(user_cache)
+            "[index] ユーザー取得: %d回, %.3f秒, 件数: %d",
+            user_directory.round_trips - round_trips_before, batch_time, len(user_cache)
         )
 
         # =========================================================
@@ -894,30 +862,6 @@ def index():
         # =========================================================
         process_start = time.time()
 
-        # 初参加判定: 全ユーザーの最初参加日を履歴テーブルから取得
-        user_min_date = {}
-        try:
-            history_table = current_app.dynamodb.Table("bad-users-history")
-            h_kwargs = {
-                'FilterExpression': Attr('status').eq('registered'),
-                'ProjectionExpression': 'user_id, #d',
-                'ExpressionAttributeNames': {'#d': 'date'},
-            }
-            while True:
-                h_resp = history_table.scan(**h_kwargs)
-                for item in h_resp.get('Items', []):
-                    uid = item.get('user_id')
-                    d = item.get('date', '')
-                    if uid and d:
-                        if uid not in user_min_date or d < user_min_date[uid]:
-                            user_min_date[uid] = d
-                lek = h_resp.get('LastEvaluatedKey')
-                if not lek:
-                    break
-                h_kwargs['ExclusiveStartKey'] = lek
-        except Exception as e:
-            current_app.logger.warning('[index] 初参加判定スキャン失敗: %s', e)
-
         def _pick_profile_url(user: dict):
             url = (
                 user.get("profile_image_url")
@@ -937,7 +881,7 @@ def index():
         def _get_user(uid: str):
             return user_cache.get(uid)
 
-        for schedule in schedules:
+        for schedule, key, stamp in pending:
             # --- 参加者 ---
             user_ids = []
             for item in schedule.get("participants", []) or []:
@@ -963,7 +907,8 @@ def index():
                     "organization": user.get("organization"),
                     "join_count": _to_int(user.get("practice_count"), 0),
                     "gender": user.get("gender", ""),
-                    "is_first_timer": user_min_date.get(uid_val) == schedule_date,
+                    # 初参加判定: BatchGet 済みの first_participation_date で判定（履歴scan不要）
+                    "is_first_timer": user.get("first_participation_date") == schedule_date,
                 })
 
             participants_info.sort(
@@ -1001,10 +946,21 @@ def index():
             schedule["tara_participants"] = tara_ids
             schedule["tara_count"] = len(tara_ids)
 
+            schedule["participants_html"] = Markup(
+                render_template("_index_participants.html", plist=participants_info)
+            )
+            fragment_cache.put("index_participants", key, stamp, {
+                "html": schedule["participants_html"],
+                "participants_count": schedule["participants_count"],
+                "tara_participants_info": tara_participants_info,
+                "tara_participants": tara_ids,
+            })
+
         process_time = time.time() - process_start
         total_time = time.time() - start_time
 
-        current_app.logger.info("[index] 参加者情報処理: %.3f秒", process_time)
+        current_app.logger.info("[index] 参加者情報処理: %.3f秒（断片キャッシュ ミス %d/%d件）",
+                                process_time, len(pending), len(schedules))
         current_app.logger.info("[index] 合計処理時間: %.3f秒", total_time)
 
         # =========================================================
@@ -1051,29 +1007,32 @@ def schedule_koyomi(year=None, month=None):
         calendar.setfirstweekday(calendar.SUNDAY)       
         cal = calendar.monthcalendar(year, month)
         
-        # スケジュール取得
-        schedules = get_schedules_with_formatting_all()
-        table_name = current_app.config.get("TABLE_NAME_USER") or "bad-users"
+        # スケジュール取得（表示する月の分だけ）
+        schedules = get_schedules_for_month(year, month)
+
+        # 0) 参加者アイコン欄の断片キャッシュ
+        pending = []
+        for schedule in schedules:
+            stamp = schedule_stamp(schedule)
+            key = f"{schedule.get('schedule_id')}#{schedule.get('date')}"
+            html = fragment_cache.get("koyomi_participants", key, stamp)
+            if html is None:
+                pending.append((schedule, key, stamp))
+            else:
+                schedule["participants_html"] = html
 
-        # 1) 全参加者の user_id を抽出
+        # 1) キャッシュに無いスケジュールの参加者 user_id を抽出
         all_uids = set()
-        for s in schedules:
+        for s, _key, _stamp in pending:
             for item in s.get("participants", []):
                 if isinstance(item, dict) and "S" in item: all_uids.add(item["S"])
                 elif isinstance(item, str): all_uids.add(item)
 
-        # 2) 参加者情報を一括取得 (BatchGet)
-        user_cache = {}
-        uid_list = list(all_uids)
-        for i in range(0, len(uid_list), 100):
-            batch = uid_list[i:i+100]
-            keys = [{"user#user_id": uid} for uid in batch]
-            res = current_app.dynamodb.batch_get_item(RequestItems={table_name: {"Keys": keys}})
-            for u in res.get("Responses", {}).get(table_name, []):
-                user_cache[u["user#user_id"]] = u
-
-        # 3) スケジュールに参加者情報を紐付け
-        for schedule in schedules:
+        # 2) 参加者情報を一括取得 (UserDirectory)
+        user_cache = user_directory.get_many(all_uids) if all_uids else {}
+
+        # 3) スケジュールに参加者情報を紐付け → アイコン欄を描画してキャッシュ
+        for schedule, key, stamp in pending:
             p_info = []
             raw_p = schedule.get("participants", [])
             for item in raw_p:
@@ -1094,31 +1053,51 @@ def schedule_koyomi(year=None, month=None):
                 x.get("display_name", "")
             ))
             schedule["participants_info"] = p_info
-        
-        # カレンダーデータ構築
-        calendar_data = []
+            schedule["participants_html"] = Markup(render_template("_koyomi_participants.html", plist=p_info))
+            fragment_cache.put("koyomi_participants", key, stamp, schedule["participants_html"])
+
+        # 4) カレンダー表（閲覧者ごとに変わるのは参加ボタンだけなので「参加中のスケジュール」で区分してキャッシュ）
         today_obj = date.today()
-        for week in cal:
-            week_data = []
-            for day_num in week:
-                if day_num == 0:
-                    week_data.append({'day': 0, 'is_other_month': True, 'schedules': []})
-                else:
-                    d_obj = date(year, month, day_num)
-                    d_str = d_obj.strftime('%Y-%m-%d')
-                    day_schedules = [s for s in schedules if s.get("date") == d_str]
-                    week_data.append({
-                        'day': day_num,
-                        'is_today': d_obj == today_obj,
-                        'is_other_month': False,
-                        'schedules': day_schedules,
-                        'has_schedule': len(day_schedules) > 0,
-                        'has_full_schedule': all(
-                            s.get('participants_count', 0) >= (s.get('adjusted_max') or s.get('max_participants', 10))
-                            for s in day_schedules
-                        ) if day_schedules else False
-                    })
-            calendar_data.append(week_data)
+        viewer_id = current_user.id if current_user.is_authenticated else None
+        if viewer_id:
+            joined = sorted(f"{s.get('schedule_id')}#{s.get('date')}" for s in schedules
+                            if viewer_id in (s.get("participants") or []))
+            variant = "auth:" + ",".join(joined)
+        else:
+            variant = "anon"
+        grid_stamp = (
+            today_obj.isoformat(),
+            tuple((s.get("schedule_id"), s.get("date"), schedule_stamp(s)) for s in schedules),
+        )
+
+        def _build_grid():
+            calendar_data = []
+            for week in cal:
+                week_data = []
+                for day_num in week:
+                    if day_num == 0:
+                        week_data.append({'day': 0, 'is_other_month': True, 'schedules': []})
+                    else:
+                        d_obj = date(year, month, day_num)
+                        d_str = d_obj.strftime('%Y-%m-%d')
+                        day_schedules = [s for s in schedules if s.get("date") == d_str]
+                        week_data.append({
+                            'day': day_num,
+                            'is_today': d_obj == today_obj,
+                            'is_other_month': False,
+                            'schedules': day_schedules,
+                            'has_schedule': len(day_schedules) > 0,
+                            'has_full_schedule': all(
+                                s.get('participants_count', 0) >= (s.get('adjusted_max') or s.get('max_participants', 10))
+                                for s in day_schedules
+                            ) if day_schedules else False
+                        })
+                calendar_data.append(week_data)
+            return Markup(render_template("_koyomi_grid.html", calendar_data=calendar_data, viewer_id=viewer_id))
+
+        calendar_html = fragment_cache.get_or_build(
+            "koyomi_grid", f"{year}-{month:02d}|{variant}", grid_stamp, _build_grid
+        )
 
         month_name = f"{month}月"
         selected_image = random.choice([f"images/top{i:03d}.jpg" for i in range(1, 6)])
@@ -1130,7 +1109,7 @@ def schedule_koyomi(year=None, month=None):
                                month_name=month_name,
                                prev_year=prev_year, prev_month=prev_month,
                                next_year=next_year, next_month=next_month,
-                               calendar_data=calendar_data)
+                               calendar_html=calendar_html)
         
     except Exception as e:
         current_app.logger.error(f"[schedule_koyomi] エラー: {e}", exc_info=True)
@@ -1147,7 +1126,7 @@ def day_of_participants():
             flash("日付が指定されていません", "warning")
             return redirect(url_for("index"))
 
-        schedules = get_schedules_with_formatting()
+        schedules = get_schedules_by_date(date)
         schedule = next((s for s in schedules if s.get("date") == date), None)
         if not schedule:
             flash(f"{date} のスケジュールが見つかりません", "warning")
@@ -1184,30 +1163,12 @@ def schedule_detail(schedule_id, date):
         )
 
         # 初参加判定: このスケジュール日より前の参加記録がないユーザーを特定
-        first_timer_ids = set()
-        try:
-            participant_ids = {p['user_id'] for p in participants_info if p.get('user_id')}
-            if participant_ids:
-                history_table = app.dynamodb.Table("bad-users-history")
-                past_participants = set()
-                scan_kwargs = {
-                    'FilterExpression': (Attr('date').lt(date) | Attr('event_date').lt(date))
-                                        & Attr('status').eq('registered'),
-                    'ProjectionExpression': 'user_id',
-                }
-                while True:
-                    resp = history_table.scan(**scan_kwargs)
-                    for item in resp.get('Items', []):
-                        uid = item.get('user_id')
-                        if uid in participant_ids:
-                            past_participants.add(uid)
-                    lek = resp.get('LastEvaluatedKey')
-                    if not lek:
-                        break
-                    scan_kwargs['ExclusiveStartKey'] = lek
-                first_timer_ids = participant_ids - past_participants
-        except Exception as e:
-            app.logger.warning(f'[first_timer] 判定失敗: {e}')
+        # （bad-users.first_participation_date で判定するので履歴scanは不要）
+        first_timer_ids = {
+            p['user_id'] for p in participants_info
+            if p.get('is_valid') and p.get('user_id')
+            and (not p.get('first_participation_date') or p['first_participation_date'] >= date)
+        }
 
         # 参加状態
         is_joined = current_user.is_authenticated and current_user.id in schedule.get('participants', [])
@@ -1290,22 +1251,20 @@ def remove_noshow(schedule_id, date, user_id):
     if not getattr(current_user, 'administrator', False):
         return jsonify({'status': 'error', 'message': '権限がありません'}), 403
     try:
-        schedule_table = app.dynamodb.Table(app.table_name_schedule)
         users_table    = app.dynamodb.Table(app.table_name_users)
         history_table  = app.dynamodb.Table("bad-users-history")
 
-        # 1) スケジュールのparticipantsから除去
-        resp = schedule_table.get_item(Key={'schedule_id': schedule_id, 'date': date})
-        schedule = resp.get('Item', {})
-        participants = [p for p in schedule.get('participants', []) if p != user_id]
-        schedule_table.update_item(
-            Key={'schedule_id': schedule_id, 'date': date},
-            UpdateExpression='SET participants = :p, participants_count = :c',
-            ExpressionAttributeValues={
-                ':p': participants,
-                ':c': len(participants)
-            }
-        )
+        # 1) スケジュールのparticipantsから除去（本人の位置を条件に REMOVE。リストごとの上書きはしない）
+        client = app.dynamodb.meta.client
+        try:
+            release_seat(client, app.table_name_schedule, schedule_id, date, user_id,
+                         now_iso=datetime.now(timezone.utc).isoformat())
+        except SeatConflict as c:
+            if c.reason == NOT_FOUND:
+                return jsonify({'status': 'error', 'message': 'スケジュールが見つかりません'}), 404
+            if c.reason != NOT_JOINED:
+                raise
+            # 既に participants に居ない（参加取り消し済み）→ 履歴側の削除だけ行う
 
         # 2) 参加履歴（bad-users-history）からその日の記録を削除
         hist_resp = history_table.query(
@@ -1314,9 +1273,21 @@ def remove_noshow(schedule_id, date, user_id):
         for item in hist_resp.get('Items', []):
             event_date = item.get('event_date') or item.get('joined_at', '')[:10]
             if event_date == date and item.get('status') != 'cancelled':
-                history_table.delete_item(
-                    Key={'user_id': item['user_id'], 'joined_at': item['joined_at']}
-                )
+                # 台帳集計（ugu_points_v2 の ledger_*）からも同じトランザクションで引く
+                try:
+                    delete_ledger_item(history_table, item)
+                except ClientError as e:
+                    # 同時に消された行（条件で弾かれる）は引き済みなので飛ばす
+                    if e.response['Error']['Code'] != 'TransactionCanceledException':
+                        raise
+                    app.logger.info(f"[remove_noshow] 削除済みの履歴: {item['joined_at']}")
+
+        # 初参加日がこの日だった場合に備えて再計算
+        try:
+            app.uguu_db.recompute_first_participation(user_id)
+        except Exception as e:
+            app.logger.warning(f'[remove_noshow] first_participation_date 再計算失敗: {e}')
+        app.uguu_db.bump_stats_version(user_id)
 
         # 3) practice_countをデクリメント
         try:
@@ -1330,6 +1301,10 @@ def remove_noshow(schedule_id, date, user_id):
             if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
                 raise
 
+        # 参加回数・初参加日が変わったので、ユーザーのキャッシュと描画済み断片はすべての更新の後で落とす
+        user_directory.invalidate(user_id)
+        fragment_cache.invalidate_schedule(schedule_id, date)
+
         app.logger.info(f'[remove_noshow] schedule={schedule_id} date={date} user={user_id}')
         return jsonify({'status': 'success', 'message': '参加記録を削除しました'})
 
@@ -1341,6 +1316,11 @@ def remove_noshow(schedule_id, date, user_id):
 @app.route('/schedule/<string:schedule_id>/join', methods=['POST'])
 @login_required
 def join_schedule(schedule_id):
+    """
+    参加登録/キャンセルのトグル
+    participants の更新は条件付き（定員・重複はサーバー側で判定）なので同時申し込みでも参加が消えない。
+    参加時は 座席 + 履歴（台帳集計）+ practice_count/最終参加日 を1トランザクションで書く。
+    """
     try:
         data = request.get_json() or {}
         date = (data.get('date') or "").strip()
@@ -1349,31 +1329,70 @@ def join_schedule(schedule_id):
             app.logger.warning(f"'date' is not provided for schedule_id={schedule_id}")
             return jsonify({'status': 'error', 'message': '日付が不足しています。'}), 400
 
-        schedule_table = app.dynamodb.Table(app.table_name_schedule)
+        client = app.dynamodb.meta.client
+        schedule_table_name = app.table_name_schedule
+        user_id = current_user.id
+        now_utc_iso = datetime.now(timezone.utc).isoformat()
 
-        # スケジュール取得
-        response = schedule_table.get_item(Key={'schedule_id': schedule_id, 'date': date})
-        schedule = response.get('Item')
-        if not schedule:
+        # 履歴に残す場所だけ読む（参加者リストは読まない）
+        meta = app.dynamodb.Table(schedule_table_name).get_item(
+            Key={'schedule_id': schedule_id, 'date': date},
+            ProjectionExpression="#loc, #venue",
+            ExpressionAttributeNames={"#loc": "location", "#venue": "venue"},
+        ).get('Item')
+        if meta is None:
             return jsonify({'status': 'error', 'message': 'スケジュールが見つかりません。'}), 404
+        location = meta.get("location") or meta.get("venue") or "未設定"
 
-        user_id = current_user.id
-
-        participants = schedule.get('participants', []) or []
-        tara_participants = schedule.get('tara_participants', []) or []
+        join_item = {
+            "user_id": user_id,
+            "joined_at": now_utc_iso,
+            "schedule_id": schedule_id,
+            "date": date,
+            "location": location,
+            "status": "registered",
+            "action": "join",
+        }
+        # 履歴は「毎回」追加（ugu_points_v2 の台帳集計も同時に更新）
+        history_tx = ledger_tx_items("bad-users-history", join_item)
+        user_tx = _participation_user_tx_item(user_id, date, now_utc_iso)
 
-        history_table = app.dynamodb.Table("bad-users-history")
-        users_table = app.dynamodb.Table("bad-users")  # ★追加：最終参加日更新用
+        try:
+            try:
+                reserve_seat(client, schedule_table_name, schedule_id, date, user_id,
+                             extra_tx_items=history_tx + [user_tx], now_iso=now_utc_iso)
+            except SeatConflict as c:
+                if c.failed_index is None:
+                    raise
+                if c.failed_index != 1 + len(history_tx):
+                    # 履歴・台帳集計の項目で弾かれた → 同じ項目での再試行は通らないので失敗として返す
+                    app.logger.error(
+                        "[join_schedule] 履歴の書き込み条件で失敗: user=%s index=%s", user_id, c.failed_index
+                    )
+                    return jsonify({'status': 'error', 'message': '参加登録に失敗しました。もう一度お試しください。'}), 409
+                # bad-users が無い（キー違い等）→ 座席と履歴だけ確定させる
+                app.logger.warning("[join_schedule] practice_count を更新できないユーザー: %s", user_id)
+                reserve_seat(client, schedule_table_name, schedule_id, date, user_id,
+                             extra_tx_items=history_tx, now_iso=now_utc_iso)
+            message = "参加登録が完了しました！"
+            is_joining = True
 
-        now_utc_iso = datetime.now(timezone.utc).isoformat()
+        except SeatConflict as c:
+            if c.reason == NOT_FOUND:
+                return jsonify({'status': 'error', 'message': 'スケジュールが見つかりません。'}), 404
+            if c.reason == FULL:
+                return jsonify({'status': 'error', 'message': '満員のため参加できません。'}), 400
+            if c.reason != ALREADY_JOINED:
+                raise
 
-        # 参加キャンセル
-        if user_id in participants:
-            participants.remove(user_id)
+            # 参加キャンセル（保険として「キャンセル」履歴も同じトランザクションで1件追加）
+            cancel_item = {**join_item, "status": "cancelled", "action": "cancel"}
+            release_seat(client, schedule_table_name, schedule_id, date, user_id, current=c.item,
+                         extra_tx_items=ledger_tx_items("bad-users-history", cancel_item), now_iso=now_utc_iso)
             message = "参加をキャンセルしました"
             is_joining = False
 
-            # 1) 既存の履歴を「cancelled」に更新（既存関数）
+            # 既存の履歴を「cancelled」に更新（既存関数）
             try:
                 db.cancel_participation(user_id, date, schedule_id)
                 app.logger.info(
@@ -1382,93 +1401,35 @@ def join_schedule(schedule_id):
             except Exception as e:
                 app.logger.error(f"[cancel_participation エラー]: {e}")
 
-            # 2) 保険として「キャンセル」履歴も1件追加
-            try:
-                history_table.put_item(
-                    Item={
-                        "user_id": user_id,
-                        "joined_at": now_utc_iso,
-                        "schedule_id": schedule_id,
-                        "date": date,
-                        "location": schedule.get("location") or schedule.get("venue") or "未設定",
-                        "status": "cancelled",
-                        "action": "cancel",
-                    }
-                )
-            except Exception as e:
-                app.logger.error(f"[キャンセル履歴保存エラー] bad-users-history: {e}")
-
             # ※キャンセル時は last_participation_date を更新しない（巻き戻しが必要になるため）
             #   必要になったら後で仕様を決めて実装
 
-        # 参加登録（正式参加）
-        else:
-            max_participants = int(schedule.get('max_participants') or 15)
-            adjusted_max = schedule.get('adjusted_max')
-            effective_max = int(adjusted_max) if adjusted_max else max_participants
-            if len(participants) >= effective_max:
-                return jsonify({'status': 'error', 'message': '満員のため参加できません。'}), 400
-
-            participants.append(user_id)
-            message = "参加登録が完了しました！"
-            is_joining = True
+        # 確定後の参加者・たら（必要な属性だけ強い整合性で読む）
+        seats = read_seats(client, schedule_table_name, schedule_id, date)
 
+        if is_joining:
             # 正式参加したら「たら」から自動削除
-            if user_id in tara_participants:
-                tara_participants.remove(user_id)
+            if remove_from_list(client, schedule_table_name, schedule_id, date, "tara_participants", user_id, seats):
+                seats = read_seats(client, schedule_table_name, schedule_id, date)
                 app.logger.info(
                     f"✓ ユーザー {user_id} の「たら」を自動削除しました (schedule_id={schedule_id}, date={date})"
                 )
 
-            # 参加回数カウントは初回だけ（この日付に未参加の場合のみ）
-            if not previously_joined(schedule_id, date, user_id):
-                try:
-                    increment_practice_count(user_id)
-                except Exception as e:
-                    app.logger.error(f"[practice_count 更新エラー]: {e}")
-
-            # 履歴は「毎回」追加
+            # 初参加日インデックス（トップページの初参加バッジ用）
             try:
-                history_table.put_item(
-                    Item={
-                        "user_id": user_id,
-                        "joined_at": now_utc_iso,
-                        "schedule_id": schedule_id,
-                        "date": date,
-                        "location": schedule.get("location") or schedule.get("venue") or "未設定",
-                        "status": "registered",
-                        "action": "join",
-                    }
-                )
+                app.uguu_db.update_first_participation(user_id, date)
             except Exception as e:
-                app.logger.error(f"[履歴保存エラー] bad-users-history: {e}")
+                app.logger.error(f"[first_participation 更新エラー] bad-users: {e}")
 
-            # ★追加：最終参加日を bad-users に反映（registered のときだけ）
-            try:
-                update_last_participation(users_table, user_id=user_id, event_date=date)
-                app.logger.info(f"✓ last_participation_date updated: user_id={user_id}, date={date}")
-            except Exception as e:
-                app.logger.error(f"[last_participation 更新エラー] bad-users: {e}")
+        repair_participants_count(client, schedule_table_name, schedule_id, date, seats)
+        participants = seats.get('participants') or []
+        tara_participants = seats.get('tara_participants') or []
 
-        # スケジュール更新（participants / count / tara も一緒に更新）
-        schedule_table.update_item(
-            Key={'schedule_id': schedule_id, 'date': date},
-            UpdateExpression=(
-                "SET participants = :participants, "
-                "participants_count = :count, "
-                "tara_participants = :tara, "
-                "updated_at = :ua"
-            ),
-            ExpressionAttributeValues={
-                ':participants': participants,
-                ':count': len(participants),
-                ':tara': tara_participants,
-                ':ua': now_utc_iso,
-            }
-        )
-
-        # キャッシュリセット
-        cache.delete_memoized(get_schedules_with_formatting)
+        # 参加/キャンセルどちらでも practice_count・初参加日が変わりうるので、
+        # ユーザーのキャッシュを落としてから描画済み断片を落とす（古いユーザー情報で断片を作り直さない）
+        user_directory.invalidate(user_id)
+        fragment_cache.invalidate_schedule(schedule_id, date)
+        app.uguu_db.bump_stats_version(user_id)
 
         return jsonify({
             'status': 'success',
@@ -1485,36 +1446,37 @@ def join_schedule(schedule_id):
     except Exception as e:
         app.logger.error(f"Unexpected error in join_schedule: {str(e)}", exc_info=True)
         return jsonify({'status': 'error', 'message': '予期しないエラーが発生しました。'}), 500
-    
 
-def update_last_participation(users_table, user_id: str, event_date: str):
+
+def _participation_user_tx_item(user_id: str, event_date: str, now_utc_iso: str) -> dict:
     """
-    bad-users の最終参加日を更新（registered のときに呼ぶ）
-    user_id: "uuid..."
-    event_date: "YYYY-MM-DD"
-    
-    ★変更点: recent_sk を固定化（日付を含めない）
-    → 1ユーザー1GSIエントリになり、重複が発生しない
+    参加登録と同じトランザクションで bad-users を更新する項目
+    - practice_count +1
+    - 最終参加日（recent_sk は固定: 1ユーザー1GSIエントリ）
     """
-    now_utc_iso = datetime.now(timezone.utc).isoformat()
-
-    users_table.update_item(
-        Key={"user#user_id": user_id},  # user#プレフィックスなし
-        UpdateExpression=(
-            "SET last_participation_date = :d, "
+    return {"Update": {
+        "TableName": app.table_name_users,
+        "Key": {"user#user_id": {"S": user_id}},
+        "UpdateExpression": (
+            "SET practice_count = if_not_exists(practice_count, :zero) + :one, "
+            "last_participation_date = :d, "
             "recent_pk = :pk, "
             "recent_sk = :sk, "
             "last_participation_updated_at = :u"
         ),
-        ExpressionAttributeValues={
-            ":d": event_date,
-            ":pk": "recent",            
-            ":sk": user_id,
-            ":u": now_utc_iso,
+        "ConditionExpression": "attribute_exists(#pk)",
+        "ExpressionAttributeNames": {"#pk": "user#user_id"},
+        "ExpressionAttributeValues": {
+            ":zero": {"N": "0"},
+            ":one": {"N": "1"},
+            ":d": {"S": event_date},
+            ":pk": {"S": "recent"},
+            ":sk": {"S": user_id},
+            ":u": {"S": now_utc_iso},
         },
-    )
-    
-    
+    }}
+
+
 @app.route('/tara_join', methods=['POST'])
 @login_required
 def tara_join():
@@ -1554,8 +1516,9 @@ def tara_join():
 
             # ★解除も履歴に残す（後から正しく判定できる）
             try:
-                history_table.put_item(
-                    Item={
+                put_ledger_item(
+                    history_table,
+                    {
                         "user_id": user_id,
                         "joined_at": now_utc,
                         "schedule_id": schedule_id,
@@ -1575,8 +1538,9 @@ def tara_join():
 
             # ★たらは tentative（仮参加）として保存
             try:
-                history_table.put_item(
-                    Item={
+                put_ledger_item(
+                    history_table,
+                    {
                         "user_id": user_id,
                         "joined_at": now_utc,
                         "schedule_id": schedule_id,
@@ -1596,7 +1560,8 @@ def tara_join():
             ExpressionAttributeValues={':tp': tara_participants, ':ua': now_utc}
         )
 
-        cache.delete_memoized(get_schedules_with_formatting)
+        fragment_cache.invalidate_schedule(schedule_id, schedule_date)
+        app.uguu_db.bump_stats_version(user_id)
 
         return jsonify({
             'status': 'success',
@@ -1609,43 +1574,6 @@ def tara_join():
         app.logger.error(f"「たら」参加処理エラー: {e}")
         return jsonify({'status': 'error', 'message': '処理中にエラーが発生しました'}), 500
 
-def previously_joined(schedule_id, date, user_id):
-    """
-    指定日付のスケジュールにすでに参加済みかを確認する。
-    同一 schedule_id の別日付は別カウントとして扱う。
-    """
-    schedule_table = app.dynamodb.Table(app.table_name_schedule)
-
-    response = schedule_table.get_item(Key={'schedule_id': schedule_id, 'date': date})
-    item = response.get('Item') or {}
-    participants = item.get('participants') or []
-    return user_id in participants
-
-def _user_pk(user_id: str) -> dict:
-    return {"user#user_id": user_id}
-
-def increment_practice_count(user_id):
-    user_table = app.dynamodb.Table(app.table_name_users)
-
-    try:
-        user_table.update_item(
-            Key=_user_pk(user_id),
-            UpdateExpression="SET practice_count = if_not_exists(practice_count, :start) + :inc",
-            ExpressionAttributeValues={
-                ":start": Decimal(0),
-                ":inc": Decimal(1),
-            },
-            ConditionExpression="attribute_exists(#pk)",
-            ExpressionAttributeNames={"#pk": "user#user_id"},
-        )
-    except ClientError as e:
-        # キー間違い/ユーザー未作成ならここに来る
-        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
-            app.logger.warning("[increment_practice_count] user not found: %s", user_id)
-            return False
-        raise
-    return True
-
 @app.route('/participants/by_date/<schedule_id>')
 @login_required
 def participants_by_date(schedule_id):
@@ -1814,6 +1742,7 @@ def temp_register():
             }
 
             table.put_item(Item=temp_data)
+            user_directory.invalidate(user_id)
 
             flash("仮登録が完了しました。ログインしてください。", "success")
             return redirect(url_for('login'))
@@ -2002,36 +1931,7 @@ def user_maintenance():
         # ユーザー情報を取得
         user_ids = list(user_last_dates.keys())
         
-        users_data = {}
-        if user_ids:
-            users_table = app.dynamodb.Table(app.table_name_users)
-            
-            # バッチ取得（100件ずつ）+ 未処理キーの再取得
-            for i in range(0, len(user_ids), 100):
-                batch_ids = user_ids[i:i + 100]
-                keys = [{"user#user_id": uid} for uid in batch_ids]
-                
-                request_items = {app.table_name_users: {"Keys": keys}}
-                
-                try:
-                    # ★未処理キーがなくなるまで繰り返し
-                    while request_items:
-                        batch_response = app.dynamodb.batch_get_item(RequestItems=request_items)
-                        
-                        for user in batch_response.get("Responses", {}).get(app.table_name_users, []):
-                            uid = user.get("user#user_id", "")  
-                            users_data[uid] = user
-                        
-                        # 未処理キーを確認
-                        unprocessed = batch_response.get("UnprocessedKeys", {})
-                        if unprocessed:
-                            current_app.logger.warning(f"[user_maintenance] 未処理キー: {len(unprocessed.get(app.table_name_users, {}).get('Keys', []))}件")
-                            request_items = unprocessed
-                        else:
-                            request_items = None
-                        
-                except Exception as e:
-                    current_app.logger.error(f"[user_maintenance] バッチ取得エラー: {e}")
+        users_data = user_directory.get_many(user_ids)
         
         current_app.logger.info(f"[user_maintenance] ユーザー情報取得: {len(users_data)}人")
         
@@ -2302,6 +2202,8 @@ def account(user_id):
                         ExpressionAttributeNames={"#pk": "user#user_id"},
                         ReturnValues="ALL_NEW"
                     )
+                    user_directory.invalidate(user_id)
+                    app.uguu_db.bump_stats_version(user_id)  # 生年月日・性別はポイント倍率に効く
                     flash('プロフィールが更新されました。', 'success')
                 else:
                     flash('更新する項目がありません。', 'info')
@@ -2473,7 +2375,7 @@ def remove_participant_from_date():
             return jsonify({"success": False, "message": "必要な情報が不足しています"}), 400
         
         # スケジュールを取得
-        schedules = get_schedules_with_formatting()
+        schedules = get_schedules_by_date(date)
         target_schedule = next((s for s in schedules if s.get("date") == date), None)
         
         if not target_schedule:
@@ -2483,43 +2385,28 @@ def remove_participant_from_date():
             }), 404
         
         schedule_id = target_schedule.get('schedule_id')
-        participants = target_schedule.get('participants', [])
-        
+
         print(f"対象スケジュール: {schedule_id}")
         print(f"対象日付: {date}")
-        print(f"現在の参加者数: {len(participants)}")
         print(f"削除対象: {user_id_to_remove}")
-        
-        if user_id_to_remove not in participants:
+
+        # 参加者リストから削除（本人の位置を条件に REMOVE。一覧の値は古いことがあるので release_seat が読み直す）
+        try:
+            release_seat(app.dynamodb.meta.client, app.table_name_schedule, schedule_id, date,
+                         user_id_to_remove, now_iso=datetime.now(timezone.utc).isoformat())
+        except SeatConflict as c:
+            if c.reason == NOT_FOUND:
+                return jsonify({
+                    "success": False,
+                    "message": f"日付 {date} のスケジュールが見つかりません"
+                }), 404
+            if c.reason != NOT_JOINED:
+                raise
             return jsonify({
-                "success": False, 
+                "success": False,
                 "message": "指定されたユーザーは参加していません"
             })
-        
-        # 参加者リストから削除
-        updated_participants = [p for p in participants if p != user_id_to_remove]
-        
-        print(f"更新後の参加者数: {len(updated_participants)}")
-        
-        schedule_table = get_schedule_table()
-        
-        # 複合主キーを使用（schedule_id + date）
-        composite_key = {
-            "schedule_id": schedule_id,
-            "date": date
-        }
-        
-        print(f"使用する複合キー: {composite_key}")
-        
-        update_response = schedule_table.update_item(
-            Key=composite_key,
-            UpdateExpression="SET participants = :participants, participants_count = :count",
-            ExpressionAttributeValues={
-                ":participants": updated_participants,
-                ":count": len(updated_participants)
-            },
-            ReturnValues="UPDATED_NEW"
-        )
+        fragment_cache.invalidate_schedule(schedule_id, date)
         
         app.logger.info(f"参加者削除完了: schedule_id={schedule_id}")
         
@@ -2888,6 +2775,7 @@ def profile_image_edit(user_id):
                 },
                 ReturnValues="NONE"
             )
+            user_directory.invalidate(user_id)
 
             flash('プロフィール画像を更新しました。', 'success')
             return redirect(url_for('account', user_id=user_id))
@@ -3525,45 +3413,27 @@ def remove_participant(schedule_id, user_id):
         if not date:
             return jsonify({'status': 'error', 'message': '日付が不足しています。'}), 400
 
-        # スケジュールの取得
-        schedule_table = app.dynamodb.Table(app.table_name_schedule)
-        response = schedule_table.get_item(
-            Key={
-                'schedule_id': schedule_id,
-                'date': date
-            }
-        )
-        schedule = response.get('Item')
-        if not schedule:
-            return jsonify({'status': 'error', 'message': 'スケジュールが見つかりません。'}), 404
+        # 参加者リストから削除（本人の位置を条件に REMOVE。同時の参加登録を上書きしない）
+        client = app.dynamodb.meta.client
+        try:
+            release_seat(client, app.table_name_schedule, schedule_id, date, user_id,
+                         now_iso=datetime.now(timezone.utc).isoformat())
+        except SeatConflict as c:
+            if c.reason == NOT_FOUND:
+                return jsonify({'status': 'error', 'message': 'スケジュールが見つかりません。'}), 404
+            if c.reason == NOT_JOINED:
+                return jsonify({'status': 'error', 'message': 'この参加者は登録されていません。'}), 400
+            raise
 
-        # 参加者リストから削除
-        participants = schedule.get('participants', [])
-        
-        if user_id not in participants:
-            return jsonify({'status': 'error', 'message': 'この参加者は登録されていません。'}), 400
-        
-        participants.remove(user_id)
-        
         # bad-users-historyのstatusを更新（schedule_idも渡す）
         db.cancel_participation(user_id, date, schedule_id)  # ★ schedule_idを追加
         app.logger.info(f"✓ 管理者がユーザー {user_id} を削除しました (date={date}, schedule_id={schedule_id})")
-        
-        # DynamoDB の更新
-        schedule_table.update_item(
-            Key={
-                'schedule_id': schedule_id,
-                'date': date
-            },
-            UpdateExpression="SET participants = :participants, participants_count = :count",
-            ExpressionAttributeValues={
-                ':participants': participants,
-                ':count': len(participants)
-            }
-        )
 
-        # キャッシュのリセット
-        cache.delete_memoized(get_schedules_with_formatting)
+        # 描画済み断片を落とす
+        fragment_cache.invalidate_schedule(schedule_id, date)
+
+        # 削除後の参加者（必要な属性だけ強い整合性で読む）
+        participants = read_seats(client, app.table_name_schedule, schedule_id, date).get('participants') or []
 
         return jsonify({
             'status': 'success',
@@ -0,0 +1,113 @@
+# bad-users-history から各ユーザーの初参加日を集計し、bad-users.first_participation_date に書き込むバックフィルです。
+# トップページの初参加バッジは、この属性を BatchGet で読むだけで判定します（履歴scan不要）。
+#
+# 使い方:
+#   python backfill_first_participation.py            # DRY-RUN（差分の表示のみ）
+#   python backfill_first_participation.py --apply    # 実際に書き込む
+
+import os, argparse
+import boto3
+from dotenv import load_dotenv
+
+from uguu.dynamo import is_first_participation_record
+
+load_dotenv()
+
+AWS_REGION = os.getenv("AWS_REGION", "ap-northeast-1")
+USERS_TABLE = os.getenv("TABLE_NAME_USER", "bad-users")
+HISTORY_TABLE = os.getenv("DYNAMO_BAD_USERS_HISTORY", "bad-users-history")
+
+ddb = boto3.resource(
+    "dynamodb",
+    region_name=AWS_REGION,
+    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+)
+
+
+def _scan_all(tbl, **kw):
+    items = []
+    while True:
+        resp = tbl.scan(**kw)
+        items += resp.get("Items", [])
+        lek = resp.get("LastEvaluatedKey")
+        if not lek:
+            break
+        kw["ExclusiveStartKey"] = lek
+    return items
+
+
+def main(apply: bool):
+    users_tbl = ddb.Table(USERS_TABLE)
+    history_tbl = ddb.Table(HISTORY_TABLE)
+
+    # 1) 履歴を1回だけ全件scanして user_id -> 最小日付
+    history = _scan_all(
+        history_tbl,
+        ProjectionExpression="user_id, #d, #st, entity_type",
+        ExpressionAttributeNames={"#d": "date", "#st": "status"},
+    )
+    first_dates = {}
+    for item in history:
+        uid = item.get("user_id")
+        if not uid or not is_first_participation_record(item):
+            continue
+        d = item["date"]
+        if uid not in first_dates or d < first_dates[uid]:
+            first_dates[uid] = d
+    print(f"[INFO] history rows={len(history)} users_with_first_date={len(first_dates)}")
+
+    # 2) 現在値と比較して差分だけ書き込む
+    users = _scan_all(
+        users_tbl,
+        ProjectionExpression="#pk, first_participation_date",
+        ExpressionAttributeNames={"#pk": "user#user_id"},
+    )
+    updated = removed = unchanged = failed = 0
+
+    for u in users:
+        uid = u.get("user#user_id")
+        if not uid:
+            continue
+        current = u.get("first_participation_date")
+        expected = first_dates.get(uid)
+
+        if current == expected:
+            unchanged += 1
+            continue
+
+        if not apply:
+            print(f"[DRYRUN] {uid} {current} -> {expected}")
+            updated += 1 if expected else 0
+            removed += 0 if expected else 1
+            continue
+
+        try:
+            if expected:
+                users_tbl.update_item(
+                    Key={"user#user_id": uid},
+                    UpdateExpression="SET first_participation_date = :d",
+                    ExpressionAttributeValues={":d": expected},
+                )
+                updated += 1
+            else:
+                users_tbl.update_item(
+                    Key={"user#user_id": uid},
+                    UpdateExpression="REMOVE first_participation_date",
+                )
+                removed += 1
+        except Exception as e:
+            failed += 1
+            print(f"[ERROR] update failed user={uid}: {e}")
+
+    print(f"[DONE] users={len(users)} updated={updated} removed={removed} "
+          f"unchanged={unchanged} failed={failed}")
+    if not apply:
+        print("[NOTE] DRY-RUN。--apply を付ければ書き込みます。")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--apply", action="store_true", help="実際に書き込む（省略時はDRY-RUN）")
+    args = ap.parse_args()
+    main(apply=args.apply)
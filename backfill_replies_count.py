@@ -0,0 +1,86 @@
+"""
+uguu_post の各投稿に replies_count（返信数カウンタ）を埋める
+
+タイムラインは投稿の replies_count を表示に使い、無い投稿だけ post-replies を COUNT する。
+返信の作成/削除はカウンタの無い投稿なら実数で初期化してから増減するので、このスクリプトは
+まだ返信の付いていない古い投稿の COUNT を無くすため（と、ずれの点検）に使う。
+何度実行しても同じ結果（実際の返信件数で SET する）。
+
+使い方:
+  python backfill_replies_count.py            # 差分の表示のみ
+  python backfill_replies_count.py --apply    # 書き込み
+"""
+
+import os
+import sys
+
+import boto3
+from boto3.dynamodb.conditions import Attr, Key
+from dotenv import load_dotenv
+
+load_dotenv()
+
+POSTS_TABLE = os.getenv("POSTS_TABLE", "uguu_post")
+REPLIES_TABLE = "post-replies"
+
+dynamodb = boto3.resource("dynamodb", region_name=os.getenv("AWS_REGION", "ap-northeast-1"))
+posts = dynamodb.Table(POSTS_TABLE)
+replies = dynamodb.Table(REPLIES_TABLE)
+
+
+def iter_posts():
+    kwargs = {
+        "FilterExpression": Attr("SK").begins_with("METADATA#"),
+        "ProjectionExpression": "PK, SK, post_id, replies_count",
+    }
+    while True:
+        resp = posts.scan(**kwargs)
+        yield from resp.get("Items", [])
+        lek = resp.get("LastEvaluatedKey")
+        if not lek:
+            return
+        kwargs["ExclusiveStartKey"] = lek
+
+
+def count_replies(post_id):
+    kwargs = {
+        "KeyConditionExpression": Key("post_id").eq(str(post_id)) & Key("sk").begins_with("REPLY#"),
+        "Select": "COUNT",
+    }
+    total = 0
+    while True:
+        resp = replies.query(**kwargs)
+        total += int(resp.get("Count", 0))
+        lek = resp.get("LastEvaluatedKey")
+        if not lek:
+            return total
+        kwargs["ExclusiveStartKey"] = lek
+
+
+def main():
+    apply = "--apply" in sys.argv
+    checked = changed = 0
+
+    for post in iter_posts():
+        post_id = post.get("post_id") or str(post["PK"]).split("#", 1)[1]
+        actual = count_replies(post_id)
+        current = post.get("replies_count")
+        checked += 1
+        if current is not None and int(current) == actual:
+            continue
+
+        changed += 1
+        print(f"[DIFF] post_id={post_id} replies_count: {current} -> {actual}")
+        if apply:
+            posts.update_item(
+                Key={"PK": post["PK"], "SK": post["SK"]},
+                UpdateExpression="SET replies_count = :c",
+                ExpressionAttributeValues={":c": actual},
+            )
+
+    mode = "更新" if apply else "差分"
+    print(f"[DONE] 投稿 {checked}件 / {mode} {changed}件")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""
+集計エンジン（uguu/analytics_engine.py）と従来の dict / set 集計の比較
+
+- 合成データ: 参加履歴 --rows 行（既定 50万行、キャンセル約5%）と、それに対応するスケジュール
+- 従来実装（各エンドポイントのループをそのまま関数にしたもの）とエンジンの結果を JSON で突き合わせる
+  - retention（月/週）, repeat_rate, member_health, overall（日/週/月）
+- 時間: 従来 = 毎リクエストで行を舐め直す / エンジン = フレーム構築1回 + 集計
+- 差分更新: 変更ログに載った --changed 人分の履歴を読み直してフレームに差し込む（_reload_users）
+
+不一致があれば終了コード 1 で終わる。
+使い方: python bench_analytics_engine.py [--rows 500000] [--users 3000] [--changed 20]
+"""
+
+import argparse
+import itertools
+import json
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+
+from uguu.analytics_engine import (
+    HISTORY_START,
+    AnalyticsEngine,
+    frame_from_rows,
+    member_health,
+    overall,
+    repeat_rate,
+    retention,
+    schedule_frame,
+)
+
+YOUBI = ["月", "火", "水", "木", "金", "土", "日"]
+
+
+# ---------------------------------------------
+# 合成データ
+# ---------------------------------------------
+def make_data(n_rows, n_users, today, seed=1):
+    rnd = random.Random(seed)
+    start = date(2021, 4, 1)
+    n_days = (today - start).days + 1
+
+    # 週3回程度の練習日
+    days = [start + timedelta(days=i) for i in range(n_days) if (start + timedelta(days=i)).weekday() in (1, 4, 5)]
+    schedules = []
+    for i, d in enumerate(days):
+        schedules.append({
+            "schedule_id": f"s{i:05d}",
+            "date": d.isoformat(),
+            "start_time": rnd.choice(["09:00", "13:00", "18:30", "19:00", ""]),
+            "status": "active",
+            "participants": [],
+            "tara_participants": [],
+        })
+
+    # ユーザーごとに活動期間と頻度を持たせる（離脱・新規が出るように）
+    users = []
+    for u in range(n_users):
+        a = rnd.randrange(len(days))
+        b = min(len(days) - 1, a + rnd.randrange(20, len(days)))
+        users.append((f"u{u:05d}", a, b, rnd.random() ** 2))
+    cum_weights = list(itertools.accumulate(w * (b - a + 1) for _, a, b, w in users))
+
+    rows = []
+    seen = set()
+    while len(rows) < n_rows:
+        uid, a, b, _ = rnd.choices(users, cum_weights=cum_weights, k=1)[0]
+        i = rnd.randint(a, b)
+        s = schedules[i]
+        cancelled = rnd.random() < 0.05
+        rows.append({
+            "user_id": uid,
+            "event_date": s["date"],
+            "status": "cancelled" if cancelled else "active",
+            "schedule_id": s["schedule_id"],
+        })
+        if not cancelled and (uid, i) not in seen:
+            seen.add((uid, i))
+            (s["tara_participants"] if rnd.random() < 0.1 else s["participants"]).append(uid)
+    return rows, schedules
+
+
+# ---------------------------------------------
+# 従来実装（uguu/analytics.py のループをそのまま）
+# ---------------------------------------------
+def _group_key(dt, group):
+    if group == "day":
+        return dt.strftime("%Y-%m-%d")
+    if group == "week":
+        iso = dt.isocalendar()
+        return f"{iso.year}-W{iso.week:02d}"
+    return dt.strftime("%Y-%m")
+
+
+def _active_dates(rows, start, end):
+    for r in rows:
+        if str(r.get("status", "active")).lower().startswith("cancel"):
+            continue
+        d = datetime.strptime(r["event_date"], "%Y-%m-%d").date()
+        if start <= d <= end:
+            yield str(r["user_id"]), d
+
+
+def legacy_retention(rows, start, end, group):
+    active_by_group = defaultdict(set)
+    for uid, d in _active_dates(rows, start, end):
+        active_by_group[_group_key(d, group)].add(uid)
+    groups_sorted = sorted(active_by_group)
+
+    new_vs_returning, seen_so_far = {}, set()
+    for g in groups_sorted:
+        users_g = active_by_group[g]
+        new_count = sum(1 for u in users_g if u not in seen_so_far)
+        new_vs_returning[g] = {"new": new_count, "returning": len(users_g) - new_count, "total_active": len(users_g)}
+        seen_so_far |= users_g
+
+    result = {}
+    for i in range(1, len(groups_sorted)):
+        prev_users = active_by_group[groups_sorted[i - 1]]
+        cur_users = active_by_group[groups_sorted[i]]
+        x = len(prev_users & cur_users) if prev_users else 0
+        result[groups_sorted[i]] = {
+            "from_prev": x,
+            "prev_active": len(prev_users),
+            "rate": round(x / len(prev_users), 3) if prev_users else None,
+        }
+    return {
+        "range": {"start": start.strftime("%Y-%m-%d"), "end": end.strftime("%Y-%m-%d")},
+        "group": group,
+        "actives": {g: len(active_by_group[g]) for g in groups_sorted},
+        "new_vs_returning": new_vs_returning,
+        "retention": result,
+    }
+
+
+def _user_months(rows, today):
+    user_dates, monthly_users = defaultdict(set), defaultdict(set)
+    for uid, d in _active_dates(rows, HISTORY_START, today):
+        user_dates[uid].add(d)
+        monthly_users[d.strftime("%Y-%m")].add(uid)
+    return user_dates, monthly_users
+
+
+def legacy_repeat_rate(rows, today):
+    user_dates, monthly_users = _user_months(rows, today)
+    total_users = len(user_dates)
+    repeat_users = sum(1 for dates in user_dates.values() if len(dates) >= 2)
+    months_sorted = sorted(monthly_users)
+    monthly = []
+    for i in range(1, len(months_sorted)):
+        prev_set, cur_set = monthly_users[months_sorted[i - 1]], monthly_users[months_sorted[i]]
+        retained = len(prev_set & cur_set)
+        monthly.append({
+            "month": months_sorted[i],
+            "prev_active": len(prev_set),
+            "retained": retained,
+            "rate": round(retained / len(prev_set) * 100, 1) if prev_set else None,
+        })
+    return {
+        "overall": {
+            "total_users": total_users,
+            "repeat_users": repeat_users,
+            "rate": round(repeat_users / total_users * 100, 1) if total_users else 0,
+        },
+        "monthly": monthly,
+    }
+
+
+def _month_minus(m, n):
+    year, month = int(m[:4]), int(m[5:7]) - n
+    while month <= 0:
+        month += 12
+        year -= 1
+    return f"{year:04d}-{month:02d}"
+
+
+def legacy_member_health(rows, today):
+    user_dates, monthly_users = _user_months(rows, today)
+    three, six = today - timedelta(days=90), today - timedelta(days=180)
+
+    def recent(dates):
+        return sum(1 for d in dates if d >= six)
+
+    total_users = sum(1 for dates in user_dates.values() if recent(dates) >= 2)
+    churned = sum(1 for dates in user_dates.values() if recent(dates) >= 2 and max(dates) < three)
+    retained_new = sum(1 for dates in user_dates.values() if recent(dates) >= 2 and len(dates) >= 3)
+    active_users = sum(1 for dates in user_dates.values()
+                       if recent(dates) >= 3 and sum(1 for d in dates if d >= three) >= 3)
+
+    def rate(x):
+        return round(x / total_users * 100, 1) if total_users else 0
+
+    months_sorted = sorted(monthly_users)
+    first_month = {uid: min(dates).strftime("%Y-%m") for uid, dates in user_dates.items()}
+    total_participants = len(user_dates)
+    user_months = {uid: [d.strftime("%Y-%m") for d in dates] for uid, dates in user_dates.items()}
+
+    monthly_data, cumulative = [], set()
+    for m in months_sorted:
+        users_this_month = monthly_users[m]
+        cumulative |= users_this_month
+        new_uids = sorted(uid for uid in users_this_month if first_month[uid] == m)
+        win3, win6 = _month_minus(m, 2), _month_minus(m, 5)
+        window_total = sum(1 for ms in user_months.values() if sum(1 for x in ms if win6 <= x <= m) >= 2)
+        rolling_active = sum(1 for ms in user_months.values()
+                             if sum(1 for x in ms if win3 <= x <= m) >= 3 and m in ms)
+        monthly_data.append({
+            "month": m,
+            "active_users": len(users_this_month),
+            "cumulative_users": len(cumulative),
+            "total_participants": total_participants,
+            "active_rate": round(len(users_this_month) / total_participants * 100, 1) if total_participants else 0,
+            "rolling_active_rate": round(rolling_active / window_total * 100, 1) if window_total else 0,
+            "rolling_active": rolling_active,
+            "rolling_active_total": window_total,
+            "new_members": len(new_uids),
+            "new_member_names": new_uids,
+        })
+    return {
+        "churn": {"rate": rate(churned), "churned": churned, "total": total_users},
+        "retention": {"rate": rate(retained_new), "retained": retained_new, "total": total_users},
+        "active": {"rate": rate(active_users), "active": active_users, "total": total_users},
+        "monthly": monthly_data,
+    }
+
+
+def legacy_overall(schedules, start, end, group):
+    first_seen = {}
+    for s in schedules:
+        d = datetime.strptime(s["date"], "%Y-%m-%d").date()
+        if d > end:
+            continue
+        for uid in list(s.get("participants", [])) + list(s.get("tara_participants", [])):
+            fd = first_seen.get(uid)
+            if fd is None or d < fd:
+                first_seen[uid] = d
+
+    total, events_count = 0, 0
+    unique_users, new_users, returning_users = set(), set(), set()
+    by_weekday, by_group, events_by_group, participation_dates = Counter(), Counter(), Counter(), Counter()
+    by_hour = Counter({f"{h:02d}": 0 for h in range(24)})
+    for s in schedules:
+        d = datetime.strptime(s["date"], "%Y-%m-%d").date()
+        if d < start or d > end:
+            continue
+        events_count += 1
+        uids = list(s.get("participants", [])) + list(s.get("tara_participants", []))
+        total += len(uids)
+        participation_dates[d] += len(uids)
+        for uid in uids:
+            unique_users.add(uid)
+            fd = first_seen.get(uid)
+            if fd is not None:
+                if start <= fd <= end:
+                    new_users.add(uid)
+                elif fd < start:
+                    returning_users.add(uid)
+        by_weekday[YOUBI[d.weekday()]] += len(uids)
+        gk = _group_key(d, group)
+        by_group[gk] += len(uids)
+        events_by_group[gk] += 1
+        st = (s.get("start_time") or "").strip()
+        if ":" in st:
+            by_hour[f"{int(st.split(':')[0]):02d}"] += len(uids)
+
+    return {
+        "range": {"start": start.strftime("%Y-%m-%d"), "end": end.strftime("%Y-%m-%d"), "events_count": events_count},
+        "totals": {
+            "participations": total,
+            "unique_users": len(unique_users),
+            "avg_participants_per_event": round(total / events_count, 2) if events_count else None,
+        },
+        "cohorts": {"new_users_in_range": len(new_users), "returning_users_in_range": len(returning_users)},
+        "distributions": {
+            "by_weekday": dict(by_weekday),
+            "by_hour": dict(by_hour),
+            "by_group": [{"group": k, "count": v} for k, v in sorted(by_group.items())],
+            "events_by_group": dict(events_by_group),
+            "by_date": [{"date": d.strftime("%Y-%m-%d"), "count": c} for d, c in sorted(participation_dates.items())],
+        },
+    }
+
+
+# ---------------------------------------------
+# 差分更新（_reload_users）用の履歴テーブル代役
+# ---------------------------------------------
+class _HistoryTable:
+    def __init__(self, rows):
+        self.by_user = defaultdict(list)
+        for r in rows:
+            self.by_user[r["user_id"]].append(r)
+        self.queries = 0
+
+    def query(self, KeyConditionExpression, **kwargs):
+        self.queries += 1
+        uid = KeyConditionExpression.get_expression()["values"][1]
+        return {"Items": list(self.by_user.get(uid, []))}
+
+
+# ---------------------------------------------
+# 実行
+# ---------------------------------------------
+def timed(fn, *args):
+    t = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - t
+
+
+def same(a, b):
+    return json.dumps(a, sort_keys=True, ensure_ascii=False) == json.dumps(b, sort_keys=True, ensure_ascii=False)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=500_000)
+    ap.add_argument("--users", type=int, default=3000)
+    ap.add_argument("--changed", type=int, default=20)
+    args = ap.parse_args()
+
+    today = date(2026, 10, 17)
+    t = time.perf_counter()
+    rows, schedules = make_data(args.rows, args.users, today)
+    print(f"合成データ: 履歴 {len(rows):,} 行 / スケジュール {len(schedules):,} 件 ({time.perf_counter() - t:.1f}s)")
+
+    sframe, t_sframe = timed(schedule_frame, schedules)
+    frame, t_frame = timed(frame_from_rows, rows, sframe.hour_by_schedule)
+    print(f"フレーム構築: 履歴 {t_frame:.2f}s ({sum(a.nbytes for a in (frame.user, frame.day, frame.hour, frame.status)) / 1e6:.1f} MB)"
+          f" / スケジュール {t_sframe:.3f}s")
+
+    r_start = (today.replace(day=1) - timedelta(days=120))
+    o_start = today - timedelta(days=180)
+    cases = [
+        ("retention(month)", lambda: legacy_retention(rows, r_start, today, "month"),
+         lambda: retention(frame, r_start, today, "month")),
+        ("retention(week)", lambda: legacy_retention(rows, r_start, today, "week"),
+         lambda: retention(frame, r_start, today, "week")),
+        ("repeat_rate", lambda: legacy_repeat_rate(rows, today),
+         lambda: repeat_rate(frame, today)),
+        ("member_health", lambda: legacy_member_health(rows, today),
+         lambda: member_health(frame, today, resolve_names=lambda uids: {u: u for u in uids})),
+    ]
+    for group in ("day", "week", "month"):
+        cases.append((f"overall({group})",
+                      lambda g=group: legacy_overall(schedules, o_start, today, g),
+                      lambda g=group: overall(sframe, o_start, today, g)))
+
+    ok = True
+    print(f"{'集計':<18}{'従来':>10}{'エンジン':>10}{'倍率':>9}  一致")
+    for name, legacy, engine in cases:
+        expected, t_old = timed(legacy)
+        actual, t_new = timed(engine)
+        if name == "member_health":
+            for m in actual["monthly"]:
+                m["new_member_names"] = sorted(m["new_member_names"])
+        match = same(expected, actual)
+        ok &= match
+        print(f"{name:<18}{t_old:>9.3f}s{t_new:>9.4f}s{t_old / max(t_new, 1e-9):>8.0f}x  {'OK' if match else 'NG'}")
+
+    # 差分更新: 一部ユーザーの履歴を書き換え、その人たちだけ読み直してフレームに差し込む
+    rnd = random.Random(2)
+    changed = rnd.sample(sorted({r["user_id"] for r in rows}), args.changed)
+    new_rows = [r for r in rows if r["user_id"] not in set(changed)]
+    for uid in changed:
+        for i in range(5):
+            new_rows.append({"user_id": uid, "event_date": (today - timedelta(days=i * 3)).isoformat(),
+                             "status": "active", "schedule_id": ""})
+    table = _HistoryTable(new_rows)
+
+    engine = AnalyticsEngine()
+    engine._frame = frame
+    engine._schedules = sframe
+    engine._schedule_frame = lambda: sframe
+    _, t_inc = timed(engine._reload_users, table, changed)
+    _, t_full = timed(frame_from_rows, new_rows, sframe.hour_by_schedule)
+    match = same(legacy_repeat_rate(new_rows, today), repeat_rate(engine._frame, today))
+    ok &= match
+    print(f"差分更新: {len(changed)} 人 / {engine.last_incremental['rows']} 行 / Query {table.queries} 回 "
+          f"{t_inc * 1000:.1f}ms（全件構築 {t_full:.2f}s）  {'OK' if match else 'NG'}")
+
+    if not ok:
+        print("不一致があります")
+        sys.exit(1)
+    print("すべて一致")
+
+
+if __name__ == "__main__":
+    main()
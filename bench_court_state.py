@@ -0,0 +1,227 @@
+"""
+コート画面のポーリング1回あたりの DynamoDB 読み取り回数の比較（game/court_state.py）
+
+- 旧: waiting_status / court() が個別に has_ongoing_matches / get_match_progress / get_current_match_status /
+      get_latest_match_id / get_organized_match_data / get_players_status を呼ぶ（各関数は今も views に残っている）
+- 新: get_court_state() のスナップショット（TTL 内・書き込みが無ければ読み取り 0 回）
+
+DynamoDB には接続せず、呼び出しを数えるインメモリのスタブで計測する。
+スナップショットから導出した値が旧関数の結果と一致しなければ終了コード 1 で終わる。
+使い方: python bench_court_state.py [--players 24] [--polls 30] [--workers-threads 8]
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("AWS_REGION", "ap-northeast-1")
+os.environ.setdefault("TABLE_NAME_USER", "bad-users")
+os.environ.setdefault("TABLE_NAME_SCHEDULE", "bad_schedules")
+
+CALLS = Counter()
+
+
+# ---------------------------------------------
+# 条件式の評価（boto3.dynamodb.conditions の一部だけ）
+# ---------------------------------------------
+def _matches(cond, item):
+    if cond is None:
+        return True
+    expr = cond.get_expression()
+    op, values = expr["operator"], expr["values"]
+
+    def val(v):
+        return item.get(v.name) if hasattr(v, "name") else v
+
+    if op == "AND":
+        return _matches(values[0], item) and _matches(values[1], item)
+    if op == "OR":
+        return _matches(values[0], item) or _matches(values[1], item)
+    if op == "NOT":
+        return not _matches(values[0], item)
+    if op == "=":
+        return val(values[0]) == values[1]
+    if op == "<>":
+        return val(values[0]) != values[1]
+    if op == "IN":
+        return val(values[0]) in values[1]
+    if op == "attribute_not_exists":
+        return values[0].name not in item
+    if op == "contains":
+        return values[1] in str(val(values[0]) or "")
+    raise NotImplementedError(op)
+
+
+class FakeTable:
+    def __init__(self, name, items, key):
+        self.name = name
+        self.items = items
+        self.key = key
+
+    def query(self, KeyConditionExpression, FilterExpression=None, **kwargs):
+        CALLS[(self.name, "query")] += 1
+        return {"Items": [dict(it) for it in self.items
+                          if _matches(KeyConditionExpression, it) and _matches(FilterExpression, it)]}
+
+    def scan(self, FilterExpression=None, **kwargs):
+        CALLS[(self.name, "scan")] += 1
+        return {"Items": [dict(it) for it in self.items if _matches(FilterExpression, it)]}
+
+    def get_item(self, Key, **kwargs):
+        CALLS[(self.name, "get_item")] += 1
+        for it in self.items:
+            if all(it.get(k) == v for k, v in Key.items()):
+                return {"Item": dict(it)}
+        return {}
+
+
+class FakeDynamo:
+    def __init__(self, tables):
+        self.tables = tables
+
+    def Table(self, name):
+        return self.tables.setdefault(name, FakeTable(name, [], "id"))
+
+    def batch_get_item(self, RequestItems):
+        CALLS[("*", "batch_get_item")] += 1
+        out = {}
+        for name, req in RequestItems.items():
+            table = self.Table(name)
+            out[name] = [dict(it) for it in table.items
+                         if any(all(it.get(k) == v for k, v in key.items()) for key in req["Keys"])]
+        return {"Responses": out}
+
+
+def make_tables(n_players):
+    from datetime import datetime
+    from utils.timezone import JST
+    today = {"session_date": datetime.now(JST).strftime("%Y-%m-%d")}
+    entries = []
+    for i in range(n_players):
+        if i < 16:
+            st, extra = "playing", {"match_id": "m001", "court_number": i // 4 + 1, "team_side": "A" if i % 4 < 2 else "B"}
+        elif i < n_players - 3:
+            st, extra = "pending", {}
+        else:
+            st, extra = "resting", {}
+        entries.append(dict({
+            "user_id": f"u{i:03d}", "joined_at": f"2026-10-17T10:{i:02d}:00", "entry_id": f"e{i}",
+            "entry_status": st, "display_name": f"player{i}", "skill_score": 50,
+        }, **extra, **today))
+    # 休みイベント（entry_status を持たない）
+    entries.append(dict({"entry_id": "r1", "type": "rest_event", "match_id": "m001", "user_id": "u020"}, **today))
+    # 前日の練習日に残った行（今日のパーティションには入らない）
+    entries.append({"entry_id": "old1", "user_id": "u900", "entry_status": "pending", "session_date": "2000-01-01"})
+    return {
+        "bad-game-match_entries": FakeTable("bad-game-match_entries", entries, "entry_id"),
+        "bad-game-matches": FakeTable("bad-game-matches", [
+            {"match_id": "meta#current", "status": "playing", "current_match_id": "m001"},
+            {"match_id": "meta#pairing", "cycle_index": 1, "round_count": 3},
+        ], "match_id"),
+        "bad-game-results": FakeTable("bad-game-results", [{"match_id": "m001", "court_number": 2}], "result_id"),
+        "bad-users": FakeTable("bad-users", [], "user#user_id"),
+    }
+
+
+def old_poll(views):
+    """旧 waiting_status 相当"""
+    pending = views.get_players_status("pending")
+    resting = views.get_players_status("resting")
+    match_id = views.get_latest_match_id()
+    in_progress = bool(views.query_entries_by_status(
+        views.current_app.dynamodb.Table("bad-game-match_entries"), "playing", match_id=match_id)) if match_id else False
+    return len(pending), len(resting), match_id, in_progress
+
+
+def old_court(views):
+    """旧 court() の読み取り部分"""
+    table = views.current_app.dynamodb.Table("bad-game-match_entries")
+    views.query_entries_by_status(table, ["pending", "resting", "playing"], ConsistentRead=True)
+    views.current_app.dynamodb.Table("bad-game-matches").get_item(Key={"match_id": "meta#pairing"})
+    has_ongoing = views.has_ongoing_matches()
+    progress = views.get_match_progress()
+    courts = views.get_current_match_status()
+    match_id = views.get_latest_match_id()
+    match_courts = views.get_organized_match_data(match_id) if match_id else {}
+    views.current_app.dynamodb.Table("bad-game-matches").get_item(Key={"match_id": "meta#current"})
+    return has_ongoing, progress, sorted(courts), match_id, {
+        c: (len(d["team_a"]), len(d["team_b"]), d["score_submitted"]) for c, d in match_courts.items()}
+
+
+def new_court(state):
+    return state.has_ongoing, state.progress(), sorted(state.current_courts()), state.match_id, {
+        c: (len(d["team_a"]), len(d["team_b"]), d["score_submitted"]) for c, d in state.match_courts().items()}
+
+
+def reads():
+    return sum(CALLS.values())
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--players", type=int, default=24)
+    ap.add_argument("--polls", type=int, default=30)
+    ap.add_argument("--threads", type=int, default=8)
+    args = ap.parse_args()
+
+    import app as app_module
+    from game import court_state, views
+
+    flask_app = app_module.app
+    flask_app.dynamodb = FakeDynamo(make_tables(args.players))
+
+    ok = True
+    with flask_app.test_request_context("/game/api/waiting_status"):
+        # 旧
+        CALLS.clear()
+        expected_poll = old_poll(views)
+        old_poll_reads = dict(CALLS)
+        CALLS.clear()
+        expected_court = old_court(views)
+        old_court_reads = dict(CALLS)
+
+        # 新: 初回はスナップショットを作る
+        court_state.invalidate_court_state()
+        CALLS.clear()
+        state = court_state.get_court_state()
+        build_reads = dict(CALLS)
+        actual_poll = (len(state.pending), len(state.resting), state.match_id, state.in_progress)
+        actual_court = new_court(state)
+        ok &= actual_poll == expected_poll and actual_court == expected_court
+
+        # TTL 内のポーリング（複数スレッド）
+        CALLS.clear()
+        t = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as ex:
+            list(ex.map(lambda _: flask_app.app_context().push() or court_state.get_court_state(), range(args.polls)))
+        poll_reads = reads()
+        elapsed = time.perf_counter() - t
+
+        # 書き込み後は作り直される
+        court_state.invalidate_court_state()
+        CALLS.clear()
+        court_state.get_court_state()
+        rebuild_reads = reads()
+
+    def fmt(d):
+        scans = sum(v for (_, op), v in d.items() if op == "scan")
+        return f"{sum(d.values()):>2} 回（scan {scans}）  {dict((f'{t}.{op}', v) for (t, op), v in sorted(d.items()))}"
+
+    print(f"旧 waiting_status : {fmt(old_poll_reads)}")
+    print(f"旧 court()        : {fmt(old_court_reads)}")
+    print(f"新 スナップショット作成: {fmt(build_reads)}")
+    print(f"新 TTL 内のポーリング {args.polls} 回: 読み取り {poll_reads} 回 ({elapsed * 1000:.1f}ms)")
+    print(f"新 書き込み後の再作成: {rebuild_reads} 回")
+    print(f"統計: {court_state.court_state_stats()}")
+    print(f"一致: {'OK' if ok else 'NG'}  poll={actual_poll} court={actual_court}")
+    ok &= poll_reads == 0
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+試合終了時のスキル更新（TrueSkill）の往復回数ベンチマーク
+- 旧: コートごとに計算し、μ/σ が無い人は get_item、エントリー・bad-users を1件ずつ update_item
+- 新: rate_match_results（BatchGet 1回 + 全コート一括計算）
+      + sync_match_entries_with_updated_skills / persist_skill_to_bad_users（25件ずつの transact）
+
+メモリ上のスタブ（1リクエストごとに RTT を sleep）で計測し、新旧のスキル値が一致することも確認する。
+使い方: python bench_finish_rating.py [--courts 6] [--rtt-ms 8] [--missing 0.5]
+"""
+
+import argparse
+import random
+import time
+from decimal import Decimal
+
+from flask import Flask
+from trueskill import Rating, rate
+
+from game.game_utils import rate_match_results, sync_match_entries_with_updated_skills
+from game.views import persist_skill_to_bad_users
+
+
+class StubClient:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def transact_write_items(self, TransactItems):
+        self.owner.hit("transact_write_items")
+        for it in TransactItems:
+            self.owner.apply_low_level(it["Update"])
+        return {}
+
+    def update_item(self, **upd):
+        self.owner.hit("update_item")
+        self.owner.apply_low_level(upd)
+        return {}
+
+
+class StubTable:
+    def __init__(self, owner, name):
+        self.owner = owner
+        self.name = name
+
+    def get_item(self, Key, **kwargs):
+        self.owner.hit("get_item")
+        item = self.owner.tables[self.name].get(next(iter(Key.values())))
+        return {"Item": dict(item)} if item else {}
+
+
+class StubDynamo:
+    """boto3 resource もどき（Table / batch_get_item / meta.client）"""
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.tables = {"bad-users": {}, "bad-game-match_entries": {}}
+        self.calls = {}
+        self.meta = type("Meta", (), {})()
+        self.meta.client = StubClient(self)
+
+    def hit(self, op):
+        self.calls[op] = self.calls.get(op, 0) + 1
+        time.sleep(self.rtt)
+
+    def round_trips(self):
+        return sum(self.calls.values())
+
+    def Table(self, name):
+        return StubTable(self, name)
+
+    def batch_get_item(self, RequestItems):
+        self.hit("batch_get_item")
+        out = {}
+        for name, req in RequestItems.items():
+            out[name] = [dict(self.tables[name][k["user#user_id"]])
+                         for k in req["Keys"] if k["user#user_id"] in self.tables[name]]
+        return {"Responses": out, "UnprocessedKeys": {}}
+
+    def apply_low_level(self, upd):
+        name = upd["TableName"]
+        key_name, key_val = next(iter(upd["Key"].items()))
+        item = self.tables[name].setdefault(key_val["S"], {key_name: key_val["S"]})
+        vals = upd["ExpressionAttributeValues"]
+        mu = vals.get(":mu") or vals.get(":s")
+        sig = vals.get(":sigma") or vals.get(":g")
+        item["skill_score"] = Decimal(mu["N"])
+        item["skill_sigma"] = Decimal(sig["N"])
+
+
+def make_match(courts, missing_ratio, rng, db):
+    playing, results = [], []
+    for c in range(courts):
+        players = []
+        for i in range(4):
+            uid = f"u{c}{i}"
+            mu, sig = rng.gauss(25, 6), rng.uniform(2, 8)
+            db.tables["bad-users"][uid] = {"user#user_id": uid, "skill_score": Decimal(str(round(mu, 2))),
+                                           "skill_sigma": Decimal(str(round(sig, 4)))}
+            entry = {"entry_id": f"e-{uid}", "user_id": uid}
+            if rng.random() >= missing_ratio:
+                entry.update(skill_score=float(round(mu, 2)), skill_sigma=float(round(sig, 4)))
+            db.tables["bad-game-match_entries"][entry["entry_id"]] = dict(entry)
+            playing.append(entry)
+            players.append(dict(entry))
+        results.append({"court_number": c + 1, "winner": rng.choice("AB"),
+                        "team_a": players[:2], "team_b": players[2:]})
+    return playing, results
+
+
+def legacy_finish(db, playing, results):
+    """旧実装と同じ手順・同じ往復数"""
+    users = db.Table("bad-users")
+    mapping = {p["user_id"]: p["entry_id"] for p in playing}
+    updated = {}
+    for res in results:
+        teams = []
+        for team in (res["team_a"], res["team_b"]):
+            rs = []
+            for p in team:
+                mu, sig = p.get("skill_score"), p.get("skill_sigma")
+                if mu is None or sig is None:
+                    data = users.get_item(Key={"user#user_id": p["user_id"]}).get("Item") or {}
+                    mu, sig = data.get("skill_score", 25.0), data.get("skill_sigma", 8.333)
+                rs.append((p["user_id"], Rating(float(mu), float(sig))))
+            teams.append(rs)
+        ranks = [0, 1] if res["winner"] == "A" else [1, 0]
+        new_a, new_b = rate([[r for _, r in teams[0]], [r for _, r in teams[1]]], ranks=ranks)
+        for (uid, _), r in list(zip(teams[0], new_a)) + list(zip(teams[1], new_b)):
+            updated[uid] = {"skill_score": float(r.mu), "skill_sigma": float(r.sigma)}
+    for uid, v in updated.items():
+        db.meta.client.update_item(
+            TableName="bad-game-match_entries", Key={"entry_id": {"S": mapping[uid]}},
+            ExpressionAttributeValues={":mu": {"N": str(v["skill_score"])}, ":sigma": {"N": str(v["skill_sigma"])}})
+    for uid, v in updated.items():
+        db.meta.client.update_item(
+            TableName="bad-users", Key={"user#user_id": {"S": uid}},
+            ExpressionAttributeValues={":s": {"N": str(round(v["skill_score"], 2))},
+                                       ":g": {"N": str(round(v["skill_sigma"], 4))}})
+    return updated
+
+
+def new_finish(db, playing, results):
+    mapping = {p["user_id"]: p["entry_id"] for p in playing}
+    known = {p["user_id"]: p for p in playing if p.get("skill_score") is not None}
+    updated, _ = rate_match_results(results, known=known)
+    sync_match_entries_with_updated_skills(mapping, updated)
+    persist_skill_to_bad_users(updated)
+    return updated
+
+
+def main(args):
+    rng_seed = 20250101
+    timings = {}
+    outputs = {}
+    for label, fn in (("legacy", legacy_finish), ("batched", new_finish)):
+        app = Flask(__name__)
+        db = StubDynamo(args.rtt_ms / 1000.0)
+        app.dynamodb = db
+        app.config["TABLE_NAME_USER"] = "bad-users"
+        playing, results = make_match(args.courts, args.missing, random.Random(rng_seed), db)
+        with app.test_request_context():
+            t0 = time.perf_counter()
+            outputs[label] = fn(db, playing, results)
+            timings[label] = (time.perf_counter() - t0) * 1000
+        print(f"[{label:<7}] round_trips={db.round_trips():>3} {timings[label]:7.1f}ms calls={db.calls}")
+
+    for uid, v in outputs["legacy"].items():
+        w = outputs["batched"][uid]
+        assert abs(v["skill_score"] - w["skill_score"]) < 1e-9 and abs(v["skill_sigma"] - w["skill_sigma"]) < 1e-9, uid
+    print(f"skills identical for {len(outputs['legacy'])} players (x{timings['legacy'] / timings['batched']:.1f})")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--courts", type=int, default=6)
+    ap.add_argument("--rtt-ms", type=float, default=8.0, help="スタブ1リクエストあたりの往復遅延(ms)")
+    ap.add_argument("--missing", type=float, default=0.5, help="エントリーに μ/σ が無いプレイヤーの割合")
+    main(ap.parse_args())
@@ -0,0 +1,101 @@
+"""
+トップページ(index)の初参加判定コストを比較するベンチマーク
+- 旧: bad-users-history を status=registered で全件scanして user_min_date を作る
+- 新: BatchGet 済みユーザーの first_participation_date を見るだけ
+
+DynamoDB には接続せず、1MB/ページ相当の scan と往復遅延(RTT)を模したスタブで計測する。
+使い方: python bench_index_first_timer.py [--rtt-ms 8] [--users 40]
+"""
+
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+ITEMS_PER_PAGE = 4000  # 1MB / 約250B
+
+
+class FakeHistoryTable:
+    def __init__(self, rows, rtt):
+        self.rows = rows
+        self.rtt = rtt
+        self.requests = 0
+
+    def scan(self, **kwargs):
+        self.requests += 1
+        time.sleep(self.rtt)
+        start = kwargs.get("ExclusiveStartKey", {}).get("i", 0)
+        page = self.rows[start:start + ITEMS_PER_PAGE]
+        resp = {"Items": [r for r in page if r["status"] == "registered"]}
+        if start + ITEMS_PER_PAGE < len(self.rows):
+            resp["LastEvaluatedKey"] = {"i": start + ITEMS_PER_PAGE}
+        return resp
+
+
+def make_history(n_rows, user_ids):
+    base = date(2023, 1, 1)
+    return [
+        {
+            "user_id": random.choice(user_ids),
+            "date": (base + timedelta(days=random.randint(0, 900))).isoformat(),
+            "status": "registered" if random.random() < 0.9 else "cancelled",
+        }
+        for _ in range(n_rows)
+    ]
+
+
+def old_first_timers(history_table, users, schedule_date):
+    user_min_date = {}
+    kwargs = {}
+    while True:
+        resp = history_table.scan(**kwargs)
+        for item in resp.get("Items", []):
+            uid, d = item["user_id"], item["date"]
+            if uid not in user_min_date or d < user_min_date[uid]:
+                user_min_date[uid] = d
+        lek = resp.get("LastEvaluatedKey")
+        if not lek:
+            break
+        kwargs["ExclusiveStartKey"] = lek
+    return {uid for uid in users if user_min_date.get(uid) == schedule_date}
+
+
+def new_first_timers(users, schedule_date):
+    return {uid for uid, u in users.items() if u.get("first_participation_date") == schedule_date}
+
+
+def main(rtt_ms, n_users):
+    rtt = rtt_ms / 1000.0
+    user_ids = [f"u{i:04d}" for i in range(600)]
+    participants = random.sample(user_ids, n_users)
+    schedule_date = "2024-06-01"
+
+    print(f"{'history_rows':>12} | {'old_reqs':>8} {'old_ms':>9} | {'new_reqs':>8} {'new_ms':>7}")
+    for n_rows in (1_000, 10_000, 100_000, 500_000):
+        rows = make_history(n_rows, user_ids)
+        # バックフィル相当: 参加者ごとの初参加日
+        first = {}
+        for r in rows:
+            if r["status"] == "registered" and (r["user_id"] not in first or r["date"] < first[r["user_id"]]):
+                first[r["user_id"]] = r["date"]
+        users = {uid: {"first_participation_date": first.get(uid)} for uid in participants}
+
+        table = FakeHistoryTable(rows, rtt)
+        t0 = time.perf_counter()
+        old = old_first_timers(table, users, schedule_date)
+        old_ms = (time.perf_counter() - t0) * 1000
+
+        t0 = time.perf_counter()
+        new = new_first_timers(users, schedule_date)
+        new_ms = (time.perf_counter() - t0) * 1000
+
+        assert old == new, "判定結果が一致しません"
+        print(f"{n_rows:>12,} | {table.requests:>8} {old_ms:>9.1f} | {0:>8} {new_ms:>7.3f}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rtt-ms", type=float, default=8.0, help="scan 1ページあたりの往復遅延(ms)")
+    ap.add_argument("--users", type=int, default=40, help="トップページに表示される参加者数")
+    args = ap.parse_args()
+    main(args.rtt_ms, args.users)
@@ -0,0 +1,190 @@
+"""
+ペア・対戦の繰り返しペナルティ（game/pair_history.py）のベンチマーク
+
+24人・6面で1日分（--rounds 試合）のペアリングを各モードで回し、
+  - 繰り返しペナルティありとなしで、同じ日に同じペアになった回数・同じ相手と当たった回数
+  - ペナルティのオーバーヘッド（共起行列からの切り出し + 試合後の加算 + 生成関数の増分）
+を比べる。DynamoDB は使わず、PairHistory に試合結果を直接足す。
+使い方: python bench_pair_history.py [--players 24] [--courts 6] [--rounds 10] [--days 5]
+"""
+
+import argparse
+import random
+import statistics
+import time
+from itertools import combinations
+
+from flask import Flask
+
+import numpy as np
+
+from game.game_utils import (
+    Player,
+    _pairing_cost_batch,
+    generate_ai_best_pairings,
+    generate_balanced_pairs_and_matches,
+    generate_full_random_pairings,
+    generate_optimal_pairings,
+    generate_skill_grouped_pairings,
+)
+from game.pair_history import PairHistory
+
+MODES = {
+    "random": lambda ps, c, rep, seed: generate_balanced_pairs_and_matches(ps, c, repeat=rep)[1],
+    "full_random": lambda ps, c, rep, seed: generate_full_random_pairings(ps, c, repeat=rep)[1],
+    "ai": lambda ps, c, rep, seed: generate_ai_best_pairings(ps, c, seed=seed, repeat=rep)[0],
+    "optimal": lambda ps, c, rep, seed: generate_optimal_pairings(ps, c, seed=seed, repeat=rep)[0],
+    "skilled": lambda ps, c, rep, seed: generate_skill_grouped_pairings(ps, c, repeat=rep)[0],
+}
+
+
+def make_roster(n, rng):
+    players = []
+    for i in range(n):
+        mu = rng.gauss(25.0, 8.0)
+        sigma = rng.uniform(1.5, 8.333)
+        p = Player(f"p{i:02d}", mu - 3 * sigma, rng.choice("MF"), skill_score=mu, skill_sigma=sigma)
+        p.conservative = mu - 3 * sigma
+        p.user_id = f"u{i:02d}"
+        players.append(p)
+    return players
+
+
+def result_items(match_id, matches):
+    return [{
+        "result_id": f"{match_id}-{c}",
+        "match_id": match_id,
+        "team_a": [{"user_id": p.user_id} for p in a],
+        "team_b": [{"user_id": p.user_id} for p in b],
+    } for c, (a, b) in enumerate(matches, 1)]
+
+
+def skill_penalty(matches):
+    return sum(((a1.conservative + a2.conservative) / 2 - (b1.conservative + b2.conservative) / 2) ** 2
+               for (a1, a2), (b1, b2) in matches)
+
+
+def simulate(mode, roster, courts, rounds, use_penalty, seed, timings):
+    """1日分を回して (パートナー重複, 対戦相手重複, スキル差の二乗和の平均) を返す"""
+    random.seed(seed)
+    history = PairHistory("bench")
+    partners, opponents = set(), set()
+    repeat_partner = repeat_opponent = 0
+    skill = []
+    for r in range(rounds):
+        # 毎試合 4人×面数 を出場させる（休みは試合数の少ない人から順に回す実運用に近い形でランダム）
+        active = random.sample(roster, courts * 4)
+
+        t0 = time.perf_counter()
+        rep = history.penalty(active) if use_penalty else None
+        if rep is not None and rep.is_zero:
+            rep = None
+        t1 = time.perf_counter()
+        matches = MODES[mode](active, courts, rep, seed * 100 + r)
+        t2 = time.perf_counter()
+        for item in result_items(f"m{r:02d}", matches):
+            history.add_result(item)
+        t3 = time.perf_counter()
+        if use_penalty:
+            timings["penalty_ms"].append((t1 - t0) * 1000)
+            timings["record_ms"].append((t3 - t2) * 1000)
+        timings[("gen", use_penalty)].append((t2 - t1) * 1000)
+
+        skill.append(skill_penalty(matches))
+        for a, b in matches:
+            for team in (a, b):
+                key = frozenset(p.user_id for p in team)
+                repeat_partner += key in partners
+                partners.add(key)
+            for x in a:
+                for y in b:
+                    key = frozenset((x.user_id, y.user_id))
+                    repeat_opponent += key in opponents
+                    opponents.add(key)
+    return repeat_partner, repeat_opponent, statistics.mean(skill)
+
+
+def lookup_cost(n, loops=20000):
+    """RepeatPenalty.pair の1回あたり（O(1) の行列参照）"""
+    roster = make_roster(n, random.Random(0))
+    history = PairHistory("bench")
+    for r in range(10):
+        random.seed(r)
+        shuffled = random.sample(roster, n)
+        matches = [((shuffled[i], shuffled[i + 1]), (shuffled[i + 2], shuffled[i + 3])) for i in range(0, n - 3, 4)]
+        for item in result_items(f"m{r}", matches):
+            history.add_result(item)
+    rep = history.penalty(roster)
+    pairs = list(combinations(roster, 2))
+    t = time.perf_counter()
+    for k in range(loops):
+        a, b = pairs[k % len(pairs)]
+        rep.pair(a, b)
+    return (time.perf_counter() - t) / loops * 1e6
+
+
+def batch_cost(n, courts, batch=256, loops=200):
+    """optimize_pairings の1バッチ（batch 個の並びの評価）にかかる時間: ペナルティなし / あり（ms）"""
+    roster = make_roster(n, random.Random(1))
+    history = PairHistory("bench")
+    for r in range(10):
+        random.seed(r)
+        sh = random.sample(roster, n)
+        matches = [((sh[i], sh[i + 1]), (sh[i + 2], sh[i + 3])) for i in range(0, courts * 4, 4)]
+        for item in result_items(f"m{r}", matches):
+            history.add_result(item)
+    pen = history.penalty(roster).matrices(roster)
+    skill = np.array([p.conservative for p in roster])
+    perms = np.argsort(np.random.default_rng(0).random((batch, n)), axis=1)
+    out = []
+    for arg in (None, pen):
+        t = time.perf_counter()
+        for _ in range(loops):
+            _pairing_cost_batch(skill, perms, courts, arg)
+        out.append((time.perf_counter() - t) / loops * 1000)
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--players", type=int, default=24)
+    ap.add_argument("--courts", type=int, default=6)
+    ap.add_argument("--rounds", type=int, default=10)
+    ap.add_argument("--days", type=int, default=5)
+    args = ap.parse_args()
+
+    app = Flask(__name__)
+    print(f"{args.players}人 / {args.courts}面 / 1日 {args.rounds} 試合 × {args.days} 日（平均）")
+    print(f"{'mode':<12}| {'ペア重複':>8} {'対戦重複':>8} {'スキル差²':>9} {'生成ms':>7} | "
+          f"{'ペア重複':>8} {'対戦重複':>8} {'スキル差²':>9} {'生成ms':>7}")
+    print(f"{'':<12}| {'ペナルティなし':^37} | {'ペナルティあり':^37}")
+    overhead = {}
+    with app.app_context():
+        for mode in MODES:
+            row = []
+            timings = {"penalty_ms": [], "record_ms": [], ("gen", False): [], ("gen", True): []}
+            for use_penalty in (False, True):
+                results = [simulate(mode, make_roster(args.players, random.Random(day)), args.courts,
+                                    args.rounds, use_penalty, day, timings)
+                           for day in range(args.days)]
+                rp, ro, sk = (statistics.mean(x) for x in zip(*results))
+                row.append(f"{rp:>8.1f} {ro:>8.1f} {sk:>9.2f} {statistics.median(timings[('gen', use_penalty)]):>7.2f}")
+            print(f"{mode:<12}| {row[0]} | {row[1]}")
+            overhead[mode] = timings
+
+    pen = [x for t in overhead.values() for x in t["penalty_ms"]]
+    rec = [x for t in overhead.values() for x in t["record_ms"]]
+    print()
+    print(f"共起行列から {args.players}人分を切り出す: 中央値 {statistics.median(pen):.3f}ms / 最大 {max(pen):.3f}ms")
+    print(f"試合後の加算（{args.courts}コート）      : 中央値 {statistics.median(rec):.3f}ms / 最大 {max(rec):.3f}ms")
+    print(f"ペア1組の参照 RepeatPenalty.pair      : {lookup_cost(args.players):.2f}µs")
+    plain, with_pen = batch_cost(args.players, args.courts)
+    print(f"ai の1バッチ（256候補）の評価          : {plain:.3f}ms → {with_pen:.3f}ms（{with_pen - plain:+.3f}ms）")
+    print("生成関数の増分（中央値の差。ai はコストが 0 になりにくく探索の早期終了が減るぶんを含む。上限は time_budget）")
+    for mode, t in overhead.items():
+        d = statistics.median(t[("gen", True)]) - statistics.median(t[("gen", False)])
+        print(f"  {mode:<12}: {d:+.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+最適ペアリング（厳密解）とヒューリスティックの比較ベンチマーク
+- heuristic: optimize_pairings（マルチスタート + 2-opt）
+- optimal  : generate_optimal_pairings（分枝限定法、time_cap 超過時はヒューリスティック解）
+
+使い方: python bench_pairing_exact.py [--trials 10] [--time-cap 0.5]
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from flask import Flask
+
+from game.game_utils import Player, generate_optimal_pairings, optimize_pairings
+
+
+def make_roster(n, rng):
+    players = []
+    for i in range(n):
+        mu = rng.gauss(25.0, 8.0)
+        sigma = rng.uniform(1.5, 8.333)
+        p = Player(f"p{i:02d}", mu - 3 * sigma, rng.choice("MF"), skill_score=mu, skill_sigma=sigma)
+        # 実運用と同じく小数2桁程度の値で比較
+        p.conservative = round(mu - 3 * sigma, 2)
+        players.append(p)
+    return players
+
+
+def main(trials, time_cap):
+    app = Flask(__name__)
+    cases = [(n, min(n // 4, 6)) for n in range(8, 25, 4)] + [(22, 5), (24, 4)]
+
+    print(f"{'players':>7} {'courts':>6} | {'heur_pen':>9} {'heur_ms':>7} | "
+          f"{'opt_pen':>9} {'opt_ms':>7} {'p95_ms':>7} {'proven':>6} {'improved':>8}")
+    with app.app_context():
+        for n, courts in cases:
+            hp, ht, op, ot, proven, improved = [], [], [], [], 0, 0
+            for t in range(trials):
+                roster = make_roster(n, random.Random(7919 * n + t))
+
+                t0 = time.perf_counter()
+                _, _, h_cost = optimize_pairings(roster, courts, seed=t)
+                ht.append((time.perf_counter() - t0) * 1000)
+                hp.append(h_cost)
+
+                t0 = time.perf_counter()
+                _, _, o_cost, ok = generate_optimal_pairings(roster, courts, time_cap=time_cap, seed=t)
+                ot.append((time.perf_counter() - t0) * 1000)
+                op.append(o_cost)
+                proven += ok
+                improved += o_cost < h_cost - 1e-9
+                assert o_cost <= h_cost + 1e-9
+
+            p95 = sorted(ot)[max(0, int(len(ot) * 0.95) - 1)]
+            print(f"{n:>7} {courts:>6} | {statistics.mean(hp):>9.4f} {statistics.mean(ht):>7.1f} | "
+                  f"{statistics.mean(op):>9.4f} {statistics.mean(ot):>7.1f} {p95:>7.1f} "
+                  f"{proven:>3}/{trials:<2} {improved:>5}/{trials:<2}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--trials", type=int, default=10)
+    ap.add_argument("--time-cap", type=float, default=0.5)
+    args = ap.parse_args()
+    main(args.trials, args.time_cap)
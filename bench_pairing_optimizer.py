@@ -0,0 +1,74 @@
+"""
+AIペアリングの比較ベンチマーク
+- 旧: generate_ai_best_pairings_legacy（ランダムシャッフル1000回）
+- 新: optimize_pairings（NumPy一括評価のマルチスタート + 2-opt）
+
+品質はチーム平均差の二乗和（小さいほど良い）で比較する。
+使い方: python bench_pairing_optimizer.py [--trials 10] [--max-courts 6]
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from flask import Flask
+
+from game.game_utils import Player, generate_ai_best_pairings_legacy, optimize_pairings
+
+
+def make_roster(n, rng):
+    players = []
+    for i in range(n):
+        mu = rng.gauss(25.0, 8.0)
+        sigma = rng.uniform(1.5, 8.333)
+        p = Player(f"p{i:02d}", mu - 3 * sigma, rng.choice("MF"), skill_score=mu, skill_sigma=sigma)
+        p.conservative = mu - 3 * sigma
+        players.append(p)
+    return players
+
+
+def penalty(matches):
+    total = 0.0
+    for (a1, a2), (b1, b2) in matches:
+        diff = abs((a1.conservative + a2.conservative) / 2 - (b1.conservative + b2.conservative) / 2)
+        total += diff ** 2
+    return total
+
+
+def main(trials, max_courts):
+    app = Flask(__name__)
+    print(f"{'players':>7} | {'legacy_pen':>10} {'legacy_ms':>9} | {'new_pen':>10} {'new_ms':>7}")
+    with app.app_context():
+        for n in range(8, 41, 4):
+            lp, lt, npen, nt = [], [], [], []
+            for t in range(trials):
+                roster = make_roster(n, random.Random(1000 * n + t))
+
+                random.seed(t)
+                t0 = time.perf_counter()
+                matches, _ = generate_ai_best_pairings_legacy(roster, max_courts, iterations=1000)
+                lt.append((time.perf_counter() - t0) * 1000)
+                lp.append(penalty(matches))
+
+                t0 = time.perf_counter()
+                matches, _, total = optimize_pairings(roster, max_courts, seed=t)
+                nt.append((time.perf_counter() - t0) * 1000)
+                npen.append(total)
+                assert abs(total - penalty(matches)) < 1e-6, "返却値と組み合わせのペナルティが一致しません"
+
+                # 同じ seed なら同じ結果
+                again, _, total2 = optimize_pairings(roster, max_courts, seed=t)
+                names = lambda ms: [[p.name for team in m for p in team] for m in ms]
+                assert total2 == total and names(again) == names(matches), "seed 指定で結果が再現しません"
+
+            print(f"{n:>7} | {statistics.mean(lp):>10.3f} {statistics.mean(lt):>9.1f} | "
+                  f"{statistics.mean(npen):>10.4f} {statistics.mean(nt):>7.1f}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--trials", type=int, default=10)
+    ap.add_argument("--max-courts", type=int, default=6)
+    args = ap.parse_args()
+    main(args.trials, args.max_courts)
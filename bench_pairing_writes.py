@@ -0,0 +1,257 @@
+"""
+ペアリング確定時の書き込み方式の比較ベンチマーク
+- 旧: プレイヤーごとに update_item / put_item（直列。待機者は休み累計の Update + 休みイベントの Put の2件）
+- 新: transact_write_in_chunks で 25件ずつの transact_write_items（create_pairings と同じ Update/Put を使う）
+
+既定はメモリ上のスタブ（1リクエストごとに RTT を sleep）で計測する。
+DynamoDB Local がある場合は --endpoint-url で実テーブルに対して計測できる。
+
+使い方:
+  python bench_pairing_writes.py [--players 30] [--courts 6] [--rtt-ms 8]
+  python bench_pairing_writes.py --endpoint-url http://localhost:8000
+  python bench_pairing_writes.py --fail-chunk 1     # 2チャンク目を失敗させて巻き戻しを確認
+"""
+
+import argparse
+import os
+import time
+import uuid
+
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("AWS_REGION", "ap-northeast-1")
+os.environ.setdefault("TABLE_NAME_USER", "bad-users")
+os.environ.setdefault("TABLE_NAME_SCHEDULE", "bad_schedules")
+
+from botocore.exceptions import ClientError  # noqa: E402
+from flask import Flask  # noqa: E402
+
+from game.game_utils import transact_write_in_chunks  # noqa: E402
+from game.views import (  # noqa: E402
+    _playing_rollback_tx_item,
+    _playing_tx_item,
+    _rest_count_rollback_tx_item,
+    _rest_count_tx_item,
+    _rest_event_rollback_tx_item,
+    _rest_event_tx_item,
+)
+
+TABLE_NAME = "bench-match_entries"
+
+
+def _canceled(reason="ConditionalCheckFailed", message="condition"):
+    return ClientError(
+        {"Error": {"Code": "TransactionCanceledException", "Message": message},
+         "CancellationReasons": [{"Code": reason}]},
+        "TransactWriteItems",
+    )
+
+
+class StubClient:
+    """entry_id -> item の dict に create_pairings の Update/Put/Delete を適用する low-level client もどき"""
+
+    def __init__(self, rtt, fail_call=None, on_commit=None):
+        self.rtt = rtt
+        self.items = {}
+        self.requests = 0
+        self.fail_call = fail_call  # n回目の transact_write_items を失敗させる
+        self.on_commit = on_commit  # 成功したトランザクションの後に呼ぶ（別ワーカーの書き込みの再現用）
+
+    # ベンチ用途: 各 helper の ExpressionAttributeValues のキーで種類を見分け、条件と更新を反映する
+    def _check(self, op, body):
+        key = body["Key"] if "Key" in body else body["Item"]
+        item = self.items.get(key["entry_id"]["S"])
+        vals = body.get("ExpressionAttributeValues", {})
+        if op == "Put":
+            return item is None
+        if op == "Delete":
+            return True
+        if ":prev" in vals:
+            return bool(item) and item.get("entry_status") == "playing" and item.get("match_id") == vals[":mid"]["S"]
+        if ":playing" in vals:
+            return bool(item) and item.get("entry_status", "pending") in ("pending", "resting")
+        if ":minus" in vals:
+            return bool(item) and item.get("last_rest_match_id") == vals[":mid"]["S"]
+        return item is not None
+
+    def _apply(self, op, body):
+        vals = body.get("ExpressionAttributeValues", {})
+        if op == "Put":
+            item = {k: list(v.values())[0] for k, v in body["Item"].items()}
+            self.items[item["entry_id"]] = item
+            return
+        entry_id = body["Key"]["entry_id"]["S"]
+        if op == "Delete":
+            self.items.pop(entry_id, None)
+            return
+        item = self.items.setdefault(entry_id, {"entry_id": entry_id})
+        if ":prev" in vals:
+            item["entry_status"] = vals[":prev"]["S"]
+            item.pop("match_id", None)
+        elif ":playing" in vals:
+            item["entry_status"] = "playing"
+            item["match_id"] = vals[":mid"]["S"]
+        elif ":rr" in vals:
+            item["last_rest_match_id"] = vals[":mid"]["S"]
+            item["rest_count"] = item.get("rest_count", 0) + 1
+        elif ":minus" in vals:
+            item["rest_count"] = item.get("rest_count", 0) - 1
+        elif ":st" in vals:
+            item["entry_status"] = vals[":st"]["S"]
+
+    def update_item(self, **upd):
+        return self._single("Update", upd)
+
+    def put_item(self, **put):
+        return self._single("Put", put)
+
+    def _single(self, op, body):
+        self.requests += 1
+        time.sleep(self.rtt)
+        if not self._check(op, body):
+            raise ClientError({"Error": {"Code": "ConditionalCheckFailedException", "Message": "condition"}}, op)
+        self._apply(op, body)
+        return {}
+
+    def transact_write_items(self, TransactItems):
+        self.requests += 1
+        time.sleep(self.rtt)
+        if len(TransactItems) > 25:
+            raise ClientError({"Error": {"Code": "ValidationException", "Message": "too many items"}}, "TransactWriteItems")
+        if self.fail_call is not None and self.requests - 1 == self.fail_call:
+            raise _canceled(message="injected")
+        ops = [next(iter(it.items())) for it in TransactItems]
+        if not all(self._check(op, body) for op, body in ops):
+            raise _canceled()
+        for op, body in ops:
+            self._apply(op, body)
+        if self.on_commit:
+            self.on_commit(self)
+        return {}
+
+
+def make_real_client(endpoint_url):
+    import boto3
+    client = boto3.client("dynamodb", endpoint_url=endpoint_url, region_name="ap-northeast-1",
+                          aws_access_key_id="dummy", aws_secret_access_key="dummy")
+    try:
+        client.delete_table(TableName=TABLE_NAME)
+        client.get_waiter("table_not_exists").wait(TableName=TABLE_NAME)
+    except ClientError:
+        pass
+    client.create_table(
+        TableName=TABLE_NAME,
+        AttributeDefinitions=[{"AttributeName": "entry_id", "AttributeType": "S"}],
+        KeySchema=[{"AttributeName": "entry_id", "KeyType": "HASH"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    client.get_waiter("table_exists").wait(TableName=TABLE_NAME)
+    return client
+
+
+def seed(client, entry_ids):
+    for eid in entry_ids:
+        if isinstance(client, StubClient):
+            client.items[eid] = {"entry_id": eid, "entry_status": "pending"}
+        else:
+            client.put_item(TableName=TABLE_NAME, Item={"entry_id": {"S": eid}, "entry_status": {"S": "pending"}})
+
+
+def build_updates(entry_ids, courts, match_id, now):
+    """出場者は playing へ、待機者は休み累計 + 休みイベント（create_pairings と同じ並び）"""
+    playing = entry_ids[:courts * 4]
+    waiting = entry_ids[courts * 4:]
+    tx, undo = [], []
+    for i, eid in enumerate(playing):
+        court, team = i // 4 + 1, "A" if i % 4 < 2 else "B"
+        tx.append(_playing_tx_item(TABLE_NAME, eid, match_id, court, team, now, count_match=False))
+        undo.append(_playing_rollback_tx_item(TABLE_NAME, eid, match_id, "pending", now, count_match=False))
+    for eid in waiting:
+        rest_item = {
+            "entry_id": str(uuid.uuid4()), "type": "rest_event", "match_id": match_id,
+            "reason": "not_selected", "court_number": 0, "team": "R",
+            "created_at": now, "updated_at": now, "source_entry_id": eid,
+        }
+        tx.append(_rest_count_tx_item(TABLE_NAME, eid, match_id, now))
+        undo.append(_rest_count_rollback_tx_item(TABLE_NAME, eid, match_id))
+        tx.append(_rest_event_tx_item(TABLE_NAME, rest_item))
+        undo.append(_rest_event_rollback_tx_item(TABLE_NAME, rest_item))
+    return tx, undo
+
+
+def write_sequential(client, tx):
+    for it in tx:
+        op, body = next(iter(it.items()))
+        if op == "Put":
+            client.put_item(**body)
+        else:
+            client.update_item(**body)
+
+
+def count_requests(client):
+    return client.requests if isinstance(client, StubClient) else None
+
+
+def main(args):
+    app = Flask(__name__)
+    entry_ids = [str(uuid.uuid4()) for _ in range(args.players)]
+    now = "2025-01-01T10:00:00+09:00"
+
+    def new_client(**kw):
+        if args.endpoint_url:
+            c = make_real_client(args.endpoint_url)
+        else:
+            c = StubClient(args.rtt_ms / 1000.0, **kw)
+        seed(c, entry_ids)
+        return c
+
+    with app.app_context():
+        # 旧: 直列 update_item / put_item
+        client = new_client()
+        tx, _ = build_updates(entry_ids, args.courts, "m-seq", now)
+        t0 = time.perf_counter()
+        write_sequential(client, tx)
+        seq_ms = (time.perf_counter() - t0) * 1000
+        print(f"[sequential] writes={len(tx)} requests={count_requests(client) or len(tx)} {seq_ms:.1f}ms")
+
+        # 新: 25件ずつの transact_write_items
+        client = new_client()
+        tx, undo = build_updates(entry_ids, args.courts, "m-tx", now)
+        t0 = time.perf_counter()
+        report = transact_write_in_chunks(client, tx, undo)
+        tx_ms = (time.perf_counter() - t0) * 1000
+        print(f"[transact ] writes={len(tx)} chunks={len(report['chunks'])} ok={report['ok']} {tx_ms:.1f}ms "
+              f"(x{seq_ms / tx_ms:.1f})")
+
+        if args.fail_chunk is None or args.endpoint_url:
+            return
+
+        # 失敗注入: 途中のチャンクが失敗したら成功済みチャンクが巻き戻ること。
+        # 巻き戻す前に1人だけ別の処理で playing から外れた（条件に合わない）場合も、他の行は戻ること
+        moved = entry_ids[0]
+
+        def move_one(c):
+            if c.items[moved].get("match_id") == "m-fail":
+                c.items[moved].update(entry_status="pending", match_id="m-other")
+
+        client = new_client(fail_call=args.fail_chunk, on_commit=move_one)
+        tx, undo = build_updates(entry_ids, args.courts, "m-fail", now)
+        report = transact_write_in_chunks(client, tx, undo)
+        leftover = [i for i in client.items.values() if i.get("match_id") == "m-fail"]
+        rests = [i for i in client.items.values() if i.get("type") == "rest_event"]
+        rest_counts = [i.get("rest_count", 0) for i in client.items.values() if "rest_count" in i]
+        print(f"[rollback ] ok={report['ok']} chunks={[(c['index'], c['ok']) for c in report['chunks']]} "
+              f"rolled_back={report['rolled_back']} skipped={report['rollback_skipped']} "
+              f"leftover_playing={len(leftover)} rest_events={len(rests)} rest_counts={sorted(set(rest_counts))}")
+        assert not leftover, "巻き戻し後に playing が残っています"
+        assert not rests and set(rest_counts) <= {0}, "巻き戻し後に休み記録が残っています"
+        assert report["rollback_skipped"] == 1, "条件に外れた補償は1件だけのはずです"
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--players", type=int, default=30)
+    ap.add_argument("--courts", type=int, default=6)
+    ap.add_argument("--rtt-ms", type=float, default=8.0, help="スタブ1リクエストあたりの往復遅延(ms)")
+    ap.add_argument("--endpoint-url", default=None, help="DynamoDB Local のURL（省略時はスタブ）")
+    ap.add_argument("--fail-chunk", type=int, default=1, help="n番目(0始まり)の transact を失敗させる")
+    main(ap.parse_args())
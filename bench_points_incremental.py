@@ -0,0 +1,242 @@
+"""
+旧ルールポイントの逐次計算（uguu/point_state.py）の一致確認とベンチマーク
+
+1) ランダムな参加履歴・練習日で、従来の一括計算
+   （calc_reset_index / calc_participation_and_cumulative / calc_monthly_bonus / calc_streak_points /
+    calc_registration_counts）と PointsCheckpoint の結果がすべて一致することを確認する
+   - 全件の作り直し（replay_points）
+   - 途中まで畳んだチェックポイントに残りを追記（advance_points、保存→読込の往復込み）
+   - 途中の参加をキャンセル / キャンセル＋新規登録（advance_points が作り直しに切り替わること）
+2) 1k / 10k 件の履歴で、一括計算・作り直し・1件追記の所要時間を比べる
+
+使い方: python bench_points_incremental.py [--cases 500] [--seed 1]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+os.environ.setdefault("POINT_LOG", "0")
+os.environ.setdefault("AWS_REGION", "ap-northeast-1")
+
+from uguu.dynamo import DynamoDB
+from uguu.point import (
+    ParticipationRecord,
+    PointRules,
+    calc_days_until_reset,
+    calc_monthly_bonus,
+    calc_participation_and_cumulative,
+    calc_registration_counts,
+    calc_reset_index,
+    calc_streak_points,
+    slice_records_for_points,
+)
+from uguu.point_state import PointsCheckpoint, advance_points, replay_points
+
+RULES = PointRules(reset_days=60, first_participation_points=200)
+
+
+def early_fn(record):
+    # self を使わない純粋関数なので、そのまま借りる
+    return DynamoDB._is_early_registration(None, record)
+
+
+def random_history(rng, n, start=datetime(2023, 1, 1)):
+    records = []
+    day = start
+    for _ in range(n):
+        r = rng.random()
+        if r < 0.05:
+            gap = rng.randint(61, 120)    # 60日ルールのリセット
+        elif r < 0.12:
+            gap = 0                       # 同日に2件
+        else:
+            gap = rng.randint(1, 10)
+        day = day + timedelta(days=gap)
+        reg = day - timedelta(days=rng.randint(0, 6), hours=rng.randint(0, 23), minutes=rng.randint(0, 59))
+        records.append(ParticipationRecord(event_date=day, registered_at=reg, status="registered"))
+    return records
+
+
+def random_schedules(rng, records, today):
+    """練習日（過去分のみ）。参加日の大半＋ランダムな欠席日、同日重複もあり"""
+    if not records:
+        return []
+    first, last = records[0].event_date, max(records[-1].event_date, today)
+    days = {r.event_date.strftime("%Y-%m-%d") for r in records if rng.random() < 0.9}
+    d = first - timedelta(days=10)
+    while d <= last:
+        if rng.random() < 0.15:
+            days.add(d.strftime("%Y-%m-%d"))
+        d += timedelta(days=1)
+    today_s = today.strftime("%Y-%m-%d")
+    schedules = [{"date": s} for s in days if s <= today_s]
+    schedules += [{"date": s["date"]} for s in schedules if rng.random() < 0.1]
+    rng.shuffle(schedules)
+    return schedules
+
+
+def batch_stats(records, all_schedules, multiplier):
+    """get_user_stats（変更前）と同じ手順の一括計算"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        last_reset_index, is_reset = calc_reset_index(records, RULES.reset_days)
+        rfp = slice_records_for_points(records, last_reset_index)
+        all_early, all_direct = calc_registration_counts(records, early_fn)
+        pc = calc_participation_and_cumulative(records, rfp, RULES, multiplier, early_fn)
+        monthly_points, monthly = calc_monthly_bonus(rfp, multiplier)
+
+        schedules = sorted(all_schedules, key=lambda s: s["date"])
+        reset_date = None
+        if last_reset_index > 0 and rfp:
+            reset_date = rfp[0].event_date.strftime("%Y-%m-%d")
+            schedules = [s for s in schedules if s["date"] >= reset_date]
+        seen, for_streak = set(), []
+        for s in schedules:
+            if s["date"] not in seen:
+                seen.add(s["date"])
+                for_streak.append(s)
+        sp, cur, mx, start = calc_streak_points(rfp, for_streak, RULES, multiplier)
+
+    return {
+        "participation_points": pc["participation_points"],
+        "cumulative_bonus_points": pc["cumulative_bonus_points"],
+        "cumulative_count": pc["cumulative_count"],
+        "early_registration_count": pc["early_registration_count"],
+        "direct_registration_count": pc["direct_registration_count"],
+        "all_time_early_registration_count": all_early,
+        "all_time_direct_registration_count": all_direct,
+        "monthly_bonus_points": monthly_points,
+        "monthly_bonuses": monthly,
+        "streak_points": sp,
+        "current_streak_count": cur,
+        "max_streak": mx,
+        "current_streak_start": start,
+        "total_participation": len(records),
+        "last_participation_date": records[-1].event_date.strftime("%Y-%m-%d"),
+        "reset_date": reset_date,
+        "is_reset": is_reset,
+        "days_until_reset": calc_days_until_reset(records[-1].event_date, RULES.reset_days),
+    }
+
+
+def incremental_stats(cp):
+    st = cp.to_stats()
+    st.pop("has_reset")
+    return st
+
+
+def as_dynamo(item):
+    """DynamoDB から読んだ時と同じく数値を Decimal にする"""
+    if isinstance(item, bool):
+        return item
+    if isinstance(item, int):
+        return Decimal(item)
+    if isinstance(item, dict):
+        return {k: as_dynamo(v) for k, v in item.items()}
+    if isinstance(item, list):
+        return [as_dynamo(v) for v in item]
+    return item
+
+
+def check(cases, seed):
+    rng = random.Random(seed)
+    failures = 0
+    rebuilt = 0
+    for case in range(cases):
+        n = rng.randint(1, 120)
+        records = random_history(rng, n)
+        today = records[rng.randrange(len(records))].event_date + timedelta(days=rng.randint(-5, 90))
+        schedules = random_schedules(rng, records, today)
+        multiplier = rng.choice([1.0, 1.0, 1.5, 2.0])
+
+        expected = batch_stats(records, schedules, multiplier)
+
+        # 全件の作り直し
+        got = incremental_stats(replay_points(records, schedules, RULES, multiplier, early_fn))
+
+        # 途中まで畳んで保存 → 読み込み → 残りを追記
+        k = rng.randint(0, len(records))
+        t = rng.choice(schedules)["date"] if schedules else "0000-00-00"
+        partial = replay_points(records[:k], [s for s in schedules if s["date"] <= t], RULES, multiplier, early_fn)
+        restored = PointsCheckpoint.from_item(as_dynamo(partial.to_item()))
+        advanced = incremental_stats(advance_points(restored, records, schedules, RULES, multiplier, early_fn))
+
+        # 途中の参加をキャンセル → 作り直し扱いになって一致
+        cancel_ok = True
+        if len(records) > 2:
+            full = replay_points(records, schedules, RULES, multiplier, early_fn)
+            remaining = records[:1] + records[2:]
+            after_cancel = incremental_stats(advance_points(full, remaining, schedules, RULES, multiplier, early_fn))
+            cancel_ok = after_cancel == batch_stats(remaining, schedules, multiplier)
+
+            # キャンセル + 新しい登録で件数が同じになっても作り直しになること
+            extra = ParticipationRecord(
+                event_date=records[-1].event_date + timedelta(days=3),
+                registered_at=records[-1].event_date,
+                status="registered",
+            )
+            swapped = remaining + [extra]
+            after_swap = incremental_stats(advance_points(full, swapped, schedules, RULES, multiplier, early_fn))
+            cancel_ok = cancel_ok and after_swap == batch_stats(swapped, schedules, multiplier)
+
+        if any(r.event_date.strftime("%Y-%m-%d") <= t for r in records[k:]):
+            rebuilt += 1
+
+        for label, value in (("replay", got), ("advance", advanced)):
+            if value != expected:
+                failures += 1
+                diff = {key: (expected.get(key), value.get(key)) for key in expected if expected.get(key) != value.get(key)}
+                print(f"[NG] case={case} {label} n={n} k={k} diff={diff}")
+        if not cancel_ok:
+            failures += 1
+            print(f"[NG] case={case} cancel n={n}")
+
+    print(f"[CHECK] cases={cases} failures={failures} (advance が作り直しに回ったケース={rebuilt})")
+    return failures == 0
+
+
+def bench(n, seed, repeat=3):
+    rng = random.Random(seed)
+    records = random_history(rng, n)
+    # 最後の1件は「これからの練習に新しく登録した」扱い（練習日は前日まで）
+    today = records[-1].event_date - timedelta(days=1)
+    schedules = random_schedules(rng, records, today)
+
+    def best(fn):
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+        return min(times) * 1000
+
+    t_batch = best(lambda: batch_stats(records, schedules, 1.0))
+    t_replay = best(lambda: replay_points(records, schedules, RULES, 1.0, early_fn))
+
+    # 最後の1件が新しく登録された状態
+    saved = replay_points(records[:-1], schedules, RULES, 1.0, early_fn).to_item()
+    t_append = best(lambda: advance_points(PointsCheckpoint.from_item(saved), records, schedules, RULES, 1.0, early_fn))
+
+    print(f"[BENCH] records={n:>6} schedules={len(schedules):>6}  "
+          f"一括={t_batch:8.2f}ms  作り直し={t_replay:8.2f}ms  1件追記={t_append:8.2f}ms")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cases", type=int, default=500)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    ok = check(args.cases, args.seed)
+    for n in (1_000, 10_000):
+        bench(n, args.seed)
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+SharedCache（utils/shared_cache.py）のワーカー間の一貫性とヒット率の確認
+
+- stand-in: プロセス内の SimpleCache（init_app 前と同じ状態）で、断片キャッシュ相当の読み書きと無効化
+- filesystem: FileSystemCache を共有する複数プロセス（gunicorn のワーカー相当）
+  1) 全ワーカーが同じ断片を読む → 最初の1回以外はヒット
+  2) 1つのワーカーが invalidate_schedule → 他のワーカーも次の読み取りでミスになる
+  3) "users" の変更ログ: 1つのワーカーで publish した ID を他のワーカーが changes_since で受け取れる
+  4) 全ワーカーが同時に publish しても、changes_since は全員分の ID を返すか None（全件読み直し）で、
+     一部の ID だけが黙って抜けることはない
+
+一貫性が崩れていたら終了コード 1 で終わる。
+使い方: python bench_shared_cache.py [--workers 4] [--requests 200] [--schedules 10]
+"""
+
+import argparse
+import multiprocessing as mp
+import shutil
+import tempfile
+import time
+
+from cachelib import FileSystemCache, SimpleCache
+
+from utils.fragment_cache import FragmentCache
+from utils.shared_cache import SharedCache
+
+
+def simulate_requests(frag, n_requests, n_schedules):
+    """トップページ相当: 毎回スケジュール数分の断片を読み、ミスなら描画して置く"""
+    for _ in range(n_requests):
+        for i in range(n_schedules):
+            key = f"s{i}#2026-11-{i + 1:02d}"
+            frag.get_or_build("index_participants", key, ("ua", ("u1",), ()), lambda: f"<div>{key}</div>")
+
+
+def worker(cache_dir, n_requests, n_schedules, n_publishes, barrier, results, idx):
+    shared = SharedCache(FileSystemCache(cache_dir, threshold=5000))
+    frag = FragmentCache(cache=shared)
+
+    # 1) 温める（誰か1人が描画すれば他は読むだけ）
+    barrier.wait()
+    simulate_requests(frag, n_requests, n_schedules)
+    warm = frag.stats()["kinds"]["index_participants"]
+
+    # 2) ワーカー0が s0 を無効化 → 全員が s0 を1回ずつ読み直す
+    seen_users = shared.version("users")
+    barrier.wait()
+    if idx == 0:
+        frag.invalidate_schedule("s0", "2026-11-01")
+        shared.publish("users", ["u1", "u2"])
+    barrier.wait()
+    before = frag.misses["index_participants"]
+    frag.get("index_participants", "s0#2026-11-01", ("ua", ("u1",), ()))
+    after = frag.misses["index_participants"]
+
+    # 3) 変更ログ
+    _, changed = shared.changes_since("users", seen_users)
+
+    # 4) 同時 publish
+    seen_race = shared.version("race")
+    barrier.wait()
+    for k in range(n_publishes):
+        shared.publish("race", [f"w{idx}-{k}"])
+    barrier.wait()
+    _, raced = shared.changes_since("race", seen_race)
+
+    results.put({
+        "idx": idx,
+        "warm_hits": warm["hits"],
+        "warm_misses": warm["misses"],
+        "saw_invalidation": after == before + 1,
+        "changed": sorted(changed or []),
+        "raced": None if raced is None else sorted(raced),
+    })
+
+
+def run_standin(n_requests, n_schedules):
+    shared = SharedCache(SimpleCache())
+    frag = FragmentCache(cache=shared)
+    t0 = time.perf_counter()
+    simulate_requests(frag, n_requests, n_schedules)
+    elapsed = (time.perf_counter() - t0) * 1000
+    frag.invalidate_schedule("s1", "2026-11-02")
+    ok = frag.get("index_participants", "s1#2026-11-02", ("ua", ("u1",), ())) is None
+    ok &= frag.get("index_participants", "s2#2026-11-03", ("ua", ("u1",), ())) is not None
+    ok &= frag.get("index_participants", "s2#2026-11-03", ("other",)) is None
+    print(f"[stand-in] {frag.stats()['kinds']['index_participants']}  {elapsed:.1f}ms  無効化={'OK' if ok else 'NG'}")
+    return ok
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--schedules", type=int, default=10)
+    ap.add_argument("--publishes", type=int, default=20, help="4) で各ワーカーが同時に publish する回数")
+    args = ap.parse_args()
+
+    ok = run_standin(args.requests, args.schedules)
+
+    cache_dir = tempfile.mkdtemp(prefix="uguis-cache-bench-")
+    try:
+        ctx = mp.get_context("spawn")
+        barrier = ctx.Barrier(args.workers)
+        results = ctx.Queue()
+        procs = [
+            ctx.Process(target=worker, args=(cache_dir, args.requests, args.schedules, args.publishes,
+                                       barrier, results, i))
+            for i in range(args.workers)
+        ]
+        t0 = time.perf_counter()
+        for p in procs:
+            p.start()
+        rows = [results.get(timeout=120) for _ in procs]
+        for p in procs:
+            p.join()
+        elapsed = (time.perf_counter() - t0) * 1000
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    total_hits = sum(r["warm_hits"] for r in rows)
+    total_misses = sum(r["warm_misses"] for r in rows)
+    expected_race = sorted(f"w{i}-{k}" for i in range(args.workers) for k in range(args.publishes))
+    for r in sorted(rows, key=lambda r: r["idx"]):
+        race = "None(全件読み直し)" if r["raced"] is None else (
+            "OK" if r["raced"] == expected_race else f"NG {len(r['raced'])}/{len(expected_race)}")
+        print(f"  worker{r['idx']}: hits={r['warm_hits']} misses={r['warm_misses']} "
+              f"invalidation={'OK' if r['saw_invalidation'] else 'NG'} changed={r['changed']} 同時publish={race}")
+    rate = total_hits / (total_hits + total_misses)
+    print(f"[filesystem] workers={args.workers} hit_rate={rate:.3f} "
+          f"(プロセス内キャッシュなら最大 {1 - 1 / args.requests:.3f} / ワーカー) {elapsed:.0f}ms")
+
+    ok &= all(r["saw_invalidation"] for r in rows)
+    ok &= all(r["changed"] == ["u1", "u2"] for r in rows)
+    ok &= all(r["raced"] is None or r["raced"] == expected_race for r in rows)
+    # 共有できていれば、断片を描画するのは全ワーカー合わせて概ねスケジュール数回だけ
+    ok &= total_misses <= args.schedules * args.workers
+    if not ok:
+        print("[NG] ワーカー間の一貫性が崩れています")
+        raise SystemExit(1)
+    print("[OK]")
+
+
+if __name__ == "__main__":
+    main()
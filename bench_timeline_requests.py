@@ -0,0 +1,162 @@
+"""
+タイムライン1ページ分の DynamoDB リクエスト数の確認
+
+get_posts_page + enrich_feed_posts（show_timeline / api_feed と同じ組み立て）を
+boto3 もどきのスタブ上で実行し、リクエスト数と所要時間（1リクエストごとに RTT を sleep）を表示する。
+
+- 旧: 投稿1件ごとに 返信 Query + COUNT Query + 投稿者 get_item + いいね get_item（5件で 1 + 4×5 = 21）
+- 新: フィード Query 1 + 投稿者 BatchGet 1 + いいね BatchGet 1 + 返信 Query ×件数（並列）
+
+リクエスト数が上限を超えたら終了コード 1 で終わる。
+使い方: python bench_timeline_requests.py [--posts 5] [--rtt-ms 8] [--legacy 0]
+"""
+
+import argparse
+import threading
+import time
+from collections import Counter
+
+from boto3.dynamodb.types import TypeSerializer
+from flask import Flask
+
+from uguu.dynamo import db
+from uguu.feed import enrich_feed_posts
+from utils.user_directory import user_directory
+
+_serializer = TypeSerializer()
+
+
+class Recorder:
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def hit(self, op):
+        with self._lock:
+            self.calls[op] += 1
+        time.sleep(self.rtt)
+
+
+class StubClient:
+    """低レベル client（返信の Query 用）"""
+
+    def __init__(self, data, rec):
+        self.data = data
+        self.rec = rec
+
+    def query(self, TableName, ExpressionAttributeValues, Limit=None, Select=None, **kwargs):
+        self.rec.hit(f"client.query:{TableName}" + (":COUNT" if Select == "COUNT" else ""))
+        pid = ExpressionAttributeValues[":pid"]["S"]
+        items = sorted(self.data["replies"].get(pid, []), key=lambda r: r["sk"], reverse=True)
+        if Select == "COUNT":
+            return {"Count": len(items)}
+        page = items[:Limit] if Limit else items
+        resp = {"Items": [{k: _serializer.serialize(v) for k, v in it.items()} for it in page]}
+        if Limit and len(items) > Limit:
+            resp["LastEvaluatedKey"] = {"post_id": {"S": pid}, "sk": {"S": page[-1]["sk"]}}
+        return resp
+
+
+class StubTable:
+    def __init__(self, name, data, rec):
+        self.name = name
+        self.data = data
+        self.rec = rec
+
+    def query(self, IndexName=None, Limit=None, **kwargs):
+        self.rec.hit(f"query:{self.name}:{IndexName}")
+        return {"Items": list(self.data["posts"][:Limit])}
+
+
+class StubDynamo:
+    def __init__(self, data, rec):
+        self.data = data
+        self.rec = rec
+        self.meta = type("Meta", (), {})()
+        self.meta.client = StubClient(data, rec)
+
+    def Table(self, name):
+        return StubTable(name, self.data, self.rec)
+
+    def batch_get_item(self, RequestItems):
+        self.rec.hit("batch_get_item")
+        responses = {}
+        for table, req in RequestItems.items():
+            found = []
+            for key in req["Keys"]:
+                if "user#user_id" in key:
+                    item = self.data["users"].get(key["user#user_id"])
+                else:
+                    item = self.data["likes"].get((key["PK"], key["SK"]))
+                if item:
+                    found.append(item)
+            responses[table] = found
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+
+def build_data(n_posts, legacy):
+    posts, users, replies, likes = [], {}, {}, {}
+    for i in range(n_posts):
+        pid = f"p{i}"
+        uid = f"u{i % 3}"
+        users[uid] = {"user#user_id": uid, "display_name": f"user{i % 3}", "profile_image_url": f"https://x/{uid}.png"}
+        replies[pid] = [
+            {"post_id": pid, "sk": f"REPLY#{j:03d}", "reply_id": f"{j:03d}", "user_id": "u9", "content": "ok",
+             "created_at": f"2026-01-01T00:00:{j:02d}"}
+            for j in range(i * 2)
+        ]
+        post = {"PK": f"POST#{pid}", "SK": f"METADATA#{pid}", "post_id": pid, "user_id": uid,
+                "content": "hello", "created_at": f"2026-01-0{i % 9 + 1}", "likes_count": i}
+        if i >= legacy:
+            post["replies_count"] = len(replies[pid])
+        posts.append(post)
+        if i % 2 == 0:
+            likes[(f"POST#{pid}", "LIKE#viewer")] = {"PK": f"POST#{pid}"}
+    return {"posts": posts, "users": users, "replies": replies, "likes": likes}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--posts", type=int, default=5)
+    ap.add_argument("--rtt-ms", type=float, default=8.0)
+    ap.add_argument("--legacy", type=int, default=0, help="replies_count カウンタの無い投稿の数")
+    args = ap.parse_args()
+
+    data = build_data(args.posts, args.legacy)
+    rec = Recorder(args.rtt_ms / 1000)
+
+    app = Flask(__name__)
+    app.config["TABLE_NAME_USER"] = "bad-users"
+    app.dynamodb = StubDynamo(data, rec)
+    user_directory.invalidate_all()
+
+    with app.test_request_context("/"):
+        t0 = time.perf_counter()
+        posts, _ = db.get_posts_page(limit=args.posts)
+        enrich_feed_posts(posts, viewer_id="viewer")
+        elapsed = (time.perf_counter() - t0) * 1000
+
+    total = sum(rec.calls.values())
+    legacy_total = 1 + 4 * args.posts
+    # 返信5件を超える旧投稿だけ COUNT が増える
+    over = sum(1 for p in data["posts"][:args.legacy] if len(data["replies"][p["post_id"]]) > 5)
+    limit = 3 + args.posts + over
+
+    for op, n in sorted(rec.calls.items()):
+        print(f"  {op:<45} {n}")
+    print(f"[REQUESTS] 新={total} (上限 {limit}) / 旧={legacy_total}   所要 {elapsed:.1f}ms (RTT {args.rtt_ms}ms)")
+
+    liked = {p["post_id"] for p in posts if p["is_liked_by_user"]}
+    assert liked == {f"p{i}" for i in range(0, args.posts, 2)}, liked
+    assert all(p["display_name"].startswith("user") for p in posts)
+    assert all(p["replies_count"] == len(data["replies"][p["post_id"]]) for p in posts)
+
+    if total > limit:
+        print("[NG] リクエスト数が上限を超えています")
+        raise SystemExit(1)
+    print("[OK]")
+
+
+if __name__ == "__main__":
+    main()
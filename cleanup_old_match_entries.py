@@ -0,0 +1,94 @@
+# bad-game-match_entries に溜まった過去の練習日の行を一括削除します（batch_writer で25件ずつ）。
+# 移行後の行は expires_at（TTL）で自動的に消えるので、これは主に移行前からの古い行を片付けるためのものです。
+#   - session_date が --before より前の行
+#   - session_date を持たない行（migrate_entry_sessions.py 前の行）のうち、時刻が --before より前のもの
+# 今日（--before の日）以降の行は消しません。
+#
+# 使い方:
+#   python cleanup_old_match_entries.py                          # DRY-RUN（今日より前の行の件数のみ）
+#   python cleanup_old_match_entries.py --before 2026-10-01      # DRY-RUN（指定日より前）
+#   python cleanup_old_match_entries.py --apply                  # 実際に削除
+
+import os, argparse
+from collections import Counter
+from datetime import datetime
+
+import boto3
+from dotenv import load_dotenv
+
+from utils.timezone import JST
+
+load_dotenv()
+
+AWS_REGION = os.getenv("AWS_REGION", "ap-northeast-1")
+TABLE_NAME = os.getenv("MATCH_ENTRIES_TABLE", "bad-game-match_entries")
+
+ddb = boto3.resource(
+    "dynamodb",
+    region_name=AWS_REGION,
+    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+)
+
+
+def _scan_all(tbl, **kw):
+    items = []
+    while True:
+        resp = tbl.scan(**kw)
+        items += resp.get("Items", [])
+        lek = resp.get("LastEvaluatedKey")
+        if not lek:
+            break
+        kw["ExclusiveStartKey"] = lek
+    return items
+
+
+def _row_date(item):
+    """session_date、無ければ joined_at / created_at / updated_at の先頭10文字（YYYY-MM-DD）"""
+    if item.get("session_date"):
+        return item["session_date"]
+    for k in ("joined_at", "created_at", "updated_at"):
+        v = item.get(k)
+        if isinstance(v, str) and len(v) >= 10:
+            return v[:10]
+    return None
+
+
+def main(before: str, apply: bool):
+    tbl = ddb.Table(TABLE_NAME)
+    rows = _scan_all(
+        tbl,
+        ProjectionExpression="entry_id, session_date, joined_at, created_at, updated_at",
+    )
+
+    targets, by_date, undated = [], Counter(), 0
+    for it in rows:
+        d = _row_date(it)
+        if d is None:
+            undated += 1  # 日付の分からない行は消さない
+            continue
+        if d < before:
+            targets.append(it)
+            by_date[d] += 1
+
+    print(f"[INFO] rows={len(rows)} delete_targets={len(targets)} (before {before}) undated={undated}")
+    for d, n in sorted(by_date.items()):
+        print(f"  - {d}: {n}")
+
+    if not apply:
+        print("[NOTE] DRY-RUN。--apply を付ければ削除します。")
+        return
+
+    with tbl.batch_writer() as batch:
+        for it in targets:
+            batch.delete_item(Key={"entry_id": it["entry_id"]})
+    print(f"[DONE] deleted={len(targets)}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--before", default=datetime.now(JST).strftime("%Y-%m-%d"),
+                    help="この日付（YYYY-MM-DD, JST）より前の行を消す。既定は今日")
+    ap.add_argument("--apply", action="store_true", help="実際に削除する（省略時はDRY-RUN）")
+    args = ap.parse_args()
+    main(before=args.before, apply=args.apply)
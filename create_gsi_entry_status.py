@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import boto3
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TABLE_NAME = os.getenv("MATCH_ENTRIES_TABLE", "bad-game-match_entries")
+REGION = os.getenv("AWS_REGION")
+
+INDEX_NAME = "entry_status-index"
+PK_ATTR = "entry_status"
+SK_ATTR = "entry_id"
+
+# match_id は試合終了時に REMOVE されるため GSI のキーにはしない（キーが欠けた行は GSI から消える）。
+# match_id での絞り込みは Query の FilterExpression で行う。
+
+
+def strip_rest_event_status(dynamodb):
+    """
+    過去の rest_event（休みの履歴行）から entry_status を外す
+    残しておくと GSI の resting パーティションに履歴が溜まり続けるため
+    """
+    paginator = dynamodb.get_paginator("scan")
+    stripped = 0
+    for page in paginator.paginate(
+        TableName=TABLE_NAME,
+        FilterExpression="#t = :re AND attribute_exists(entry_status)",
+        ExpressionAttributeNames={"#t": "type"},
+        ExpressionAttributeValues={":re": {"S": "rest_event"}},
+        ProjectionExpression="entry_id",
+    ):
+        for item in page.get("Items", []):
+            dynamodb.update_item(
+                TableName=TABLE_NAME,
+                Key={"entry_id": item["entry_id"]},
+                UpdateExpression="REMOVE entry_status",
+            )
+            stripped += 1
+    print(f"[OK] rest_event から entry_status を削除: {stripped}件")
+
+
+def main():
+    dynamodb = boto3.client(
+        "dynamodb",
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+        region_name=REGION,
+    )
+
+    if "--strip-rest-events" in sys.argv:
+        strip_rest_event_status(dynamodb)
+
+    # すでに存在するか確認
+    desc = dynamodb.describe_table(TableName=TABLE_NAME)
+    gsis = desc["Table"].get("GlobalSecondaryIndexes", []) or []
+    if any(g.get("IndexName") == INDEX_NAME for g in gsis):
+        print(f"[SKIP] GSI already exists: {INDEX_NAME}")
+        return
+
+    print(f"[CREATE] add GSI '{INDEX_NAME}' to table '{TABLE_NAME}'")
+
+    try:
+        dynamodb.update_table(
+            TableName=TABLE_NAME,
+            AttributeDefinitions=[
+                {"AttributeName": PK_ATTR, "AttributeType": "S"},
+                {"AttributeName": SK_ATTR, "AttributeType": "S"},
+            ],
+            GlobalSecondaryIndexUpdates=[
+                {
+                    "Create": {
+                        "IndexName": INDEX_NAME,
+                        "KeySchema": [
+                            {"AttributeName": PK_ATTR, "KeyType": "HASH"},
+                            {"AttributeName": SK_ATTR, "KeyType": "RANGE"},
+                        ],
+                        "Projection": {"ProjectionType": "ALL"},
+                    }
+                }
+            ],
+        )
+    except ClientError as e:
+        print("[ERROR] update_table failed")
+        raise
+
+    # ACTIVE待ち
+    print("[WAIT] building index... (this can take a few minutes)")
+    while True:
+        desc = dynamodb.describe_table(TableName=TABLE_NAME)
+        gsis = desc["Table"].get("GlobalSecondaryIndexes", []) or []
+        g = next((x for x in gsis if x.get("IndexName") == INDEX_NAME), None)
+        status = (g or {}).get("IndexStatus")
+        print(f"  - status: {status}")
+        if status == "ACTIVE":
+            break
+        time.sleep(10)
+
+    print(f"[OK] GSI ACTIVE: {INDEX_NAME}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import boto3
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TABLE_NAME = os.getenv("DYNAMODB_TABLE_NAME", "bad_schedules")
+REGION = os.getenv("AWS_REGION")
+
+INDEX_NAME = "status-date-index"
+PK_ATTR = "status"
+SK_ATTR = "date"
+
+# schedule_repository（utils/schedule_repository.py）が status=active + date の範囲で Query する。
+# status の無い古い行は GSI に載らないので、--backfill-status で active を埋めておく。
+
+
+def backfill_status(dynamodb):
+    """status が無いスケジュールに status=active を入れる（従来は未設定＝active 扱いだった）"""
+    paginator = dynamodb.get_paginator("scan")
+    filled = 0
+    for page in paginator.paginate(
+        TableName=TABLE_NAME,
+        FilterExpression="attribute_not_exists(#s)",
+        ExpressionAttributeNames={"#s": "status", "#d": "date"},
+        ProjectionExpression="schedule_id, #d",
+    ):
+        for item in page.get("Items", []):
+            dynamodb.update_item(
+                TableName=TABLE_NAME,
+                Key={"schedule_id": item["schedule_id"], "date": item["date"]},
+                UpdateExpression="SET #s = :a",
+                ConditionExpression="attribute_not_exists(#s)",
+                ExpressionAttributeNames={"#s": "status"},
+                ExpressionAttributeValues={":a": {"S": "active"}},
+            )
+            filled += 1
+    print(f"[OK] status を補完: {filled}件")
+
+
+def main():
+    dynamodb = boto3.client(
+        "dynamodb",
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+        region_name=REGION,
+    )
+
+    if "--backfill-status" in sys.argv:
+        backfill_status(dynamodb)
+
+    # すでに存在するか確認
+    desc = dynamodb.describe_table(TableName=TABLE_NAME)
+    gsis = desc["Table"].get("GlobalSecondaryIndexes", []) or []
+    if any(g.get("IndexName") == INDEX_NAME for g in gsis):
+        print(f"[SKIP] GSI already exists: {INDEX_NAME}")
+        return
+
+    print(f"[CREATE] add GSI '{INDEX_NAME}' to table '{TABLE_NAME}'")
+
+    try:
+        dynamodb.update_table(
+            TableName=TABLE_NAME,
+            AttributeDefinitions=[
+                {"AttributeName": PK_ATTR, "AttributeType": "S"},
+                {"AttributeName": SK_ATTR, "AttributeType": "S"},
+            ],
+            GlobalSecondaryIndexUpdates=[
+                {
+                    "Create": {
+                        "IndexName": INDEX_NAME,
+                        "KeySchema": [
+                            {"AttributeName": PK_ATTR, "KeyType": "HASH"},
+                            {"AttributeName": SK_ATTR, "KeyType": "RANGE"},
+                        ],
+                        "Projection": {"ProjectionType": "ALL"},
+                    }
+                }
+            ],
+        )
+    except ClientError as e:
+        print("[ERROR] update_table failed")
+        raise
+
+    # ACTIVE待ち
+    print("[WAIT] building index... (this can take a few minutes)")
+    while True:
+        desc = dynamodb.describe_table(TableName=TABLE_NAME)
+        gsis = desc["Table"].get("GlobalSecondaryIndexes", []) or []
+        g = next((x for x in gsis if x.get("IndexName") == INDEX_NAME), None)
+        status = (g or {}).get("IndexStatus")
+        print(f"  - status: {status}")
+        if status == "ACTIVE":
+            break
+        time.sleep(10)
+
+    print(f"[OK] GSI ACTIVE: {INDEX_NAME}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+bad-game-player-results テーブル（プレイヤー別の試合結果インデックス）を作成し、
+既存の bad-game-results から埋め戻すスクリプト
+
+PK=user_id, SK=match_id（match_id は YYYYMMDD_HHMMSS なので SK 順 = 時系列）
+
+ローカルで実行:
+  python create_player_results_table.py              # テーブル作成のみ
+  python create_player_results_table.py --backfill   # 作成 + 既存結果の埋め戻し（何度実行しても同じ結果）
+"""
+
+import os
+import sys
+
+import boto3
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+from game.results_repository import PLAYER_RESULTS_TABLE, RESULTS_TABLE, player_result_items
+
+load_dotenv()
+
+dynamodb = boto3.resource(
+    'dynamodb',
+    region_name=os.getenv('AWS_REGION', 'ap-northeast-1'),
+    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+)
+
+
+def create_table():
+    try:
+        table = dynamodb.create_table(
+            TableName=PLAYER_RESULTS_TABLE,
+            KeySchema=[
+                {'AttributeName': 'user_id', 'KeyType': 'HASH'},
+                {'AttributeName': 'match_id', 'KeyType': 'RANGE'},
+            ],
+            AttributeDefinitions=[
+                {'AttributeName': 'user_id', 'AttributeType': 'S'},
+                {'AttributeName': 'match_id', 'AttributeType': 'S'},
+            ],
+            BillingMode='PAY_PER_REQUEST',
+        )
+        table.wait_until_exists()
+        print(f"テーブル '{PLAYER_RESULTS_TABLE}' を作成しました")
+
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ResourceInUseException':
+            print(f"ℹ️  テーブル '{PLAYER_RESULTS_TABLE}' は既に存在します")
+        else:
+            raise
+
+
+def backfill():
+    results = dynamodb.Table(RESULTS_TABLE)
+    target = dynamodb.Table(PLAYER_RESULTS_TABLE)
+
+    scanned = written = 0
+    kwargs = {}
+    with target.batch_writer(overwrite_by_pkeys=['user_id', 'match_id']) as batch:
+        while True:
+            resp = results.scan(**kwargs)
+            for r in resp.get('Items', []):
+                scanned += 1
+                for row in player_result_items(r):
+                    batch.put_item(Item=row)
+                    written += 1
+            lek = resp.get('LastEvaluatedKey')
+            if not lek:
+                break
+            kwargs['ExclusiveStartKey'] = lek
+
+    print(f"[OK] 埋め戻し完了: 結果 {scanned}件 → プレイヤー行 {written}件")
+
+
+if __name__ == '__main__':
+    create_table()
+    if '--backfill' in sys.argv:
+        backfill()
@@ -0,0 +1,335 @@
+"""
+コート画面の状態スナップショット（CourtState）
+
+court() / waiting_status / court_status_api / score_input / submission_status は、
+それぞれが現役エントリーや meta#current を何度も読み直していた（1回の描画で Query/Scan が7〜8回）。
+ここでは 1回の読み込みで
+  - bad-game-match_entries の今日の現役エントリー（session_date GSI の Query 1回: pending / resting / playing）
+  - bad-game-matches の meta#current と meta#pairing（BatchGetItem 1回）
+を取得して CourtState にまとめ、各画面・API はそこから必要な値を導出する。
+
+- スナップショットはワーカー内で COURT_STATE_TTL 秒共有する（タブレットの20秒ポーリングはほぼこれで返る）
+- 書き込み（bp_game の POST など）のあとは invalidate_court_state() で捨てる。
+  SharedCache の "court" 名前空間のバージョンも進めるので、他のワーカーのスナップショットも次の参照で作り直される
+- ペアリング・試合終了など判断に使う処理は従来どおり fresh な読み取り（has_ongoing_matches 等）を使う
+- "court" のバージョンは変更フィード（/game/api/court_feed）のカーソルも兼ねる。
+  端末はバージョンが変わったときだけ waiting_status などを取りに行く
+"""
+
+import os
+import threading
+import time
+
+from flask import current_app
+
+from utils.shared_cache import shared_cache
+from .results_repository import get_results_for_match
+
+ENTRY_TABLE = "bad-game-match_entries"
+META_TABLE = "bad-game-matches"
+LIVE_STATUSES = ("pending", "resting", "playing")
+
+COURT_STATE_TTL = 3.0          # ポーリング間隔（20秒）より十分短く
+_NS = "court"
+
+# 変更フィードでリクエストを保留（long-poll）する最大秒数。
+# 既定の gunicorn（sync ワーカー）では保留するとワーカーが塞がるので 0（すぐ返す）。
+# gthread / gevent などで動かす場合だけ 25 などに上げる
+COURT_FEED_MAX_WAIT = float(os.getenv("COURT_FEED_MAX_WAIT", "0"))
+_FEED_CHECK_INTERVAL = 0.5
+
+_state = None
+_state_lock = threading.Lock()
+_stats = {"builds": 0, "hits": 0, "invalidations": 0, "feed_requests": 0, "feed_changes": 0}
+
+
+def _ts(it):
+    # 文字列ISO前提。無ければ空文字で最小扱い
+    return str(it.get("updated_at") or it.get("joined_at") or it.get("created_at") or "")
+
+
+def _norm_team(item):
+    v = item.get("team_side") or item.get("team") or item.get("team_name")
+    if v is None:
+        return None
+    s = str(v).strip().upper()
+    if s in ("A", "TEAM_A", "LEFT"):
+        return "A"
+    if s in ("B", "TEAM_B", "RIGHT"):
+        return "B"
+    return None
+
+
+def _to_int_court(v):
+    try:
+        return int(str(v))
+    except (TypeError, ValueError):
+        return 999
+
+
+def organize_match_courts(players, match_id):
+    """1試合分の playing エントリー → {court_number: {team_a, team_b, score_submitted}}"""
+    if not players:
+        return {}
+
+    # 並びを安定させる
+    players = sorted(players, key=lambda x: (_to_int_court(x.get("court_number")), (_norm_team(x) or "Z")))
+
+    match_courts = {}
+    for item in players:
+        court = item.get("court_number")
+        team = _norm_team(item)
+        if court is None or team not in ("A", "B"):
+            continue
+
+        court_num = _to_int_court(court)
+        court_data = match_courts.setdefault(
+            court_num,
+            {"court_number": court_num, "team_a": [], "team_b": []}
+        )
+        (court_data["team_a"] if team == "A" else court_data["team_b"]).append(item)
+
+    if current_app.logger.isEnabledFor(10):  # DEBUG
+        summary_list = []
+        for c_num, data in sorted(match_courts.items()):
+            a_names = ",".join([p.get("display_name", "") for p in data["team_a"]])
+            b_names = ",".join([p.get("display_name", "") for p in data["team_b"]])
+            summary_list.append(f"C{c_num}:[{a_names} vs {b_names}]")
+        current_app.logger.debug(f"試合データ取得: match_id={match_id} | 構成: {' / '.join(summary_list)}")
+
+    # --- スコア送信済みコートを判定（match_id-index の Query、短時間キャッシュあり） ---
+    try:
+        submitted_courts = set()
+        for s in get_results_for_match(match_id):
+            try:
+                submitted_courts.add(int(str(s["court_number"])))
+            except Exception:
+                pass
+        for c_num, court_data in match_courts.items():
+            court_data["score_submitted"] = c_num in submitted_courts
+    except Exception:
+        current_app.logger.warning("[organize_match_courts] score_submitted チェック失敗")
+        for court_data in match_courts.values():
+            court_data["score_submitted"] = False
+
+    return match_courts
+
+
+def latest_playing_match_id(playing_items):
+    """meta#current が使えないときの match_id 推定（playing エントリーのうち時刻が最も新しいもの）"""
+    playing_items = [it for it in playing_items if it.get("match_id")]
+    if not playing_items:
+        return None
+
+    def sort_key(it):
+        for k in ("created_at", "updated_at", "joined_at"):
+            v = it.get(k)
+            if isinstance(v, str) and v:
+                return v
+        return ""
+
+    return max(playing_items, key=sort_key).get("match_id")
+
+
+class CourtState:
+    """1回分の読み込み結果と、そこから導出するコート画面の値"""
+
+    def __init__(self, entries, meta, pairing_meta, version=None):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.meta = meta or {}
+        self.pairing_meta = pairing_meta or {}
+
+        self.by_status = {st: [] for st in LIVE_STATUSES}
+        for it in entries:
+            # 休みイベント・メタ行は現役一覧に含めない
+            if it.get("type") == "rest_event" or "meta" in str(it.get("entry_id", "")):
+                continue
+            it["rest_count"] = it.get("rest_count") or 0
+            it["match_count"] = it.get("match_count") or 0
+            it["join_count"] = it.get("join_count") or 0
+            st = it.get("entry_status")
+            if st in self.by_status:
+                self.by_status[st].append(it)
+
+        self._match_courts = None
+        self._lock = threading.Lock()
+
+    # ---------------------------------------------
+    # エントリー
+    # ---------------------------------------------
+    @property
+    def pending(self):
+        return self.by_status["pending"]
+
+    @property
+    def resting(self):
+        return self.by_status["resting"]
+
+    @property
+    def playing(self):
+        return self.by_status["playing"]
+
+    @property
+    def entries(self):
+        return self.pending + self.resting + self.playing
+
+    def entries_for(self, user_id):
+        return [it for it in self.entries if it.get("user_id") == user_id]
+
+    def latest_entry_for(self, user_id):
+        """自分の entry は「最新1件」を採用"""
+        mine = self.entries_for(user_id)
+        return max(mine, key=_ts) if mine else None
+
+    # ---------------------------------------------
+    # 試合
+    # ---------------------------------------------
+    @property
+    def match_id(self):
+        """進行中の match_id（meta#current が playing ならその current_match_id、なければ playing エントリーから推定）"""
+        if self.meta.get("status") == "playing" and self.meta.get("current_match_id"):
+            return self.meta["current_match_id"]
+        return latest_playing_match_id(self.playing)
+
+    @property
+    def has_ongoing(self):
+        return bool(self.playing)
+
+    @property
+    def in_progress(self):
+        """最新の match_id の playing が1件でもあれば試合中"""
+        match_id = self.match_id
+        return bool(match_id) and any(str(it.get("match_id")) == str(match_id) for it in self.playing)
+
+    def progress(self):
+        """(完了した試合数, 試合数)。いちばん人数の多い match_id を対象に4人で1試合として数える"""
+        sessions = {}
+        for it in self.playing:
+            if it.get("match_id"):
+                sessions[it["match_id"]] = sessions.get(it["match_id"], 0) + 1
+        if not sessions:
+            return 0, 0
+        # finished を書く complete_match_for_player はどこからも呼ばれていないので完了数は 0（従来の get_match_progress と同じ結果）
+        return 0, max(sessions.values()) // 4
+
+    def current_courts(self):
+        courts = {}
+        for player in self.playing:
+            courts.setdefault(player.get("court_number", 0), []).append(player)
+        return courts
+
+    def match_courts(self):
+        """進行中の試合のコート別構成（スコア送信済みフラグ付き）"""
+        with self._lock:
+            if self._match_courts is None:
+                match_id = self.match_id
+                players = [it for it in self.playing if str(it.get("match_id")) == str(match_id)] if match_id else []
+                self._match_courts = organize_match_courts(players, match_id) if players else {}
+            return self._match_courts
+
+    # ---------------------------------------------
+    # ペアリングモード
+    # ---------------------------------------------
+    def pairing_info(self):
+        """(cycle_index, last_mode, next_mode, session_round)"""
+        try:
+            cycle_index = int(self.pairing_meta.get("cycle_index", 0))
+            session_round = int(self.pairing_meta.get("round_count", 0))
+        except (TypeError, ValueError):
+            cycle_index, session_round = 0, 0
+        if cycle_index == 1:
+            next_mode = "full_random"
+        elif cycle_index == 2:
+            next_mode = "ai"
+        else:
+            next_mode = "random"
+        return cycle_index, self.pairing_meta.get("last_mode"), next_mode, session_round
+
+
+def _load_meta(dynamodb):
+    """meta#current と meta#pairing を BatchGetItem 1回で"""
+    keys = [{"match_id": "meta#current"}, {"match_id": "meta#pairing"}]
+    request = {META_TABLE: {"Keys": keys, "ConsistentRead": True}}
+    found = {}
+    for _ in range(3):
+        resp = dynamodb.batch_get_item(RequestItems=request)
+        for item in resp.get("Responses", {}).get(META_TABLE, []):
+            found[item["match_id"]] = item
+        request = resp.get("UnprocessedKeys") or {}
+        if not request:
+            break
+    return found.get("meta#current", {}), found.get("meta#pairing", {})
+
+
+def _build(version):
+    # 循環 import を避けるため関数内で
+    from .views import query_entries_by_status
+
+    dynamodb = current_app.dynamodb
+    entries = query_entries_by_status(dynamodb.Table(ENTRY_TABLE), list(LIVE_STATUSES), ConsistentRead=True)
+    meta, pairing_meta = _load_meta(dynamodb)
+    return CourtState(entries, meta, pairing_meta, version=version)
+
+
+def get_court_state(fresh=False) -> CourtState:
+    """
+    コート画面の状態を返す
+    - fresh=False: COURT_STATE_TTL 秒以内かつ "court" のバージョンが同じならワーカー内のスナップショットを使う
+    - fresh=True : 必ず読み直す
+    """
+    global _state
+    version = shared_cache.version(_NS)
+    with _state_lock:
+        state = _state
+        if (not fresh and state is not None and state.version == version
+                and time.monotonic() - state.built_at < COURT_STATE_TTL):
+            _stats["hits"] += 1
+            return state
+
+    state = _build(version)
+    with _state_lock:
+        _state = state
+        _stats["builds"] += 1
+    return state
+
+
+def invalidate_court_state():
+    """エントリー / meta を書いたあとに呼ぶ（全ワーカーのスナップショットを捨てる）"""
+    global _state
+    with _state_lock:
+        _state = None
+        _stats["invalidations"] += 1
+    try:
+        shared_cache.bump(_NS)
+    except Exception as e:
+        current_app.logger.warning("[court_state] バージョン更新に失敗: %s", e)
+
+
+def court_version() -> str:
+    """変更フィードのカーソル（エントリー / meta を書くたびに変わる）"""
+    return shared_cache.version(_NS)
+
+
+def wait_for_change(since, wait=0.0):
+    """
+    since と違うバージョンになるまで最大 wait 秒（COURT_FEED_MAX_WAIT で頭打ち）待つ
+    読むのは SharedCache のバージョンだけで、DynamoDB は読まない
+    返り値: {"version": 現在のバージョン, "changed": 変わったか, "hold": サーバーが保留する最大秒数}
+    """
+    version = court_version()
+    deadline = time.monotonic() + max(0.0, min(float(wait or 0), COURT_FEED_MAX_WAIT))
+    while since and version == since and time.monotonic() < deadline:
+        time.sleep(_FEED_CHECK_INTERVAL)
+        version = court_version()
+    with _state_lock:
+        _stats["feed_requests"] += 1
+        if since and version != since:
+            _stats["feed_changes"] += 1
+    return {"version": version, "changed": bool(since) and version != since, "hold": COURT_FEED_MAX_WAIT}
+
+
+def court_state_stats() -> dict:
+    with _state_lock:
+        total = _stats["hits"] + _stats["builds"]
+        return dict(_stats, hit_rate=round(_stats["hits"] / total, 3) if total else None)
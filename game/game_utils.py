@@ -1,6 +1,9 @@
 from flask import current_app
 from trueskill import TrueSkill
 import random
+import time
+import bisect
+import numpy as np
 from typing import List, Tuple, Dict, Any
 from dataclasses import dataclass
 from datetime import datetime
@@ -13,6 +16,8 @@ from trueskill import Rating, rate
 from typing import Optional, List
 import copy
 
+from utils.user_directory import user_directory
+
 # 環境設定
 env = TrueSkill(draw_probability=0.0)  # 引き分けなし
 
@@ -105,14 +110,86 @@ def finish_match_meta(match_id: str):
         raise
 
 
-def update_trueskill_for_players_and_return_updates(result_item):
+TRANSACT_LIMIT = 25  # transact_write_items の1回あたり上限
+
+
+def transact_write_in_chunks(client, tx_items, rollback_items=None, chunk_size=TRANSACT_LIMIT):
     """
-    result_item から team_a/team_b のプレイヤーを取り出して TrueSkill 更新し、
-    updated_skills = {user_id: {skill_score: float, skill_sigma: float}} を返す。
-    同時に bad-users にも永続化する（test_ は除外）。
+    transact_write_items を25件ずつに分けて順に実行する（low-level client 形式のアイテム）
+
+    - 各チャンクは全件成功 or 全件失敗（DynamoDB のトランザクション）
+    - 途中のチャンクが失敗したら、それまでに成功したチャンクを rollback_items で巻き戻して中断
+      rollback_items は tx_items と同じ並び・同じ長さ（補償不要な要素は None）
+      巻き戻しは1件ずつ。条件に外れた補償（ConditionalCheckFailed）は飛ばして残りを続ける
+
+    Returns:
+        {"ok": bool, "chunks": [{"index", "size", "ok", "error"}],
+         "rolled_back": int, "rollback_skipped": int, "rollback_failed": int}
     """
-    user_table = current_app.dynamodb.Table("bad-users")
+    logger = current_app.logger
+    chunk_size = max(1, min(int(chunk_size), TRANSACT_LIMIT))
+    if rollback_items is not None and len(rollback_items) != len(tx_items):
+        raise ValueError("rollback_items must be aligned with tx_items")
+
+    report = {"ok": True, "chunks": [], "rolled_back": 0, "rollback_skipped": 0, "rollback_failed": 0}
+    committed = []  # 成功したチャンクの (start, end)
+
+    for idx, start in enumerate(range(0, len(tx_items), chunk_size)):
+        chunk = tx_items[start:start + chunk_size]
+        try:
+            client.transact_write_items(TransactItems=chunk)
+            report["chunks"].append({"index": idx, "size": len(chunk), "ok": True, "error": None})
+            committed.append((start, start + len(chunk)))
+        except ClientError as e:
+            err = e.response.get("Error", {})
+            reasons = [r.get("Code") for r in e.response.get("CancellationReasons", []) or []]
+            message = f"{err.get('Code')}: {err.get('Message')}" + (f" reasons={reasons}" if reasons else "")
+            report["chunks"].append({"index": idx, "size": len(chunk), "ok": False, "error": message})
+            report["ok"] = False
+            logger.error("[tx-chunk] chunk=%d size=%d 失敗: %s", idx, len(chunk), message)
+            break
+
+    if report["ok"] or rollback_items is None or not committed:
+        return report
+
+    # 成功済みチャンクを新しい順に巻き戻す。
+    # 補償は条件付き（例: まだこの match_id で playing の行だけ）なので、まとめて送ると
+    # 1行が条件に外れただけで同じトランザクションの他の行まで戻らない。1件ずつ送る。
+    for start, end in reversed(committed):
+        for it in reversed(rollback_items[start:end]):
+            if not it:
+                continue
+            try:
+                client.transact_write_items(TransactItems=[it])
+                report["rolled_back"] += 1
+            except ClientError as e:
+                reasons = [r.get("Code") for r in e.response.get("CancellationReasons", []) or []]
+                if reasons == ["ConditionalCheckFailed"]:
+                    # その後に別の処理が書き換えた行。戻さずに残す
+                    report["rollback_skipped"] += 1
+                    continue
+                report["rollback_failed"] += 1
+                logger.error("[tx-chunk] rollback 失敗: %s", e)
+
+    logger.warning(
+        "[tx-chunk] rollback 完了: %d件（条件外でスキップ %d件 / 失敗 %d件）",
+        report["rolled_back"], report["rollback_skipped"], report["rollback_failed"],
+    )
+    return report
+
+
+DEFAULT_MU = 25.0
+DEFAULT_SIGMA = 8.333
+
 
+def _to_float(val, default):
+    try:
+        return float(val)
+    except Exception:
+        return default
+
+
+def _result_winner_and_scores(result_item):
     def safe_get_score(item, keys):
         for k in keys:
             val = item.get(k)
@@ -126,124 +203,193 @@ def update_trueskill_for_players_and_return_updates(result_item):
     t1 = safe_get_score(result_item, ["team1_score", "team_a_score", "score1"])
     t2 = safe_get_score(result_item, ["team2_score", "team_b_score", "score2"])
     winner = str(result_item.get("winner", "A")).upper()
-    # score_diff は今は未使用なら消してOK（残したいならそのまま）
-    score_diff = (t1 - t2) if winner == "A" else (t2 - t1)
-
-    def get_team_ratings(team):
-        """
-        team: [{user_id, skill_score?, skill_sigma?, ...}, ...]
-        戻り: [(player_uid, Rating), ...]
-        """
-        out = []
-        for player in team or []:
-            player_uid = player.get("user_id")
-            if not player_uid:
-                continue
+    return winner, t1, t2
+
+
+def _team_uids(team):
+    return [str(p.get("user_id")) for p in team or [] if p.get("user_id")]
+
 
+def prefetch_player_ratings(result_items, known=None):
+    """
+    全コートの出場者の (mu, sigma) を1回の BatchGet でまとめて揃える
+
+    - known（{user_id: {skill_score, skill_sigma}}）にあるユーザーは問い合わせない
+    - team 内の dict に skill_score / skill_sigma が両方あるユーザーも問い合わせない
+    - 残りだけを user_directory.get_many(fresh=True) で bad-users から読む（100件ずつ1往復）
+
+    Returns:
+        {user_id: Rating}
+    """
+    ratings = {}
+    missing = []
+
+    for uid, vals in (known or {}).items():
+        ratings[str(uid)] = Rating(
+            mu=_to_float(vals.get("skill_score"), DEFAULT_MU),
+            sigma=_to_float(vals.get("skill_sigma"), DEFAULT_SIGMA),
+        )
+
+    for result_item in result_items:
+        for player in (result_item.get("team_a") or []) + (result_item.get("team_b") or []):
+            uid = player.get("user_id")
+            if not uid or str(uid) in ratings:
+                continue
             mu = player.get("skill_score")
             sig = player.get("skill_sigma")
-
-            # 足りなければ bad-users から拾う
             if mu is None or sig is None:
-                try:
-                    res = user_table.get_item(
-                        Key={"user#user_id": player_uid}
-                    )
-                    data = res.get("Item") or {}
-                    mu = data.get("skill_score", 25.0)
-                    sig = data.get("skill_sigma", 8.333)
-                except Exception:
-                    mu, sig = 25.0, 8.333
+                missing.append(str(uid))
+                continue
+            ratings[str(uid)] = Rating(mu=_to_float(mu, DEFAULT_MU), sigma=_to_float(sig, DEFAULT_SIGMA))
 
-            try:
-                mu = float(mu)
-            except Exception:
-                mu = 25.0
-            try:
-                sig = float(sig)
-            except Exception:
-                sig = 8.333
+    if missing:
+        try:
+            users = user_directory.get_many(missing, fresh=True)
+        except Exception as e:
+            current_app.logger.error("[ts-prefetch] bad-users 取得失敗: %s", e)
+            users = {}
+        for uid in missing:
+            data = users.get(uid) or {}
+            ratings[uid] = Rating(
+                mu=_to_float(data.get("skill_score", DEFAULT_MU), DEFAULT_MU),
+                sigma=_to_float(data.get("skill_sigma", DEFAULT_SIGMA), DEFAULT_SIGMA),
+            )
 
-            out.append((str(player_uid), Rating(mu=mu, sigma=sig)))
+    return ratings
 
-        return out
 
-    ratings_a = get_team_ratings(result_item.get("team_a", []))
-    ratings_b = get_team_ratings(result_item.get("team_b", []))
+def rate_match_results(result_items, known=None):
+    """
+    複数コートの結果をまとめて TrueSkill 更新する（DynamoDB へは書かない）
 
-    if not ratings_a or not ratings_b:
-        return {}
+    - レーティングの取得は prefetch_player_ratings の1回だけ
+    - コートを順に処理し、更新後の値を次のコートに引き継ぐ（同じ人が2コートにいても二重計算しない）
 
-    team_a_uids = [uid for uid, _r in ratings_a]
-    team_b_uids = [uid for uid, _r in ratings_b]
-    team_a_ratings = [_r for _uid, _r in ratings_a]
-    team_b_ratings = [_r for _uid, _r in ratings_b]
+    Returns:
+        (updated_skills, rated_courts)
+        updated_skills = {user_id: {skill_score: float, skill_sigma: float}}
+        rated_courts   = 更新できたコート数
+    """
+    ratings = prefetch_player_ratings(result_items, known)
+    updated_skills = {}
+    rated_courts = 0
 
-    ranks = [0, 1] if winner == "A" else [1, 0]
-    new_team_a, new_team_b = rate([team_a_ratings, team_b_ratings], ranks=ranks)
+    for result_item in result_items:
+        try:
+            winner, _t1, _t2 = _result_winner_and_scores(result_item)
 
-    updated_skills = {}
-    for uid, new_r in zip(team_a_uids, new_team_a):
-        updated_skills[uid] = {"skill_score": float(new_r.mu), "skill_sigma": float(new_r.sigma)}
-    for uid, new_r in zip(team_b_uids, new_team_b):
-        updated_skills[uid] = {"skill_score": float(new_r.mu), "skill_sigma": float(new_r.sigma)}
-
-    current_app.logger.debug(
-        "[ts-after-rate] match=%s court=%s | updated=%d sample=%s",
-        result_item.get("match_id"),
-        result_item.get("court_number"),
-        len(updated_skills),
-        next(iter(updated_skills.items()), None),
-    )    
+            team_a_uids = _team_uids(result_item.get("team_a", []))
+            team_b_uids = _team_uids(result_item.get("team_b", []))
+            if not team_a_uids or not team_b_uids:
+                continue
+
+            ranks = [0, 1] if winner == "A" else [1, 0]
+            new_team_a, new_team_b = rate(
+                [[ratings[uid] for uid in team_a_uids], [ratings[uid] for uid in team_b_uids]],
+                ranks=ranks,
+            )
 
+            court_updates = {}
+            for uid, new_r in list(zip(team_a_uids, new_team_a)) + list(zip(team_b_uids, new_team_b)):
+                ratings[uid] = new_r
+                court_updates[uid] = {"skill_score": float(new_r.mu), "skill_sigma": float(new_r.sigma)}
+            updated_skills.update(court_updates)
+            rated_courts += 1
+
+            current_app.logger.debug(
+                "[ts-after-rate] match=%s court=%s | updated=%d sample=%s",
+                result_item.get("match_id"),
+                result_item.get("court_number"),
+                len(court_updates),
+                next(iter(court_updates.items()), None),
+            )
+        except Exception as e:
+            current_app.logger.error("スキル更新エラー (court=%s): %s", result_item.get("court_number"), e)
+
+    return updated_skills, rated_courts
+
+
+def update_trueskill_for_players_and_return_updates(result_item):
+    """
+    result_item から team_a/team_b のプレイヤーを取り出して TrueSkill 更新し、
+    updated_skills = {user_id: {skill_score: float, skill_sigma: float}} を返す。
+    永続化は呼び出し側（persist_skill_to_bad_users 等）で行う。
+    """
+    updated_skills, _ = rate_match_results([result_item])
     return updated_skills
 
 
+def transact_update_or_fallback(client, tx_items, label="tx"):
+    """
+    補償（巻き戻し）の要らない Update 群を transact_write_in_chunks でまとめて書く
+
+    途中のチャンクが失敗した場合は、失敗チャンク以降を1件ずつ update_item でやり直す
+    （以前の「1件ずつ書いて、失敗した分だけログに残す」挙動と同じ結果になる）
+
+    Returns:
+        (ok_count, ng_count, round_trips)
+    """
+    if not tx_items:
+        return 0, 0, 0
+
+    report = transact_write_in_chunks(client, tx_items)
+    done = sum(c["size"] for c in report["chunks"] if c["ok"])
+    round_trips = len(report["chunks"])
+    ok, ng = done, 0
+
+    for it in tx_items[done:]:
+        round_trips += 1
+        try:
+            client.update_item(**it["Update"])
+            ok += 1
+        except ClientError as e:
+            ng += 1
+            current_app.logger.error("[%s] 更新失敗 key=%s: %s", label, it["Update"].get("Key"), e)
+
+    return ok, ng, round_trips
+
+
 def sync_match_entries_with_updated_skills(entry_mapping, updated_skills):
     """
     更新されたスキルスコアでmatch_entriesテーブルを同期する
+    （25件ずつの transact_write_items。6コート24人なら1往復）
     """
-    from decimal import Decimal
-    
-    match_table = current_app.dynamodb.Table("bad-game-match_entries")
     sync_count = 0
     total_count = len(updated_skills)
-    
+
     try:
-        # 同期開始のサマリー
         current_app.logger.debug(f"エントリー同期開始: 対象 {total_count} 件")
-        
+
+        tx_items = []
         for user_id, data in updated_skills.items():
             entry_id = data.get("entry_id") or entry_mapping.get(user_id)
-            
+
             if not entry_id:
-                # 警告ログは重要なので残すが、簡潔に
                 current_app.logger.warning(f"エントリーID未発見: user_id={user_id}")
                 continue
-                
-            try:
-                match_table.update_item(
-                    Key={"entry_id": entry_id},
-                    UpdateExpression="SET skill_score = :mu, skill_sigma = :sigma",
-                    ExpressionAttributeValues={
-                        ":mu": Decimal(str(data["skill_score"])),
-                        ":sigma": Decimal(str(data["skill_sigma"]))
-                    }
-                )
-                sync_count += 1
-                
-                # 【削除】1件ずとの詳細な DEBUG ログは削除しました
-                
-            except Exception as e:
-                # 失敗時は原因を特定したいので詳細を出す
-                current_app.logger.error(f"更新失敗 entry_id={entry_id}: {str(e)}")
-        
-        # 完了報告を 1 行で出力
-        current_app.logger.info(f"同期完了: {sync_count}/{total_count} 件のスキルを反映しました")
-    
+
+            tx_items.append({
+                "Update": {
+                    "TableName": "bad-game-match_entries",
+                    "Key": {"entry_id": {"S": str(entry_id)}},
+                    "UpdateExpression": "SET skill_score = :mu, skill_sigma = :sigma",
+                    "ExpressionAttributeValues": {
+                        ":mu": {"N": str(Decimal(str(data["skill_score"])))},
+                        ":sigma": {"N": str(Decimal(str(data["skill_sigma"])))},
+                    },
+                }
+            })
+
+        client = current_app.dynamodb.meta.client
+        sync_count, _ng, round_trips = transact_update_or_fallback(client, tx_items, label="entry-sync")
+
+        current_app.logger.info(
+            f"同期完了: {sync_count}/{total_count} 件のスキルを反映しました（{round_trips}往復）"
+        )
+
     except Exception as e:
         current_app.logger.error(f"同期プロセス異常終了: {str(e)}")
-    
+
     return sync_count
 
 
@@ -312,7 +458,7 @@ class Player:
         return self.level
 
 
-def generate_balanced_pairs_and_matches(players: List[Player], max_courts: int) -> Tuple[
+def generate_balanced_pairs_and_matches(players: List[Player], max_courts: int, repeat=None) -> Tuple[
     List[Tuple[Player, Player]],  # all pairs
     List[Tuple[Tuple[Player, Player], Tuple[Player, Player]]],  # matches
     List[Player]  # waiting players
@@ -321,9 +467,10 @@ def generate_balanced_pairs_and_matches(players: List[Player], max_courts: int)
     プレイヤー一覧からペアをランダムに作成し、スキルバランスが取れた試合を組む。
     ただしdiffが閾値(20)以上のコートがあれば、そのコート内で
     全4通りの交換を試して最善の1交換を採用する。
+    repeat（game/pair_history.RepeatPenalty）を渡すと、今日すでに組んだペアになりにくいシャッフルを選ぶ。
     """
     # ステップ①：まずランダムにペアを作る
-    pairs, waiting_players = generate_random_pairs(players)
+    pairs, waiting_players = generate_random_pairs(players, repeat=repeat)
 
     # ステップ②：ペアからスキルが近い同士でマッチを組む
     matches, unused_pairs = generate_matches_by_pair_skill_balance(pairs, max_courts)
@@ -374,10 +521,33 @@ def _names_sample(players: List["Player"], n: int = 12) -> str:
         return ", ".join(names)
     return ", ".join(names[:n]) + f", ... (+{len(names)-n})"
 
-def generate_random_pairs(players: List["Player"]) -> Tuple[List[Tuple["Player", "Player"]], List["Player"]]:
+REPEAT_SHUFFLE_TRIES = 30  # 繰り返しペナルティがあるときにシャッフルを引き直す最大回数
+
+
+def _shuffle_avoiding_repeats(players, repeat, score):
+    """
+    ランダムな並びを返す。repeat があれば REPEAT_SHUFFLE_TRIES 回まで引き直し、
+    score(並び)（繰り返しペナルティの合計）が最小のものを採用する（0 になった時点で打ち切り）
+    """
+    best, best_score = None, float("inf")
+    for _ in range(REPEAT_SHUFFLE_TRIES if repeat is not None else 1):
+        shuffled = players.copy()
+        random.shuffle(shuffled)
+        if repeat is None:
+            return shuffled
+        sc = score(shuffled)
+        if sc < best_score:
+            best, best_score = shuffled, sc
+        if sc <= 0:
+            break
+    return best
+
+
+def generate_random_pairs(players: List["Player"], repeat=None) -> Tuple[List[Tuple["Player", "Player"]], List["Player"]]:
     """
     プレイヤーリストから完全ランダムでペアを作成する。
     奇数の場合は最後のプレイヤーを待機リストに入れる。
+    repeat があれば、今日すでに組んだペアが少ないシャッフルを選ぶ。
     ※元の players は変更しない
     """
     logger = logging.getLogger("generate_random_pairs")
@@ -385,8 +555,10 @@ def generate_random_pairs(players: List["Player"]) -> Tuple[List[Tuple["Player",
     # INFO: 要約だけ（普段の運用）
     logger.info("[pairs] start n=%d", len(players))
 
-    shuffled = players.copy()
-    random.shuffle(shuffled)
+    shuffled = _shuffle_avoiding_repeats(
+        players, repeat,
+        lambda sh: sum(repeat.pair(sh[i], sh[i + 1]) for i in range(0, len(sh) - 1, 2)),
+    )
 
     # DEBUG: 詳細（必要な時だけ）
     if logger.isEnabledFor(logging.DEBUG):
@@ -450,9 +622,325 @@ def pair_strength(p1: Player, p2: Player) -> float:
     return float(getattr(p1, "level", 0)) + float(getattr(p2, "level", 0))
 
 
-def generate_ai_best_pairings(active_players, max_courts, iterations=1000):
+# コート内の4人 (p0,p1,p2,p3) のチーム分け3通り: (A1, A2, B1, B2)
+_COURT_SPLITS = ((0, 1, 2, 3), (0, 2, 1, 3), (0, 3, 1, 2))
+
+
+def _court_costs(skill, idx, pen=None):
+    """
+    4人組 idx (..., 4) の3通りのチーム分け（_COURT_SPLITS の順）それぞれのコスト (..., 3)
+    pen=(partner, opponent)（選手の並びに揃えた n×n の繰り返しペナルティ）を渡すと、
+    各チーム分けのコストにペア2組・対戦4組ぶんのペナルティを足す（1組あたり行列の参照1回）
+    """
+    g = skill[idx]
+    a, b, c, d = g[..., 0], g[..., 1], g[..., 2], g[..., 3]
+    costs = (np.stack([(a + b) - (c + d), (a + c) - (b + d), (a + d) - (b + c)], axis=-1) / 2) ** 2
+    if pen is not None:
+        partner, opponent = pen
+        ia, ib, ic, id_ = idx[..., 0], idx[..., 1], idx[..., 2], idx[..., 3]
+        # 4人の対戦ペナルティ6組の合計から、同じチームになる2組ぶんを引いてパートナーのペナルティに置き換える
+        diff = partner - opponent
+        all_opp = (opponent[ia, ib] + opponent[ia, ic] + opponent[ia, id_]
+                   + opponent[ib, ic] + opponent[ib, id_] + opponent[ic, id_])
+        costs = costs + np.stack([
+            diff[ia, ib] + diff[ic, id_],
+            diff[ia, ic] + diff[ib, id_],
+            diff[ia, id_] + diff[ib, ic],
+        ], axis=-1) + all_opp[..., None]
+    return costs
+
+
+def _pairing_cost_batch(skill, perms, num_courts, pen=None):
+    """
+    並び順 perms (B, n) をまとめて評価する
+    先頭 num_courts*4 人を4人ずつコートに割り当て、各コートは3通りのチーム分けのうち最良を採用。
+    pen を渡すと繰り返しペナルティも足す（_court_costs）
+
+    Returns:
+        total: (B,) 各候補のペナルティ合計（チーム平均差の二乗和 + 繰り返しペナルティ）
+        split: (B, num_courts) 各コートで採用したチーム分け（_COURT_SPLITS の index）
+    """
+    idx = perms[:, :num_courts * 4].reshape(len(perms), num_courts, 4)
+    costs = _court_costs(skill, idx, pen)
+    split = costs.argmin(axis=-1)
+    best = np.take_along_axis(costs, split[..., None], axis=-1)[..., 0]
+    return best.sum(axis=1), split
+
+
+def _penalty_matrices(repeat, players):
+    """RepeatPenalty を players の並びに揃えた (partner, opponent)。repeat が無ければ None"""
+    if repeat is None or getattr(repeat, "is_zero", False):
+        return None
+    return repeat.matrices(players)
+
+
+def _two_opt_pairing(skill, perm, cost, num_courts, swap_i, swap_j, pen=None):
+    """
+    別コート同士（待機者を含む）の2人入れ替えを全通り一括評価し、
+    改善がなくなるまで最良の入れ替えを適用する（最急降下）
+    入れ替えで変わるのは2コート（片方が待機なら1コート）だけなので、そのコートだけ評価し直して差分で比べる
+    """
+    if len(swap_i) == 0:
+        return perm, cost
+    m = num_courts * 4
+    rows = np.arange(len(swap_i))
+    group = np.minimum(np.arange(len(perm)) // 4, num_courts)
+    gi, gj = group[swap_i], group[swap_j]
+    in_i, in_j = gi < num_courts, gj < num_courts          # False = 待機枠
+    ci, cj = np.minimum(gi, num_courts - 1), np.minimum(gj, num_courts - 1)
+
+    court = _court_costs(skill, perm[:m].reshape(num_courts, 4), pen).min(axis=-1)
+    cost = float(court.sum())
+    while True:
+        cand = np.repeat(perm[None, :], len(swap_i), axis=0)
+        cand[rows, swap_i] = perm[swap_j]
+        cand[rows, swap_j] = perm[swap_i]
+        four = cand[:, :m].reshape(len(cand), num_courts, 4)
+        new_i = _court_costs(skill, four[rows, ci], pen).min(axis=-1)
+        new_j = _court_costs(skill, four[rows, cj], pen).min(axis=-1)
+        costs = (cost + np.where(in_i, new_i - court[ci], 0.0)
+                 + np.where(in_j, new_j - court[cj], 0.0))
+        k = int(costs.argmin())
+        if costs[k] >= cost - 1e-9:
+            return perm, cost
+        perm = cand[k]
+        court = _court_costs(skill, perm[:m].reshape(num_courts, 4), pen).min(axis=-1)
+        cost = float(court.sum())
+
+
+def optimize_pairings(active_players, max_courts, time_budget=0.2, seed=None,
+                      batch_size=256, top_k=4, max_rounds=50, patience=5, repeat=None):
+    """
+    全コートのスキルバランス（チーム平均差の二乗和）を最小化する組み合わせを探す
+    repeat（RepeatPenalty）を渡すと、今日すでに組んだペア・対戦の繰り返しペナルティも足して最小化する
+
+    - ランダムな並び順を batch_size 個まとめて NumPy で評価（マルチスタート）
+    - 上位 top_k 個から、コート間の2人入れ替え（2-opt）で局所探索
+    - 改善が patience ラウンド続かなければ終了
+    - seed を指定した場合は乱数・ラウンド数だけで止まるので結果は再現する（time_budget は見ない）
+      seed なしの場合は time_budget 秒で打ち切り
+
+    Returns:
+        (matches, waiting, total_penalty)
+        matches: [((A1, A2), (B1, B2)), ...]
+    """
+    players = list(active_players)
+    n = len(players)
+    num_courts = min(max_courts, n // 4)
+    if num_courts <= 0:
+        return [], players, 0.0
+
+    rng = np.random.default_rng(seed)
+    skill = np.array([_conservative_key(p) for p in players], dtype=float)
+    pen = _penalty_matrices(repeat, players)
+
+    # 入れ替え候補: 所属（コート番号 or 待機）が異なるスロットの組
+    m = num_courts * 4
+    group = np.minimum(np.arange(n) // 4, num_courts)
+    swap_i, swap_j = np.triu_indices(n, k=1)
+    keep = group[swap_i] != group[swap_j]
+    swap_i, swap_j = swap_i[keep], swap_j[keep]
+
+    deadline = time.perf_counter() + time_budget
+    best_perm, best_cost = None, float("inf")
+    stale = 0
+
+    for _ in range(max_rounds):
+        perms = np.argsort(rng.random((batch_size, n)), axis=1)
+        costs, _ = _pairing_cost_batch(skill, perms, num_courts, pen)
+
+        improved = False
+        for idx in np.argsort(costs, kind="stable")[:top_k]:
+            perm, cost = _two_opt_pairing(skill, perms[idx], float(costs[idx]), num_courts, swap_i, swap_j, pen)
+            if cost < best_cost - 1e-9:
+                best_perm, best_cost = perm, cost
+                improved = True
+
+        stale = 0 if improved else stale + 1
+        if best_cost <= 1e-9 or stale >= patience:
+            break
+        if seed is None and time.perf_counter() >= deadline:
+            break
+
+    _, split = _pairing_cost_batch(skill, best_perm[None, :], num_courts, pen)
+    matches = []
+    for c in range(num_courts):
+        four = [players[i] for i in best_perm[c * 4:(c + 1) * 4]]
+        a1, a2, b1, b2 = (four[k] for k in _COURT_SPLITS[int(split[0, c])])
+        matches.append(((a1, a2), (b1, b2)))
+    waiting = [players[i] for i in best_perm[m:]]
+
+    return matches, waiting, best_cost
+
+
+def generate_ai_best_pairings(active_players, max_courts, iterations=1000, time_budget=0.2, seed=None, repeat=None):
+    """
+    全コートのスキルバランスが最も均等な組み合わせを返す（optimize_pairings を使用）
+    iterations は旧実装との互換用で、ランダム初期解の数の目安として扱う。
+    repeat（RepeatPenalty）を渡すと、今日すでに組んだペア・対戦を避ける項をコストに足す。
+    """
+    batch_size = 256
+    max_rounds = max(1, -(-int(iterations) // batch_size))
+    matches, waiting, total_penalty = optimize_pairings(
+        active_players, max_courts, time_budget=time_budget, seed=seed,
+        batch_size=batch_size, max_rounds=max(max_rounds, 5), repeat=repeat,
+    )
+    current_app.logger.debug("[ai-pairing] courts=%d waiting=%d total_penalty=%.3f",
+                             len(matches), len(waiting), total_penalty)
+    return matches, waiting
+
+
+class _ExactSearchTimeout(Exception):
+    pass
+
+
+def _exact_pairing_search(skill, num_courts, upper_bound, deadline, pen=None):
+    """
+    skill（昇順ソート済み）を num_courts 面に割り当てる厳密解の分枝限定法
+
+    - 残りの中で最もスキルが低い選手 i を「待機」させるか「i を含むコートを作る」かで分岐
+    - 昇順の4人 (i, j, k, l) のスキル差が最小のチーム分けは必ず (i, l) vs (j, k) なので、
+      コートのコストの下界は ((s_i + s_l - s_j - s_k) / 2)^2。l は二分探索で予算内の範囲だけ列挙する
+    - pen=(partner, opponent)（skill と同じ並びの繰り返しペナルティ）があれば、3通りのチーム分けそれぞれに
+      ペナルティを足して最良を採る。ペナルティは 0 以上なので上の下界（と l の範囲）はそのまま使える
+    - (残り集合のビットマスク, 残りコート数) ごとに厳密値 / 下界をメモ化
+
+    upper_bound 未満の解が見つかれば (cost, [(A1, A2, B1, B2), ...]) を、なければ (upper_bound, None) を返す。
+    deadline を超えたら _ExactSearchTimeout。
+    """
+    n = len(skill)
+    if pen is not None:
+        partner, opponent = (m.tolist() for m in pen)
+
+    def court_cost(i, j, k, l, lower_bound):
+        """4人 (i < j < k < l) の最良のチーム分け: (コスト, (A1, A2, B1, B2))"""
+        if pen is None:
+            return lower_bound, (i, l, j, k)
+        best = None
+        for a1, a2, b1, b2 in ((i, l, j, k), (i, j, k, l), (i, k, j, l)):
+            c = (((skill[a1] + skill[a2] - skill[b1] - skill[b2]) / 2) ** 2
+                 + partner[a1][a2] + partner[b1][b2]
+                 + opponent[a1][b1] + opponent[a1][b2] + opponent[a2][b1] + opponent[a2][b2])
+            if best is None or c < best[0]:
+                best = (c, (a1, a2, b1, b2))
+        return best
+
+    exact = {}
+    lower = {}
+    calls = [0]
+
+    def solve(mask, courts_left, budget):
+        calls[0] += 1
+        if calls[0] & 1023 == 0 and time.perf_counter() > deadline:
+            raise _ExactSearchTimeout()
+        if courts_left == 0:
+            return 0.0, ()
+
+        key = (mask, courts_left)
+        if key in exact:
+            c, plan = exact[key]
+            return (c, plan) if c < budget else (c, None)
+        lb = lower.get(key, 0.0)
+        if lb >= budget:
+            return lb, None
+
+        rem = [x for x in range(n) if mask >> x & 1]
+        i, rest = rem[0], rem[1:]
+        vals = [skill[x] for x in rest]
+        si = skill[i]
+        best_cost, best_plan = budget, None
+
+        # i を待機させる（待機枠が残っている場合）
+        if len(rem) > 4 * courts_left:
+            c, plan = solve(mask & ~(1 << i), courts_left, best_cost)
+            if plan is not None:
+                best_cost, best_plan = c, plan
+
+        # i を含むコートを作る
+        for a in range(len(rest)):
+            for b in range(a + 1, len(rest)):
+                target = vals[a] + vals[b] - si
+                radius = 2 * best_cost ** 0.5 if best_cost != float("inf") else float("inf")
+                lo = bisect.bisect_left(vals, target - radius, b + 1)
+                hi = bisect.bisect_right(vals, target + radius, b + 1)
+                for c_idx in range(lo, hi):
+                    court = ((si + vals[c_idx] - vals[a] - vals[b]) / 2) ** 2
+                    if court >= best_cost:
+                        continue
+                    j, k, l = rest[a], rest[b], rest[c_idx]
+                    court, teams = court_cost(i, j, k, l, court)
+                    if court >= best_cost:
+                        continue
+                    sub_mask = mask & ~((1 << i) | (1 << j) | (1 << k) | (1 << l))
+                    sub_cost, sub_plan = solve(sub_mask, courts_left - 1, best_cost - court)
+                    if sub_plan is not None:
+                        best_cost, best_plan = court + sub_cost, (teams,) + sub_plan
+
+        if best_plan is None:
+            lower[key] = max(lb, budget)
+            return budget, None
+        exact[key] = (best_cost, best_plan)
+        return best_cost, best_plan
+
+    return solve((1 << n) - 1, num_courts, upper_bound)
+
+
+def generate_optimal_pairings(active_players, max_courts, time_cap=0.5, max_players=24, max_exact_courts=6, seed=None,
+                              repeat=None):
+    """
+    チーム平均差の二乗和が最小になる組み合わせを厳密に求める（少人数向け）
+
+    - まず optimize_pairings のヒューリスティック解を上界にする
+    - max_players 人・max_exact_courts 面以下なら分枝限定法で厳密解を探索
+    - time_cap 秒を超えたら探索を打ち切り、ヒューリスティック解を返す
+    - repeat（繰り返しペナルティ）があれば、厳密解もペナルティ込みのコストで探す
+
+    Returns:
+        (matches, waiting, total_penalty, proven_optimal)
+    """
+    players = list(active_players)
+    n = len(players)
+    num_courts = min(max_courts, n // 4)
+    if num_courts <= 0:
+        return [], players, 0.0, True
+
+    deadline = time.perf_counter() + time_cap
+    matches, waiting, heuristic_cost = optimize_pairings(
+        players, num_courts, time_budget=min(0.2, time_cap / 2), seed=seed, repeat=repeat
+    )
+
+    if n > max_players or num_courts > max_exact_courts:
+        return matches, waiting, heuristic_cost, False
+
+    order = sorted(range(n), key=lambda x: _conservative_key(players[x]))
+    skill = [_conservative_key(players[x]) for x in order]
+    pen = _penalty_matrices(repeat, [players[x] for x in order])
+
+    try:
+        # ヒューリスティック解より真に良い解だけを探す（見つからなければヒューリスティック解が最適）
+        cost, plan = _exact_pairing_search(skill, num_courts, heuristic_cost - 1e-12, deadline, pen)
+    except _ExactSearchTimeout:
+        current_app.logger.info("[optimal-pairing] time cap %.2fs に到達 → ヒューリスティック解を使用", time_cap)
+        return matches, waiting, heuristic_cost, False
+    except RecursionError:
+        return matches, waiting, heuristic_cost, False
+
+    if plan is None:
+        return matches, waiting, heuristic_cost, True
+
+    used = set()
+    exact_matches = []
+    for a1, a2, b1, b2 in plan:
+        used.update((a1, a2, b1, b2))
+        exact_matches.append(((players[order[a1]], players[order[a2]]), (players[order[b1]], players[order[b2]])))
+    exact_waiting = [players[order[x]] for x in range(n) if x not in used]
+    return exact_matches, exact_waiting, cost, True
+
+
+def generate_ai_best_pairings_legacy(active_players, max_courts, iterations=1000):
     """
-    シミュレーションを行い、全コートのスキルバランスが最も均等な組み合わせを返す。
+    旧実装（ベンチマーク比較用）: ランダムシャッフルを iterations 回試し、
+    全コートのスキルバランスが最も均等な組み合わせを返す。
     """
     # 試合に必要な人数（4の倍数）
     num_active = len(active_players)
@@ -562,10 +1050,11 @@ def preprocess_low_skill_grouping(players: List["Player"], max_courts: int):
     return [best], remaining, max_courts - 1
 
 
-def generate_skill_grouped_pairings(players: List["Player"], max_courts: int):
+def generate_skill_grouped_pairings(players: List["Player"], max_courts: int, repeat=None):
     """
     スキル高い順に4人ずつコートへ割り当て、コート内でチームバランスを最適化する。
     各コートはスキルが近い4人で構成される。
+    repeat があれば、コート内のチーム分けのコストに繰り返しペナルティを足す。
     戻り値: (matches, waiting_players)
     """
     sorted_players = sorted(players, key=_conservative_key, reverse=True)
@@ -578,15 +1067,17 @@ def generate_skill_grouped_pairings(players: List["Player"], max_courts: int):
     for c in range(num_courts):
         p1, p2, p3, p4 = active[c * 4:(c + 1) * 4]
 
-        # 3パターン試してコート内チームバランス最適を選ぶ
-        best_diff = float("inf")
+        # 3パターン試してコート内チームバランス最適を選ぶ（コストはチーム平均差の二乗 + 繰り返しペナルティ）
+        best_cost = float("inf")
         best_pair = ((p1, p2), (p3, p4))
         for t1, t2 in [((p1, p2), (p3, p4)), ((p1, p3), (p2, p4)), ((p1, p4), (p2, p3))]:
             s1 = _conservative_key(t1[0]) + _conservative_key(t1[1])
             s2 = _conservative_key(t2[0]) + _conservative_key(t2[1])
-            diff = abs(s1 - s2)
-            if diff < best_diff:
-                best_diff = diff
+            cost = ((s1 - s2) / 2) ** 2
+            if repeat is not None:
+                cost += repeat.court(t1, t2)
+            if cost < best_cost:
+                best_cost = cost
                 best_pair = (t1, t2)
 
         matches.append(best_pair)
@@ -596,19 +1087,21 @@ def generate_skill_grouped_pairings(players: List["Player"], max_courts: int):
 
 FULL_RANDOM_SWAP_THRESHOLD = 20
 
-def generate_full_random_pairings(players, max_courts):
+def generate_full_random_pairings(players, max_courts, repeat=None):
     """
     ペアも対戦相手も完全ランダムで決定する。
     ただしdiffが閾値(20)以上のコートがあれば、そのコート内で
     全4通りの交換を試して最善の1交換を採用する。
+    repeat があれば、今日すでに組んだペア・対戦が少ないシャッフルを選ぶ。
     """
-    import random
     import copy
 
-    shuffled = players.copy()
-    random.shuffle(shuffled)
+    num_courts = min(max_courts, len(players) // 4)
+    shuffled = _shuffle_avoiding_repeats(
+        players, repeat,
+        lambda sh: sum(repeat.court(sh[i:i + 2], sh[i + 2:i + 4]) for i in range(0, num_courts * 4, 4)),
+    )
 
-    num_courts = min(max_courts, len(shuffled) // 4)
     active = shuffled[:num_courts * 4]
     additional_waiting = shuffled[num_courts * 4:]
 
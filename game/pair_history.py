@@ -0,0 +1,234 @@
+"""
+練習日ごとの「誰と誰が一緒に試合をしたか」（ペア・対戦の共起行列）
+
+create_pairings の各モード（random / full_random / ai / optimal / skilled）は、
+同じ日に何度も同じペア・同じ対戦になることを考慮していなかった。
+ここでは今日（JST）の bad-game-results から
+  - partner[i, j]  : i と j が同じチームだった回数
+  - opponent[i, j] : i と j が相手チームだった回数
+を NumPy の行列（プレイヤーごとのスロット番号で添字）で持ち、ペアリングのコストに繰り返しペナルティを足す。
+
+- 今日の結果を読むのはワーカーごとに1回（session_date-index の Query）。日付が変わったら作り直す
+- finish_current_match が record_match_results() で試合分を足す（結果の result_id で重複を防ぐ）。
+  SharedCache の "pair_history" 変更ログに match_id を載せるので、他のワーカーは次の参照でその試合だけ Query して足す
+- 生成関数には RepeatPenalty を渡す。対象の選手だけを切り出した k×k 行列なので、ペア1組の参照は O(1)
+"""
+
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from flask import current_app
+
+from utils.shared_cache import shared_cache
+from utils.timezone import JST
+from .game_utils import _team_uids, parse_players
+from .results_repository import get_results_for_match, get_results_for_session
+
+# 1回の繰り返しあたりのペナルティ（コストはチーム平均差の二乗なので、25 ≒ 平均差5点ぶん）
+PARTNER_REPEAT_PENALTY = 25.0
+OPPONENT_REPEAT_PENALTY = 4.0
+
+_NS = "pair_history"
+_INITIAL_SLOTS = 32
+
+_history = None
+_history_lock = threading.Lock()
+_stats = {"full_loads": 0, "incremental": 0, "results_applied": 0, "last_full_load": {}}
+
+
+class PairHistory:
+    """1練習日分のペア・対戦回数"""
+
+    def __init__(self, session_date, version=None):
+        self.session_date = session_date
+        self.version = version
+        self.slots = {}                    # user_id -> 行列の添字
+        self.partner = np.zeros((_INITIAL_SLOTS, _INITIAL_SLOTS), dtype=np.int16)
+        self.opponent = np.zeros((_INITIAL_SLOTS, _INITIAL_SLOTS), dtype=np.int16)
+        self.result_ids = set()
+        self.matches = set()
+
+    def slot(self, user_id):
+        """user_id のスロット番号（初めての人は追加。足りなければ行列を倍に広げる）"""
+        i = self.slots.get(user_id)
+        if i is not None:
+            return i
+        i = len(self.slots)
+        if i >= len(self.partner):
+            size = len(self.partner) * 2
+            for name in ("partner", "opponent"):
+                grown = np.zeros((size, size), dtype=np.int16)
+                old = getattr(self, name)
+                grown[:len(old), :len(old)] = old
+                setattr(self, name, grown)
+        self.slots[user_id] = i
+        return i
+
+    def add_result(self, result_item):
+        """1コート分の結果を足す（同じ result_id は1回だけ）"""
+        rid = result_item.get("result_id")
+        if rid is not None:
+            if rid in self.result_ids:
+                return False
+            self.result_ids.add(rid)
+        team_a = [self.slot(u) for u in _team_uids(parse_players(result_item.get("team_a")))]
+        team_b = [self.slot(u) for u in _team_uids(parse_players(result_item.get("team_b")))]
+        for team in (team_a, team_b):
+            for x in range(len(team)):
+                for y in range(x + 1, len(team)):
+                    self.partner[team[x], team[y]] += 1
+                    self.partner[team[y], team[x]] += 1
+        for a in team_a:
+            for b in team_b:
+                self.opponent[a, b] += 1
+                self.opponent[b, a] += 1
+        if result_item.get("match_id"):
+            self.matches.add(str(result_item["match_id"]))
+        return True
+
+    def penalty(self, players, partner_weight=PARTNER_REPEAT_PENALTY, opponent_weight=OPPONENT_REPEAT_PENALTY):
+        """players（user_id 属性を持つ Player）だけを切り出した RepeatPenalty"""
+        ix = np.array([self.slots.get(str(getattr(p, "user_id", None)), -1) for p in players], dtype=np.intp)
+        known = ix >= 0
+        k = len(players)
+        partner = np.zeros((k, k))
+        opponent = np.zeros((k, k))
+        if known.any():
+            sub = np.ix_(ix[known], ix[known])
+            mask = np.ix_(known, known)
+            partner[mask] = self.partner[sub] * partner_weight
+            opponent[mask] = self.opponent[sub] * opponent_weight
+        return RepeatPenalty(players, partner, opponent)
+
+
+class RepeatPenalty:
+    """
+    ペアリング候補の選手だけの繰り返しペナルティ（k×k）
+    - pair(p1, p2)       : p1 と p2 が同じチームになるペナルティ
+    - court(team_a, team_b): 1コート分（ペア2組 + 対戦4組）
+    - matrices(players)  : NumPy の生成関数用に players の並びに揃えた (partner, opponent)
+    """
+
+    def __init__(self, players, partner, opponent):
+        self.pos = {id(p): i for i, p in enumerate(players)}
+        self.partner = partner
+        self.opponent = opponent
+        self.is_zero = not (partner.any() or opponent.any())
+
+    def _i(self, p):
+        return self.pos.get(id(p))
+
+    def pair(self, p1, p2):
+        i, j = self._i(p1), self._i(p2)
+        if i is None or j is None:
+            return 0.0
+        return float(self.partner[i, j])
+
+    def versus(self, p1, p2):
+        i, j = self._i(p1), self._i(p2)
+        if i is None or j is None:
+            return 0.0
+        return float(self.opponent[i, j])
+
+    def court(self, team_a, team_b):
+        a1, a2 = team_a
+        b1, b2 = team_b
+        return (self.pair(a1, a2) + self.pair(b1, b2)
+                + self.versus(a1, b1) + self.versus(a1, b2) + self.versus(a2, b1) + self.versus(a2, b2))
+
+    def matrices(self, players):
+        ix = np.array([self.pos.get(id(p), -1) for p in players], dtype=np.intp)
+        known = ix >= 0
+        partner = np.zeros((len(players), len(players)))
+        opponent = np.zeros((len(players), len(players)))
+        if known.any():
+            sub = np.ix_(ix[known], ix[known])
+            mask = np.ix_(known, known)
+            partner[mask] = self.partner[sub]
+            opponent[mask] = self.opponent[sub]
+        return partner, opponent
+
+
+def _today():
+    return datetime.now(JST).strftime("%Y-%m-%d")
+
+
+def _full_load(session_date, version):
+    """今日の bad-game-results を session_date-index の Query 1本で読んで作る"""
+    t = time.perf_counter()
+    history = PairHistory(session_date, version=version)
+    rows = 0
+    for item in get_results_for_session(session_date, projection="result_id, match_id, team_a, team_b"):
+        history.add_result(item)
+        rows += 1
+    _stats["full_loads"] += 1
+    _stats["results_applied"] += rows
+    _stats["last_full_load"] = {
+        "session_date": session_date, "results": rows, "players": len(history.slots),
+        "ms": round((time.perf_counter() - t) * 1000, 1),
+    }
+    return history
+
+
+def get_pair_history() -> PairHistory:
+    """今日のペア・対戦回数（ワーカー内で共有。他のワーカーが足した試合は変更ログで追いつく）"""
+    global _history
+    with _history_lock:
+        today = _today()
+        if _history is None or _history.session_date != today:
+            _history = _full_load(today, shared_cache.version(_NS))
+            return _history
+
+        version, changed = shared_cache.changes_since(_NS, _history.version)
+        if version != _history.version:
+            if changed is None:
+                _history = _full_load(today, version)
+            else:
+                # 途中までのコートだけ読んでいた試合もあるので、match_id ではなく result_id で重複を除く
+                for match_id in sorted(changed):
+                    for item in get_results_for_match(match_id, fresh=True):
+                        if _history.add_result(item):
+                            _stats["results_applied"] += 1
+                _history.version = version
+                _stats["incremental"] += 1
+        return _history
+
+
+def record_match_results(match_id, result_items):
+    """finish_current_match から: 終わった試合のコートを足して他のワーカーに知らせる"""
+    with _history_lock:
+        if _history is not None and _history.session_date == _today():
+            for item in result_items:
+                if _history.add_result(dict(item, match_id=match_id)):
+                    _stats["results_applied"] += 1
+    try:
+        # 自分の publish も次の参照で変更ログに出てくるが、result_id が足し済みなので Query 1回で終わる
+        shared_cache.publish(_NS, [match_id])
+    except Exception as e:
+        current_app.logger.warning("[pair_history] 変更ログの書き込みに失敗: %s", e)
+
+
+def repeat_penalty(players):
+    """
+    players 用の RepeatPenalty（今日まだ誰も一緒に試合をしていなければ None）
+    読み込みに失敗してもペアリングは止めない（ペナルティなしで続行）
+    """
+    try:
+        penalty = get_pair_history().penalty(players)
+    except Exception as e:
+        current_app.logger.warning("[pair_history] 読み込み失敗のため繰り返しペナルティなし: %s", e)
+        return None
+    return None if penalty.is_zero else penalty
+
+
+def pair_history_stats() -> dict:
+    history = _history
+    return dict(
+        _stats,
+        session_date=history.session_date if history else None,
+        players=len(history.slots) if history else 0,
+        results=len(history.result_ids) if history else 0,
+        matches=len(history.matches) if history else 0,
+    )
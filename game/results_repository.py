@@ -0,0 +1,204 @@
+"""
+試合結果（bad-game-results）まわりの読み書き
+
+- get_results_for_match: match_id-index（GSI）で1試合分の結果を Query する。
+  コートのタブレットが数秒おきにポーリングするので、短時間のプロセス内キャッシュを挟み、
+  submit_score / 結果の修正・削除で invalidate_match_results() して最新化する。
+- get_results_for_session: session_date-index（GSI）で1練習日分の結果を Query する（pair_history の読み込み用）。
+  submit_score が結果に JST の練習日（session_date）を持たせる。
+- bad-game-player-results: プレイヤー別の結果インデックス
+  PK=user_id, SK=match_id。1試合1人1行で、マイページの戦績はこのテーブルだけを Query する。
+  submit_score で作成し、finish_current_match / スコア修正で pairing_mode やスキルを追記（上書き）する。
+"""
+
+import copy
+import threading
+import time
+
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+from flask import current_app
+
+RESULTS_TABLE = "bad-game-results"
+PLAYER_RESULTS_TABLE = "bad-game-player-results"
+RESULTS_MATCH_INDEX = "match_id-index"
+RESULTS_SESSION_INDEX = "session_date-index"
+
+RESULTS_CACHE_TTL = 3.0           # ポーリング間隔より少し短い程度
+_INDEX_RETRY_SEC = 300             # GSI が使えなかった場合に再挑戦するまでの秒数
+
+_results_cache = {}                # match_id -> (expires_at, items)
+_results_cache_lock = threading.Lock()
+_match_index_missing_at = None
+_session_index_missing_at = None
+
+
+def get_results_for_match(match_id, fresh=False):
+    """
+    1試合分の bad-game-results を返す（match_id-index の Query、コート数ぶんの件数だけ読む）
+
+    - fresh=False: RESULTS_CACHE_TTL 秒のキャッシュを使う（ポーリング用）
+    - fresh=True : 必ず読み直す（終了処理・重複チェックなど判断に使う場合）
+    GSI が無い/作成中の環境では match_id で絞った Scan に戻し、しばらくしてから GSI を再試行する
+    """
+    global _match_index_missing_at
+    if not match_id:
+        return []
+    match_id = str(match_id)
+
+    if not fresh:
+        with _results_cache_lock:
+            hit = _results_cache.get(match_id)
+            if hit and hit[0] > time.monotonic():
+                return copy.deepcopy(hit[1])
+
+    table = current_app.dynamodb.Table(RESULTS_TABLE)
+    items = None
+
+    if _match_index_missing_at is None or time.monotonic() - _match_index_missing_at > _INDEX_RETRY_SEC:
+        try:
+            items = _paginate(table.query, IndexName=RESULTS_MATCH_INDEX,
+                              KeyConditionExpression=Key("match_id").eq(match_id))
+            _match_index_missing_at = None
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("ValidationException", "ResourceNotFoundException"):
+                raise
+            _match_index_missing_at = time.monotonic()
+            current_app.logger.warning("[results] %s が使えないため Scan します: %s", RESULTS_MATCH_INDEX, e)
+
+    if items is None:
+        items = _paginate(table.scan, FilterExpression=Attr("match_id").eq(match_id), ConsistentRead=True)
+
+    with _results_cache_lock:
+        _results_cache[match_id] = (time.monotonic() + RESULTS_CACHE_TTL, items)
+        # 終わった試合のエントリを溜め込まない
+        now = time.monotonic()
+        for mid in [m for m, (exp, _) in _results_cache.items() if exp <= now]:
+            del _results_cache[mid]
+
+    return copy.deepcopy(items)
+
+
+def get_results_for_session(session_date, projection=None):
+    """
+    1練習日分の bad-game-results（session_date-index の Query。その日のコート数ぶんだけ読む）
+    GSI が無い/作成中の環境では created_at が session_date で始まる行の Scan に戻す
+    （session_date を持たない古い行もこちらなら拾える）
+    """
+    global _session_index_missing_at
+    table = current_app.dynamodb.Table(RESULTS_TABLE)
+    kwargs = {"ProjectionExpression": projection} if projection else {}
+
+    if _session_index_missing_at is None or time.monotonic() - _session_index_missing_at > _INDEX_RETRY_SEC:
+        try:
+            items = _paginate(table.query, IndexName=RESULTS_SESSION_INDEX,
+                              KeyConditionExpression=Key("session_date").eq(session_date), **kwargs)
+            _session_index_missing_at = None
+            return items
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("ValidationException", "ResourceNotFoundException"):
+                raise
+            _session_index_missing_at = time.monotonic()
+            current_app.logger.warning("[results] %s が使えないため Scan します: %s", RESULTS_SESSION_INDEX, e)
+
+    return _paginate(table.scan, FilterExpression=Attr("created_at").begins_with(session_date), **kwargs)
+
+
+def invalidate_match_results(match_id=None):
+    """結果を書いた/消したあとに呼ぶ（match_id 省略で全消去）"""
+    with _results_cache_lock:
+        if match_id is None:
+            _results_cache.clear()
+        else:
+            _results_cache.pop(str(match_id), None)
+
+
+def _paginate(op, **kwargs):
+    items = []
+    while True:
+        resp = op(**kwargs)
+        items.extend(resp.get("Items", []))
+        lek = resp.get("LastEvaluatedKey")
+        if not lek:
+            return items
+        kwargs["ExclusiveStartKey"] = lek
+
+# プレイヤー行に持たせる結果の項目（my_stats の表示に必要なものだけ）
+_PLAYER_RESULT_FIELDS = (
+    "result_id", "court_number", "team1_score", "team2_score", "winner",
+    "team_a", "team_b", "created_at", "pairing_mode",
+)
+
+
+def player_result_items(result_item):
+    """1コート分の結果から、出場者ごとの bad-game-player-results の行を作る"""
+    match_id = result_item.get("match_id")
+    if not match_id:
+        return []
+
+    snapshot = result_item.get("skill_snapshot") or {}
+    items = []
+    for team, key in (("A", "team_a"), ("B", "team_b")):
+        for p in result_item.get(key) or []:
+            uid = p.get("user_id") if isinstance(p, dict) else None
+            if not uid:
+                continue
+            item = {
+                "user_id": str(uid),
+                "match_id": str(match_id),
+                "team": team,
+                "won": result_item.get("winner") == team,
+            }
+            for f in _PLAYER_RESULT_FIELDS:
+                if result_item.get(f) is not None:
+                    item[f] = result_item[f]
+            my_snap = snapshot.get(uid) if isinstance(snapshot, dict) else None
+            if isinstance(my_snap, dict):
+                item["skill_snapshot"] = {uid: my_snap}
+            items.append(item)
+    return items
+
+
+def put_player_results(result_items):
+    """
+    結果（複数コート可）をプレイヤー別インデックスに書き込む（batch_writer で25件ずつ）
+    結果本体の保存を妨げないよう、失敗はログだけ残して件数を返す
+    """
+    rows = [row for r in result_items for row in player_result_items(r)]
+    if not rows:
+        return 0
+    try:
+        table = current_app.dynamodb.Table(PLAYER_RESULTS_TABLE)
+        with table.batch_writer(overwrite_by_pkeys=["user_id", "match_id"]) as batch:
+            for row in rows:
+                batch.put_item(Item=row)
+        return len(rows)
+    except Exception as e:
+        current_app.logger.error("[player-results] 書き込み失敗 rows=%d: %s", len(rows), e)
+        return 0
+
+
+def query_player_results(user_id):
+    """
+    1人分の試合結果を古い順に返す（プレイヤー別インデックスを1本のページング Query）
+    インデックス未作成の環境では bad-game-results の全件スキャンに戻す
+    """
+    table = current_app.dynamodb.Table(PLAYER_RESULTS_TABLE)
+    try:
+        return _paginate(table.query, KeyConditionExpression=Key("user_id").eq(str(user_id)))
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "ResourceNotFoundException":
+            raise
+        current_app.logger.warning("[player-results] %s が無いため全件スキャンします", PLAYER_RESULTS_TABLE)
+
+    return _scan_results_for_player(user_id)
+
+
+def _scan_results_for_player(user_id):
+    table = current_app.dynamodb.Table(RESULTS_TABLE)
+    return [
+        row
+        for r in _paginate(table.scan)
+        for row in player_result_items(r)
+        if row["user_id"] == user_id
+    ]
@@ -10,20 +10,32 @@ from collections import Counter
 from .game_utils import (
     Player,
     generate_ai_best_pairings,
+    generate_optimal_pairings,
     generate_balanced_pairs_and_matches,
     generate_full_random_pairings,
     generate_skill_grouped_pairings,
     preprocess_low_skill_grouping,
     parse_players,
     sync_match_entries_with_updated_skills,
-    update_trueskill_for_players_and_return_updates, _rest_queue_pk
+    _rest_queue_pk,
+    transact_write_in_chunks,
+    rate_match_results,
+    transact_update_or_fallback,
 )
 from utils.timezone import JST
+from uguu.dynamo import db as uguu_db
+from utils.user_directory import user_directory
+from utils.points import put_ledger_item
+from utils.schedule_repository import schedule_repository
+from .results_repository import get_results_for_match, invalidate_match_results, put_player_results
+from .court_state import get_court_state, invalidate_court_state, organize_match_courts, wait_for_change
+from .pair_history import record_match_results, repeat_penalty
 import re
 from decimal import Decimal
 import time
 import logging
 from botocore.exceptions import ClientError
+from boto3.dynamodb.types import TypeSerializer
 from zoneinfo import ZoneInfo
 from typing import List, Tuple, Dict, Any
 from typing import Optional, List
@@ -31,9 +43,21 @@ from typing import Optional, List
 JST = ZoneInfo("Asia/Tokyo")
 
 logger = logging.getLogger(__name__)
+_serializer = TypeSerializer()
 
 bp_game = Blueprint('game', __name__)
 
+# GET でもエントリー / meta を書き換えるエンドポイント
+_GET_WRITERS = {"game.create_test_data", "game.clear_test_data"}
+
+
+@bp_game.after_request
+def _invalidate_court_state_after_write(response):
+    """書き込み系のリクエストのあとはコート状態のスナップショットを捨てる（game/court_state.py）"""
+    if request.method not in ("GET", "HEAD", "OPTIONS") or request.endpoint in _GET_WRITERS:
+        invalidate_court_state()
+    return response
+
 
 # DynamoDBリソース取得
 dynamodb = boto3.resource('dynamodb', region_name='ap-northeast-1')
@@ -75,39 +99,11 @@ def court():
     try:
         # セッション初期値
 
-        match_table = current_app.dynamodb.Table("bad-game-match_entries")
-
-        # ★履歴(rest_event)は現役一覧から除外
-        filter_expr = (
-            Attr("entry_status").is_in(["pending", "resting", "playing"])
-            & (Attr("type").not_exists() | Attr("type").ne("rest_event"))
-        )
-
-        items = _scan_all(
-            match_table,
-            FilterExpression=filter_expr,
-            ConsistentRead=True
-        )
-
-        # --- デフォルト値補完（ログ無し） ---
-        for it in items:
-            it["rest_count"]  = it.get("rest_count")  or 0
-            it["match_count"] = it.get("match_count") or 0
-            it["join_count"]  = it.get("join_count")  or 0
-
-        # --- ステータス別に分類 ---
-        pending_players = []
-        resting_players = []
-        playing_players = []
-
-        for it in items:
-            st = it.get("entry_status")
-            if st == "pending":
-                pending_players.append(it)
-            elif st == "resting":
-                resting_players.append(it)
-            elif st == "playing":
-                playing_players.append(it)
+        # 現役エントリー + meta#current / meta#pairing を1回で読んだスナップショット（game/court_state.py）
+        state = get_court_state()
+        pending_players = state.pending
+        resting_players = state.resting
+        playing_players = state.playing
 
         # --- ユーザー状態の判定（自分の entry は「最新1件」を採用） ---
         user_id = current_user.get_id()
@@ -119,15 +115,8 @@ def court():
         skill_score = 50
         match_count = 0
 
-        def _ts(it):
-            # 文字列ISO前提。無ければ空文字で最小扱い
-            return str(it.get("updated_at") or it.get("joined_at") or it.get("created_at") or "")
-
-        my_entries = [it for it in items if it.get("user_id") == user_id]
-
-        me = None
-        if my_entries:
-            me = max(my_entries, key=_ts)  # 最新を採用
+        me = state.latest_entry_for(user_id)
+        if me:
             st = me.get("entry_status")
 
             is_registered  = (st == "pending")
@@ -159,37 +148,15 @@ def court():
             logger.exception("[court] user skill_score reload failed")
 
         # --- ペアリングモード情報 ---
-        try:
-            meta_table = current_app.dynamodb.Table("bad-game-matches")
-            pairing_meta = meta_table.get_item(
-                Key={"match_id": "meta#pairing"},
-                ConsistentRead=True
-            ).get("Item", {}) or {}
-            cycle_index = int(pairing_meta.get("cycle_index", 0))
-            last_mode = pairing_meta.get("last_mode", None)
-            session_round = int(pairing_meta.get("round_count", 0))
-            if cycle_index == 1:
-                next_mode = "full_random"
-            elif cycle_index == 2:
-                next_mode = "ai"
-            else:
-                next_mode = "random"
-        except Exception:
-            cycle_index = 0
-            last_mode = None
-            next_mode = "random"
-            session_round = 0
+        cycle_index, last_mode, next_mode, session_round = state.pairing_info()
 
         # --- 進行中試合関連（INFO最小、詳細はDEBUG） ---
-        has_ongoing = has_ongoing_matches()
-        completed, total = get_match_progress()
-        current_courts = get_current_match_status()
+        has_ongoing = state.has_ongoing
+        completed, total = state.progress()
+        current_courts = state.current_courts()
 
-        match_id = get_latest_match_id()
-        if match_id:
-            match_courts = get_organized_match_data(match_id)
-        else:
-            match_courts = {}
+        match_id = state.match_id
+        match_courts = state.match_courts()
 
         user_court_submitted = False
         for court in match_courts.values():
@@ -210,8 +177,7 @@ def court():
         training_menu = None
         match_started_at = None
         try:
-            _meta_table = current_app.dynamodb.Table("bad-game-matches")
-            meta_item = _meta_table.get_item(Key={"match_id": "meta#current"}).get("Item", {})
+            meta_item = state.meta
             if meta_item.get("status") == "idle" and getattr(current_user, 'administrator', False):
                 last_match_id_for_correction = meta_item.get("last_match_id")
             if meta_item.get("status") == "playing":
@@ -223,7 +189,7 @@ def court():
 
         logger.debug(
             "[court] total=%d pending=%d resting=%d playing=%d user=%s state=%s ongoing=%s progress=%s/%s match_id=%s",
-            len(items), len(pending_players), len(resting_players), len(playing_players),
+            len(pending_players) + len(resting_players) + len(playing_players), len(pending_players), len(resting_players), len(playing_players),
             user_id,
             ("playing" if is_playing else "resting" if is_resting else "pending" if is_registered else "none"),
             has_ongoing, completed, total, match_id or "-"
@@ -233,10 +199,10 @@ def court():
             logger.debug("[court] current_courts=%s", current_courts)
             if match_id:
                 logger.debug("[court] match_courts keys=%d", len(match_courts))
-            if my_entries and me:
+            if me:
                 logger.debug(
-                    "[court][me] entries=%d picked_ts=%s picked_entry_skill=%s final_skill=%s",
-                    len(my_entries), _ts(me), me.get("skill_score"), skill_score
+                    "[court][me] picked_ts=%s picked_entry_skill=%s final_skill=%s",
+                    me.get("updated_at") or me.get("joined_at"), me.get("skill_score"), skill_score
                 )
 
         return render_template(
@@ -264,6 +230,7 @@ def court():
             training_menu=training_menu,
             match_started_at=match_started_at,
             session_round=session_round,
+            court_version=state.version,
         )
 
     except Exception:
@@ -286,6 +253,236 @@ def _scan_all(table, **kwargs):
     return items
 
 
+# bad-game-match_entries の entry_status GSI（create_gsi_entry_status.py で作成）
+ENTRY_STATUS_INDEX = "entry_status-index"
+_ENTRY_STATUS_INDEX_RETRY_SEC = 300
+_entry_status_index_missing_at = None
+
+
+def query_entries_by_status(table, statuses, match_id=None, user_id=None, filter_expression=None, **kwargs):
+    """
+    entry_status（pending / resting / playing ...）で今日のエントリーを取得する
+
+    - 今日の練習日パーティション（session_date GSI）を1回 Query し、entry_status で絞る
+      （状態が複数でも Query は1回。過去の練習日の行は読まない）
+    - session_date GSI が未作成の環境では entry_status GSI の Query（状態ごと）、それも無ければ Scan+Filter
+    - match_id / user_id / filter_expression は追加のフィルタ
+    - GSI は強整合読みができないため ConsistentRead は Scan フォールバック時のみ有効
+    """
+    global _entry_status_index_missing_at
+
+    if isinstance(statuses, str):
+        statuses = [statuses]
+    statuses = list(dict.fromkeys(statuses))
+
+    extra = filter_expression
+    if match_id is not None:
+        cond = Attr("match_id").eq(str(match_id))
+        extra = cond if extra is None else extra & cond
+    if user_id is not None:
+        cond = Attr("user_id").eq(user_id)
+        extra = cond if extra is None else extra & cond
+
+    status_cond = Attr("entry_status").eq(statuses[0]) if len(statuses) == 1 else Attr("entry_status").is_in(statuses)
+
+    if _session_index_available():
+        try:
+            return _query_session_index(table, session_date_jst(),
+                                        status_cond if extra is None else status_cond & extra, **kwargs)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "ValidationException":
+                raise
+
+    consistent_read = kwargs.pop("ConsistentRead", False)
+
+    use_index = (
+        _entry_status_index_missing_at is None
+        or time.monotonic() - _entry_status_index_missing_at > _ENTRY_STATUS_INDEX_RETRY_SEC
+    )
+    if use_index:
+        try:
+            items = []
+            for st in statuses:
+                qkw = dict(kwargs)
+                qkw["IndexName"] = ENTRY_STATUS_INDEX
+                qkw["KeyConditionExpression"] = Key("entry_status").eq(st)
+                if extra is not None:
+                    qkw["FilterExpression"] = extra
+                while True:
+                    resp = table.query(**qkw)
+                    items.extend(resp.get("Items", []))
+                    lek = resp.get("LastEvaluatedKey")
+                    if not lek:
+                        break
+                    qkw["ExclusiveStartKey"] = lek
+            _entry_status_index_missing_at = None
+            return items
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "ValidationException":
+                raise
+            _entry_status_index_missing_at = time.monotonic()
+            current_app.logger.warning(
+                "[query_entries_by_status] GSI %s が使えないため scan にフォールバック: %s",
+                ENTRY_STATUS_INDEX, e
+            )
+
+    scan_filter = status_cond if extra is None else status_cond & extra
+    if consistent_read:
+        kwargs["ConsistentRead"] = True
+    return _scan_all(table, FilterExpression=scan_filter, **kwargs)
+
+
+# bad-game-match_entries の user_id GSI（create_gsi_entry_user.py で作成）
+ENTRY_USER_INDEX = "user_id-index"
+LIVE_ENTRY_STATUSES = ("pending", "resting", "playing")
+_entry_user_index_missing_at = None
+
+
+def query_entries_by_user(table, user_id, statuses=None, **kwargs):
+    """
+    user_id でエントリーを取得する（休みイベント行も含む、その人の行すべて）
+
+    - user_id GSI を Query するので、読む量はそのユーザーの行数だけ（テーブルの大きさに依存しない）
+    - statuses を渡すと entry_status で絞る（FilterExpression）
+    - GSI が未作成の環境では従来の Scan+Filter にフォールバック
+    """
+    global _entry_user_index_missing_at
+
+    extra = None
+    if statuses:
+        statuses = [statuses] if isinstance(statuses, str) else list(statuses)
+        extra = Attr("entry_status").eq(statuses[0]) if len(statuses) == 1 else Attr("entry_status").is_in(statuses)
+
+    consistent_read = kwargs.pop("ConsistentRead", False)
+
+    if (_entry_user_index_missing_at is None
+            or time.monotonic() - _entry_user_index_missing_at > _ENTRY_STATUS_INDEX_RETRY_SEC):
+        try:
+            qkw = dict(kwargs)
+            qkw["IndexName"] = ENTRY_USER_INDEX
+            qkw["KeyConditionExpression"] = Key("user_id").eq(user_id)
+            if extra is not None:
+                qkw["FilterExpression"] = extra
+            items = []
+            while True:
+                resp = table.query(**qkw)
+                items.extend(resp.get("Items", []))
+                lek = resp.get("LastEvaluatedKey")
+                if not lek:
+                    break
+                qkw["ExclusiveStartKey"] = lek
+            _entry_user_index_missing_at = None
+            return items
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "ValidationException":
+                raise
+            _entry_user_index_missing_at = time.monotonic()
+            current_app.logger.warning(
+                "[query_entries_by_user] GSI %s が使えないため scan にフォールバック: %s",
+                ENTRY_USER_INDEX, e
+            )
+
+    user_cond = Attr("user_id").eq(user_id)
+    if consistent_read:
+        kwargs["ConsistentRead"] = True
+    return _scan_all(table, FilterExpression=user_cond if extra is None else user_cond & extra, **kwargs)
+
+
+# bad-game-match_entries の練習日パーティション（migrate_entry_sessions.py で作成）
+#   session_date: JST の練習日（"YYYY-MM-DD"）。GSI session_date-index の PK
+#   expires_at  : DynamoDB の TTL 属性（epoch 秒）。練習日から ENTRY_TTL_DAYS 日後に DynamoDB が消す
+# 現役の画面・API は今日のパーティションだけを Query し、過去の練習日の行は Scan せずに TTL で消える
+ENTRY_SESSION_INDEX = "session_date-index"
+ENTRY_TTL_DAYS = 2
+_entry_session_index_missing_at = None
+
+
+def session_date_jst():
+    """今日の練習日（JST）"""
+    return datetime.now(JST).strftime("%Y-%m-%d")
+
+
+def session_fields(session_date=None):
+    """match_entries に新しく書く行に付ける練習日と TTL"""
+    session_date = session_date or session_date_jst()
+    day_start = datetime.strptime(session_date, "%Y-%m-%d").replace(tzinfo=JST)
+    return {
+        "session_date": session_date,
+        "expires_at": int((day_start + timedelta(days=ENTRY_TTL_DAYS)).timestamp()),
+    }
+
+
+def in_session(item, session_date=None):
+    """今日の練習日の行か（session_date を持たない移行前の行は今日扱い）"""
+    session_date = session_date or session_date_jst()
+    return item.get("session_date", session_date) == session_date
+
+
+def session_entry_id(user_id, session_date=None):
+    """
+    参加登録の entry_id（練習日 × ユーザーで一意）
+    同じ日に同じユーザーが二重に登録しようとすると条件付き put で弾かれる
+    """
+    session_date = session_date or session_date_jst()
+    return f"{session_date}#{user_id}"
+
+
+def _session_index_available():
+    return (_entry_session_index_missing_at is None
+            or time.monotonic() - _entry_session_index_missing_at > _ENTRY_STATUS_INDEX_RETRY_SEC)
+
+
+def _query_session_index(table, session_date, filter_expression=None, **kwargs):
+    """session_date GSI を全ページ Query する（GSI が無ければ ClientError のまま投げる）"""
+    global _entry_session_index_missing_at
+
+    qkw = dict(kwargs)
+    qkw.pop("ConsistentRead", None)  # GSI は強整合読み不可
+    qkw["IndexName"] = ENTRY_SESSION_INDEX
+    qkw["KeyConditionExpression"] = Key("session_date").eq(session_date)
+    if filter_expression is not None:
+        qkw["FilterExpression"] = filter_expression
+    items = []
+    try:
+        while True:
+            resp = table.query(**qkw)
+            items.extend(resp.get("Items", []))
+            lek = resp.get("LastEvaluatedKey")
+            if not lek:
+                break
+            qkw["ExclusiveStartKey"] = lek
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") == "ValidationException":
+            _entry_session_index_missing_at = time.monotonic()
+            current_app.logger.warning(
+                "[session_index] GSI %s が使えないためフォールバック: %s", ENTRY_SESSION_INDEX, e
+            )
+        raise
+    _entry_session_index_missing_at = None
+    return items
+
+
+def query_session_entries(table, session_date=None, filter_expression=None, **kwargs):
+    """
+    練習日（既定は今日）のパーティションの行をすべて取得する（休みイベント行も含む）
+
+    - session_date GSI を Query するので、読む量はその日の行数だけ（過去の練習日は読まない）
+    - filter_expression は追加のフィルタ
+    - GSI が未作成の環境では Scan+Filter にフォールバック（session_date を持たない移行前の行も対象）
+    """
+    session_date = session_date or session_date_jst()
+    if _session_index_available():
+        try:
+            return _query_session_index(table, session_date, filter_expression, **kwargs)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "ValidationException":
+                raise
+
+    session_cond = Attr("session_date").eq(session_date) | Attr("session_date").not_exists()
+    scan_filter = session_cond if filter_expression is None else session_cond & filter_expression
+    return _scan_all(table, FilterExpression=scan_filter, **kwargs)
+
+
 def get_latest_match_id(hours_window=12):
     """
     進行中の match_id を返す（なければ None）
@@ -349,10 +546,10 @@ def get_latest_match_id(hours_window=12):
             )
 
         # created_at が無いデータが混ざっても落ちにくいように候補を多めに取る
-        playing_items = _scan_all(
+        playing_items = query_entries_by_status(
             match_table,
+            "playing",
             ProjectionExpression="match_id, entry_status, created_at, updated_at, joined_at",
-            FilterExpression=Attr("entry_status").eq("playing"),
             ConsistentRead=True
         )
 
@@ -397,13 +594,14 @@ def get_match_players_by_court(match_id):
     match_table = current_app.dynamodb.Table("bad-game-match_entries")
     current_app.logger.info(f" 試合情報取得開始: match_id={match_id}")
 
-    players = _scan_all(
+    players = query_entries_by_status(
         match_table,
+        "playing",
+        match_id=match_id,
         ProjectionExpression=(
             "user_id, display_name, skill_score, gender, organization, badminton_experience, "
             "match_id, entry_status, court_number, team, team_name, team_side"
         ),
-        FilterExpression=Attr("match_id").eq(match_id) & Attr("entry_status").eq("playing")
     )
     current_app.logger.info(f"試合プレイヤー取得: {len(players)}人")
 
@@ -472,14 +670,13 @@ def get_match_players_by_court(match_id):
 @bp_game.route("/api/court_status")
 @login_required
 def court_status_api():
-    """コート状況のAPIエンドポイント"""
+    """コート状況のAPIエンドポイント（件数だけなのでスナップショットから）"""
     try:
-        pending_players = get_pending_players()
-        resting_players = get_resting_players()
-        
+        state = get_court_state()
+
         return jsonify({
-            'pending_count': len(pending_players),
-            'resting_count': len(resting_players),
+            'pending_count': len(state.pending),
+            'resting_count': len(state.resting),
             'entry_status': 'success'
         })
     except Exception as e:
@@ -521,20 +718,7 @@ def get_players_status(status, user_id=None, debug_dump_all=False, debug_sample=
                 )
 
         # --- 本処理：必要なものだけ取得 ---
-        filter_expr = Attr("entry_status").eq(status)
-        if user_id:
-            filter_expr = filter_expr & Attr("user_id").eq(user_id)
-
-        items = []
-        resp = match_table.scan(FilterExpression=filter_expr)
-        items.extend(resp.get("Items", []))
-
-        while "LastEvaluatedKey" in resp:
-            resp = match_table.scan(
-                FilterExpression=filter_expr,
-                ExclusiveStartKey=resp["LastEvaluatedKey"],
-            )
-            items.extend(resp.get("Items", []))
+        items = query_entries_by_status(match_table, status, user_id=user_id or None)
 
         # --- デフォルト値補完（ログなし） ---
         for it in items:
@@ -606,14 +790,16 @@ def get_pending_players():
         today = date.today().isoformat()
         match_table   = current_app.dynamodb.Table("bad-game-match_entries")
         history_table = current_app.dynamodb.Table("bad-users-history")
-        user_table    = current_app.dynamodb.Table("bad-users")
 
         # entry_statusのみでフィルタ。メタ行は除外。強整合読みを推奨
-        resp = match_table.scan(
-            FilterExpression=Attr('entry_status').eq('pending') & ~Attr('entry_id').contains('meta'),
+        items = query_entries_by_status(
+            match_table, 'pending',
+            filter_expression=~Attr('entry_id').contains('meta'),
             ConsistentRead=True,
         )
-        items = resp.get('Items', [])
+
+        # ユーザー詳細はまとめて取得（UserDirectory）
+        users_by_id = user_directory.get_many(item.get('user_id') for item in items)
 
         players = []
         for item in items:
@@ -622,8 +808,7 @@ def get_pending_players():
                 continue
 
             # ユーザー詳細
-            uresp = user_table.get_item(Key={"user#user_id": user_id})
-            user_data = uresp.get("Item", {})
+            user_data = users_by_id.get(user_id, {})
 
             # 参加回数（履歴）
             try:
@@ -679,14 +864,16 @@ def get_resting_players():
 
         match_table   = current_app.dynamodb.Table("bad-game-match_entries")
         history_table = current_app.dynamodb.Table("bad-users-history")
-        user_table    = current_app.dynamodb.Table("bad-users")
 
         # entry_statusのみでフィルタ。メタ行除外。強整合読み。
-        resp = match_table.scan(
-            FilterExpression=Attr('entry_status').eq('resting') & ~Attr('entry_id').contains('meta'),
+        items = query_entries_by_status(
+            match_table, 'resting',
+            filter_expression=~Attr('entry_id').contains('meta'),
             ConsistentRead=True,
         )
-        items = resp.get('Items', [])
+
+        # ユーザー詳細はまとめて取得（UserDirectory）
+        users_by_id = user_directory.get_many(item.get('user_id') for item in items)
 
         players = []
         for item in items:
@@ -695,8 +882,7 @@ def get_resting_players():
                 continue
 
             # ユーザー詳細
-            uresp = user_table.get_item(Key={"user#user_id": user_id})
-            user_data = uresp.get("Item", {}) or {}
+            user_data = users_by_id.get(user_id, {})
 
             # 参加回数（履歴）
             try:
@@ -736,23 +922,18 @@ def get_resting_players():
 def get_user_status(user_id):
     """ユーザーの現在の状態を取得"""
     try:
-        # pending状態の確認
-        pending_response = match_table.scan(
-            FilterExpression=Attr('user_id').eq(user_id) & Attr('match_id').eq('pending')
-        )
-        is_registered = bool(pending_response.get('Items'))
-        
-        # resting状態の確認
-        resting_response = match_table.scan(
-            FilterExpression=Attr('user_id').eq(user_id) & Attr('match_id').eq('resting')
-        )
-        is_resting = bool(resting_response.get('Items'))
+        # その人のエントリーだけを user_id GSI で読む
+        items = [it for it in query_entries_by_user(match_table, user_id, ["pending", "resting"]) if in_session(it)]
+        pending_items = [it for it in items if it.get("entry_status") == "pending"]
+        resting_items = [it for it in items if it.get("entry_status") == "resting"]
+        is_registered = bool(pending_items)
+        is_resting = bool(resting_items)
         
         # 戦闘力を取得
         skill_score = None
         
         # pending_itemsまたはresting_itemsから戦闘力を取得
-        all_items = pending_response.get('Items', []) + resting_response.get('Items', [])
+        all_items = pending_items + resting_items
         if all_items:
             skill_score = all_items[0].get('skill_score')
         
@@ -788,22 +969,21 @@ def entry():
     match_table = current_app.dynamodb.Table("bad-game-match_entries")
     user_table = current_app.dynamodb.Table("bad-users")
 
-    # 1) すでにpending登録されていないかチェック
-    response = match_table.scan(
-        FilterExpression=Attr("user_id").eq(user_id) & Attr("entry_status").is_in(["pending", "resting", "playing"])
-    )
-    existing = response.get("Items", [])
+    # 1) その人のエントリーを user_id GSI で読む（テーブル全体は読まない）
+    mine = query_entries_by_user(match_table, user_id, ConsistentRead=True)
+    # 過去の練習日に残った行は現役扱いしない（下で消す）
+    live = [it for it in mine if it.get("entry_status") in LIVE_ENTRY_STATUSES
+            and it.get("type") != "rest_event" and in_session(it)]
 
-    if existing:
+    if live:
         current_app.logger.info("[ENTRY] すでに参加登録済みのためスキップ")
         return redirect(url_for("game.court"))
 
     # 2) 他の状態のエントリがあれば削除（念のため）
-    cleanup_response = match_table.scan(
-        FilterExpression=Attr("user_id").eq(user_id)
-    )
-    for item in cleanup_response.get("Items", []):
-        match_table.delete_item(Key={"entry_id": item["entry_id"]})
+    if mine:
+        with match_table.batch_writer() as batch:
+            for item in mine:
+                batch.delete_item(Key={"entry_id": item["entry_id"]})
 
     # -------------------------------------------------------
     # 3) ユーザー情報取得（user# プレフィックスの有無を吸収する暫定ロジック）
@@ -825,9 +1005,9 @@ def entry():
         display_name = "未設定"
     # -------------------------------------------------------
 
-    # 4) 新規登録
+    # 4) 新規登録（練習日 × ユーザーのキーに条件付き put。同時に押されても1件しかできない）
     entry_item = {
-        "entry_id": str(uuid.uuid4()),
+        "entry_id": session_entry_id(user_id),
         "user_id": user_id,
         "match_id": "pending",
         "entry_status": "pending",
@@ -837,9 +1017,20 @@ def entry():
         "created_at": now,
         "rest_count": 0,
         "match_count": 0,
-        "join_count": 1
+        "join_count": 1,
+        **session_fields(),
     }
-    match_table.put_item(Item=entry_item)
+    try:
+        match_table.put_item(
+            Item=entry_item,
+            ConditionExpression="attribute_not_exists(entry_id) OR NOT entry_status IN (:p, :r, :pl)",
+            ExpressionAttributeValues={":p": "pending", ":r": "resting", ":pl": "playing"},
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        current_app.logger.info("[ENTRY] 同時に登録済み（条件付き put で重複を防止）")
+        return redirect(url_for("game.court"))
     current_app.logger.info(f"[ENTRY] 新規参加登録完了: {entry_item['entry_id']}, 名前: {display_name}")
 
     # ── 出席記録（bad-users-history）を自動作成 ──────────────────────────
@@ -856,18 +1047,10 @@ def entry():
             for item in h_resp.get("Items", [])
         )
 
-        # 今日のスケジュールIDを取得（あれば）
+        # 今日のスケジュールIDを取得（あれば）: status-date-index の Query
         schedule_id_today = None
         try:
-            sched_table = current_app.dynamodb.Table(
-                current_app.config.get("TABLE_NAME_SCHEDULE", "bad_schedules")
-            )
-            s_resp = sched_table.scan(
-                FilterExpression=Attr("date").eq(today_jst),
-                ProjectionExpression="schedule_id, #loc",
-                ExpressionAttributeNames={"#loc": "location"},
-            )
-            s_items = s_resp.get("Items", [])
+            s_items = schedule_repository.range(today_jst, today_jst)
             if s_items:
                 schedule_id_today = s_items[0].get("schedule_id")
                 location_today = s_items[0].get("location", "")
@@ -877,7 +1060,8 @@ def entry():
             location_today = ""
 
         # 参加履歴を追加（コートエントリー時刻で登録）
-        history_table.put_item(Item={
+        # join 行は台帳集計（ugu_points_v2 の ledger_*）の対象なので同じトランザクションで ADD する
+        put_ledger_item(history_table, {
             "user_id": user_id,
             "joined_at": datetime.now(timezone.utc).isoformat(),
             "date": today_jst,
@@ -888,6 +1072,12 @@ def entry():
             **({"location": location_today} if location_today else {}),
         })
 
+        # 初参加日インデックス（トップページの初参加バッジ用）
+        try:
+            uguu_db.update_first_participation(user_id, today_jst)
+        except Exception as e:
+            current_app.logger.error(f"[ENTRY] first_participation_date 更新エラー: {e}")
+
         # 初回参加のみ practice_count を加算
         if not already_registered:
             try:
@@ -903,6 +1093,9 @@ def entry():
                 if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
                     current_app.logger.error(f"[ENTRY] practice_count更新エラー: {e}")
 
+        # 参加履歴・ポイントが変わったので統計キャッシュと集計エンジンに知らせる
+        uguu_db.bump_stats_version(user_id)
+
         current_app.logger.info(f"[ENTRY] 出席記録作成: {user_id} date={today_jst} already={already_registered}")
     except Exception as e:
         current_app.logger.error(f"[ENTRY] 出席記録エラー（無視して続行）: {e}")
@@ -951,12 +1144,10 @@ def correct_last_score():
     if request.method == "POST":
         try:
             # 前回試合の全結果を取得
-            resp = results_table.scan(
-                FilterExpression=Attr("match_id").eq(last_match_id)
-            )
-            results = resp.get("Items", [])
+            results = get_results_for_match(last_match_id, fresh=True)
 
-            updated_skills = {}
+            corrected_items = []
+            corrected_rows = []
             for result in results:
                 court_num = int(result.get("court_number", 0))
                 new_winner = request.form.get(f"winner_{court_num}")
@@ -987,8 +1178,7 @@ def correct_last_score():
                     "team1_score": new_score_a,
                     "team2_score": new_score_b,
                 }
-                court_skills = update_trueskill_for_players_and_return_updates(result_item)
-                updated_skills.update(court_skills)
+                corrected_items.append(result_item)
 
                 # 結果レコードを更新
                 results_table.update_item(
@@ -1004,7 +1194,12 @@ def correct_last_score():
                 current_app.logger.info(
                     "[correct_score] court=%d %s→%s", court_num, old_winner, new_winner
                 )
+                corrected_rows.append(dict(result, winner=new_winner,
+                                           team1_score=new_score_a, team2_score=new_score_b))
 
+            invalidate_match_results(last_match_id)
+            put_player_results(corrected_rows)
+            updated_skills, _ = rate_match_results(corrected_items)
             if updated_skills:
                 persist_skill_to_bad_users(updated_skills)
                 current_app.logger.info(
@@ -1032,6 +1227,32 @@ def correct_last_score():
     )
 
 
+def cleanup_duplicate_entries():
+    """
+    今日の練習日パーティションで、同じユーザーの現役エントリーが複数あれば最新1件だけ残して消す
+    戻り値: 削除件数
+    """
+    match_table = current_app.dynamodb.Table("bad-game-match_entries")
+    items = query_entries_by_status(match_table, list(LIVE_ENTRY_STATUSES))
+
+    by_user = {}
+    for it in items:
+        by_user.setdefault(it.get("user_id"), []).append(it)
+
+    targets = []
+    for uid, rows in by_user.items():
+        if len(rows) < 2:
+            continue
+        keep = max(rows, key=lambda x: str(x.get("updated_at") or x.get("joined_at") or ""))
+        targets.extend(it for it in rows if it["entry_id"] != keep["entry_id"])
+        current_app.logger.info("[cleanup_duplicates] user=%s 残す=%s 削除=%d件", uid, keep["entry_id"], len(rows) - 1)
+
+    with match_table.batch_writer() as batch:
+        for it in targets:
+            batch.delete_item(Key={"entry_id": it["entry_id"]})
+    return len(targets)
+
+
 # 管理者用エンドポイント
 @bp_game.route("/admin/cleanup_duplicates", methods=['POST'])
 @login_required
@@ -1155,106 +1376,202 @@ def dump_client(tag, c):
         current_app.logger.warning("[%s] creds_dump_failed=%r", tag, e)
 
 
+def _playing_tx_item(table_name, entry_id, match_id, court_number, team, now_iso, count_match=True):
+    """entry を playing に昇格させる Update（pending/resting のときだけ）"""
+    update_expr = (
+        "SET entry_status = :playing, match_id = :mid, court_number = :court, "
+        "team = :team, team_side = :team, updated_at = :now"
+    )
+    values = {
+        ":playing": {"S": "playing"},
+        ":mid": {"S": str(match_id)},
+        ":court": {"N": str(int(court_number))},
+        ":team": {"S": team},
+        ":now": {"S": now_iso},
+        ":pend": {"S": "pending"},
+        ":rest": {"S": "resting"},
+    }
+    if count_match:
+        update_expr += ", match_count = if_not_exists(match_count, :zero) + :one"
+        values[":zero"] = {"N": "0"}
+        values[":one"] = {"N": "1"}
+    update_expr += " REMOVE court"  # 旧 'court' を掃除
+    return {
+        "Update": {
+            "TableName": table_name,
+            "Key": {"entry_id": {"S": str(entry_id)}},
+            "UpdateExpression": update_expr,
+            "ConditionExpression": (
+                "attribute_exists(entry_id) AND "
+                "(attribute_not_exists(entry_status) OR entry_status IN (:pend, :rest))"
+            ),
+            "ExpressionAttributeValues": values,
+        }
+    }
+
+
+def _playing_rollback_tx_item(table_name, entry_id, match_id, prev_status, now_iso, count_match=True):
+    """_playing_tx_item の補償（この match_id で playing にした行だけ元のステータスへ戻す）"""
+    update_expr = "SET entry_status = :prev, updated_at = :now REMOVE match_id, court_number, team, team_side"
+    values = {
+        ":prev": {"S": prev_status or "pending"},
+        ":now": {"S": now_iso},
+        ":playing": {"S": "playing"},
+        ":mid": {"S": str(match_id)},
+    }
+    if count_match:
+        update_expr += " ADD match_count :minus"
+        values[":minus"] = {"N": "-1"}
+    return {
+        "Update": {
+            "TableName": table_name,
+            "Key": {"entry_id": {"S": str(entry_id)}},
+            "UpdateExpression": update_expr,
+            "ConditionExpression": "entry_status = :playing AND match_id = :mid",
+            "ExpressionAttributeValues": values,
+        }
+    }
+
+
+def _status_tx_item(table_name, entry_id, status, now_iso):
+    """entry_status だけを書き換える Update（休憩者・巻き戻し用）"""
+    return {
+        "Update": {
+            "TableName": table_name,
+            "Key": {"entry_id": {"S": str(entry_id)}},
+            "UpdateExpression": "SET entry_status = :st, updated_at = :now",
+            "ConditionExpression": "attribute_exists(entry_id)",
+            "ExpressionAttributeValues": {":st": {"S": status}, ":now": {"S": now_iso}},
+        }
+    }
+
+
+def _rest_count_tx_item(table_name, entry_id, match_id, now_iso):
+    """待機になった entry の休み累計/最新を更新する Update"""
+    return {
+        "Update": {
+            "TableName": table_name,
+            "Key": {"entry_id": {"S": str(entry_id)}},
+            "UpdateExpression": (
+                "SET last_rest_match_id=:mid, last_rest_at=:now, last_rest_reason=:rr, updated_at=:now "
+                "ADD rest_count :one"
+            ),
+            "ConditionExpression": "attribute_exists(entry_id)",
+            "ExpressionAttributeValues": {
+                ":mid": {"S": str(match_id)},
+                ":now": {"S": now_iso},
+                ":rr": {"S": "not_selected"},
+                ":one": {"N": "1"},
+            },
+        }
+    }
+
+
+def _rest_count_rollback_tx_item(table_name, entry_id, match_id):
+    """_rest_count_tx_item の補償（この match_id で休みを数えた行だけ1戻す）"""
+    return {
+        "Update": {
+            "TableName": table_name,
+            "Key": {"entry_id": {"S": str(entry_id)}},
+            "UpdateExpression": "ADD rest_count :minus",
+            "ConditionExpression": "last_rest_match_id = :mid",
+            "ExpressionAttributeValues": {":minus": {"N": "-1"}, ":mid": {"S": str(match_id)}},
+        }
+    }
+
+
+def _rest_event_tx_item(table_name, rest_item):
+    """休みイベント行の Put（同じ entry_id があれば書かない）"""
+    return {
+        "Put": {
+            "TableName": table_name,
+            "Item": {k: _serializer.serialize(v) for k, v in rest_item.items()},
+            "ConditionExpression": "attribute_not_exists(entry_id)",
+        }
+    }
+
+
+def _rest_event_rollback_tx_item(table_name, rest_item):
+    """_rest_event_tx_item の補償"""
+    return {
+        "Delete": {
+            "TableName": table_name,
+            "Key": {"entry_id": {"S": str(rest_item["entry_id"])}},
+        }
+    }
+
+
 def update_players_to_playing(matches, match_id, match_table):
-    """選ばれた人を 'playing' に更新する（このタイミングで match_id を新規に付与）"""
+    """
+    選ばれた人を 'playing' に更新する（このタイミングで match_id を新規に付与）
+
+    1人ずつ update_item していたのを transact_write_items（25件ずつ）にまとめる。
+    途中のチャンクが失敗したら、成功済みのチャンクを元のステータスに巻き戻す。
+    """
     current_app.logger.info(f" [START] update_players_to_playing - match_id: {match_id}")
 
     # 例: 2025-09-02T14:25:00+09:00
     now_iso = datetime.now(JST).isoformat()
+    table_name = match_table.name
+
+    tx_items, rollback_items = [], []
 
     for match_idx, match in enumerate(matches):
-        try:
-            current_app.logger.info(f"処理中の match[{match_idx}]: {match}")
+        if not isinstance(match, dict):
+            current_app.logger.error(f"❌ match[{match_idx}] は dict ではありません: {type(match)}")
+            continue
 
-            if not isinstance(match, dict):
-                current_app.logger.error(f"❌ match[{match_idx}] は dict ではありません: {type(match)}")
-                continue
+        courts_data = match.get("courts", match)
+        if not isinstance(courts_data, dict):
+            current_app.logger.error(f"❌ courts_data が dict ではありません: {type(courts_data)}")
+            continue
 
-            courts_data = match.get("courts", match)
-            if not isinstance(courts_data, dict):
-                current_app.logger.error(f"❌ courts_data が dict ではありません: {type(courts_data)}")
+        for court_key, court_data in courts_data.items():
+            if not isinstance(court_data, dict):
+                current_app.logger.error(f"court_data[{court_key}] が dict ではありません: {type(court_data)}")
                 continue
 
-            current_app.logger.info(f"使用する courts_data: {list(courts_data.keys())}")
+            # court_number は数値に正規化（"court_1" 形式のキーは court_data 側の番号を使う）
+            try:
+                court_number = int(str(court_data.get("court_number", court_key)).strip())
+            except (ValueError, TypeError):
+                current_app.logger.error(f"❌ 無効な court_number: {court_key}")
+                continue
 
-            for court_key, court_data in courts_data.items():
-                if not isinstance(court_data, dict):
-                    current_app.logger.error(f"court_data[{court_key}] が dict ではありません: {type(court_data)}")
+            for team_key in ["team_a", "team_b"]:
+                players = court_data.get(team_key, [])
+                if not isinstance(players, list):
+                    current_app.logger.error(f"❌ players[{court_key}][{team_key}] が list ではありません: {type(players)}")
                     continue
 
-                # court_number は数値に正規化
-                try:
-                    court_number = int(str(court_key).strip())
-                except (ValueError, TypeError):
-                    current_app.logger.error(f"❌ 無効な court_number: {court_key}")
-                    continue
+                # "team_a"/"team_b" -> "A"/"B" に正規化（保存は 'A' / 'B'）
+                team_letter = "A" if team_key == "team_a" else "B"
 
-                for team_key in ["team_a", "team_b"]:
-                    players = court_data.get(team_key, [])
-                    if not isinstance(players, list):
-                        current_app.logger.error(f"❌ players[{court_key}][{team_key}] が list ではありません: {type(players)}")
+                for player in players:
+                    if not isinstance(player, dict) or "entry_id" not in player:
+                        current_app.logger.error(f"無効なプレイヤーデータ: {player}")
                         continue
 
-                    # "team_a"/"team_b" -> "A"/"B" に正規化（保存は 'A' / 'B'）
-                    team_letter = "A" if team_key == "team_a" else "B"
-
-                    current_app.logger.info(f" court={court_number}, team={team_letter}, players={len(players)}人")
-
-                    for player in players:
-                        if not isinstance(player, dict) or "entry_id" not in player:
-                            current_app.logger.error(f"無効なプレイヤーデータ: {player}")
-                            continue
-
-                        entry_id = player["entry_id"]
-                        display_name = player.get("display_name", "Unknown")
-                        user_id = player.get("user_id", "N/A")
-
-                        current_app.logger.info(f"↪DynamoDB更新開始: {display_name} (entry_id={entry_id})")
-
-                        # 🔒 冪等化: pending/resting の人だけ playing に昇格（playing 連打防止）
-                        # ついでに 'court' フィールドは今後使わない前提で削除（古い互換を掃除）
-                        result = match_table.update_item(
-                            Key={"entry_id": entry_id},
-                            UpdateExpression=(
-                                "SET entry_status = :playing, "
-                                "    match_id     = :mid, "
-                                "    court_number = :court, "
-                                "    team         = :team, "
-                                "    team_side    = :team, "        # 互換のため重複持ち
-                                "    updated_at   = :now, "
-                                "    match_count  = if_not_exists(match_count, :zero) + :one "
-                                "REMOVE court"                      # 旧 'court' を掃除（残すならこの行は外す）
-                            ),
-                            ConditionExpression=(
-                                "attribute_exists(entry_id) AND "
-                                "(attribute_not_exists(entry_status) OR entry_status IN (:pend, :rest))"
-                            ),
-                            ExpressionAttributeValues={
-                                ":playing": "playing",
-                                ":mid": {"S": str(match_id)},
-                                ":court": court_number,
-                                ":team": team_letter,
-                                ":now": now_iso,
-                                ":zero": 0,
-                                ":one": 1,
-                                ":pend": "pending",
-                                ":rest": "resting",
-                            },
-                            ReturnValues="UPDATED_NEW",
-                        )
-
-                        updated_attrs = result.get("Attributes", {})
-                        current_app.logger.info(
-                            f"更新完了: {display_name} (user_id={user_id}, entry_id={entry_id}) "
-                            f"→ court_number={court_number}, team={team_letter}, 更新後: {updated_attrs}"
-                        )
-        except Exception as e:
-            current_app.logger.error(f"例外発生（match[{match_idx}]）: {e}")
-            import traceback
-            current_app.logger.error(traceback.format_exc())
-            continue
+                    entry_id = player["entry_id"]
+                    tx_items.append(_playing_tx_item(
+                        table_name, entry_id, match_id, court_number, team_letter, now_iso
+                    ))
+                    rollback_items.append(_playing_rollback_tx_item(
+                        table_name, entry_id, match_id, player.get("entry_status"), now_iso
+                    ))
+
+    if not tx_items:
+        current_app.logger.warning("[update_players_to_playing] 更新対象なし - match_id: %s", match_id)
+        return {"ok": True, "chunks": [], "rolled_back": 0, "rollback_skipped": 0, "rollback_failed": 0}
+
+    report = transact_write_in_chunks(match_table.meta.client, tx_items, rollback_items)
 
-    current_app.logger.info(f"[END] update_players_to_playing - match_id: {match_id}")
+    current_app.logger.info(
+        "[END] update_players_to_playing - match_id: %s ok=%s players=%d chunks=%s rolled_back=%d",
+        match_id, report["ok"], len(tx_items),
+        [(c["index"], c["size"], c["ok"]) for c in report["chunks"]], report["rolled_back"],
+    )
+    return report
 
 
 def simplify_player(player):
@@ -1283,6 +1600,11 @@ def perform_pairing(entries, match_id, max_courts=6):
     court_number = 1
     
     match_table = current_app.dynamodb.Table("bad-game-match_entries")
+    table_name = match_table.name
+    now_iso = datetime.now(JST).isoformat()
+
+    # 書き込みはまとめて最後に transact_write_items（25件ずつ）で行う
+    tx_items, rollback_items = [], []
     
     current_app.logger.info(f"ペアリング開始: 総エントリー数={len(entries)}, 最大コート数={max_courts}")
     current_app.logger.info(f"使用する試合ID: {match_id}")
@@ -1306,38 +1628,15 @@ def perform_pairing(entries, match_id, max_courts=6):
             
             current_app.logger.info(f"コート{court_number}で試合作成")
             
-            # プレイヤーのエントリーステータスを更新
-            for p in teamA:
-                try:
-                    match_table.update_item(
-                        Key={'entry_id': p['entry_id']},
-                        UpdateExpression="SET #status = :playing, entry_status = :playing, match_id = :mid, court_number = :court, team_side = :team",
-                        ExpressionAttributeNames={"#status": "entry_status"},
-                        ExpressionAttributeValues={
-                            ":playing": "playing",
-                            ":mid": {"S": str(match_id)},
-                            ":court": court_number,
-                            ":team": "A"
-                        }
-                    )
-                except Exception as e:
-                    current_app.logger.error(f"⚠️ プレイヤー更新エラー (チームA): {p.get('display_name')} - {str(e)}")
-            
-            for p in teamB:
-                try:
-                    match_table.update_item(
-                        Key={'entry_id': p['entry_id']},
-                        UpdateExpression="SET #status = :playing, entry_status = :playing, match_id = :mid, court_number = :court, team_side = :team",
-                        ExpressionAttributeNames={"#status": "entry_status"},
-                        ExpressionAttributeValues={
-                            ":playing": "playing",
-                            ":mid": {"S": str(match_id)},
-                            ":court": court_number,
-                            ":team": "B"
-                        }
-                    )
-                except Exception as e:
-                    current_app.logger.error(f"⚠️ プレイヤー更新エラー (チームB): {p.get('display_name')} - {str(e)}")
+            # プレイヤーのエントリーステータス更新を積む
+            for team, members in (("A", teamA), ("B", teamB)):
+                for p in members:
+                    tx_items.append(_playing_tx_item(
+                        table_name, p['entry_id'], match_id, court_number, team, now_iso, count_match=False
+                    ))
+                    rollback_items.append(_playing_rollback_tx_item(
+                        table_name, p['entry_id'], match_id, p.get('entry_status'), now_iso, count_match=False
+                    ))
             
             # プレイヤー情報を簡素化して保存用辞書に変換
             simplified_teamA = [simplify_player(p) for p in teamA]
@@ -1360,46 +1659,53 @@ def perform_pairing(entries, match_id, max_courts=6):
     current_app.logger.info(f"ペアリング結果: {len(matches)}コート使用, {len(rest)}人休憩")
     
     for p in rest:
-        try:
-            match_table.update_item(
-                Key={'entry_id': p['entry_id']},
-                UpdateExpression="SET entry_status = :resting",
-                ExpressionAttributeValues={
-                    ":resting": "resting"
-                }
-            )
-        except Exception as e:
-            current_app.logger.error(f"⚠️ 休憩者更新エラー: {p.get('display_name')} - {str(e)}")
+        tx_items.append(_status_tx_item(table_name, p['entry_id'], "resting", now_iso))
+        rollback_items.append(_status_tx_item(table_name, p['entry_id'], p.get('entry_status') or "pending", now_iso))
+
+    report = transact_write_in_chunks(match_table.meta.client, tx_items, rollback_items)
+    if not report["ok"]:
+        current_app.logger.error(
+            "⚠️ ペアリング書き込み失敗（巻き戻し %d件）: %s",
+            report["rolled_back"], [c for c in report["chunks"] if not c["ok"]]
+        )
+        return [], list(entries)
+
+    return matches, rest
 
 
 def persist_skill_to_bad_users(updated_skills: dict):
-    users_table = current_app.dynamodb.Table("bad-users")
-    ok, ng = 0, 0
+    """bad-users の skill_score / skill_sigma を25件ずつのトランザクションでまとめて更新する"""
+    tx_items = []
 
     for uid, vals in (updated_skills or {}).items():
-        current_app.logger.debug("[bad-users] Persist uid=%s", str(uid))
         try:
             new_s = Decimal(str(round(float(vals.get("skill_score", 25.0)), 2)))
             new_g = Decimal(str(round(float(vals.get("skill_sigma", 8.333)), 4)))
+        except Exception as e:
+            current_app.logger.error("[bad-users] Unexpected error uid=%s err=%s", str(uid), str(e))
+            continue
 
-            users_table.update_item(
-                Key={"user#user_id": uid},
-                UpdateExpression="SET skill_score=:s, skill_sigma=:g",
-                ExpressionAttributeValues={":s": new_s, ":g": new_g},
-                ReturnValues="NONE",
-            )
+        current_app.logger.debug(
+            "[bad-users] Persist uid=%s (score: %s, sigma: %s)", str(uid), str(new_s), str(new_g)
+        )
+        tx_items.append({
+            "Update": {
+                "TableName": "bad-users",
+                "Key": {"user#user_id": {"S": str(uid)}},
+                "UpdateExpression": "SET skill_score=:s, skill_sigma=:g",
+                "ExpressionAttributeValues": {":s": {"N": str(new_s)}, ":g": {"N": str(new_g)}},
+            }
+        })
 
-            current_app.logger.debug(
-                "[bad-users] Updated uid=%s (score: %s, sigma: %s)",
-                str(uid), str(new_s), str(new_g)
-            )
-            ok += 1
+    ok, ng, round_trips = transact_update_or_fallback(
+        current_app.dynamodb.meta.client, tx_items, label="bad-users"
+    )
+    ng += len(updated_skills or {}) - len(tx_items)
 
-        except Exception as e:
-            ng += 1
-            current_app.logger.error("[bad-users] Unexpected error uid=%s err=%s", str(uid), str(e))
+    # 表示用のユーザーキャッシュから更新分を落とす
+    user_directory.invalidate(*(updated_skills or {}).keys())
 
-    current_app.logger.info("[bad-users] Persist finished. ok=%d ng=%d", ok, ng)
+    current_app.logger.info("[bad-users] Persist finished. ok=%d ng=%d round_trips=%d", ok, ng, round_trips)
     return ok, ng
 
     
@@ -1471,19 +1777,7 @@ def finish_current_match():
         # =========================================================
         results_table = current_app.dynamodb.Table("bad-game-results")
 
-        def scan_all_results_for_match(mid: str):
-            items = []
-            kwargs = {"FilterExpression": Attr("match_id").eq(mid)}
-            while True:
-                resp = results_table.scan(**kwargs)
-                items.extend(resp.get("Items", []))
-                lek = resp.get("LastEvaluatedKey")
-                if not lek:
-                    break
-                kwargs["ExclusiveStartKey"] = lek
-            return items
-
-        match_results = scan_all_results_for_match(match_id)
+        match_results = get_results_for_match(match_id, fresh=True)
         submitted_results_count = len(match_results)
 
         # court_count が取れるなら厳密にチェック（推奨）
@@ -1516,22 +1810,12 @@ def finish_current_match():
         match_table = current_app.dynamodb.Table("bad-game-match_entries")
 
         def scan_all_playing(mid: str):
-            items = []
-            kwargs = {
-                "FilterExpression": (
-                    Attr("match_id").eq(mid) &
-                    Attr("entry_status").eq("playing") &
-                    ~Attr("entry_id").contains("meta")
-                ),
-                "ConsistentRead": True,
-            }
-            while True:
-                resp = match_table.scan(**kwargs)
-                items.extend(resp.get("Items", []))
-                lek = resp.get("LastEvaluatedKey")
-                if not lek:
-                    break
-                kwargs["ExclusiveStartKey"] = lek
+            items = query_entries_by_status(
+                match_table, "playing",
+                match_id=mid,
+                filter_expression=~Attr("entry_id").contains("meta"),
+                ConsistentRead=True,
+            )
             return items
 
         playing_players = scan_all_playing(match_id)
@@ -1549,83 +1833,57 @@ def finish_current_match():
         }
 
         # =========================================================
-        # 3) TrueSkill 更新
+        # 3) TrueSkill 更新（全コートまとめて1回で計算）
+        #    - 現在のスキルは playing エントリーから1回だけ作る
+        #    - 足りない人だけ rate_match_results 内で1回の BatchGet
         # =========================================================
-        updated_skills = {}
-        skill_update_count = 0
+        skill_map = {
+            str(p["user_id"]): {
+                "skill_score": p.get("skill_score"),
+                "skill_sigma": p.get("skill_sigma"),
+            }
+            for p in playing_players
+            if "user_id" in p and p.get("skill_score") is not None and p.get("skill_sigma") is not None
+        }
 
+        result_items = []
         for result in match_results:
-            try:
-                
-                # 取得した結果(result)から直接スコアを取り出す
-                t1_score = result.get("team1_score")
-                t2_score = result.get("team2_score")
-                winner = result.get("winner", "A")
-
-                team_a = parse_players(result.get("team_a", []))
-                team_b = parse_players(result.get("team_b", []))
-
-                current_app.logger.debug(
-                    "[finish-debug] court=%s raw_team_a=%s raw_team_b=%s | parsed_len A=%d B=%d",
-                    result.get("court_number"),
-                    type(result.get("team_a")).__name__,
-                    type(result.get("team_b")).__name__,
-                    len(team_a), len(team_b),
-                )
+            # 取得した結果(result)から直接スコアを取り出す
+            t1_score = result.get("team1_score")
+            t2_score = result.get("team2_score")
+            winner = result.get("winner", "A")
 
-                skill_map = {
-                    str(p["user_id"]): {
-                        "skill_score": float(p.get("skill_score", 25.0)),
-                        "skill_sigma": float(p.get("skill_sigma", 8.333)),
-                    }
-                    for p in playing_players if "user_id" in p
-                }                
-
-                for pl in team_a + team_b:
-                    uid = str(pl.get("user_id"))
-                    if uid in skill_map:
-                        pl["skill_score"] = skill_map[uid]["skill_score"]
-                        pl["skill_sigma"] = skill_map[uid]["skill_sigma"]
-
-                # entry_id 補完
-                for pl in team_a + team_b:
-                    uid = pl.get("user_id")
-                    if uid in player_mapping:
-                        pl["entry_id"] = player_mapping[uid]
-
-                current_app.logger.debug(
-                    "[finish-skill-inject] court=%s | A0_uid=%s A0_mu=%s A0_sig=%s | B0_uid=%s B0_mu=%s B0_sig=%s",
-                    result.get("court_number"),
-                    (team_a[0].get("user_id") if team_a else None),
-                    (team_a[0].get("skill_score") if team_a else None),
-                    (team_a[0].get("skill_sigma") if team_a else None),
-                    (team_b[0].get("user_id") if team_b else None),
-                    (team_b[0].get("skill_score") if team_b else None),
-                    (team_b[0].get("skill_sigma") if team_b else None),
-                )
+            team_a = parse_players(result.get("team_a", []))
+            team_b = parse_players(result.get("team_b", []))
 
-                # ★ 修正ポイント: スコアを明示的に result_item に含める
-                result_item = {
-                    "team_a": team_a,
-                    "team_b": team_b,
-                    "winner": winner,
-                    "match_id": match_id,
-                    "court_number": result.get("court_number"),
-                    "team1_score": t1_score,  # 追加
-                    "team2_score": t2_score   # 追加
-                }
+            current_app.logger.debug(
+                "[finish-debug] court=%s raw_team_a=%s raw_team_b=%s | parsed_len A=%d B=%d",
+                result.get("court_number"),
+                type(result.get("team_a")).__name__,
+                type(result.get("team_b")).__name__,
+                len(team_a), len(team_b),
+            )
 
-                current_app.logger.info("コート%s: %sチーム勝利 (スコア: %s-%s)", 
-                                        result.get("court_number"), winner, t1_score, t2_score)
+            # entry_id 補完
+            for pl in team_a + team_b:
+                uid = pl.get("user_id")
+                if uid in player_mapping:
+                    pl["entry_id"] = player_mapping[uid]
 
-                # これで関数内の .get("team1_score") が正しく値を拾えるようになります
-                updated_user_skills = update_trueskill_for_players_and_return_updates(result_item)
-                updated_skills.update(updated_user_skills)
+            result_items.append({
+                "team_a": team_a,
+                "team_b": team_b,
+                "winner": winner,
+                "match_id": match_id,
+                "court_number": result.get("court_number"),
+                "team1_score": t1_score,
+                "team2_score": t2_score,
+            })
 
-                skill_update_count += 1
+            current_app.logger.info("コート%s: %sチーム勝利 (スコア: %s-%s)",
+                                    result.get("court_number"), winner, t1_score, t2_score)
 
-            except Exception as e:
-                current_app.logger.error("スキル更新エラー (court=%s): %s", result.get("court_number"), e)
+        updated_skills, skill_update_count = rate_match_results(result_items, known=skill_map)
 
         current_app.logger.info("スキル更新完了: %d/%dコート", skill_update_count, len(match_results))
 
@@ -1778,9 +2036,21 @@ def finish_current_match():
                 match_id, len(match_results), pairing_mode
             )
 
+            invalidate_match_results(match_id)
+            put_player_results([
+                dict(r, pairing_mode=pairing_mode, skill_snapshot=skill_snapshot)
+                for r in match_results
+            ])
+
         except Exception as e:
             current_app.logger.warning("[results] 補足情報追記失敗（無視）: %s", e)
 
+        # 今日のペア・対戦回数に足す（次のペアリングの繰り返しペナルティ）
+        try:
+            record_match_results(match_id, match_results)
+        except Exception as e:
+            current_app.logger.warning("[pair_history] 更新失敗（無視）: %s", e)
+
         # =========================================================
         # Ajax / 通常レスポンス  ← ステップ6の後に移動
         # =========================================================
@@ -1834,15 +2104,7 @@ def start_next_match():
         current_match_id = meta.get("current_match_id")
 
         # 2. playing中のエントリーをpendingに戻す
-        playing_entries = []
-        kwargs = {"FilterExpression": Attr("entry_status").eq("playing")}
-        while True:
-            resp = entry_table.scan(**kwargs)
-            playing_entries.extend(resp.get("Items", []))
-            lek = resp.get("LastEvaluatedKey")
-            if not lek:
-                break
-            kwargs["ExclusiveStartKey"] = lek
+        playing_entries = query_entries_by_status(entry_table, "playing")
 
         reset_count = 0
         for entry in playing_entries:
@@ -1862,13 +2124,13 @@ def start_next_match():
         # 3. 現在の試合結果を削除
         deleted_results = 0
         if current_match_id:
-            resp = results_table.scan(FilterExpression=Attr("match_id").eq(current_match_id))
-            for item in resp.get("Items", []):
+            for item in get_results_for_match(current_match_id, fresh=True):
                 try:
                     results_table.delete_item(Key={"result_id": item["result_id"]})
                     deleted_results += 1
                 except Exception:
                     pass
+            invalidate_match_results(current_match_id)
 
         # 4. meta#currentをidleにリセット
         meta_table.update_item(
@@ -1905,10 +2167,11 @@ def show_pairings():
         match_id = get_latest_match_id()
 
         match_table = current_app.dynamodb.Table("bad-game-match_entries")
-        response = match_table.scan(
-            FilterExpression=Attr("match_id").eq(match_id) & Attr("type").ne("meta")
+        # 今日の練習日パーティションだけを読む
+        items = query_session_entries(
+            match_table,
+            filter_expression=Attr("match_id").eq(match_id) & Attr("type").ne("meta"),
         )
-        items = response.get("Items", [])
 
         court_dict = {}
         for item in items:
@@ -2079,11 +2342,7 @@ def rest_request():
     try:
         user_id = current_user.get_id()
         match_table = current_app.dynamodb.Table("bad-game-match_entries")
-        resp = match_table.scan(
-            FilterExpression=Attr('user_id').eq(user_id) & Attr('entry_status').eq('playing'),
-            ConsistentRead=True,
-        )
-        items = resp.get('Items', [])
+        items = query_entries_by_status(match_table, 'playing', user_id=user_id, ConsistentRead=True)
         if not items:
             flash('試合中のエントリーが見つかりません', 'warning')
             return redirect(url_for('game.court'))
@@ -2110,11 +2369,7 @@ def rest_request_cancel():
     try:
         user_id = current_user.get_id()
         match_table = current_app.dynamodb.Table("bad-game-match_entries")
-        resp = match_table.scan(
-            FilterExpression=Attr('user_id').eq(user_id) & Attr('entry_status').eq('playing'),
-            ConsistentRead=True,
-        )
-        items = resp.get('Items', [])
+        items = query_entries_by_status(match_table, 'playing', user_id=user_id, ConsistentRead=True)
         if not items:
             flash('試合中のエントリーが見つかりません', 'warning')
             return redirect(url_for('game.court'))
@@ -2163,11 +2418,8 @@ def leave_court():
     try:
         user_id = current_user.get_id()
 
-        # ユーザーの全エントリーを取得
-        res = match_table.scan(
-            FilterExpression=Attr('user_id').eq(user_id)
-        )
-        items = res.get('Items', [])
+        # ユーザーの全エントリーを取得（user_id GSI）
+        items = query_entries_by_user(match_table, user_id, ConsistentRead=True)
 
         current_app.logger.info("[leave_court] user_id=%s entries=%s", user_id, items)
 
@@ -2198,10 +2450,7 @@ def leave_court():
 def get_user_current_entry(user_id):
     """ユーザーの現在のエントリー（参加中 or 休憩中）を取得"""
     try:
-        response = match_table.scan(
-            FilterExpression=Attr('user_id').eq(user_id) & Attr('entry_status').is_in(['pending', 'resting'])
-        )
-        items = response.get('Items', [])
+        items = [it for it in query_entries_by_user(match_table, user_id, ['pending', 'resting']) if in_session(it)]
         if items:
             return max(items, key=lambda x: x.get('joined_at', ''))
         return None
@@ -2209,30 +2458,37 @@ def get_user_current_entry(user_id):
         current_app.logger.error(f'ユーザーエントリ取得エラー: {e}')
         return None
 
+@bp_game.route("/api/court_feed")
+@login_required
+def court_feed():
+    """
+    コート状態の変更フィード（バージョンカーソル）
+    - since: 前回受け取った version。変わっていれば changed=true（端末はそのときだけ waiting_status 等を取る）
+    - wait : 変わるまで保留する秒数（COURT_FEED_MAX_WAIT が 0 の既定構成ではすぐ返す）
+    - version は entry / toggle_player_status / submit_score / create_pairings / finish_current_match など
+      書き込み系リクエストのたびに進む（_invalidate_court_state_after_write）
+    """
+    since = request.args.get("since") or None
+    try:
+        wait = float(request.args.get("wait", 0))
+    except ValueError:
+        wait = 0.0
+    resp = jsonify(wait_for_change(since, wait))
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
 @bp_game.route("/api/waiting_status")
 @login_required
 def waiting_status():
-    pending_players = get_players_status("pending")
-    resting_players = get_players_status("resting")
-
-    latest_match_id = get_latest_match_id()
+    # タブレットが20秒ごとにポーリングする。スナップショットから導出するので通常は読み取り0回
+    state = get_court_state()
+    pending_players = state.pending
+    resting_players = state.resting
+    latest_match_id = state.match_id
+    in_progress = state.in_progress
     current_app.logger.debug(f"最新の試合ID: {latest_match_id}")
 
-    in_progress = False
-
-    if latest_match_id:
-        match_table = current_app.dynamodb.Table("bad-game-match_entries")
-        try:
-            # latest_match_id の playing が1件でもあれば試合中
-            resp = match_table.scan(
-                FilterExpression=Attr("match_id").eq(latest_match_id) & Attr("entry_status").eq("playing"),
-                ProjectionExpression="entry_id",
-            )
-            in_progress = len(resp.get("Items", [])) > 0
-
-        except Exception as e:
-            current_app.logger.error(f"試合中判定の取得に失敗: {e}")
-
     return jsonify({
         "pending_count": len(pending_players),
         "resting_count": len(resting_players),
@@ -2249,23 +2505,10 @@ def waiting_status():
 @bp_game.route('/api/match_score_status/<match_id>')
 @login_required
 def match_score_status(match_id):
-    results_table = current_app.dynamodb.Table("bad-game-results")
-
     try:
         court_count = 3  # 固定でOK（将来は match_meta から取得でも可）
 
-        items = []
-        resp = results_table.scan(
-            FilterExpression=Attr("match_id").eq(match_id)
-        )
-        items.extend(resp.get("Items", []))
-
-        while "LastEvaluatedKey" in resp:
-            resp = results_table.scan(
-                FilterExpression=Attr("match_id").eq(match_id),
-                ExclusiveStartKey=resp["LastEvaluatedKey"]
-            )
-            items.extend(resp.get("Items", []))
+        items = get_results_for_match(match_id)
 
         # court_number -> item（同一コートが複数あったら、created_at が新しい方を採用）
         by_court = {}
@@ -2304,13 +2547,15 @@ def match_score_status(match_id):
 @bp_game.route("/score_input", methods=["GET", "POST"])
 @login_required
 def score_input():
+    state = get_court_state()
+
     # 1. 進行中の試合がないなら入れない
-    if not has_ongoing_matches():
+    if not state.has_ongoing:
         flash("進行中の試合がないため、スコア入力はできません。", "warning")
         return redirect(url_for("game.court"))
 
     # 2. 最新の match_id を取得
-    match_id = get_latest_match_id()
+    match_id = state.match_id
     current_app.logger.info(f"[score_input] match_id = {match_id}")
 
     if not match_id:
@@ -2318,7 +2563,7 @@ def score_input():
         return redirect(url_for("game.court"))
 
     # 3. コート情報取得
-    match_courts = get_organized_match_data(match_id)
+    match_courts = state.match_courts()
 
     if not match_courts:
         flash("スコア入力対象の試合データが見つかりませんでした。", "warning")
@@ -2337,7 +2582,8 @@ def score_input():
     return render_template(
         "game/score_input.html",
         match_courts=match_courts,
-        match_id=match_id
+        match_id=match_id,
+        court_version=state.version,
     )
 
 
@@ -2368,13 +2614,13 @@ def submit_score(match_id, court_number):
         winner = "A" if team1_score > team2_score else "B"
         court_number_int = int(court_number)
 
-        # ---- 2. エントリー取得 (Scan) ----
+        # ---- 2. エントリー取得（今日の練習日パーティション） ----
         match_table = current_app.dynamodb.Table("bad-game-match_entries")
-        
-        resp = match_table.scan(
-            FilterExpression=Attr("match_id").eq(str(match_id)) & Attr("court_number").eq(court_number_int)
+
+        entries = query_session_entries(
+            match_table,
+            filter_expression=Attr("match_id").eq(str(match_id)) & Attr("court_number").eq(court_number_int),
         )
-        entries = resp.get("Items", [])
 
         if not entries:
             current_app.logger.error("❌ エントリー不在: match=%s, court=%d", match_id, court_number_int)
@@ -2420,29 +2666,12 @@ def submit_score(match_id, court_number):
             current_app.logger.error("❌ チーム不完全: match=%s, court=%d", match_id, court_number_int)
             return "コートのチームデータが不完全です", 404
 
-        # ★ 重複チェック
-
+        # ---- 4. 結果保存 ----
+        # ★ 重複チェック: result_id を match_id#court_number に固定し、条件付き put で1コート1件にする
+        #   （match_id-index は結果整合なので、読んでから書くと同時送信を取りこぼす）
         result_table = current_app.dynamodb.Table("bad-game-results")
-
-        existing = _scan_all(  # またはresult_table.scan(...)
-            result_table,
-            FilterExpression=(
-                Attr("match_id").eq(str(match_id)) &
-                Attr("court_number").eq(court_number_int)
-            ),
-            ProjectionExpression="result_id",
-            ConsistentRead=True,
-        )
-        if existing:
-            current_app.logger.warning(
-                "[submit_score] 重複送信ブロック: match=%s, court=%d",
-                match_id, court_number_int
-            )
-            return "", 200  # 冪等に200を返す（クライアントは正常扱い）
-
-        # ---- 4. 結果保存 ----        
         result_item = {
-            "result_id": str(uuid.uuid4()),
+            "result_id": f"{match_id}#{court_number_int}",
             "match_id": str(match_id),
             "court_number": court_number_int,
             "team1_score": team1_score,
@@ -2451,10 +2680,25 @@ def submit_score(match_id, court_number):
             "team_a": team_a,
             "team_b": team_b,
             "created_at": datetime.now(JST).isoformat(),
+            "session_date": session_date_jst(),  # session_date-index（その日の結果を Query で読む）
         }
 
-        res = result_table.put_item(Item=result_item)
+        try:
+            res = result_table.put_item(
+                Item=result_item,
+                ConditionExpression="attribute_not_exists(result_id)",
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            current_app.logger.warning(
+                "[submit_score] 重複送信ブロック: match=%s, court=%d",
+                match_id, court_number_int
+            )
+            return "", 200  # 冪等に200を返す（クライアントは正常扱い）
         current_app.logger.info(f"[DEBUG] 保存完了レスポンス: {res.get('ResponseMetadata', {}).get('HTTPStatusCode')}")
+        invalidate_match_results(match_id)
+        put_player_results([result_item])
         
         # 成功時はこの1行のみ
         current_app.logger.info("Score: Match=%s, Court=%d, %d-%d (Win:%s)", 
@@ -2479,31 +2723,16 @@ def submission_status():
 
     current_app.logger.info(f"[submission_status] GSIを利用した照会開始: match_id={match_id}")
 
-    if not has_ongoing_matches():
+    state = get_court_state()
+    if not state.has_ongoing:
         return jsonify({"match_id": match_id, "submitted_count": 0, "match_active": False})
 
-    current_match_id = get_latest_match_id()
+    current_match_id = state.match_id
     if current_match_id != match_id:
         return jsonify({"match_id": match_id, "submitted_count": 0, "match_active": False})
 
-    result_table = current_app.dynamodb.Table("bad-game-results")
-    
-    # ★ 修正ポイント: scan をやめて query を使用
-    try:
-        # 作成したGSI（match_id-index）を指定してクエリを実行
-        resp = result_table.query(
-            IndexName="match_id-index",
-            KeyConditionExpression=Key("match_id").eq(str(match_id))
-        )
-        items = resp.get("Items", [])
-    except Exception as e:
-        # インデックス作成直後などでエラーが出た場合の安全策（フォールバック）
-        current_app.logger.error(f"❌ [submission_status] Query失敗、Scanに切り替えます: {str(e)}")
-        resp = result_table.scan(
-            FilterExpression=Attr("match_id").eq(str(match_id)),
-            ConsistentRead=True
-        )
-        items = resp.get("Items", [])
+    # match_id-index の Query（短時間キャッシュあり）
+    items = get_results_for_match(match_id)
 
     # デバッグログ（取得できた中身の確認）
     current_app.logger.info(f"[submission_status] 取得件数: {len(items)}件")
@@ -2519,7 +2748,7 @@ def submission_status():
         submitted_courts = []
 
     # 試合データの取得（全コート数を確認）
-    match_data = get_organized_match_data(match_id)
+    match_data = state.match_courts()
     total_courts = len(match_data)
     
     current_app.logger.info(f"[submission_status] 最終判定: {len(submitted_courts)}/{total_courts} (コート: {submitted_courts})")
@@ -2566,38 +2795,19 @@ def reset_participants():
         return redirect(url_for('index'))
 
     try:
-        # 1. match_entries テーブルの全削除
+        # 1. 今日の練習日パーティションの全削除（過去の練習日の行は TTL で消えるので読まない）
         match_table = current_app.dynamodb.Table("bad-game-match_entries")
-        deleted_count = 0
-        last_evaluated_key = None
 
         current_app.logger.info("🔄全エントリー削除開始")
-        
-        while True:
-            if last_evaluated_key:
-                response = match_table.scan(ExclusiveStartKey=last_evaluated_key)
-            else:
-                response = match_table.scan()
 
-            items = response.get('Items', [])
+        items = query_session_entries(match_table, ProjectionExpression="entry_id")
+        with match_table.batch_writer() as batch:
             for item in items:
-                try:
-                    match_table.delete_item(Key={'entry_id': item['entry_id']})
-                    deleted_count += 1
-                    current_app.logger.info(f"削除: {item.get('display_name', 'Unknown')} - {item['entry_id']}")
-                except Exception as e:
-                    current_app.logger.error(f"エントリー削除エラー: {item.get('display_name', 'Unknown')} - {str(e)}")
-
-            last_evaluated_key = response.get('LastEvaluatedKey')
-            if not last_evaluated_key:
-                break
+                batch.delete_item(Key={'entry_id': item['entry_id']})
+        deleted_count = len(items)
 
         # 2. 削除完了後の確認
-        time.sleep(0.5)  # DynamoDB の一貫性を待つ
-        
-        check_response = match_table.scan()
-        remaining_items = check_response.get('Items', [])
-        
+        remaining_items = query_session_entries(match_table, ProjectionExpression="entry_id")
         if remaining_items:
             current_app.logger.warning(f"削除後も残っているエントリー: {len(remaining_items)}件")
         else:
@@ -2725,89 +2935,18 @@ def get_organized_match_data(match_id):
     """指定試合の 'playing' エントリーだけをコート別に整形して返す"""
     match_table = current_app.dynamodb.Table("bad-game-match_entries")
 
-    players = _scan_all(
+    players = query_entries_by_status(
         match_table,
+        "playing",
+        match_id=match_id,
         ProjectionExpression=(
             "user_id, display_name, skill_score, entry_status, "
             "court_number, team_side, team, team_name"
         ),
-        FilterExpression=Attr("match_id").eq(match_id) & Attr("entry_status").eq("playing"),
         ConsistentRead=True,
     )
 
-    if not players:
-        return {}
-
-    # ヘルパー関数群
-    def norm_team(item):
-        v = item.get("team_side") or item.get("team") or item.get("team_name")
-        if v is None: return None
-        s = str(v).strip().upper()
-        if s in ("A", "TEAM_A", "LEFT"): return "A"
-        if s in ("B", "TEAM_B", "RIGHT"): return "B"
-        return None
-
-    def to_int_court(v):
-        try: return int(str(v))
-        except: return 999
-
-    # 並びを安定させる
-    players.sort(key=lambda x: (to_int_court(x.get("court_number")), (norm_team(x) or "Z")))
-
-    match_courts = {}
-    for item in players:
-        court = item.get("court_number")
-        team = norm_team(item)
-
-        # 【削除】1人ずつの詳細ログ [item] は削除しました
-
-        if court is None or team not in ("A", "B"):
-            continue
-
-        court_num = to_int_court(court)
-        court_data = match_courts.setdefault(
-            court_num,
-            {"court_number": court_num, "team_a": [], "team_b": []}
-        )
-        (court_data["team_a"] if team == "A" else court_data["team_b"]).append(item)
-
-    # --- 整理されたサマリーログ ---
-    # 1試合全体の状況を1行で出す
-    summary_list = []
-    for c_num, data in sorted(match_courts.items()):
-        a_names = ",".join([p.get("display_name", "") for p in data["team_a"]])
-        b_names = ",".join([p.get("display_name", "") for p in data["team_b"]])
-        summary_list.append(f"C{c_num}:[{a_names} vs {b_names}]")
-    
-    current_app.logger.debug(
-        f"試合データ取得: match_id={match_id} | 構成: {' / '.join(summary_list)}"
-    )
-
-    # --- スコア送信済みコートを判定 ---
-    try:
-        result_table = current_app.dynamodb.Table("bad-game-results")
-        score_items = _scan_all(
-            result_table,
-            FilterExpression=Attr("match_id").eq(match_id),
-            ProjectionExpression="court_number",
-            ConsistentRead=True,
-        )
-        submitted_courts = set()
-        for s in score_items:
-            try:
-                submitted_courts.add(int(str(s["court_number"])))
-            except Exception:
-                pass
-
-        for c_num, court_data in match_courts.items():
-            court_data["score_submitted"] = c_num in submitted_courts
-
-    except Exception:
-        current_app.logger.warning("[get_organized_match_data] score_submitted チェック失敗")
-        for court_data in match_courts.values():
-            court_data["score_submitted"] = False
-
-    return match_courts  # ← 既存のreturnをここに統合
+    return organize_match_courts(players, match_id)
 
 @bp_game.route("/api/skill_score")
 @login_required
@@ -2889,6 +3028,7 @@ def create_test_data():
             "skill_sigma": skill_sigma,
             "gender": gender,
             "rest_count": Decimal("0"),
+            **session_fields(),
         })
 
         # 2) bad-users（PK=user#user_id が必須）
@@ -2951,19 +3091,20 @@ def clear_test_data():
                 for item in targets[i:i+25]:
                     bw.delete_item(Key={'result_id': item['result_id']})
         total_deleted += len(targets)
+        invalidate_match_results()
         current_app.logger.info(f"[clear_test_data] bad-game-results 削除: {len(targets)}件")
     except Exception as e:
         current_app.logger.error(f"[clear_test_data] results削除失敗: {e}")
 
     # 2. bad-game-match_entries: display_name でキーワード判定
     try:
+        # 今日の練習日パーティションだけを読む（過去の日のテストデータは TTL で消える）
         match_table = current_app.dynamodb.Table("bad-game-match_entries")
-        all_entries = scan_all(match_table)
+        all_entries = query_session_entries(match_table)
         targets = [item for item in all_entries if has_test_keyword(item.get('display_name', ''))]
-        for i in range(0, len(targets), 25):
-            with match_table.batch_writer() as bw:
-                for item in targets[i:i+25]:
-                    bw.delete_item(Key={'entry_id': item['entry_id']})
+        with match_table.batch_writer() as bw:
+            for item in targets:
+                bw.delete_item(Key={'entry_id': item['entry_id']})
         total_deleted += len(targets)
         current_app.logger.info(f"[clear_test_data] bad-game-match_entries 削除: {len(targets)}件")
     except Exception as e:
@@ -3082,11 +3223,7 @@ def has_ongoing_matches():
         match_table = current_app.dynamodb.Table("bad-game-match_entries")
         
         # entry_statusが"playing"のエントリーがあるかチェック
-        response = match_table.scan(
-            FilterExpression=Attr("entry_status").eq("playing")
-        )
-        
-        ongoing_count = len(response.get("Items", []))
+        ongoing_count = len(query_entries_by_status(match_table, "playing", ProjectionExpression="entry_id"))
         current_app.logger.debug("has_ongoing_matches: playing_count=%d", ongoing_count)
         
         return ongoing_count > 0
@@ -3101,11 +3238,7 @@ def get_match_progress():
         match_table = current_app.dynamodb.Table("bad-game-match_entries")
         
         # 現在の試合セッションのプレイヤーを取得
-        response = match_table.scan(
-            FilterExpression=Attr("entry_status").is_in(["playing", "finished"])
-        )
-        
-        items = response.get("Items", [])
+        items = query_entries_by_status(match_table, ["playing", "finished"])
         
         # 最新のmatch_idを取得して、そのセッションのみを対象にする
         if not items:
@@ -3150,11 +3283,7 @@ def get_current_match_status():
     try:
         match_table = current_app.dynamodb.Table("bad-game-match_entries")
         
-        response = match_table.scan(
-            FilterExpression=Attr("entry_status").eq("playing")
-        )
-        
-        playing_players = response.get("Items", [])
+        playing_players = query_entries_by_status(match_table, "playing")
         
         # コート別にグループ化
         courts = {}
@@ -3211,18 +3340,18 @@ def game_view():
     try:
         # 既存のpendingプレイヤー取得処理
         match_table = current_app.dynamodb.Table("bad-game-match_entries")
-        response = match_table.scan(FilterExpression=Attr("entry_status").eq("pending"))
         entries_by_user = {}
-        for e in response.get("Items", []):
+        for e in query_entries_by_status(match_table, "pending"):
             uid, joined_at = e["user_id"], e.get("joined_at", "")
             if uid not in entries_by_user or joined_at > entries_by_user[uid].get("joined_at", ""):
                 entries_by_user[uid] = e
         pending_players = list(entries_by_user.values())
         
         # 進行中の試合チェック
-        has_ongoing = has_ongoing_matches()
-        completed, total = get_match_progress()
-        current_courts = get_current_match_status()
+        state = get_court_state()
+        has_ongoing = state.has_ongoing
+        completed, total = state.progress()
+        current_courts = state.current_courts()
         
         return render_template('game.html',
             pending_players=pending_players,
@@ -3253,10 +3382,7 @@ def reset_ongoing_matches():
         meta_table  = current_app.dynamodb.Table("bad-game-matches")
 
         # 1) playing 全員を pending に戻す（コート・チーム情報も削除）
-        response = entry_table.scan(
-            FilterExpression=Attr("entry_status").eq("playing")
-        )
-        playing_entries = response.get("Items", [])
+        playing_entries = query_entries_by_status(entry_table, "playing")
         reset_count = 0
         for entry in playing_entries:
             try:
@@ -3369,7 +3495,6 @@ def create_pairings():
     try:
         import boto3
         import uuid
-        from botocore.exceptions import ClientError
         from boto3.dynamodb.conditions import Attr
         from datetime import datetime
         import random
@@ -3402,6 +3527,11 @@ def create_pairings():
             mode = "random"
             next_cycle_index = cycle_index + 1
 
+        # 管理者が「最適ペアリング」を明示的に選んだ場合はサイクルより優先（サイクルは進めない）
+        if request.form.get("pairing_mode") == "optimal":
+            mode = "optimal"
+            next_cycle_index = cycle_index
+
         current_app.logger.info(
             "[pairing-mode] cycle_index=%d -> mode=%s (next=%d)",
             cycle_index, mode, next_cycle_index
@@ -3410,10 +3540,8 @@ def create_pairings():
         # 1) pendingエントリー取得 & ユーザーごとに最新だけ残す
         # =========================================================
         entry_table = current_app.dynamodb.Table("bad-game-match_entries")
-        response = entry_table.scan(FilterExpression=Attr("entry_status").eq("pending"))
-
         entries_by_user = {}
-        for e in response.get("Items", []):
+        for e in query_entries_by_status(entry_table, "pending"):
             uid, joined_at = e["user_id"], e.get("joined_at", "")
             if uid not in entries_by_user or joined_at > entries_by_user[uid].get("joined_at", ""):
                 entries_by_user[uid] = e
@@ -3498,12 +3626,24 @@ def create_pairings():
                 len(forced_matches), effective_courts
             )
 
+        # 今日すでに組んだペア・対戦の繰り返しペナルティ（game/pair_history.py。まだ無ければ None）
+        repeat = repeat_penalty(players)
+
         if mode == "ai":
-            matches, additional_waiting_players = generate_ai_best_pairings(players, effective_courts, iterations=1000)
+            matches, additional_waiting_players = generate_ai_best_pairings(
+                players, effective_courts, iterations=1000, repeat=repeat)
+        elif mode == "optimal":
+            matches, additional_waiting_players, total_penalty, proven = generate_optimal_pairings(
+                players, effective_courts, repeat=repeat)
+            current_app.logger.info(
+                "[optimal-pairing] total_penalty=%.4f proven_optimal=%s", total_penalty, proven
+            )
         elif mode == "full_random":
-            pairs, matches, additional_waiting_players = generate_full_random_pairings(players, effective_courts)
+            pairs, matches, additional_waiting_players = generate_full_random_pairings(
+                players, effective_courts, repeat=repeat)
         else:  # random
-            pairs, matches, additional_waiting_players = generate_balanced_pairs_and_matches(players, effective_courts)
+            pairs, matches, additional_waiting_players = generate_balanced_pairs_and_matches(
+                players, effective_courts, repeat=repeat)
 
         # 低スキル強制コートを先頭に結合
         matches = forced_matches + list(matches)
@@ -3657,18 +3797,19 @@ def create_pairings():
                     }
                 })
 
-        try:
-            dynamodb_client.transact_write_items(TransactItems=tx_items)
-            current_app.logger.info(
-                "[meta] lock+players committed: current_match_id=%s court_count=%s",
-                match_id, len(matches)
-            )
-        except ClientError as e:
-            if e.response.get("Error", {}).get("Code") == "TransactionCanceledException":
-                current_app.logger.warning("[meta] lock tx canceled: %s", e)
+        # need_tx <= 25 なので1チャンク（metaロックと参加者更新は全件成功 or 全件失敗）
+        report = transact_write_in_chunks(dynamodb_client, tx_items)
+        if not report["ok"]:
+            error = report["chunks"][-1]["error"] or ""
+            if error.startswith("TransactionCanceledException"):
+                current_app.logger.warning("[meta] lock tx canceled: %s", error)
                 flash("進行中の試合があるためペアリングできませんでした。", "warning")
                 return redirect(url_for("game.court"))
-            raise
+            raise RuntimeError(f"meta lock tx failed: {error}")
+        current_app.logger.info(
+            "[meta] lock+players committed: current_match_id=%s court_count=%s",
+            match_id, len(matches)
+        )
 
         # =========================================================
         # ★サイクル状態を保存（成功後だけ）
@@ -3689,48 +3830,51 @@ def create_pairings():
         # ★ここ：休み「累計」更新 + 休み「イベント」追加
         #   ※ user_id は「uid未定義」にならないように必ず後で入れる
         # ==============================
+        #   1人2件（累計の Update + イベントの Put）を25件ずつの transact_write_items にまとめる。
+        #   途中で失敗したら成功済みのチャンクを巻き戻す（休み回数が一部の人だけ増えないように）
         if waiting_players:
+            rest_tx, rest_undo = [], []
             for wp in waiting_players:
                 entry_id = str(getattr(wp, "entry_id", "") or "")
                 if not entry_id:
                     continue
 
                 # (1) 既存レコードに「休み累計/最新」だけ追記
-                entry_table.update_item(
-                    Key={"entry_id": entry_id},
-                    UpdateExpression=(
-                        "SET last_rest_match_id=:mid, last_rest_at=:now, last_rest_reason=:rr, updated_at=:now "
-                        "ADD rest_count :one"
-                    ),
-                    ExpressionAttributeValues={
-                        ":mid": str(match_id),
-                        ":now": now_jst,
-                        ":rr": "not_selected",
-                        ":one": 1,
-                    },
-                )
+                rest_tx.append(_rest_count_tx_item(entry_table.name, entry_id, match_id, now_jst))
+                rest_undo.append(_rest_count_rollback_tx_item(entry_table.name, entry_id, match_id))
 
                 # (2) 休みイベントを別レコードとして追加
-                rest_event_id = str(uuid.uuid4())
                 rest_item = {
-                    "entry_id": rest_event_id,
+                    "entry_id": str(uuid.uuid4()),
                     "type": "rest_event",
                     "match_id": str(match_id),
                     "display_name": wp.name,
-                    "entry_status": "resting",
+                    # entry_status は持たせない（entry_status GSI に履歴行を入れないため）
                     "reason": "not_selected",
                     "court_number": 0,
                     "team": "R",
                     "created_at": now_jst,
                     "updated_at": now_jst,
                     "source_entry_id": entry_id,
+                    **session_fields(),
                 }
 
                 uid = getattr(wp, "user_id", None)
                 if uid:  # None/空文字なら入れない（NULLを書かない）
                     rest_item["user_id"] = str(uid)
 
-                entry_table.put_item(Item=rest_item)
+                rest_tx.append(_rest_event_tx_item(entry_table.name, rest_item))
+                rest_undo.append(_rest_event_rollback_tx_item(entry_table.name, rest_item))
+
+            if rest_tx:
+                rest_report = transact_write_in_chunks(dynamodb_client, rest_tx, rest_undo)
+                if not rest_report["ok"]:
+                    # 試合自体は確定済み。休み記録だけ残らない（巻き戻し済み）
+                    current_app.logger.error(
+                        "[wait] 休み記録の書き込み失敗 match_id=%s chunks=%s rolled_back=%d skipped=%d",
+                        match_id, [c for c in rest_report["chunks"] if not c["ok"]],
+                        rest_report["rolled_back"], rest_report["rollback_skipped"],
+                    )
 
         current_app.logger.info("ペアリング成功: %s試合, %s人待機 (mode=%s)", len(matches), len(waiting_players), mode)
         return redirect(url_for("game.court"))
@@ -3769,10 +3913,8 @@ def create_pairings_skilled():
 
         # 1) pendingエントリー取得
         entry_table = current_app.dynamodb.Table("bad-game-match_entries")
-        response = entry_table.scan(FilterExpression=Attr("entry_status").eq("pending"))
-
         entries_by_user = {}
-        for e in response.get("Items", []):
+        for e in query_entries_by_status(entry_table, "pending"):
             uid, joined_at = e["user_id"], e.get("joined_at", "")
             if uid not in entries_by_user or joined_at > entries_by_user[uid].get("joined_at", ""):
                 entries_by_user[uid] = e
@@ -3815,7 +3957,8 @@ def create_pairings_skilled():
 
         # 6) スキル順コートグループ化ペアリング
         match_id = generate_match_id()
-        matches, additional_waiting_players = generate_skill_grouped_pairings(players, max_courts)
+        matches, additional_waiting_players = generate_skill_grouped_pairings(
+            players, max_courts, repeat=repeat_penalty(players))
 
         for i, ((a1, a2), (b1, b2)) in enumerate(matches, 1):
             current_app.logger.info(
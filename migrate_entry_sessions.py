@@ -0,0 +1,175 @@
+# bad-game-match_entries を練習日（session_date）でパーティション分けするための移行です。
+#   1) TTL を expires_at 属性で有効化（過去の練習日の行は DynamoDB が Scan なしで消す）
+#   2) session_date / expires_at を持たない既存の行にバックフィル
+#      （joined_at / created_at / updated_at の JST の日付。時刻が無い行は昨日扱い = 今日の画面には出さない）
+#   3) GSI session_date-index（PK=session_date, SK=entry_id）を作成して ACTIVE まで待つ
+# バックフィルのあとで GSI を作るので、インデックスには既存の行も入る。
+# アプリ側（game/views.py）は GSI が無いあいだは entry_status GSI / Scan にフォールバックする。
+#
+# 使い方:
+#   python migrate_entry_sessions.py            # DRY-RUN（件数と日付の内訳の表示のみ）
+#   python migrate_entry_sessions.py --apply    # 実際に TTL 有効化・書き込み・GSI 作成
+
+import os, argparse, time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import boto3
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from game.views import ENTRY_SESSION_INDEX, session_fields  # noqa: E402
+from utils.timezone import JST  # noqa: E402
+
+AWS_REGION = os.getenv("AWS_REGION", "ap-northeast-1")
+TABLE_NAME = os.getenv("MATCH_ENTRIES_TABLE", "bad-game-match_entries")
+TTL_ATTR = "expires_at"
+
+session = boto3.session.Session(
+    region_name=AWS_REGION,
+    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+)
+ddb = session.resource("dynamodb")
+client = session.client("dynamodb")
+
+
+def _scan_all(tbl, **kw):
+    items = []
+    while True:
+        resp = tbl.scan(**kw)
+        items += resp.get("Items", [])
+        lek = resp.get("LastEvaluatedKey")
+        if not lek:
+            break
+        kw["ExclusiveStartKey"] = lek
+    return items
+
+
+def _session_date_of(item, fallback):
+    """行の時刻（ISO 文字列）から JST の練習日を出す"""
+    for k in ("joined_at", "created_at", "updated_at"):
+        v = item.get(k)
+        if not isinstance(v, str) or not v:
+            continue
+        try:
+            dt = datetime.fromisoformat(v.replace("Z", "+00:00"))
+        except ValueError:
+            continue
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=JST)
+        return dt.astimezone(JST).strftime("%Y-%m-%d")
+    return fallback
+
+
+def enable_ttl(apply: bool):
+    desc = client.describe_time_to_live(TableName=TABLE_NAME)["TimeToLiveDescription"]
+    status = desc.get("TimeToLiveStatus")
+    if status in ("ENABLED", "ENABLING") and desc.get("AttributeName") == TTL_ATTR:
+        print(f"[SKIP] TTL already {status}: {TTL_ATTR}")
+        return
+    if not apply:
+        print(f"[DRYRUN] enable TTL on '{TTL_ATTR}' (current: {status} {desc.get('AttributeName')})")
+        return
+    client.update_time_to_live(
+        TableName=TABLE_NAME,
+        TimeToLiveSpecification={"Enabled": True, "AttributeName": TTL_ATTR},
+    )
+    print(f"[OK] TTL enabled: {TTL_ATTR}")
+
+
+def backfill(apply: bool):
+    tbl = ddb.Table(TABLE_NAME)
+    rows = _scan_all(
+        tbl,
+        ProjectionExpression="entry_id, session_date, joined_at, created_at, updated_at",
+    )
+    fallback = (datetime.now(JST) - timedelta(days=1)).strftime("%Y-%m-%d")
+    targets = [it for it in rows if not it.get("session_date")]
+    by_date = Counter()
+    updated = failed = 0
+
+    for it in targets:
+        fields = session_fields(_session_date_of(it, fallback))
+        by_date[fields["session_date"]] += 1
+        if not apply:
+            continue
+        try:
+            tbl.update_item(
+                Key={"entry_id": it["entry_id"]},
+                UpdateExpression="SET session_date = :d, expires_at = :e",
+                ConditionExpression="attribute_exists(entry_id) AND attribute_not_exists(session_date)",
+                ExpressionAttributeValues={":d": fields["session_date"], ":e": fields["expires_at"]},
+            )
+            updated += 1
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                continue  # 途中で消された / アプリが書き直した行
+            failed += 1
+            print(f"[ERROR] update failed entry={it['entry_id']}: {e}")
+
+    print(f"[INFO] rows={len(rows)} without_session={len(targets)} (no timestamp -> {fallback})")
+    for d, n in sorted(by_date.items()):
+        print(f"  - {d}: {n}")
+    if apply:
+        print(f"[DONE] updated={updated} failed={failed}")
+
+
+def create_index(apply: bool):
+    desc = client.describe_table(TableName=TABLE_NAME)
+    gsis = desc["Table"].get("GlobalSecondaryIndexes", []) or []
+    if any(g.get("IndexName") == ENTRY_SESSION_INDEX for g in gsis):
+        print(f"[SKIP] GSI already exists: {ENTRY_SESSION_INDEX}")
+        return
+    if not apply:
+        print(f"[DRYRUN] add GSI '{ENTRY_SESSION_INDEX}' (session_date, entry_id)")
+        return
+
+    print(f"[CREATE] add GSI '{ENTRY_SESSION_INDEX}' to table '{TABLE_NAME}'")
+    client.update_table(
+        TableName=TABLE_NAME,
+        AttributeDefinitions=[
+            {"AttributeName": "session_date", "AttributeType": "S"},
+            {"AttributeName": "entry_id", "AttributeType": "S"},
+        ],
+        GlobalSecondaryIndexUpdates=[
+            {
+                "Create": {
+                    "IndexName": ENTRY_SESSION_INDEX,
+                    "KeySchema": [
+                        {"AttributeName": "session_date", "KeyType": "HASH"},
+                        {"AttributeName": "entry_id", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {"ProjectionType": "ALL"},
+                }
+            }
+        ],
+    )
+
+    print("[WAIT] building index... (this can take a few minutes)")
+    while True:
+        gsis = client.describe_table(TableName=TABLE_NAME)["Table"].get("GlobalSecondaryIndexes", []) or []
+        g = next((x for x in gsis if x.get("IndexName") == ENTRY_SESSION_INDEX), None)
+        status = (g or {}).get("IndexStatus")
+        print(f"  - status: {status}")
+        if status == "ACTIVE":
+            break
+        time.sleep(10)
+    print(f"[OK] GSI ACTIVE: {ENTRY_SESSION_INDEX}")
+
+
+def main(apply: bool):
+    enable_ttl(apply)
+    backfill(apply)
+    create_index(apply)
+    if not apply:
+        print("[NOTE] DRY-RUN。--apply を付ければ書き込みます。")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--apply", action="store_true", help="実際に書き込む（省略時はDRY-RUN）")
+    args = ap.parse_args()
+    main(apply=args.apply)
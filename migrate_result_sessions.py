@@ -0,0 +1,158 @@
+# bad-game-results を練習日（session_date）で Query できるようにするための移行です。
+#   1) session_date を持たない既存の結果にバックフィル
+#      （created_at の JST の日付。created_at が無い行は match_id の先頭 YYYYMMDD）
+#   2) GSI session_date-index（PK=session_date, SK=result_id）を作成して ACTIVE まで待つ
+# バックフィルのあとで GSI を作るので、インデックスには既存の行も入る。
+# 新しい結果は submit_score が session_date を付けて書く。
+# アプリ側（game/results_repository.get_results_for_session）は GSI が無いあいだは
+# created_at の Scan にフォールバックする。
+#
+# 使い方:
+#   python migrate_result_sessions.py            # DRY-RUN（件数と日付の内訳の表示のみ）
+#   python migrate_result_sessions.py --apply    # 実際に書き込み・GSI 作成
+
+import os, argparse, time
+from collections import Counter
+from datetime import datetime
+
+import boto3
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from game.results_repository import RESULTS_SESSION_INDEX, RESULTS_TABLE  # noqa: E402
+from utils.timezone import JST  # noqa: E402
+
+AWS_REGION = os.getenv("AWS_REGION", "ap-northeast-1")
+
+session = boto3.session.Session(
+    region_name=AWS_REGION,
+    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+)
+ddb = session.resource("dynamodb")
+client = session.client("dynamodb")
+
+
+def _scan_all(tbl, **kw):
+    items = []
+    while True:
+        resp = tbl.scan(**kw)
+        items += resp.get("Items", [])
+        lek = resp.get("LastEvaluatedKey")
+        if not lek:
+            break
+        kw["ExclusiveStartKey"] = lek
+    return items
+
+
+def _session_date_of(item):
+    """結果の created_at（ISO 文字列）か match_id（YYYYMMDD_HHMMSS）から JST の練習日を出す"""
+    v = item.get("created_at")
+    if isinstance(v, str) and v:
+        try:
+            dt = datetime.fromisoformat(v.replace("Z", "+00:00"))
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=JST)
+            return dt.astimezone(JST).strftime("%Y-%m-%d")
+        except ValueError:
+            pass
+    mid = str(item.get("match_id") or "")
+    try:
+        return datetime.strptime(mid[:8], "%Y%m%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def backfill(apply: bool):
+    tbl = ddb.Table(RESULTS_TABLE)
+    rows = _scan_all(tbl, ProjectionExpression="result_id, match_id, session_date, created_at")
+    targets = [it for it in rows if not it.get("session_date")]
+    by_date = Counter()
+    updated = failed = skipped = 0
+
+    for it in targets:
+        d = _session_date_of(it)
+        if d is None:
+            skipped += 1
+            continue
+        by_date[d] += 1
+        if not apply:
+            continue
+        try:
+            tbl.update_item(
+                Key={"result_id": it["result_id"]},
+                UpdateExpression="SET session_date = :d",
+                ConditionExpression="attribute_exists(result_id) AND attribute_not_exists(session_date)",
+                ExpressionAttributeValues={":d": d},
+            )
+            updated += 1
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                continue  # 途中で消された / アプリが書き直した行
+            failed += 1
+            print(f"[ERROR] update failed result={it['result_id']}: {e}")
+
+    print(f"[INFO] rows={len(rows)} without_session={len(targets)} no_date={skipped}")
+    for d, n in sorted(by_date.items())[-10:]:
+        print(f"  - {d}: {n}")
+    if apply:
+        print(f"[DONE] updated={updated} failed={failed}")
+
+
+def create_index(apply: bool):
+    desc = client.describe_table(TableName=RESULTS_TABLE)
+    gsis = desc["Table"].get("GlobalSecondaryIndexes", []) or []
+    if any(g.get("IndexName") == RESULTS_SESSION_INDEX for g in gsis):
+        print(f"[SKIP] GSI already exists: {RESULTS_SESSION_INDEX}")
+        return
+    if not apply:
+        print(f"[DRYRUN] add GSI '{RESULTS_SESSION_INDEX}' (session_date, result_id)")
+        return
+
+    print(f"[CREATE] add GSI '{RESULTS_SESSION_INDEX}' to table '{RESULTS_TABLE}'")
+    client.update_table(
+        TableName=RESULTS_TABLE,
+        AttributeDefinitions=[
+            {"AttributeName": "session_date", "AttributeType": "S"},
+            {"AttributeName": "result_id", "AttributeType": "S"},
+        ],
+        GlobalSecondaryIndexUpdates=[
+            {
+                "Create": {
+                    "IndexName": RESULTS_SESSION_INDEX,
+                    "KeySchema": [
+                        {"AttributeName": "session_date", "KeyType": "HASH"},
+                        {"AttributeName": "result_id", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {"ProjectionType": "ALL"},
+                }
+            }
+        ],
+    )
+
+    print("[WAIT] building index... (this can take a few minutes)")
+    while True:
+        gsis = client.describe_table(TableName=RESULTS_TABLE)["Table"].get("GlobalSecondaryIndexes", []) or []
+        g = next((x for x in gsis if x.get("IndexName") == RESULTS_SESSION_INDEX), None)
+        status = (g or {}).get("IndexStatus")
+        print(f"  - status: {status}")
+        if status == "ACTIVE":
+            break
+        time.sleep(10)
+    print(f"[OK] GSI ACTIVE: {RESULTS_SESSION_INDEX}")
+
+
+def main(apply: bool):
+    backfill(apply)
+    create_index(apply)
+    if not apply:
+        print("[NOTE] DRY-RUN。--apply を付ければ書き込みます。")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--apply", action="store_true", help="実際に書き込む（省略時はDRY-RUN）")
+    args = ap.parse_args()
+    main(apply=args.apply)
@@ -0,0 +1,123 @@
+"""
+reconcile_point_balances.py
+
+目的:
+    ugu_points_v2 の台帳集計（ledger_earned / ledger_spent / ... ）を
+    bad-users-history の基準日以降の行（台帳）と突き合わせる。
+
+概要:
+    - ユーザーごとに bad-users-history を user_id + joined_at 範囲で Query し、summarize_ledger で集計し直す
+    - ugu_points_v2 の値と比較して差分を表示
+    - --fix 指定時は集計値で上書きし ledger_ready=True にする
+      （get_current_points_hybrid は ledger_ready のユーザーだけ get_item 1回で残高を返す）
+    - 上書きは ledger_version が読み取り時から変わっていない場合だけ行う（並行して付与/支払いがあったら読み直す）
+
+使い方:
+    python reconcile_point_balances.py                 # 全ユーザーを検証のみ
+    python reconcile_point_balances.py --fix           # 差分を修正し ledger_ready を立てる
+    python reconcile_point_balances.py --user <id> --fix
+"""
+
+import argparse
+import os
+from datetime import datetime, timezone
+
+import boto3
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+from uguu.point import (
+    LEDGER_BALANCE_FIELDS,
+    POINT_BALANCE_TABLE,
+    query_history_after_cutoff,
+    summarize_ledger,
+    to_decimal,
+)
+
+load_dotenv()
+
+USERS_TABLE = "bad-users"
+MAX_ATTEMPTS = 3
+
+dynamodb = boto3.resource("dynamodb", region_name=os.getenv("AWS_REGION", "ap-northeast-1"))
+balance_table = dynamodb.Table(POINT_BALANCE_TABLE)
+
+
+def all_user_ids():
+    table = dynamodb.Table(USERS_TABLE)
+    kwargs = {"ProjectionExpression": "#uid", "ExpressionAttributeNames": {"#uid": "user#user_id"}}
+    while True:
+        resp = table.scan(**kwargs)
+        for u in resp.get("Items", []):
+            if u.get("user#user_id"):
+                yield u["user#user_id"]
+        lek = resp.get("LastEvaluatedKey")
+        if not lek:
+            return
+        kwargs["ExclusiveStartKey"] = lek
+
+
+def reconcile_user(user_id, fix):
+    """戻り値: "ok" / "mismatch" / "fixed" / "conflict" """
+    for _ in range(MAX_ATTEMPTS):
+        current = balance_table.get_item(Key={"user_id": user_id}, ConsistentRead=True).get("Item") or {}
+        version = current.get("ledger_version")
+        expected = summarize_ledger(query_history_after_cutoff(dynamodb, user_id))
+
+        diffs = {
+            f: (to_decimal(current.get(f)), expected[f])
+            for f in LEDGER_BALANCE_FIELDS
+            if to_decimal(current.get(f)) != expected[f]
+        }
+        if not diffs and current.get("ledger_ready"):
+            return "ok"
+
+        if diffs:
+            print(f"[MISMATCH] user={user_id} " + " ".join(f"{k}: {a}->{b}" for k, (a, b) in diffs.items()))
+        if not fix:
+            return "mismatch" if diffs else "ok"
+
+        sets = ", ".join(f"{f} = :{f}" for f in LEDGER_BALANCE_FIELDS)
+        values = {f":{f}": expected[f] for f in LEDGER_BALANCE_FIELDS}
+        values[":true"] = True
+        values[":now"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        if version is None:
+            condition = "attribute_not_exists(ledger_version)"
+        else:
+            condition = "ledger_version = :ver"
+            values[":ver"] = version
+
+        try:
+            balance_table.update_item(
+                Key={"user_id": user_id},
+                UpdateExpression=f"SET {sets}, ledger_ready = :true, ledger_reconciled_at = :now",
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values,
+            )
+            return "fixed"
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            # 集計中に付与/支払いが入った → 読み直してやり直す
+
+    print(f"[CONFLICT] user={user_id} 更新が続いたため後で再実行してください")
+    return "conflict"
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--fix", action="store_true", help="差分を修正して ledger_ready を立てる")
+    ap.add_argument("--user", default=None, help="対象ユーザーを1人に絞る")
+    args = ap.parse_args()
+
+    counts = {}
+    user_ids = [args.user] if args.user else all_user_ids()
+    for uid in user_ids:
+        status = reconcile_user(uid, args.fix)
+        counts[status] = counts.get(status, 0) + 1
+
+    print(f"[DONE] {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,8 @@ from flask_login import login_required, current_user
 from datetime import datetime
 from botocore.exceptions import ClientError
 from .forms import ScheduleForm
-from utils.db import get_schedule_table, get_schedules_with_formatting
+from utils.db import get_schedule_table
+from utils.fragment_cache import fragment_cache
 import logging
 import uuid
 from flask import jsonify
@@ -278,6 +279,10 @@ def edit_schedule(schedule_id):
                             ExpressionAttributeValues=expr_values,
                         )
                     
+                    fragment_cache.invalidate_schedule(schedule_id, old_date)
+                    if new_date != old_date:
+                        fragment_cache.invalidate_schedule(schedule_id, new_date)
+
                     flash('スケジュールを更新しました', 'success')
                     # 編集後は一覧画面（admin_schedules）に戻るのが親切です
                     return redirect(url_for('schedule.admin_schedules'))
@@ -309,8 +314,6 @@ def edit_schedule(schedule_id):
 @bp.route("/delete_schedule/<schedule_id>", methods=['POST'])
 @login_required
 def delete_schedule(schedule_id):    
-    from flask import current_app
-    
     if not current_user.administrator and current_user.role != 'admin':
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return jsonify({'success': False, 'message': '管理者権限が必要です'})
@@ -355,9 +358,8 @@ def delete_schedule(schedule_id):
             )
             message = 'スケジュールを削除しました'
 
-        # キャッシュをリセット - current_appを使用
-        if hasattr(current_app, 'cache'):
-            current_app.cache.delete_memoized(get_schedules_with_formatting)
+        # 描画済み断片を落とす
+        fragment_cache.invalidate_schedule(schedule_id, date)
         
         # AJAX リクエストとHTMLリクエストで異なるレスポンスを返す
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
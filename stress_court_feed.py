@@ -0,0 +1,165 @@
+"""
+コート画面の更新方式の負荷試験（30台のタブレット相当）
+
+- polling : 従来。waiting_status + skill_score を20秒ごと、管理者端末は submission_status を10秒ごと
+            （スナップショットを使わない = 毎回読み直す設定で、従来の読み取り量を再現する）
+- feed    : /game/api/court_feed のカーソルを5秒ごとに確認し、version が変わったときだけ取りに行く
+- longpoll: feed と同じだが、サーバーが変化まで保留する（COURT_FEED_MAX_WAIT > 0 の構成）
+
+DynamoDB は bench_court_state.py のインメモリのスタブ（呼び出し回数を数える）。
+時間は --speed 倍で縮める（既定 20倍: 20秒の間隔 → 1秒）。
+試合中の変化（entry / submit_score など）は --changes 回、書き込み後の無効化（invalidate_court_state）で起こす。
+各方式の HTTP リクエスト数・DynamoDB 読み取り数・変化から端末が取り直すまでの遅れを出す。
+使い方: python stress_court_feed.py [--tablets 30] [--minutes 10] [--changes 8] [--speed 20]
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from collections import Counter
+
+import bench_court_state as stub
+
+
+class _Clock:
+    """シミュレーション上の時刻（秒）"""
+
+    def __init__(self, speed):
+        self.speed = speed
+        self.t0 = time.monotonic()
+
+    def now(self):
+        return (time.monotonic() - self.t0) * self.speed
+
+    def sleep(self, sim_seconds):
+        time.sleep(max(0.0, sim_seconds / self.speed))
+
+
+def run(mode, flask_app, court_state, args):
+    stub.CALLS.clear()
+    clock = _Clock(args.speed)
+    end = args.minutes * 60
+    requests = Counter()
+    lock = threading.Lock()
+    change_times = []
+    lags = []
+
+    court_state.invalidate_court_state()
+    court_state.COURT_STATE_TTL = 0.0 if mode == "polling" else 3.0 / args.speed
+    court_state.COURT_FEED_MAX_WAIT = 25.0 if mode == "longpoll" else 0.0
+    court_state._FEED_CHECK_INTERVAL = 0.5 / args.speed
+
+    def get(client, path, name):
+        resp = client.get(path)
+        with lock:
+            requests[name] += 1
+        return resp
+
+    def refreshed():
+        # 直近の変化からの遅れ（シミュレーション秒）
+        with lock:
+            if change_times:
+                lags.append(clock.now() - change_times[-1])
+
+    def tablet(idx):
+        client = flask_app.test_client()
+        admin = idx < args.admins
+        # 各端末の開始をずらす
+        clock.sleep((idx / args.tablets) * 5)
+        if mode == "polling":
+            next_status, next_score = clock.now(), clock.now()
+            seen_change = 0
+            while clock.now() < end:
+                if clock.now() >= next_status:
+                    get(client, "/game/api/waiting_status", "waiting_status")
+                    get(client, "/game/api/skill_score", "skill_score")
+                    next_status += 20
+                    if len(change_times) != seen_change:
+                        seen_change = len(change_times)
+                        refreshed()
+                if admin and clock.now() >= next_score:
+                    get(client, "/game/api/submission_status?match_id=m001", "submission_status")
+                    next_score += 10
+                clock.sleep(1)
+            return
+
+        version = get(client, "/game/api/court_feed", "court_feed").get_json()["version"]
+        seen_change = len(change_times)
+        while clock.now() < end:
+            data = get(client, f"/game/api/court_feed?since={version}&wait=25", "court_feed").get_json()
+            if data["changed"]:
+                version = data["version"]
+                get(client, "/game/api/waiting_status", "waiting_status")
+                get(client, "/game/api/skill_score", "skill_score")
+                if admin:
+                    get(client, "/game/api/submission_status?match_id=m001", "submission_status")
+                if len(change_times) != seen_change:
+                    seen_change = len(change_times)
+                    refreshed()
+            if not data["hold"]:
+                clock.sleep(5)
+
+    def writer():
+        with flask_app.app_context():
+            for _ in range(args.changes):
+                clock.sleep(end / (args.changes + 1))
+                with lock:
+                    change_times.append(clock.now())
+                court_state.invalidate_court_state()
+
+    threads = [threading.Thread(target=tablet, args=(i,)) for i in range(args.tablets)]
+    threads.append(threading.Thread(target=writer))
+    t = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    elapsed = time.perf_counter() - t
+
+    return {
+        "requests": dict(requests),
+        "http": sum(requests.values()),
+        "dynamo": sum(stub.CALLS.values()),
+        "lag_median": statistics.median(lags) if lags else None,
+        "lag_max": max(lags) if lags else None,
+        "seconds": elapsed,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tablets", type=int, default=30)
+    ap.add_argument("--admins", type=int, default=2)
+    ap.add_argument("--minutes", type=float, default=10)
+    ap.add_argument("--changes", type=int, default=8)
+    ap.add_argument("--speed", type=float, default=20)
+    ap.add_argument("--modes", default="polling,feed,longpoll")
+    args = ap.parse_args()
+
+    import app as app_module
+    from flask_login import AnonymousUserMixin
+    from game import court_state
+
+    class TabletUser(AnonymousUserMixin):
+        administrator = True
+        user_id = "u000"
+
+        def get_id(self):
+            return self.user_id
+
+    flask_app = app_module.app
+    flask_app.config["LOGIN_DISABLED"] = True
+    app_module.login_manager.anonymous_user = TabletUser
+    flask_app.dynamodb = stub.FakeDynamo(stub.make_tables(24))
+
+    print(f"タブレット {args.tablets} 台（管理者 {args.admins}）/ {args.minutes:g} 分 / 変化 {args.changes} 回 / {args.speed:g} 倍速")
+    print(f"{'方式':<10}{'HTTP':>7}{'DynamoDB':>10}{'遅れ中央値':>12}{'遅れ最大':>10}  内訳")
+    for mode in args.modes.split(","):
+        r = run(mode, flask_app, court_state, args)
+        lag = (lambda v: f"{v:.1f}s" if v is not None else "-")
+        print(f"{mode:<10}{r['http']:>7}{r['dynamo']:>10}{lag(r['lag_median']):>12}{lag(r['lag_max']):>10}  {r['requests']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+"""
+座席予約（utils/seat_reservation.py）の同時実行ストレステスト
+
+50人が同時に同じ練習会へ参加登録し、
+- 参加が消えない（成功した人数 == participants の人数、重複なし）
+- 定員を超えない
+- participants_count・履歴の行数・practice_count が参加人数と一致する
+ことを確認する。続けて半数が同時にキャンセルし、残りの人数が合うことも確認する。
+
+接続先:
+  --endpoint http://localhost:8000   DynamoDB Local（一時テーブルを作って消す。条件式も本物で評価される）
+  （指定なし）                         メモリ上の簡易スタンドイン（1トランザクションずつ直列に適用し、
+                                       一定確率で TransactionConflict を返す。ConditionExpression は
+                                       RESERVE_CONDITION などの式そのものを小さな評価器で評価する）
+
+使い方: python stress_seat_reservation.py [--users 50] [--capacity 30] [--endpoint URL]
+"""
+
+import argparse
+import random
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+from utils.points import ledger_tx_items
+from utils.seat_reservation import (
+    FULL, SeatConflict, read_seats, release_seat, reserve_seat,
+)
+
+SCHEDULE_ID = "stress"
+DATE = "2099-01-01"
+
+_ser = TypeSerializer()
+_de = TypeDeserializer()
+
+
+# ---------------------------------------------
+# ConditionExpression の評価器（このテストで使う構文だけ）
+#   AND / OR / NOT / 括弧、= <> < <= > >=、attribute_exists / attribute_not_exists / contains / size、
+#   #名前・:値・リストの添字 #p[3]
+# ---------------------------------------------
+_TOKEN = re.compile(r"\s*(<>|<=|>=|[=<>(),\[\]]|[#:]?[A-Za-z_][\w#]*|\d+)")
+_MISSING = object()
+
+
+class _Condition:
+    def __init__(self, expr, item, names, values):
+        self.tokens = []
+        pos = 0
+        expr = expr.strip()
+        while pos < len(expr):
+            m = _TOKEN.match(expr, pos)
+            if not m:
+                raise ValueError(f"解釈できない条件式: {expr[pos:]}")
+            self.tokens.append(m.group(1))
+            pos = m.end()
+        self.i = 0
+        self.item, self.names, self.values = item, names, values
+
+    def evaluate(self):
+        result = self._or()
+        if self.i != len(self.tokens):
+            raise ValueError(f"条件式の末尾が余っています: {self.tokens[self.i:]}")
+        return result
+
+    def _peek(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else None
+
+    def _take(self, expected=None):
+        tok = self._peek()
+        if expected is not None and tok != expected:
+            raise ValueError(f"{expected} が必要: {tok}")
+        self.i += 1
+        return tok
+
+    def _or(self):
+        result = self._and()
+        while self._peek() == "OR":
+            self._take()
+            rhs = self._and()
+            result = result or rhs
+        return result
+
+    def _and(self):
+        result = self._not()
+        while self._peek() == "AND":
+            self._take()
+            rhs = self._not()
+            result = result and rhs
+        return result
+
+    def _not(self):
+        if self._peek() == "NOT":
+            self._take()
+            return not self._not()
+        return self._primary()
+
+    def _primary(self):
+        tok = self._peek()
+        if tok == "(":
+            self._take()
+            result = self._or()
+            self._take(")")
+            return result
+        if tok in ("attribute_exists", "attribute_not_exists"):
+            self._take()
+            self._take("(")
+            exists = self._path() is not _MISSING
+            self._take(")")
+            return exists if tok == "attribute_exists" else not exists
+        if tok == "contains":
+            self._take()
+            self._take("(")
+            container = self._path()
+            self._take(",")
+            needle = self._operand()
+            self._take(")")
+            return container is not _MISSING and needle in container
+        lhs = self._operand()
+        op = self._take()
+        rhs = self._operand()
+        if lhs is _MISSING or rhs is _MISSING:
+            return False
+        return {"=": lhs == rhs, "<>": lhs != rhs, "<": lhs < rhs, "<=": lhs <= rhs,
+                ">": lhs > rhs, ">=": lhs >= rhs}[op]
+
+    def _operand(self):
+        tok = self._peek()
+        if tok == "size":
+            self._take()
+            self._take("(")
+            value = self._path()
+            self._take(")")
+            return _MISSING if value is _MISSING else len(value)
+        if tok.startswith(":"):
+            self._take()
+            return self.values[tok]
+        return self._path()
+
+    def _path(self):
+        tok = self._take()
+        value = self.item.get(self.names.get(tok, tok), _MISSING)
+        while self._peek() == "[":
+            self._take()
+            idx = int(self._take())
+            self._take("]")
+            value = value[idx] if isinstance(value, list) and idx < len(value) else _MISSING
+        return value
+
+
+def condition_holds(expr, item, names, values):
+    """ConditionExpression を item（無ければ {}）に対して評価する"""
+    return _Condition(expr, item or {}, names or {}, values or {}).evaluate()
+
+
+# ---------------------------------------------
+# メモリ上のスタンドイン
+# ---------------------------------------------
+class FakeClient:
+    def __init__(self, conflict_rate=0.2):
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.conflict_rate = conflict_rate
+        self.conflicts = 0
+
+    def _k(self, table, key):
+        return table, tuple(sorted((k, _de.deserialize(v)) for k, v in key.items()))
+
+    def put(self, table, item):
+        key = {k: _ser.serialize(item[k]) for k in ("schedule_id", "date", "user_id", "joined_at", "user#user_id")
+               if k in item}
+        self.tables[self._k(table, key)] = dict(item)
+
+    def get_item(self, TableName, Key, **kwargs):
+        with self.lock:
+            item = self.tables.get(self._k(TableName, Key))
+            return {"Item": {k: _ser.serialize(v) for k, v in item.items()}} if item else {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues,
+                    ConditionExpression=None, **kw):
+        with self.lock:
+            item = self.tables[self._k(TableName, Key)]
+            attr = ExpressionAttributeNames.get("#a") or ExpressionAttributeNames.get("#pc")
+            values = {k: _de.deserialize(v) for k, v in ExpressionAttributeValues.items()}
+            if ConditionExpression and not condition_holds(ConditionExpression, item, ExpressionAttributeNames,
+                                                           values):
+                raise ClientError({"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem")
+            if UpdateExpression.startswith("REMOVE"):
+                pos = int(UpdateExpression.split("[")[1].split("]")[0])
+                item[attr].pop(pos)
+            else:
+                item["participants_count"] = values[":n"]
+            return {}
+
+    def transact_write_items(self, TransactItems):
+        with self.lock:
+            if random.random() < self.conflict_rate:
+                self.conflicts += 1
+                raise ClientError({"Error": {"Code": "TransactionCanceledException"},
+                                   "CancellationReasons": [{"Code": "TransactionConflict"}] * len(TransactItems)},
+                                  "TransactWriteItems")
+            reasons, ok = [], True
+            for op in TransactItems:
+                failed_item = self._check(op)
+                if failed_item is None:
+                    reasons.append({"Code": "None"})
+                else:
+                    ok = False
+                    reason = {"Code": "ConditionalCheckFailed"}
+                    if failed_item:
+                        reason["Item"] = {k: _ser.serialize(v) for k, v in failed_item.items()}
+                    reasons.append(reason)
+            if not ok:
+                raise ClientError({"Error": {"Code": "TransactionCanceledException"}, "CancellationReasons": reasons},
+                                  "TransactWriteItems")
+            for op in TransactItems:
+                self._apply(op)
+            return {}
+
+    def _check(self, op):
+        """None: 条件成立 / dict: 不成立（現在の値。無ければ {}）"""
+        (kind, body), = op.items()
+        cond = body.get("ConditionExpression")
+        if not cond:
+            return None
+        if kind == "Put":
+            key = {k: v for k, v in body["Item"].items()
+                   if k in ("schedule_id", "date", "user_id", "joined_at", "user#user_id")}
+        else:
+            key = body["Key"]
+        item = self.tables.get(self._k(body["TableName"], key))
+        values = {k: _de.deserialize(v) for k, v in body.get("ExpressionAttributeValues", {}).items()}
+        if condition_holds(cond, item, body.get("ExpressionAttributeNames"), values):
+            return None
+        return dict(item) if item is not None else {}
+
+    def _apply(self, op):
+        (kind, body), = op.items()
+        if kind == "Put":
+            self.put(body["TableName"], {k: _de.deserialize(v) for k, v in body["Item"].items()})
+            return
+        key = self._k(body["TableName"], body["Key"])
+        item = self.tables.setdefault(key, dict(key[1]))
+        values = {k: _de.deserialize(v) for k, v in body.get("ExpressionAttributeValues", {}).items()}
+        expr = body["UpdateExpression"]
+        if "list_append" in expr:
+            item["participants"] = (item.get("participants") or []) + values[":me"]
+            item["participants_count"] = item.get("participants_count", 0) + 1
+        elif expr.startswith("REMOVE #p["):
+            pos = int(expr.split("[")[1].split("]")[0])
+            item["participants"].pop(pos)
+            item["participants_count"] = item.get("participants_count", 0) - 1
+        elif "practice_count" in expr:
+            item["practice_count"] = item.get("practice_count", 0) + 1
+        # ledger の ADD は件数確認に使わないので省略
+
+    def count(self, table, pred=lambda it: True):
+        return sum(1 for (t, _), it in self.tables.items() if t == table and pred(it))
+
+
+# ---------------------------------------------
+# DynamoDB Local
+# ---------------------------------------------
+class LocalTables:
+    def __init__(self, endpoint):
+        self.resource = boto3.resource("dynamodb", endpoint_url=endpoint, region_name="ap-northeast-1",
+                                       aws_access_key_id="local", aws_secret_access_key="local")
+        self.client = self.resource.meta.client
+        self.suffix = uuid.uuid4().hex[:8]
+        self.created = []
+
+    def create(self, name, keys):
+        table_name = f"{name}-{self.suffix}"
+        self.resource.create_table(
+            TableName=table_name,
+            KeySchema=[{"AttributeName": k, "KeyType": t} for k, t in keys],
+            AttributeDefinitions=[{"AttributeName": k, "AttributeType": "S"} for k, _ in keys],
+            BillingMode="PAY_PER_REQUEST",
+        ).wait_until_exists()
+        self.created.append(table_name)
+        return table_name
+
+    def drop(self):
+        for name in self.created:
+            self.resource.Table(name).delete()
+
+
+def run(client, schedule_table, history_table, users_table, n_users, capacity, count_rows, practice_total):
+    users = [f"u{i:03d}" for i in range(n_users)]
+
+    def user_tx(uid):
+        return {"Update": {
+            "TableName": users_table,
+            "Key": {"user#user_id": {"S": uid}},
+            "UpdateExpression": "SET practice_count = if_not_exists(practice_count, :zero) + :one",
+            "ConditionExpression": "attribute_exists(#pk)",
+            "ExpressionAttributeNames": {"#pk": "user#user_id"},
+            "ExpressionAttributeValues": {":zero": {"N": "0"}, ":one": {"N": "1"}},
+        }}
+
+    def join(uid):
+        item = {"user_id": uid, "joined_at": f"2000-01-01T00:00:00#{uid}", "schedule_id": SCHEDULE_ID,
+                "date": DATE, "status": "cancelled", "action": "join"}  # 台帳対象外の行（件数確認用）
+        try:
+            reserve_seat(client, schedule_table, SCHEDULE_ID, DATE, uid,
+                         extra_tx_items=ledger_tx_items(history_table, item) + [user_tx(uid)], now_iso="t")
+            return "ok"
+        except SeatConflict as c:
+            return c.reason
+
+    start = threading.Barrier(n_users)
+
+    def join_at_once(uid):
+        start.wait()
+        return join(uid)
+
+    with ThreadPoolExecutor(max_workers=n_users) as ex:
+        results = list(ex.map(join_at_once, users))
+
+    joined = [u for u, r in zip(users, results) if r == "ok"]
+    seats = read_seats(client, schedule_table, SCHEDULE_ID, DATE)
+    participants = seats.get("participants") or []
+
+    problems = []
+    expected = min(n_users, capacity)
+    if len(joined) != expected:
+        problems.append(f"成功 {len(joined)} != 期待 {expected}")
+    if sorted(participants) != sorted(joined):
+        problems.append(f"participants {len(participants)} と成功 {len(joined)} が不一致（参加の消失）")
+    if len(set(participants)) != len(participants):
+        problems.append("participants に重複")
+    if int(seats.get("participants_count", 0)) != len(participants):
+        problems.append(f"participants_count {seats.get('participants_count')} != {len(participants)}")
+    if any(r not in ("ok", FULL) for r in results):
+        problems.append(f"想定外の結果: {set(results)}")
+    if count_rows() != len(joined):
+        problems.append(f"履歴 {count_rows()} 行 != 参加 {len(joined)}")
+    if practice_total() != len(joined):
+        problems.append(f"practice_count 合計 {practice_total()} != 参加 {len(joined)}")
+    print(f"[JOIN]   {n_users}人同時 → 参加 {len(joined)} / 満員 {results.count(FULL)} / 定員 {capacity}")
+
+    # 半数が同時にキャンセル
+    leaving = joined[::2]
+    with ThreadPoolExecutor(max_workers=max(1, len(leaving))) as ex:
+        list(ex.map(lambda u: release_seat(client, schedule_table, SCHEDULE_ID, DATE, u, now_iso="t"), leaving))
+    seats = read_seats(client, schedule_table, SCHEDULE_ID, DATE)
+    remaining = seats.get("participants") or []
+    if sorted(remaining) != sorted(set(joined) - set(leaving)):
+        problems.append(f"キャンセル後の participants が不一致（{len(remaining)}人）")
+    if int(seats.get("participants_count", 0)) != len(remaining):
+        problems.append(f"キャンセル後の participants_count {seats.get('participants_count')} != {len(remaining)}")
+    print(f"[CANCEL] {len(leaving)}人同時 → 残り {len(remaining)}")
+
+    for p in problems:
+        print(f"[NG] {p}")
+    print("[OK] 参加の消失・定員超過なし" if not problems else "[NG]")
+    return not problems
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--capacity", type=int, default=30)
+    ap.add_argument("--endpoint", default=None, help="DynamoDB Local の URL（省略時はメモリ上のスタンドイン）")
+    args = ap.parse_args()
+
+    if args.endpoint:
+        local = LocalTables(args.endpoint)
+        try:
+            schedules = local.create("bad_schedules", [("schedule_id", "HASH"), ("date", "RANGE")])
+            history = local.create("bad-users-history", [("user_id", "HASH"), ("joined_at", "RANGE")])
+            users = local.create("bad-users", [("user#user_id", "HASH")])
+            local.resource.Table(schedules).put_item(Item={
+                "schedule_id": SCHEDULE_ID, "date": DATE, "max_participants": args.capacity,
+                "participants": [], "participants_count": 0,
+            })
+            with local.resource.Table(users).batch_writer() as batch:
+                for i in range(args.users):
+                    batch.put_item(Item={"user#user_id": f"u{i:03d}"})
+
+            def count_rows():
+                return len(local.resource.Table(history).scan(ConsistentRead=True)["Items"])
+
+            def practice_total():
+                items = local.resource.Table(users).scan(ConsistentRead=True)["Items"]
+                return sum(int(it.get("practice_count", 0)) for it in items)
+
+            ok = run(local.client, schedules, history, users, args.users, args.capacity, count_rows, practice_total)
+        finally:
+            local.drop()
+    else:
+        fake = FakeClient()
+        fake.put("bad_schedules", {"schedule_id": SCHEDULE_ID, "date": DATE, "max_participants": args.capacity,
+                                   "participants": [], "participants_count": 0})
+        for i in range(args.users):
+            fake.put("bad-users", {"user#user_id": f"u{i:03d}"})
+        ok = run(fake, "bad_schedules", "bad-users-history", "bad-users", args.users, args.capacity,
+                 lambda: fake.count("bad-users-history"),
+                 lambda: sum(it.get("practice_count", 0) for (t, _), it in fake.tables.items() if t == "bad-users"))
+        print(f"[INFO] 注入した TransactionConflict: {fake.conflicts} 回")
+
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
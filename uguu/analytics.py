@@ -3,15 +3,15 @@ from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
 from dateutil import tz
 import logging
-from collections import Counter, defaultdict 
-from utils.db import get_schedules_with_formatting_all
+from collections import Counter
+import numpy as np
+from utils.user_directory import user_directory
 
 # 追加インポート
-import os
-import boto3
 from boto3.dynamodb.conditions import Attr
 from dateutil import parser as dtparser  # ← isoparse 用
 
+from .analytics_engine import analytics_engine, date_summary, member_health, overall, repeat_rate, retention
 from .dynamo import DynamoDB
 db = DynamoDB()
 
@@ -23,56 +23,6 @@ def _parse_date(s, default=None):
         return default
     return datetime.strptime(s[:10], "%Y-%m-%d").date()
 
-def _group_key(dt: date, group: str):
-    if group == "day":
-        return dt.strftime("%Y-%m-%d")
-    if group == "week":
-        iso = dt.isocalendar()
-        return f"{iso.year}-W{iso.week:02d}"
-    return dt.strftime("%Y-%m")
-
-def _event_start_hour(sched: dict) -> int | None:
-    """スケジュールの start_time ('HH:MM') から hour を返す"""
-    st = (sched.get("start_time") or "").strip()
-    if ":" in st:
-        try:
-            h = int(st.split(":")[0])
-            return h if 0 <= h <= 23 else None
-        except Exception:
-            return None
-    return None
-
-def _hour_from_event_start(schedule_id: str, target_tz="Asia/Tokyo"):
-    """
-    bad_schedules から start_time('HH:MM') を取り出して hour を返す。
-    schedule_id が MANUALPOINT のように実スケジュールでない場合は None を返す。
-    """
-    if not schedule_id or schedule_id.startswith("MANUALPOINT#"):
-        return None
-
-    table_name = os.getenv("DYNAMODB_TABLE_NAME", "bad_schedules")
-    region = os.getenv("AWS_REGION", "ap-northeast-1")
-    ddb = boto3.resource("dynamodb", region_name=region)
-    tbl = ddb.Table(table_name)
-
-    try:
-        resp = tbl.get_item(Key={"schedule_id": schedule_id})
-        item = resp.get("Item") or {}
-    except Exception:
-        return None
-
-    start_time = (item.get("start_time") or "").strip()  # 例: "19:00"
-    if not start_time or ":" not in start_time:
-        return None
-
-    try:
-        hh = int(start_time.split(":")[0])
-        if 0 <= hh <= 23:
-            return hh
-    except Exception:
-        pass
-    return None
-
 def _to_hour_with_debug(reg, target_tz="Asia/Tokyo"):
     """
     registered_at を指定タイムゾーンの時刻に変換して hour を返す
@@ -108,20 +58,6 @@ def _to_hour(reg, target_tz="Asia/Tokyo"):
     hour, _ = _to_hour_with_debug(reg, target_tz)
     return hour
 
-def _calc_streaks(sorted_dates: list[date]) -> tuple[int, int]:
-    """14日超でストリーク断絶とみなす簡易定義"""
-    if not sorted_dates:
-        return 0, 0
-    cur = best = 1
-    for i in range(1, len(sorted_dates)):
-        gap = (sorted_dates[i] - sorted_dates[i-1]).days
-        if gap <= 14:
-            cur += 1
-            best = max(best, cur)
-        else:
-            cur = 1
-    return cur, best
-
 @analytics.route("/admin/analytics/retention", methods=["GET"])
 @login_required
 def analytics_retention():
@@ -140,78 +76,9 @@ def analytics_retention():
     if start and start > end:
         start, end = end, start
 
-    # 期間内の全参加（キャンセル除外）
-    rows = db.get_all_participations_with_timestamp(start, end) or []
-
-    # userごとの初参加日を特定するために、広い期間での「初回日」も必要ならdb側で取得してもOK。
-    # ここでは簡便に、[過去分も含めた初参加日] を別メソッドで取れたと仮定（なければrowsのみで「期間内での初回」を新規と定義）
-    # first_map = db.get_users_first_participation_dates()  # {user_id: date} などを想定
-
-    # 集計
-    def grpkey(d: date) -> str:
-        if group == "week":
-            iso = d.isocalendar()
-            return f"{iso.year}-W{iso.week:02d}"
-        return d.strftime("%Y-%m")
-
-    active_by_group = defaultdict(set)  # グループごとの参加者集合
-    for r in rows:
-        try:
-            st = str(r.get("status", "active")).lower()
-            if st.startswith("cancel"):   # 'cancel', 'canceled', 'cancelled' すべて弾く
-                continue
-            d = datetime.strptime(r["event_date"], "%Y-%m-%d").date()
-            if d < start or d > end:
-                continue
-            g = grpkey(d)
-            uid = str(r["user_id"])
-            active_by_group[g].add(uid)
-        except Exception:
-            continue
-
-    # 並び順を一度だけ決めて以降もそれを使用
-    groups_sorted = sorted(active_by_group.keys())
-
-    # 期間内「新規/継続」判定（期間内累積で初登場=新規）
-    new_vs_returning = {}
-    seen_so_far = set()
-    for g in groups_sorted:
-        users_g = active_by_group[g]
-        new_count = sum(1 for u in users_g if u not in seen_so_far)
-        returning_count = len(users_g) - new_count
-        new_vs_returning[g] = {
-            "new": new_count,
-            "returning": returning_count,
-            "total_active": len(users_g),
-        }
-        seen_so_far |= users_g
-
-    # Retention（前グループ→当グループ）
-    retention = {}
-    for i in range(1, len(groups_sorted)):
-        prev_g = groups_sorted[i-1]
-        cur_g  = groups_sorted[i]
-        prev_users = active_by_group[prev_g]
-        cur_users  = active_by_group[cur_g]
-        if not prev_users:
-            x = 0
-            rate = None
-        else:
-            x = len(prev_users & cur_users)
-            rate = round(x / len(prev_users), 3)
-        retention[cur_g] = {
-            "from_prev": x,
-            "prev_active": len(prev_users),
-            "rate": rate,
-        }
-
-    return jsonify({
-        "range": {"start": start.strftime("%Y-%m-%d"), "end": end.strftime("%Y-%m-%d")},
-        "group": group,
-        "actives": {g: len(active_by_group[g]) for g in groups_sorted},
-        "new_vs_returning": new_vs_returning,
-        "retention": retention,
-    })
+    # 期間内の全参加（キャンセル除外）を共有フレームから集計
+    frame = analytics_engine.participations(db.part_history)
+    return jsonify(retention(frame, start, end, group))
 
 
 @analytics.route("/admin/analytics/repeat_rate", methods=["GET"])
@@ -226,56 +93,9 @@ def analytics_repeat_rate():
         abort(403)
 
     today = datetime.now(tz=tz.gettz("Asia/Tokyo")).date()
-    # 全期間を対象に取得
-    all_start = date(2020, 1, 1)
-    rows = db.get_all_participations_with_timestamp(all_start, today) or []
-
-    # ユーザーごとの参加日セットを集計
-    user_dates = defaultdict(set)
-    monthly_users = defaultdict(set)
-
-    for r in rows:
-        try:
-            st = str(r.get("status", "active")).lower()
-            if st.startswith("cancel"):
-                continue
-            d = datetime.strptime(r["event_date"], "%Y-%m-%d").date()
-            uid = str(r["user_id"])
-            user_dates[uid].add(d)
-            monthly_users[d.strftime("%Y-%m")].add(uid)
-        except Exception:
-            continue
-
-    # 全体リピート率
-    total_users = len(user_dates)
-    repeat_users = sum(1 for dates in user_dates.values() if len(dates) >= 2)
-    overall_rate = round(repeat_users / total_users * 100, 1) if total_users else 0
-
-    # 月次継続率（前月→当月）
-    months_sorted = sorted(monthly_users.keys())
-    monthly_retention = []
-    for i in range(1, len(months_sorted)):
-        prev_m = months_sorted[i - 1]
-        cur_m  = months_sorted[i]
-        prev_set = monthly_users[prev_m]
-        cur_set  = monthly_users[cur_m]
-        retained = len(prev_set & cur_set)
-        rate = round(retained / len(prev_set) * 100, 1) if prev_set else None
-        monthly_retention.append({
-            "month": cur_m,
-            "prev_active": len(prev_set),
-            "retained": retained,
-            "rate": rate,
-        })
-
-    return jsonify({
-        "overall": {
-            "total_users": total_users,
-            "repeat_users": repeat_users,
-            "rate": overall_rate,
-        },
-        "monthly": monthly_retention,
-    })
+    # 全期間（2020-01-01〜今日）を対象に集計
+    frame = analytics_engine.participations(db.part_history)
+    return jsonify(repeat_rate(frame, today))
 
 
 @analytics.route("/admin/analytics/member_health", methods=["GET"])
@@ -288,154 +108,14 @@ def analytics_member_health():
         abort(403)
 
     today = datetime.now(tz=tz.gettz("Asia/Tokyo")).date()
-    all_start = date(2020, 1, 1)
-    rows = db.get_all_participations_with_timestamp(all_start, today) or []
+    frame = analytics_engine.participations(db.part_history)
+    return jsonify(member_health(frame, today, resolve_names=_display_names))
 
-    # ユーザーごとの参加日セット・月セットを集計
-    user_dates = defaultdict(set)   # user_id -> {date, ...}
-    monthly_users = defaultdict(set)  # "YYYY-MM" -> {user_id, ...}
 
-    for r in rows:
-        try:
-            st = str(r.get("status", "active")).lower()
-            if st.startswith("cancel"):
-                continue
-            d = datetime.strptime(r["event_date"], "%Y-%m-%d").date()
-            uid = str(r["user_id"])
-            user_dates[uid].add(d)
-            monthly_users[d.strftime("%Y-%m")].add(uid)
-        except Exception:
-            continue
-
-    three_months_ago = today - timedelta(days=90)
-    six_months_ago   = today - timedelta(days=180)
-
-    # 総メンバー = 直近6ヶ月以内に2回以上参加したユーザー
-    def _recent_count(dates):
-        return sum(1 for d in dates if d >= six_months_ago)
-
-    total_users = sum(1 for dates in user_dates.values() if _recent_count(dates) >= 2)
-
-    # --- 離脱率 ---
-    # 直近6ヶ月メンバーのうち、最終参加が3ヶ月以上前のユーザー
-    churned_users = sum(
-        1 for dates in user_dates.values()
-        if _recent_count(dates) >= 2 and max(dates) < three_months_ago
-    )
-    churn_rate = round(churned_users / total_users * 100, 1) if total_users else 0
-
-    # --- 新規定着率 ---
-    # 直近6ヶ月メンバーのうち累計3回以上参加したユーザーの割合
-    retained_new = sum(
-        1 for dates in user_dates.values()
-        if _recent_count(dates) >= 2 and len(dates) >= 3
-    )
-    retention_rate = round(retained_new / total_users * 100, 1) if total_users else 0
-
-    # --- アクティブ率 ---
-    # 直近3ヶ月以内に3回以上参加したユーザー / 直近6ヶ月メンバー
-    active_users = sum(
-        1 for dates in user_dates.values()
-        if _recent_count(dates) >= 3
-        and sum(1 for d in dates if d >= three_months_ago) >= 3
-    )
-    active_rate = round(active_users / total_users * 100, 1) if total_users else 0
-
-    # --- 月次データ（グラフ用）---
-    months_sorted = sorted(monthly_users.keys())
-    # 全ユーザーの初参加月を記録
-    user_first_month = {}
-    for uid, dates in user_dates.items():
-        first = min(dates).strftime("%Y-%m")
-        user_first_month[uid] = first
-
-    # 参加経験者全員（固定分母）
-    total_participants = len(user_dates)
-
-    # 月ごとの新規UID一覧を収集
-    monthly_new_uids = {}
-    cumulative_users = set()
-    for m in months_sorted:
-        users_this_month = monthly_users[m]
-        cumulative_users |= users_this_month
-        monthly_new_uids[m] = [uid for uid in users_this_month if user_first_month.get(uid) == m]
-
-    # 全新規UIDをbatch_get_itemで名前取得
-    all_new_uids = list({uid for uids in monthly_new_uids.values() for uid in uids})
-    uid_to_name = {}
-    if all_new_uids:
-        users_table_name = "bad-users"
-        region = os.getenv("AWS_REGION", "ap-northeast-1")
-        ddb = boto3.resource("dynamodb", region_name=region)
-        # batch_get_item は100件上限なので分割
-        for i in range(0, len(all_new_uids), 100):
-            chunk = all_new_uids[i:i+100]
-            resp = ddb.batch_get_item(RequestItems={
-                users_table_name: {
-                    "Keys": [{"user#user_id": uid} for uid in chunk],
-                    "ProjectionExpression": "#uid, display_name",
-                    "ExpressionAttributeNames": {"#uid": "user#user_id"},
-                }
-            })
-            for item in resp.get("Responses", {}).get(users_table_name, []):
-                uid_to_name[item["user#user_id"]] = item.get("display_name", "名前なし")
-
-    def _month_minus(m, n):
-        """YYYY-MM から n ヶ月前の YYYY-MM を返す"""
-        year, month = int(m[:4]), int(m[5:7])
-        month -= n
-        while month <= 0:
-            month += 12
-            year -= 1
-        return f"{year:04d}-{month:02d}"
-
-    monthly_data = []
-    cumulative_users = set()
-    for m in months_sorted:
-        users_this_month = monthly_users[m]
-        cumulative_users |= users_this_month
-
-        new_uids = monthly_new_uids[m]
-        new_names = [uid_to_name.get(uid, uid) for uid in new_uids]
-
-        # アクティブ率（参加経験者全員のうち当月参加者）
-        act_rate = round(len(users_this_month) / total_participants * 100, 1) if total_participants else 0
-
-        # 月次アクティブ率（KPIと同ロジック、月ごとにスライド）
-        # 分母: その月を含む過去6ヶ月に2回以上参加した人
-        # 分子: その月を含む過去3ヶ月に3回以上参加 かつ 当月にも参加した人
-        win3_start = _month_minus(m, 2)
-        win6_start = _month_minus(m, 5)
-        window_total = sum(
-            1 for dates in user_dates.values()
-            if sum(1 for d in dates if win6_start <= d.strftime("%Y-%m") <= m) >= 2
-        )
-        rolling_active = sum(
-            1 for dates in user_dates.values()
-            if sum(1 for d in dates if win3_start <= d.strftime("%Y-%m") <= m) >= 3
-            and any(d.strftime("%Y-%m") == m for d in dates)
-        )
-        rolling_active_rate = round(rolling_active / window_total * 100, 1) if window_total else 0
-
-        monthly_data.append({
-            "month": m,
-            "active_users": len(users_this_month),
-            "cumulative_users": len(cumulative_users),
-            "total_participants": total_participants,
-            "active_rate": act_rate,
-            "rolling_active_rate": rolling_active_rate,
-            "rolling_active": rolling_active,
-            "rolling_active_total": window_total,
-            "new_members": len(new_uids),
-            "new_member_names": new_names,
-        })
-
-    return jsonify({
-        "churn":     {"rate": churn_rate,     "churned": churned_users,  "total": total_users},
-        "retention": {"rate": retention_rate, "retained": retained_new,  "total": total_users},
-        "active":    {"rate": active_rate,    "active": active_users,    "total": total_users},
-        "monthly":   monthly_data,
-    })
+def _display_names(user_ids) -> dict:
+    """新規メンバー名の表示用（UserDirectory の BatchGet）"""
+    users = user_directory.get_many(user_ids)
+    return {uid: u.get("display_name", "名前なし") for uid, u in users.items()}
 
 
 @analytics.route("/admin/analytics/user/<user_id>/participation", methods=["GET"])
@@ -464,8 +144,10 @@ def analytics_user_participation(user_id):
         start, end = end, start
 
     records = db.get_user_participation_history_with_timestamp(user_id) or []
+    # 開始時刻はスケジュールのフレームから引く（レコードごとに bad_schedules を読まない）
+    hour_by_schedule = analytics_engine.schedules().hour_by_schedule
 
-    dates: list[date] = []
+    dates: list[int] = []
     # 3本用意：イベント開始時刻での分布、登録時刻での分布、最終採用分布
     hours_event     = Counter({f"{h:02d}": 0 for h in range(24)})
     hours_registered= Counter({f"{h:02d}": 0 for h in range(24)})
@@ -482,10 +164,11 @@ def analytics_user_participation(user_id):
             if str(r.get("status", "active")).lower() == "cancelled":
                 continue
 
-            dates.append(d)
+            dates.append(d.toordinal())
 
             # 個別に両方求める
-            event_h = _hour_from_event_start(r.get("schedule_id"), tzname)
+            event_h = hour_by_schedule.get(r.get("schedule_id"), -1)
+            event_h = event_h if event_h >= 0 else None
             reg_h   = None
             ra = r.get("registered_at")
             if debug and idx < 10:
@@ -516,51 +199,23 @@ def analytics_user_participation(user_id):
             logger.error(f"Error processing record: {e}, record: {r}")
             continue
 
-    # 去重・ソート
-    dates = sorted(set(dates))
-    total = len(dates)
-
-    # 期間統計
-    if total:
-        first_date = dates[0].strftime("%Y-%m-%d")
-        last_date  = dates[-1].strftime("%Y-%m-%d")
-        if total >= 2:
-            gaps = [(dates[i] - dates[i-1]).days for i in range(1, total)]
-            avg_gap = sum(gaps) / len(gaps)
-            max_gap = max(gaps)
-        else:
-            avg_gap = None
-            max_gap = None
-    else:
-        first_date = last_date = None
-        avg_gap = max_gap = None
-
-    # 曜日分布
-    youbi = ["月","火","水","木","金","土","日"]
-    by_weekday = Counter()
-    for d in dates:
-        by_weekday[youbi[d.weekday()]] += 1
-
-    # 粒度集計
-    by_group = Counter()
-    for d in dates:
-        by_group[_group_key(d, group)] += 1
-
-    # ストリーク
-    current_streak, max_streak = _calc_streaks(dates)
+    # 去重・ソート → 間隔・曜日・粒度・ストリークは配列で集計
+    days = np.unique(np.asarray(dates, dtype=np.int32))
+    summary = date_summary(days, group)
+    total = len(days)
 
     response_data = {
         "user_id": user_id,
         "range": {
-            "start": (start or (dates[0] if dates else None)).strftime("%Y-%m-%d") if (start or dates) else None,
+            "start": start.strftime("%Y-%m-%d") if start else summary["first_date"],
             "end": end.strftime("%Y-%m-%d") if end else None
         },
         "totals": {
             "participations": total,
-            "first_date": first_date,
-            "last_date": last_date,
-            "avg_interval_days": round(avg_gap, 2) if avg_gap is not None else None,
-            "max_gap_days": int(max_gap) if max_gap is not None else None
+            "first_date": summary["first_date"],
+            "last_date": summary["last_date"],
+            "avg_interval_days": summary["avg_interval_days"],
+            "max_gap_days": summary["max_gap_days"]
         },
         "distributions": {
             # 採用（フロントは従来通り by_hour を読むだけでOK）
@@ -568,14 +223,14 @@ def analytics_user_participation(user_id):
             # 参考: どちらで集計しても見たい時用
             "by_hour_event": dict(hours_event),
             "by_hour_registered": dict(hours_registered),
-            "by_weekday": dict(by_weekday),
-            "by_group": [{"group": k, "count": v} for k, v in sorted(by_group.items())]
+            "by_weekday": summary["by_weekday"],
+            "by_group": summary["by_group"]
         },
         "streaks": {
-            "current_streak": current_streak,
-            "max_streak": max_streak
+            "current_streak": summary["current_streak"],
+            "max_streak": summary["max_streak"]
         },
-        "dates": [d.strftime("%Y-%m-%d") for d in dates],
+        "dates": [date.fromordinal(int(d)).strftime("%Y-%m-%d") for d in days],
         "meta": {
             "hour_source": hour_source  # auto / event / registered
         }
@@ -605,116 +260,8 @@ def analytics_overall():
     if start and start > end:
         start, end = end, start
 
-    # すべてのアクティブ・スケジュール
-    schedules = get_schedules_with_formatting_all() or []
-
-    # まず全期間（end まで）の「初参加日」を作る（新規/リピーター判定用）
-    first_seen: dict[str, date] = {}
-    for s in schedules:
-        if s.get("status", "active") != "active":
-            continue
-        try:
-            d = datetime.strptime(s["date"], "%Y-%m-%d").date()
-        except Exception:
-            continue
-        if d > end:
-            continue
-        # 参加者リスト（通常参加 + タラ参加もあれば加算）
-        uids = list(s.get("participants", [])) + list(s.get("tara_participants", []))
-        for uid in uids:
-            fd = first_seen.get(uid)
-            if fd is None or d < fd:
-                first_seen[uid] = d
-
-    # 集計用
-    total_participations = 0          # 参加延べ数
-    unique_users: set[str] = set()    # 一意ユーザ
-    events_count = 0                  # 対象期間のイベント数
-    by_weekday = Counter()            # 曜日別（延べ）
-    by_group = Counter()              # 月/週/日別（延べ）
-    events_by_group = Counter()       # 月/週/日別（イベント数）
-    by_hour  = Counter({f"{h:02d}": 0 for h in range(24)})  # 開始時刻ベース
-    participation_dates = Counter()   # 日別の延べ参加数（ヒートマップ等で使える）
-
-    new_users_in_range = set()        # 期間中に初参加（=新規）
-    returning_users_in_range = set()  # 期間中に参加し、初参加日は期間より前（=リピーター）
-
-    # 期間内だけを本集計
-    for s in schedules:
-        if s.get("status", "active") != "active":
-            continue
-        try:
-            d = datetime.strptime(s["date"], "%Y-%m-%d").date()
-        except Exception:
-            continue
-        if d < start or d > end:
-            continue
-
-        events_count += 1
-
-        # 参加者
-        uids = list(s.get("participants", [])) + list(s.get("tara_participants", []))
-        count_here = len(uids)
-        total_participations += count_here
-        participation_dates[d] += count_here
-
-        # 一意ユーザ
-        for uid in uids:
-            unique_users.add(uid)
-            # 新規 / リピーター
-            fd = first_seen.get(uid)
-            if fd is not None:
-                if start <= fd <= end:
-                    new_users_in_range.add(uid)
-                elif fd < start:
-                    returning_users_in_range.add(uid)
-
-        # 曜日別（延べ）
-        youbi = ["月","火","水","木","金","土","日"]
-        by_weekday[youbi[d.weekday()]] += count_here
-
-        # 粒度別（延べ）
-        gk = _group_key(d, group)
-        by_group[gk] += count_here
-        events_by_group[gk] += 1
-
-        # 開始時刻→時間帯（延べ）
-        hh = _event_start_hour(s)
-        if hh is not None:
-            by_hour[f"{hh:02d}"] += count_here
-
-    # KPI
-    unique_users_count = len(unique_users)
-    new_users_count = len(new_users_in_range)
-    returning_users_count = len(returning_users_in_range)
-
-    # 返却
-    return jsonify({
-        "range": {
-            "start": start.strftime("%Y-%m-%d") if start else None,
-            "end":   end.strftime("%Y-%m-%d") if end else None,
-            "events_count": events_count
-        },
-        "totals": {
-            "participations": total_participations,         # 延べ参加数
-            "unique_users": unique_users_count,             # 一意参加者数
-            "avg_participants_per_event": (
-                round(total_participations / events_count, 2) if events_count else None
-            )
-        },
-        "cohorts": {
-            "new_users_in_range": new_users_count,          # 期間中に初参加
-            "returning_users_in_range": returning_users_count
-        },
-        "distributions": {
-            "by_weekday": dict(by_weekday),                 # 曜日別（延べ）
-            "by_hour": dict(by_hour),                       # 開始時刻ベース
-            "by_group": [{"group": k, "count": v} for k, v in sorted(by_group.items())],
-            "events_by_group": {k: v for k, v in events_by_group.items()},
-            "by_date": [{"date": d.strftime("%Y-%m-%d"), "count": c}
-                        for d, c in sorted(participation_dates.items())]
-        }
-    })
+    # 初参加日（新規/リピーター判定）は end までの全期間、本集計は期間内だけ
+    return jsonify(overall(analytics_engine.schedules(), start, end, group))
 
 # ★ ルート装飾子を付与して公開
 @analytics.route("/admin/analytics/match_history", methods=["GET"])
@@ -0,0 +1,638 @@
+"""
+/admin/analytics/* の集計エンジン
+
+各エンドポイントがリクエストごとに bad-users-history（または全スケジュール）を読み直して
+dict / set で集計していたのをやめ、参加履歴を一度だけ列指向（NumPy 配列）に読み込んで共有する。
+
+- ParticipationFrame: 履歴1行 = (ユーザー番号, 日付の序数, 開始時刻, 状態)
+- ScheduleFrame: スケジュール1件 = (日付の序数, 開始時刻, 人数) と 参加者行 (ユーザー番号, スケジュール番号)
+- 集計（グループ別・コホート・ストリーク・移動窓）はすべて配列演算で行う
+- 更新: JST の日付が変わったら全件を読み直す。それ以外は SharedCache の "history" 変更ログ
+  （bump_stats_version が書く）に載ったユーザーの履歴だけを Query して差し替える
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime
+
+import numpy as np
+from boto3.dynamodb.conditions import Key
+
+from utils.schedule_repository import schedule_repository
+from utils.shared_cache import shared_cache
+from utils.timezone import JST
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = 0
+CANCELLED = 1
+
+YOUBI = ["月", "火", "水", "木", "金", "土", "日"]
+HISTORY_START = date(2020, 1, 1)          # repeat_rate / member_health の集計開始日
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_HISTORY_PROJECTION = "user_id, event_date, #d, #s, schedule_id"
+_HISTORY_NAMES = {"#d": "date", "#s": "status"}
+
+
+# ---------------------------------------------
+# フレーム
+# ---------------------------------------------
+class UserIndex:
+    """user_id <-> 連番"""
+
+    def __init__(self):
+        self.ids = []
+        self._pos = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def code(self, user_id: str) -> int:
+        pos = self._pos.get(user_id)
+        if pos is None:
+            pos = self._pos[user_id] = len(self.ids)
+            self.ids.append(user_id)
+        return pos
+
+    def get(self, user_id: str):
+        return self._pos.get(user_id)
+
+
+@dataclass
+class ParticipationFrame:
+    users: UserIndex
+    user: np.ndarray      # int32
+    day: np.ndarray       # int32（date.toordinal()）
+    hour: np.ndarray      # int8（スケジュールの開始時刻、不明は -1）
+    status: np.ndarray    # int8（ACTIVE / CANCELLED）
+
+    def __len__(self):
+        return len(self.user)
+
+
+@dataclass
+class ScheduleFrame:
+    users: UserIndex
+    event_day: np.ndarray     # int32
+    event_hour: np.ndarray    # int8
+    event_count: np.ndarray   # int32（participants + tara_participants の人数）
+    p_user: np.ndarray        # int32
+    p_event: np.ndarray       # int32
+    hour_by_schedule: dict = field(default_factory=dict)
+
+
+class _RowBuffer:
+    """履歴アイテム → 列（日付文字列の解析はメモ化）"""
+
+    def __init__(self, users: UserIndex, hour_by_schedule: dict):
+        self.users = users
+        self.hour_by_schedule = hour_by_schedule
+        self.user, self.day, self.hour, self.status = [], [], [], []
+        self._days = {}
+
+    def add(self, user_id, event_date, status, schedule_id):
+        if not user_id or not event_date:
+            return
+        d = event_date[:10]
+        ordinal = self._days.get(d)
+        if ordinal is None:
+            try:
+                ordinal = date.fromisoformat(d).toordinal()
+            except ValueError:
+                ordinal = -1
+            self._days[d] = ordinal
+        if ordinal < 0:
+            return
+        self.user.append(self.users.code(str(user_id)))
+        self.day.append(ordinal)
+        self.hour.append(self.hour_by_schedule.get(schedule_id, -1))
+        self.status.append(CANCELLED if str(status or "active").lower().startswith("cancel") else ACTIVE)
+
+    def add_raw(self, item):
+        """低レベル client の Scan/Query 結果（{"S": ...} 形式）"""
+        def s(name):
+            v = item.get(name)
+            return v.get("S") if v else None
+        self.add(s("user_id"), s("event_date") or s("date"), s("status"), s("schedule_id") or "")
+
+    def frame(self) -> ParticipationFrame:
+        return ParticipationFrame(
+            users=self.users,
+            user=np.asarray(self.user, dtype=np.int32),
+            day=np.asarray(self.day, dtype=np.int32),
+            hour=np.asarray(self.hour, dtype=np.int8),
+            status=np.asarray(self.status, dtype=np.int8),
+        )
+
+
+def frame_from_rows(rows, hour_by_schedule=None, users=None) -> ParticipationFrame:
+    """[{"user_id", "event_date", "status", "schedule_id"}, ...] から作る（ベンチ・移行用）"""
+    buf = _RowBuffer(users or UserIndex(), hour_by_schedule or {})
+    for r in rows:
+        buf.add(r.get("user_id"), r.get("event_date") or r.get("date"), r.get("status"), r.get("schedule_id") or "")
+    return buf.frame()
+
+
+def start_hour(start_time) -> int:
+    """'HH:MM' → hour（不明は -1）"""
+    st = (start_time or "").strip()
+    if ":" in st:
+        try:
+            h = int(st.split(":")[0])
+            return h if 0 <= h <= 23 else -1
+        except ValueError:
+            return -1
+    return -1
+
+
+def schedule_frame(schedules, users=None) -> ScheduleFrame:
+    users = users or UserIndex()
+    days, hours, counts, p_user, p_event = [], [], [], [], []
+    hour_by_schedule = {}
+    for s in schedules:
+        try:
+            ordinal = date.fromisoformat(str(s.get("date", ""))[:10]).toordinal()
+        except ValueError:
+            continue
+        h = start_hour(s.get("start_time"))
+        if s.get("schedule_id"):
+            hour_by_schedule[s["schedule_id"]] = h
+        uids = list(s.get("participants") or []) + list(s.get("tara_participants") or [])
+        idx = len(days)
+        days.append(ordinal)
+        hours.append(h)
+        counts.append(len(uids))
+        for uid in uids:
+            p_user.append(users.code(str(uid)))
+            p_event.append(idx)
+    return ScheduleFrame(
+        users=users,
+        event_day=np.asarray(days, dtype=np.int32),
+        event_hour=np.asarray(hours, dtype=np.int8),
+        event_count=np.asarray(counts, dtype=np.int32),
+        p_user=np.asarray(p_user, dtype=np.int32),
+        p_event=np.asarray(p_event, dtype=np.int32),
+        hour_by_schedule=hour_by_schedule,
+    )
+
+
+# ---------------------------------------------
+# 配列ヘルパー
+# ---------------------------------------------
+def group_label(d: date, group: str) -> str:
+    if group == "day":
+        return d.strftime("%Y-%m-%d")
+    if group == "week":
+        iso = d.isocalendar()
+        return f"{iso.year}-W{iso.week:02d}"
+    return d.strftime("%Y-%m")
+
+
+def group_codes(days: np.ndarray, group: str):
+    """日付の序数 → (昇順のラベル一覧, 各行のラベル番号)。ラベル化は重複しない日付だけ"""
+    if len(days) == 0:
+        return [], np.zeros(0, dtype=np.int64)
+    uniq, inv = np.unique(days, return_inverse=True)
+    labels = np.array([group_label(date.fromordinal(int(d)), group) for d in uniq])
+    sorted_labels, label_inv = np.unique(labels, return_inverse=True)
+    return sorted_labels.tolist(), label_inv[inv.ravel()].astype(np.int64)
+
+
+def month_index(days: np.ndarray) -> np.ndarray:
+    """日付の序数 → 1970-01 からの月数"""
+    return (days.astype(np.int64) - _EPOCH_ORDINAL).astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+
+def month_label(mi: int) -> str:
+    return f"{1970 + mi // 12:04d}-{mi % 12 + 1:02d}"
+
+
+def weekday(days: np.ndarray) -> np.ndarray:
+    """date.weekday() と同じ（月曜 = 0）"""
+    return (days.astype(np.int64) - 1) % 7
+
+
+def _active(frame: ParticipationFrame, start=None, end=None):
+    m = frame.status == ACTIVE
+    if start is not None:
+        m &= frame.day >= start.toordinal()
+    if end is not None:
+        m &= frame.day <= end.toordinal()
+    return frame.user[m].astype(np.int64), frame.day[m]
+
+
+def _group_pairs(user: np.ndarray, codes: np.ndarray, n_users: int):
+    """重複しない (グループ, ユーザー) の組（グループ昇順）"""
+    keys = np.unique(codes * n_users + user)
+    return keys, keys // n_users, keys % n_users
+
+
+def _retention_by_group(user, codes, n_groups, n_users):
+    """グループごとの参加人数 / 初登場人数 / 直前グループからの継続人数"""
+    n_users = max(n_users, 1)
+    keys, g, u = _group_pairs(user, codes, n_users)
+    active = np.bincount(g, minlength=n_groups)
+    _, first_idx = np.unique(u, return_index=True)   # keys はグループ昇順なので最初の出現が初登場
+    new = np.bincount(g[first_idx], minlength=n_groups)
+    has_prev = (g > 0) & np.isin(keys - n_users, keys)
+    retained = np.bincount(g[has_prev], minlength=n_groups)
+    return active, new, retained
+
+
+def streaks(days: np.ndarray, max_gap: int = 14):
+    """昇順・重複なしの日付 → (現在のストリーク, 最長ストリーク)。max_gap 日超で断絶"""
+    n = len(days)
+    if n == 0:
+        return 0, 0
+    breaks = np.flatnonzero(np.diff(days) > max_gap)
+    bounds = np.concatenate(([-1], breaks, [n - 1]))
+    runs = np.diff(bounds)
+    return int(runs[-1]), int(runs.max())
+
+
+# ---------------------------------------------
+# 集計
+# ---------------------------------------------
+def retention(frame: ParticipationFrame, start: date, end: date, group: str) -> dict:
+    user, day = _active(frame, start, end)
+    labels, codes = group_codes(day, group)
+    active, new, retained = _retention_by_group(user, codes, len(labels), len(frame.users))
+
+    new_vs_returning = {}
+    result = {}
+    for i, g in enumerate(labels):
+        new_vs_returning[g] = {
+            "new": int(new[i]),
+            "returning": int(active[i] - new[i]),
+            "total_active": int(active[i]),
+        }
+        if i:
+            prev = int(active[i - 1])
+            result[g] = {
+                "from_prev": int(retained[i]),
+                "prev_active": prev,
+                "rate": round(int(retained[i]) / prev, 3) if prev else None,
+            }
+
+    return {
+        "range": {"start": start.strftime("%Y-%m-%d"), "end": end.strftime("%Y-%m-%d")},
+        "group": group,
+        "actives": {g: int(active[i]) for i, g in enumerate(labels)},
+        "new_vs_returning": new_vs_returning,
+        "retention": result,
+    }
+
+
+def _distinct_user_days(frame, start, end):
+    user, day = _active(frame, start, end)
+    n_days = np.int64(end.toordinal() + 1)
+    keys = np.unique(user * n_days + day)
+    return keys // n_days, (keys % n_days).astype(np.int32)
+
+
+def repeat_rate(frame: ParticipationFrame, today: date) -> dict:
+    u, d = _distinct_user_days(frame, HISTORY_START, today)
+    per_user = np.bincount(u, minlength=len(frame.users))
+    total_users = int((per_user > 0).sum())
+    repeat_users = int((per_user >= 2).sum())
+
+    months = month_index(d)
+    month_codes = np.unique(months, return_inverse=True)
+    labels = [month_label(int(m)) for m in month_codes[0]]
+    active, _, retained = _retention_by_group(u, month_codes[1].ravel().astype(np.int64), len(labels), len(frame.users))
+
+    monthly = []
+    for i in range(1, len(labels)):
+        prev = int(active[i - 1])
+        monthly.append({
+            "month": labels[i],
+            "prev_active": prev,
+            "retained": int(retained[i]),
+            "rate": round(int(retained[i]) / prev * 100, 1) if prev else None,
+        })
+
+    return {
+        "overall": {
+            "total_users": total_users,
+            "repeat_users": repeat_users,
+            "rate": round(repeat_users / total_users * 100, 1) if total_users else 0,
+        },
+        "monthly": monthly,
+    }
+
+
+def member_health(frame: ParticipationFrame, today: date, resolve_names=None) -> dict:
+    """
+    離脱率・新規定着率・アクティブ率と月次推移
+    resolve_names: [user_id] -> {user_id: 表示名}（新規メンバー名の表示用）
+    """
+    u, d = _distinct_user_days(frame, HISTORY_START, today)
+    n_users = len(frame.users)
+    three = (today.toordinal() - 90)
+    six = (today.toordinal() - 180)
+
+    total = np.bincount(u, minlength=n_users)
+    recent6 = np.bincount(u[d >= six], minlength=n_users)
+    recent3 = np.bincount(u[d >= three], minlength=n_users)
+    last = np.full(n_users, -1, dtype=np.int64)
+    np.maximum.at(last, u, d)
+
+    members = recent6 >= 2
+    total_users = int(members.sum())
+    churned = int((members & (last < three)).sum())
+    retained_new = int((members & (total >= 3)).sum())
+    active_users = int(((recent6 >= 3) & (recent3 >= 3)).sum())
+
+    def rate(x):
+        return round(x / total_users * 100, 1) if total_users else 0
+
+    monthly_data = []
+    if len(u):
+        # ユーザー × 月（最小月〜最大月の連続）の参加日数
+        mi = month_index(d)
+        m0 = int(mi.min())
+        n_months = int(mi.max()) - m0 + 1
+        counts = np.bincount(u * n_months + (mi - m0), minlength=n_users * n_months).reshape(n_users, n_months)
+        present = counts > 0
+        participants = present.any(axis=1)
+        total_participants = int(participants.sum())
+        first_month = np.where(participants, present.argmax(axis=1), n_months)
+
+        cum = np.concatenate([np.zeros((n_users, 1), dtype=np.int64), counts.cumsum(axis=1)], axis=1)
+        cols = np.arange(n_months)
+        win6 = cum[:, cols + 1] - cum[:, np.maximum(cols - 5, 0)]
+        win3 = cum[:, cols + 1] - cum[:, np.maximum(cols - 2, 0)]
+        window_total = (win6 >= 2).sum(axis=0)
+        rolling_active = ((win3 >= 3) & present).sum(axis=0)
+        active_per_month = present.sum(axis=0)
+        new_per_month = np.bincount(first_month[participants], minlength=n_months)
+        cumulative = np.cumsum(new_per_month)
+
+        new_uids = {j: [frame.users.ids[i] for i in np.flatnonzero(first_month == j)]
+                    for j in np.flatnonzero(new_per_month)}
+        all_new = [uid for uids in new_uids.values() for uid in uids]
+        names = resolve_names(all_new) if (resolve_names and all_new) else {}
+
+        for j in np.flatnonzero(active_per_month):
+            wt = int(window_total[j])
+            ra = int(rolling_active[j])
+            n_active = int(active_per_month[j])
+            uids = new_uids.get(j, [])
+            monthly_data.append({
+                "month": month_label(m0 + int(j)),
+                "active_users": n_active,
+                "cumulative_users": int(cumulative[j]),
+                "total_participants": total_participants,
+                "active_rate": round(n_active / total_participants * 100, 1) if total_participants else 0,
+                "rolling_active_rate": round(ra / wt * 100, 1) if wt else 0,
+                "rolling_active": ra,
+                "rolling_active_total": wt,
+                "new_members": len(uids),
+                "new_member_names": [names.get(uid, uid) for uid in uids],
+            })
+
+    return {
+        "churn":     {"rate": rate(churned),      "churned": churned,       "total": total_users},
+        "retention": {"rate": rate(retained_new), "retained": retained_new, "total": total_users},
+        "active":    {"rate": rate(active_users), "active": active_users,   "total": total_users},
+        "monthly":   monthly_data,
+    }
+
+
+def overall(sframe: ScheduleFrame, start: date, end: date, group: str) -> dict:
+    s_ord, e_ord = start.toordinal(), end.toordinal()
+    upto_end = sframe.event_day <= e_ord
+    in_range = upto_end & (sframe.event_day >= s_ord)
+
+    # 初参加日（end までの全期間）
+    n_users = len(sframe.users)
+    p_day = sframe.event_day[sframe.p_event] if len(sframe.p_event) else np.zeros(0, dtype=np.int32)
+    p_upto = upto_end[sframe.p_event] if len(sframe.p_event) else np.zeros(0, dtype=bool)
+    first_seen = np.full(n_users, np.iinfo(np.int32).max, dtype=np.int64)
+    np.minimum.at(first_seen, sframe.p_user[p_upto], p_day[p_upto])
+
+    p_in = in_range[sframe.p_event] if len(sframe.p_event) else np.zeros(0, dtype=bool)
+    users_in = np.unique(sframe.p_user[p_in])
+    fs = first_seen[users_in]
+    new_users = int(((fs >= s_ord) & (fs <= e_ord)).sum())
+    returning_users = int((fs < s_ord).sum())
+
+    days = sframe.event_day[in_range]
+    counts = sframe.event_count[in_range].astype(np.int64)
+    hours = sframe.event_hour[in_range]
+    events_count = int(in_range.sum())
+    total = int(counts.sum())
+
+    wd = weekday(days)
+    wd_sum = np.bincount(wd, weights=counts, minlength=7)
+    wd_seen = np.bincount(wd, minlength=7)
+    by_weekday = {YOUBI[i]: int(wd_sum[i]) for i in range(7) if wd_seen[i]}
+
+    labels, codes = group_codes(days, group)
+    g_sum = np.bincount(codes, weights=counts, minlength=len(labels))
+    g_events = np.bincount(codes, minlength=len(labels))
+
+    known = hours >= 0
+    h_sum = np.bincount(hours[known].astype(np.int64), weights=counts[known], minlength=24)
+    by_hour = {f"{h:02d}": int(h_sum[h]) for h in range(24)}
+
+    uniq_days, inv = np.unique(days, return_inverse=True)
+    d_sum = np.bincount(inv.ravel(), weights=counts, minlength=len(uniq_days))
+
+    return {
+        "range": {
+            "start": start.strftime("%Y-%m-%d"),
+            "end": end.strftime("%Y-%m-%d"),
+            "events_count": events_count,
+        },
+        "totals": {
+            "participations": total,
+            "unique_users": int(len(users_in)),
+            "avg_participants_per_event": round(total / events_count, 2) if events_count else None,
+        },
+        "cohorts": {
+            "new_users_in_range": new_users,
+            "returning_users_in_range": returning_users,
+        },
+        "distributions": {
+            "by_weekday": by_weekday,
+            "by_hour": by_hour,
+            "by_group": [{"group": g, "count": int(g_sum[i])} for i, g in enumerate(labels)],
+            "events_by_group": {g: int(g_events[i]) for i, g in enumerate(labels)},
+            "by_date": [{"date": date.fromordinal(int(d)).strftime("%Y-%m-%d"), "count": int(d_sum[i])}
+                        for i, d in enumerate(uniq_days)],
+        },
+    }
+
+
+def date_summary(days: np.ndarray, group: str) -> dict:
+    """1ユーザーの参加日（昇順・重複なし）→ 間隔・曜日・粒度別・ストリーク"""
+    total = len(days)
+    if total >= 2:
+        gaps = np.diff(days)
+        avg_gap, max_gap = float(gaps.mean()), int(gaps.max())
+    else:
+        avg_gap = max_gap = None
+
+    wd = np.bincount(weekday(days), minlength=7) if total else np.zeros(7, dtype=np.int64)
+    labels, codes = group_codes(days, group)
+    g_count = np.bincount(codes, minlength=len(labels))
+    current, best = streaks(days)
+
+    return {
+        "first_date": date.fromordinal(int(days[0])).strftime("%Y-%m-%d") if total else None,
+        "last_date": date.fromordinal(int(days[-1])).strftime("%Y-%m-%d") if total else None,
+        "avg_interval_days": round(avg_gap, 2) if avg_gap is not None else None,
+        "max_gap_days": max_gap,
+        "by_weekday": {YOUBI[i]: int(wd[i]) for i in range(7) if wd[i]},
+        "by_group": [{"group": g, "count": int(g_count[i])} for i, g in enumerate(labels)],
+        "current_streak": current,
+        "max_streak": best,
+    }
+
+
+# ---------------------------------------------
+# 読み込みと更新
+# ---------------------------------------------
+class AnalyticsEngine:
+    """参加履歴とスケジュールのフレームを保持し、日次の全件ロードと変更ログでの差分更新を行う"""
+
+    SCHEDULE_TTL = 600.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frame = None
+        self._loaded_day = None
+        self._history_version = None
+        self._schedules = None
+        self._schedules_at = None
+        self._schedules_version = None
+
+        self.full_loads = 0
+        self.incremental_refreshes = 0
+        self.last_full_load = {}
+        self.last_incremental = {}
+
+    def participations(self, history_table) -> ParticipationFrame:
+        with self._lock:
+            today = datetime.now(JST).date()
+            if self._frame is None or self._loaded_day != today:
+                self._full_load(history_table, today)
+            else:
+                version, changed = shared_cache.changes_since("history", self._history_version)
+                if version != self._history_version:
+                    if changed is None:
+                        self._full_load(history_table, today)
+                    else:
+                        self._reload_users(history_table, changed)
+                        self._history_version = version
+            return self._frame
+
+    def schedules(self) -> ScheduleFrame:
+        with self._lock:
+            return self._schedule_frame()
+
+    def invalidate(self):
+        with self._lock:
+            self._frame = None
+            self._schedules = None
+
+    def metrics(self) -> dict:
+        frame = self._frame
+        return {
+            "rows": len(frame) if frame is not None else 0,
+            "users": len(frame.users) if frame is not None else 0,
+            "bytes": int(sum(a.nbytes for a in (frame.user, frame.day, frame.hour, frame.status))) if frame is not None else 0,
+            "loaded_day": self._loaded_day.isoformat() if self._loaded_day else None,
+            "full_loads": self.full_loads,
+            "incremental_refreshes": self.incremental_refreshes,
+            "last_full_load": self.last_full_load,
+            "last_incremental": self.last_incremental,
+        }
+
+    # ---------------------------------------------
+    # 内部
+    # ---------------------------------------------
+    def _schedule_frame(self) -> ScheduleFrame:
+        version = shared_cache.version("history")
+        if (self._schedules is None or version != self._schedules_version
+                or time.monotonic() - self._schedules_at > self.SCHEDULE_TTL):
+            self._schedules = schedule_frame(schedule_repository.range())
+            self._schedules_at = time.monotonic()
+            self._schedules_version = version
+        return self._schedules
+
+    def _full_load(self, history_table, today):
+        start = time.perf_counter()
+        version = shared_cache.version("history")
+        hour_by_schedule = self._schedule_frame().hour_by_schedule
+
+        buf = _RowBuffer(UserIndex(), hour_by_schedule)
+        client = history_table.meta.client
+        pages = 0
+        for page in client.get_paginator("scan").paginate(
+            TableName=history_table.name,
+            ProjectionExpression=_HISTORY_PROJECTION,
+            ExpressionAttributeNames=_HISTORY_NAMES,
+        ):
+            pages += 1
+            for item in page.get("Items", []):
+                buf.add_raw(item)
+
+        self._frame = buf.frame()
+        self._loaded_day = today
+        self._history_version = version
+        self.full_loads += 1
+        self.last_full_load = {
+            "rows": len(self._frame),
+            "pages": pages,
+            "seconds": round(time.perf_counter() - start, 4),
+        }
+        logger.info("[analytics] 参加履歴を全件ロード: %d行 (%dページ, %.3f秒)",
+                    len(self._frame), pages, self.last_full_load["seconds"])
+
+    def _reload_users(self, history_table, user_ids):
+        """変更のあったユーザーの行だけを Query し直して差し替える"""
+        if not user_ids:
+            return
+        start = time.perf_counter()
+        frame = self._frame
+        buf = _RowBuffer(frame.users, self._schedule_frame().hour_by_schedule)
+        codes = []
+        for uid in user_ids:
+            codes.append(frame.users.code(str(uid)))
+            kwargs = {
+                "KeyConditionExpression": Key("user_id").eq(str(uid)),
+                "ProjectionExpression": _HISTORY_PROJECTION,
+                "ExpressionAttributeNames": _HISTORY_NAMES,
+            }
+            while True:
+                resp = history_table.query(**kwargs)
+                for item in resp.get("Items", []):
+                    buf.add(item.get("user_id"), item.get("event_date") or item.get("date"),
+                            item.get("status"), item.get("schedule_id") or "")
+                lek = resp.get("LastEvaluatedKey")
+                if not lek:
+                    break
+                kwargs["ExclusiveStartKey"] = lek
+
+        keep = ~np.isin(frame.user, np.asarray(codes, dtype=np.int32))
+        fresh = buf.frame()
+        self._frame = ParticipationFrame(
+            users=frame.users,
+            user=np.concatenate([frame.user[keep], fresh.user]),
+            day=np.concatenate([frame.day[keep], fresh.day]),
+            hour=np.concatenate([frame.hour[keep], fresh.hour]),
+            status=np.concatenate([frame.status[keep], fresh.status]),
+        )
+        self.incremental_refreshes += 1
+        self.last_incremental = {
+            "users": len(codes),
+            "rows": len(fresh),
+            "seconds": round(time.perf_counter() - start, 4),
+        }
+
+
+analytics_engine = AnalyticsEngine()
@@ -2,7 +2,11 @@ from datetime import datetime, timezone, date
 from uuid import uuid4
 from dotenv import load_dotenv
 from boto3.dynamodb.conditions import Key
-from utils.points import record_spend
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from concurrent.futures import ThreadPoolExecutor
+from utils.points import put_ledger_item, put_point_tx, record_spend
+from utils.user_stats_cache import user_stats_cache
+from utils.shared_cache import shared_cache
 from uguu.point import get_point_multiplier
 from typing import Any, Dict, List, Optional, Tuple, Set
 import json, base64
@@ -16,23 +20,17 @@ from flask import current_app
 from uguu.point import (
     PointRules,
     normalize_participation_history,
-    calc_reset_index,
-    slice_records_for_points,
-    build_participated_date_set,
-    calc_registration_counts,
-    calc_participation_and_cumulative,
-    calc_monthly_bonus,
-    calc_days_until_reset,
-    classify,
-    better,
-    calc_streak_points,
-    get_point_multiplier,
 )
+from uguu.point_state import PointsCheckpoint, advance_points
 
 load_dotenv()
 
 import boto3
 import os
+import time
+
+FEED_REPLY_WORKERS = 4  # タイムラインの返信取得の同時リクエスト数
+
 
 def get_today_jst():
     return datetime.now(JST).date()
@@ -84,6 +82,19 @@ def iso_to_jst(s: str) -> str:
     except Exception:
         return s
 
+def is_first_participation_record(item: dict) -> bool:
+    """
+    初参加日の判定対象になる履歴レコードか。
+    - 正式参加（status 未設定は registered 扱い）で date を持つもの
+    - ポイント取引（joined_at=points#...）は除外
+    """
+    if item.get("entity_type") == "point_transaction":
+        return False
+    if (item.get("status") or "registered").lower() != "registered":
+        return False
+    return bool(item.get("date"))
+
+
 def _encode_cursor(last_key: Optional[Dict[str, Any]]) -> Optional[str]:
     if not last_key:
         return None
@@ -168,68 +179,177 @@ class DynamoDB:
                 if isinstance(pk, str) and pk.startswith("POST#"):
                     post_id = pk.split("#", 1)[1]
 
-            user_id = post.get("user_id")
-
-            p: Dict[str, Any] = {
+            enriched_posts.append({
                 "post_id": post_id,
                 "content": post.get("content"),
                 "image_url": post.get("image_url"),
                 "youtube_url": post.get("youtube_url"),
                 "created_at": post.get("created_at"),
                 "updated_at": post.get("updated_at", post.get("created_at")),
-                "user_id": user_id,
+                "user_id": post.get("user_id"),
                 "display_name": post.get("display_name"),
                 "user_name": post.get("user_name"),
-            }
+                "likes_count": int(post.get("likes_count", 0) or 0),
+                # 返信数は投稿側のカウンタ（無い古い投稿だけ COUNT する）
+                "replies_count": int(post["replies_count"]) if "replies_count" in post else None,
+            })
 
-            # 返信
-            if post_id:
-                try:
-                    rr = self.replies_table.query(
-                        KeyConditionExpression=Key("post_id").eq(str(post_id)) & Key("sk").begins_with("REPLY#"),
-                        ScanIndexForward=False,
-                        Limit=replies_limit,
-                    )
-                    replies_items = rr.get("Items", [])
+        # 返信（投稿ごとの Query を並列に）
+        replies_by_post = self._fetch_feed_replies(
+            [p["post_id"] for p in enriched_posts if p["post_id"]],
+            replies_limit=replies_limit,
+            count_for={p["post_id"] for p in enriched_posts if p["post_id"] and p["replies_count"] is None},
+        )
+        for p in enriched_posts:
+            replies, count = replies_by_post.get(p["post_id"], ([], None))
+            p["replies"] = replies
+            if p["replies_count"] is None:
+                p["replies_count"] = count or 0
 
-                    cr = self.replies_table.query(
-                        KeyConditionExpression=Key("post_id").eq(str(post_id)) & Key("sk").begins_with("REPLY#"),
-                        Select="COUNT",
-                    )
-                    replies_count = int(cr.get("Count", 0))
-
-                    p["replies"] = [
-                        {
-                            "reply_id": it.get("reply_id") or (
-                                it.get("sk", "").split("#", 1)[1]
-                                if str(it.get("sk", "")).startswith("REPLY#")
-                                else None
-                            ),
-                            "post_id": str(post_id),
-                            "user_id": it.get("user_id"),
-                            "content": it.get("content"),
-                            "created_at": it.get("created_at"),
-                            "display_name": it.get("display_name"),
-                            "profile_image_url": it.get("profile_image_url"),
-                        }
-                        for it in replies_items
-                    ]
-                    p["replies_count"] = replies_count
+        # ★これが必要（必ずタプルで返す）
+        return enriched_posts, next_cursor
 
-                except Exception as e:
-                    print("[DEBUG replies] error:", e)
-                    p["replies"] = []
-                    p["replies_count"] = 0
-            else:
-                p["replies"] = []
-                p["replies_count"] = 0
+    def _fetch_feed_replies(self, post_ids, replies_limit: int, count_for=()):
+        """
+        post_id -> (直近の返信リスト, 返信数 or None)
+        投稿ごとの Query は FEED_REPLY_WORKERS 本まで並列に投げる（低レベル client はスレッドセーフ）
+        返信数は count_for に含まれる（replies_count カウンタの無い）投稿だけ COUNT する
+        """
+        if not post_ids:
+            return {}
 
-            # ★これが必要（作ったpをリストに入れる）
-            enriched_posts.append(p)
+        client = self.dynamodb.meta.client
+        table_name = self.replies_table.name
+        deserializer = TypeDeserializer()
+        key_cond = "post_id = :pid AND begins_with(sk, :pfx)"
 
-        # ★これが必要（必ずタプルで返す）
-        return enriched_posts, next_cursor
+        def fetch(post_id):
+            values = {":pid": {"S": str(post_id)}, ":pfx": {"S": "REPLY#"}}
+            try:
+                rr = client.query(
+                    TableName=table_name,
+                    KeyConditionExpression=key_cond,
+                    ExpressionAttributeValues=values,
+                    ScanIndexForward=False,
+                    Limit=replies_limit,
+                )
+                replies = []
+                for raw in rr.get("Items", []):
+                    it = {k: deserializer.deserialize(v) for k, v in raw.items()}
+                    replies.append({
+                        "reply_id": it.get("reply_id") or (
+                            it.get("sk", "").split("#", 1)[1]
+                            if str(it.get("sk", "")).startswith("REPLY#")
+                            else None
+                        ),
+                        "post_id": str(post_id),
+                        "user_id": it.get("user_id"),
+                        "content": it.get("content"),
+                        "created_at": it.get("created_at"),
+                        "display_name": it.get("display_name"),
+                        "profile_image_url": it.get("profile_image_url"),
+                    })
 
+                count = None
+                if post_id in count_for:
+                    if "LastEvaluatedKey" not in rr:
+                        count = len(replies)  # 1ページに収まっていれば COUNT 不要
+                    else:
+                        count = 0
+                        kwargs = dict(TableName=table_name, KeyConditionExpression=key_cond,
+                                      ExpressionAttributeValues=values, Select="COUNT")
+                        while True:
+                            cr = client.query(**kwargs)
+                            count += int(cr.get("Count", 0))
+                            if "LastEvaluatedKey" not in cr:
+                                break
+                            kwargs["ExclusiveStartKey"] = cr["LastEvaluatedKey"]
+                return replies, count
+            except Exception as e:
+                print("[DEBUG replies] error:", e)
+                return [], 0
+
+        workers = max(1, min(FEED_REPLY_WORKERS, len(post_ids)))
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            return dict(zip(post_ids, ex.map(fetch, post_ids)))
+
+    def get_liked_post_ids(self, post_ids, user_id) -> Set[str]:
+        """
+        user_id がいいね済みの post_id の集合（LIKE# 行を BatchGet、100件ずつ）
+        投稿ごとの check_if_liked の代わりにタイムラインで使う
+        """
+        ids = list(dict.fromkeys(str(p) for p in post_ids or [] if p))
+        if not ids or not user_id:
+            return set()
+
+        table_name = self.posts_table.name
+        liked: Set[str] = set()
+        for i in range(0, len(ids), 100):
+            request_items = {table_name: {
+                "Keys": [{"PK": f"POST#{pid}", "SK": f"LIKE#{user_id}"} for pid in ids[i:i + 100]],
+                "ProjectionExpression": "PK",
+            }}
+            for attempt in range(4):
+                resp = self.dynamodb.batch_get_item(RequestItems=request_items)
+                for it in resp.get("Responses", {}).get(table_name, []):
+                    liked.add(str(it["PK"]).split("#", 1)[1])
+                request_items = resp.get("UnprocessedKeys") or {}
+                if not request_items:
+                    break
+                time.sleep(0.05 * (2 ** attempt))
+        return liked
+
+    def _transact_with_counter(self, item_op: Dict[str, Any], post_id: str, field: str, delta: int, seed=None):
+        """
+        1件の Put/Delete（item_op）と投稿の counter ADD を1トランザクションで書く
+        seed: カウンタの無い投稿（カウンタ導入前）の現在値を数える関数。渡すとカウンタがある時だけ ADD し、
+              無ければ seed() の実数を if_not_exists で入れてから delta を足す（先に他の書き込みが入れていればそちらを使う）
+        Returns: None（成功）/ "item"（item_op の条件不成立）/ "post"（投稿が無い）
+        """
+        client = self.dynamodb.meta.client
+        serializer = TypeSerializer()
+        counter = {
+            "TableName": self.posts_table.name,
+            "Key": {"PK": {"S": f"POST#{post_id}"}, "SK": {"S": f"METADATA#{post_id}"}},
+            "UpdateExpression": "ADD #f :d",
+            "ConditionExpression": "attribute_exists(PK)",
+            "ExpressionAttributeNames": {"#f": field},
+            "ExpressionAttributeValues": {":d": serializer.serialize(delta)},
+        }
+        if seed is not None:
+            counter["ConditionExpression"] = "attribute_exists(PK) AND attribute_exists(#f)"
+            counter["ReturnValuesOnConditionCheckFailure"] = "ALL_OLD"
+
+        def attempt():
+            """Returns: (None / "item" / "post", 条件不成立時に返った投稿)"""
+            try:
+                client.transact_write_items(TransactItems=[item_op, {"Update": counter}])
+                return None, None
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "TransactionCanceledException":
+                    raise
+                reasons = e.response.get("CancellationReasons", [])
+                codes = [r.get("Code") for r in reasons]
+                if codes and codes[0] == "ConditionalCheckFailed":
+                    return "item", None
+                if len(codes) > 1 and codes[1] == "ConditionalCheckFailed":
+                    return "post", reasons[1].get("Item")
+                raise
+
+        failed, post = attempt()
+        if failed == "post" and post:
+            # 投稿はあるがカウンタが無い → 実数で初期化してから足す
+            counter.update(
+                UpdateExpression="SET #f = if_not_exists(#f, :base) + :d",
+                ConditionExpression="attribute_exists(PK)",
+                ExpressionAttributeValues={
+                    ":d": serializer.serialize(delta),
+                    ":base": serializer.serialize(seed()),
+                },
+            )
+            counter.pop("ReturnValuesOnConditionCheckFailure")
+            failed, _ = attempt()
+        return failed
 
     def get_post(self, post_id: str) -> Optional[Dict[str, Any]]:
         """投稿メタデータ1件を取得（uguu_post から）"""
@@ -427,47 +547,122 @@ class DynamoDB:
             print(f"返信削除エラー: {str(e)}")
             return False
         
+    def create_reply(self, post_id: str, user_id: str, content: str, display_name: str = "不明") -> Dict[str, Any]:
+        """返信を作成し、投稿の replies_count を同じトランザクションで +1 する"""
+        reply_id = str(uuid4())
+        item = {
+            "post_id": str(post_id),
+            "sk": f"REPLY#{reply_id}",
+            "reply_id": reply_id,
+            "user_id": str(user_id),
+            "content": content,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "display_name": display_name,
+        }
+        serializer = TypeSerializer()
+        failed = self._transact_with_counter(
+            {"Put": {
+                "TableName": self.replies_table.name,
+                "Item": {k: serializer.serialize(v) for k, v in item.items()},
+                "ConditionExpression": "attribute_not_exists(sk)",
+            }},
+            post_id, "replies_count", 1,
+            seed=lambda: self.count_replies(post_id),
+        )
+        if failed == "post":
+            raise Exception(f"Post {post_id} not found")
+        if failed == "item":
+            raise Exception(f"Reply {reply_id} already exists")
+        return item
+
+    def count_replies(self, post_id: str) -> int:
+        """投稿の返信の実数（強い整合性の COUNT。replies_count カウンタの初期化用）"""
+        kwargs = {
+            "KeyConditionExpression": Key("post_id").eq(str(post_id)) & Key("sk").begins_with("REPLY#"),
+            "Select": "COUNT",
+            "ConsistentRead": True,
+        }
+        total = 0
+        while True:
+            res = self.replies_table.query(**kwargs)
+            total += int(res.get("Count", 0))
+            if "LastEvaluatedKey" not in res:
+                return total
+            kwargs["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+
     def delete_reply(self, post_id: str, reply_id: str) -> bool:
-        """返信1件を削除（sk = REPLY#<reply_id> 前提）"""
+        """返信1件を削除（sk = REPLY#<reply_id> 前提）。replies_count も同じトランザクションで -1"""
         try:
             sk = f"REPLY#{reply_id}"
-            self.replies_table.delete_item(
-                Key={"post_id": str(post_id), "sk": sk}
+            failed = self._transact_with_counter(
+                {"Delete": {
+                    "TableName": self.replies_table.name,
+                    "Key": {"post_id": {"S": str(post_id)}, "sk": {"S": sk}},
+                    "ConditionExpression": "attribute_exists(sk)",
+                }},
+                post_id, "replies_count", -1,
+                seed=lambda: self.count_replies(post_id),
             )
+            if failed == "post":
+                # 投稿が既に無い → カウンタは不要なので返信だけ消す
+                self.replies_table.delete_item(Key={"post_id": str(post_id), "sk": sk})
             return True
         except Exception as e:
             print("[delete_reply] error:", e)
             return False
-        
 
-    def like_post(self, post_id, user_id):
-        """投稿にいいねを追加/削除"""
+    def like_post(self, post_id, user_id, liked: Optional[bool] = None):
+        """
+        投稿にいいねを追加/削除
+        LIKE# 行の条件付き Put/Delete と likes_count の ADD を1トランザクションで書く（同時押しでもずれない）
+
+        liked=True/False: その状態にする（既にその状態なら何もしない）。タイムラインはこちらを送る
+        liked=None      : トグル（LIKE# 行を強い整合性で読み、逆の状態へ条件付きで1回書く）
+        Returns: 処理後にいいねしているか
+        """
         try:
-            # いいねの状態を確認
-            like_key = {
-                'PK': f"POST#{post_id}",
-                'SK': f"LIKE#{user_id}"
-            }
-            
-            response = self.posts_table.get_item(Key=like_key)
-            
-            if 'Item' in response:
-                # いいねを削除
-                self.posts_table.delete_item(Key=like_key)
-                self.update_likes_count(post_id, -1)
-                return False
-            else:
-                # いいねを追加
-                like_data = {
-                    'PK': f"POST#{post_id}",
-                    'SK': f"LIKE#{user_id}",
-                    'user_id': user_id,
-                    'created_at': datetime.now().isoformat()
-                }
-                self.posts_table.put_item(Item=like_data)
-                self.update_likes_count(post_id, 1)
-                return True
-                
+            like_key = {"PK": {"S": f"POST#{post_id}"}, "SK": {"S": f"LIKE#{user_id}"}}
+            table_name = self.posts_table.name
+
+            def add():
+                return self._transact_with_counter(
+                    {"Put": {
+                        "TableName": table_name,
+                        "Item": {
+                            **like_key,
+                            "user_id": {"S": str(user_id)},
+                            "created_at": {"S": datetime.now().isoformat()},
+                        },
+                        "ConditionExpression": "attribute_not_exists(SK)",
+                    }},
+                    post_id, "likes_count", 1,
+                )
+
+            def remove():
+                return self._transact_with_counter(
+                    {"Delete": {
+                        "TableName": table_name,
+                        "Key": like_key,
+                        "ConditionExpression": "attribute_exists(SK)",
+                    }},
+                    post_id, "likes_count", -1,
+                )
+
+            if liked is None:
+                # 失敗するトランザクションを試し書きしない（書き込み容量を2回分使う）よう、先に読む
+                liked = not self.check_if_liked(post_id, user_id, consistent=True)
+
+            if liked:
+                failed = add()
+                if failed == "post":
+                    raise Exception(f"Post {post_id} not found")
+                return True  # failed == "item" は既にいいね済み
+
+            failed = remove()
+            if failed == "post":
+                raise Exception(f"Post {post_id} not found")
+            return False
+
         except Exception as e:
             print(f"Error in like_post: {e}")
             raise
@@ -490,28 +685,26 @@ class DynamoDB:
             raise
 
     def get_likes_count(self, post_id):
-        """投稿のいいね数を取得"""
+        """投稿のいいね数を取得（METADATA の likes_count カウンタ）"""
         try:
-            response = self.posts_table.query(
-                KeyConditionExpression="PK = :pk AND begins_with(SK, :like)",
-                ExpressionAttributeValues={
-                    ':pk': f"POST#{post_id}",
-                    ':like': 'LIKE#'
-                }
+            response = self.posts_table.get_item(
+                Key={"PK": f"POST#{post_id}", "SK": f"METADATA#{post_id}"},
+                ProjectionExpression="likes_count",
+                ConsistentRead=True,
             )
-            return len(response.get('Items', []))
+            return int((response.get("Item") or {}).get("likes_count", 0))
         except Exception as e:
             print(f"Error getting likes count: {e}")
             return 0
 
-    def check_if_liked(self, post_id, user_id):
+    def check_if_liked(self, post_id, user_id, consistent=False):
         """ユーザーが投稿をいいねしているか確認"""
         try:
             key = {
                 'PK': f"POST#{post_id}",
                 'SK': f"LIKE#{user_id}"
             }
-            response = self.posts_table.get_item(Key=key)
+            response = self.posts_table.get_item(Key=key, ConsistentRead=consistent)
             return 'Item' in response
         except Exception as e:
             print(f"Error checking like status: {e}")
@@ -734,6 +927,12 @@ class DynamoDB:
             
             if updated_count > 0:
                 print(f"[INFO] キャンセル成功: user_id={user_id}, date={date}, schedule_id={schedule_id}, 更新件数={updated_count}")
+                # 初参加日がキャンセルされた日なら繰り下げが必要
+                try:
+                    self.recompute_first_participation(user_id)
+                except Exception as e:
+                    print(f"[WARN] first_participation_date 再計算失敗: user_id={user_id}, err={e}")
+                self.bump_stats_version(user_id)
             else:
                 print(f"[WARNING] 該当レコードなし: user_id={user_id}, date={date}, schedule_id={schedule_id}")
             
@@ -1091,6 +1290,7 @@ class DynamoDB:
     # 参加履歴の書き込み（登録/更新時に呼ぶ。ビューからは呼ばない）
     def record_participation(self, date_str: str, schedule_id: str, participants: list[str]):
         tbl = self.dynamodb.Table("bad-users-history")
+        written = []
         for uid in set(participants or []):
             # すでに同日の記録があるか確認
             resp = tbl.query(
@@ -1102,12 +1302,83 @@ class DynamoDB:
             if resp.get("Count", 0) > 0:
                 continue  # 同日データがあればスキップ
 
-            tbl.put_item(Item={
+            put_ledger_item(tbl, {
                 "user_id": uid,
                 "joined_at": datetime.utcnow().isoformat() + "Z",
                 "date": date_str,
                 "schedule_id": schedule_id
             })
+            self.update_first_participation(uid, date_str)
+            written.append(uid)
+        if written:
+            self.bump_stats_version(*written)
+
+    # ===== 初参加日インデックス（bad-users.first_participation_date） =====
+
+    def update_first_participation(self, user_id: str, event_date: str) -> bool:
+        """
+        正式参加(registered)を記録したときに呼ぶ。
+        first_participation_date が未設定、または event_date より後の場合だけ前倒しする。
+        （条件付き更新なので読み取り不要・同時更新でも最小値が残る）
+        """
+        if not user_id or not event_date:
+            return False
+        try:
+            self.users_table.update_item(
+                Key={"user#user_id": user_id},
+                UpdateExpression="SET first_participation_date = :d",
+                ConditionExpression=(
+                    "attribute_exists(#pk) AND "
+                    "(attribute_not_exists(first_participation_date) OR first_participation_date > :d)"
+                ),
+                ExpressionAttributeNames={"#pk": "user#user_id"},
+                ExpressionAttributeValues={":d": event_date},
+            )
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+
+    def recompute_first_participation(self, user_id: str) -> str | None:
+        """
+        ユーザー本人の履歴だけを query して first_participation_date を再計算する。
+        キャンセル・ノーショウ削除などで最小日付が変わる可能性があるときに呼ぶ。
+        """
+        first_date = None
+        kwargs = {"KeyConditionExpression": Key("user_id").eq(user_id)}
+        while True:
+            resp = self.part_history.query(**kwargs)
+            for item in resp.get("Items", []):
+                if is_first_participation_record(item):
+                    d = item["date"]
+                    if first_date is None or d < first_date:
+                        first_date = d
+            lek = resp.get("LastEvaluatedKey")
+            if not lek:
+                break
+            kwargs["ExclusiveStartKey"] = lek
+
+        try:
+            if first_date:
+                self.users_table.update_item(
+                    Key={"user#user_id": user_id},
+                    UpdateExpression="SET first_participation_date = :d",
+                    ConditionExpression="attribute_exists(#pk)",
+                    ExpressionAttributeNames={"#pk": "user#user_id"},
+                    ExpressionAttributeValues={":d": first_date},
+                )
+            else:
+                self.users_table.update_item(
+                    Key={"user#user_id": user_id},
+                    UpdateExpression="REMOVE first_participation_date",
+                    ConditionExpression="attribute_exists(#pk)",
+                    ExpressionAttributeNames={"#pk": "user#user_id"},
+                )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+        return first_date
 
     # def get_user_participation_history(self, user_id: str):
     #     from datetime import datetime
@@ -1412,11 +1683,10 @@ class DynamoDB:
                 "version": 1,
             }
 
-            self.part_history.put_item(
-                Item=item,
-                ConditionExpression="attribute_not_exists(user_id) AND attribute_not_exists(joined_at)",
-            )
+            # 台帳集計（ugu_points_v2）も同じトランザクションで更新
+            put_point_tx(self.part_history, item)
 
+            self.bump_stats_version(str(user_id))
             print(f"[SUCCESS] earn保存 - user_id={user_id}, +{pts}P, earn_type={earn_type_norm}, source={source}")
             return True
 
@@ -1438,6 +1708,7 @@ class DynamoDB:
                 reason=description,
                 created_by=None
             )
+            self.bump_stats_version(user_id)
             print(f"[SUCCESS] 支払い記録保存 - user_id={user_id}, event_date={event_date}, points={points_used}P")
             return True
         except Exception as e:
@@ -1634,7 +1905,7 @@ class DynamoDB:
                 using_calculated = False
             else:
                 # フォールバック：既存の計算ロジック
-                stats = self.get_user_stats(user_id)
+                stats = self.get_user_stats_cached(user_id)
                 total_earned = (
                     int(stats.get('participation_points', 0)) +
                     int(stats.get('streak_points', 0)) +
@@ -1819,6 +2090,87 @@ class DynamoDB:
       
     
         # プロフィール表示用：うぐポイント等の集計（履歴テーブルのみで計算）
+    def get_stats_version(self, user_id: str):
+        """bad-users の stats_version（履歴が変わるたびに +1）。未設定は 0"""
+        try:
+            resp = self.users_table.get_item(
+                Key={"user#user_id": user_id},
+                ProjectionExpression="stats_version",
+                ConsistentRead=True,
+            )
+            return int((resp.get("Item") or {}).get("stats_version", 0))
+        except Exception as e:
+            print(f"[WARN] stats_version 取得失敗 user_id={user_id}: {e}")
+            return None
+
+    def bump_stats_version(self, *user_ids):
+        """
+        参加履歴・ポイント台帳を書いたあとに呼ぶ
+        他プロセスのキャッシュはバージョン不一致で、このプロセスのキャッシュは即時に無効化される
+        """
+        for user_id in {u for u in user_ids if u}:
+            try:
+                self.users_table.update_item(
+                    Key={"user#user_id": user_id},
+                    UpdateExpression="ADD stats_version :one",
+                    ConditionExpression="attribute_exists(#pk)",
+                    ExpressionAttributeNames={"#pk": "user#user_id"},
+                    ExpressionAttributeValues={":one": 1},
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    print(f"[WARN] stats_version 更新失敗 user_id={user_id}: {e}")
+        user_stats_cache.invalidate(*user_ids)
+        try:
+            # 集計エンジン（uguu/analytics_engine）の差分更新用に、どのユーザーの履歴が変わったかを残す
+            shared_cache.publish("history", user_ids)
+        except Exception as e:
+            print(f"[WARN] history 変更ログの記録に失敗: {e}")
+
+    def get_user_stats_cached(self, user_id: str, version=None):
+        """
+        get_user_stats の結果を (user_id, stats_version, 今日の日付) でキャッシュして返す
+        version を渡せばバージョン確認の読み取りも省略する
+        """
+        if version is None:
+            version = self.get_stats_version(user_id)
+        day = datetime.now(JST).date().isoformat()
+
+        if version is not None:
+            cached = user_stats_cache.get("user_stats", user_id, version, day)
+            if cached is not None:
+                return cached
+
+        stats = self.get_user_stats(user_id)
+        if version is not None and stats is not None:
+            user_stats_cache.put("user_stats", user_id, version, day, stats)
+        return stats
+
+    def load_points_checkpoint(self, user_id: str):
+        """bad-users の points_checkpoint（旧ルールポイントの途中計算）。無ければ None"""
+        try:
+            resp = self.users_table.get_item(
+                Key={"user#user_id": user_id},
+                ProjectionExpression="points_checkpoint",
+            )
+            return PointsCheckpoint.from_item((resp.get("Item") or {}).get("points_checkpoint"))
+        except Exception as e:
+            print(f"[WARN] points_checkpoint 取得失敗 user_id={user_id}: {e}")
+            return None
+
+    def save_points_checkpoint(self, user_id: str, cp):
+        """失敗しても次回は作り直すだけなので例外は投げない"""
+        try:
+            self.users_table.update_item(
+                Key={"user#user_id": user_id},
+                UpdateExpression="SET points_checkpoint = :cp",
+                ConditionExpression="attribute_exists(#pk)",
+                ExpressionAttributeNames={"#pk": "user#user_id"},
+                ExpressionAttributeValues={":cp": cp.to_item()},
+            )
+        except Exception as e:
+            print(f"[WARN] points_checkpoint 保存失敗 user_id={user_id}: {e}")
+
     def get_user_stats(self, user_id: str, raw_history=None, spends=None, all_schedules=None):
         rules = PointRules(reset_days=60, first_participation_points=200)
 
@@ -1867,64 +2219,44 @@ class DynamoDB:
                 'manual_points': manual_points,
             }
 
-        # リセット判定
-        last_reset_index, is_reset = calc_reset_index(records_all, rules.reset_days)
-        records_for_points = slice_records_for_points(records_all, last_reset_index)
-        print("[DBG] user_id=", user_id, "records_all=", len(records_all), "records_for_points=", len(records_for_points))
+        # 連続ポイント用の練習日
+        today = datetime.now(JST).date()
+
+        if all_schedules is None:
+            all_schedules = self.get_all_past_schedules(today)
 
-        # ★リセットが発生している場合、手動ポイントもリセット
-        if last_reset_index > 0:
-            print(f"[DBG] Reset occurred at index {last_reset_index}, clearing manual_points")
-            manual_points = 0
+        # 保存済みチェックポイントに増えた分だけ畳み込む（倍率変更・キャンセル等があれば全件から作り直し）
+        saved_cp = self.load_points_checkpoint(user_id)
+        cp = advance_points(saved_cp, records_all, all_schedules, rules, point_multiplier, self._is_early_registration)
+        if saved_cp is None or cp.to_item() != saved_cp.to_item():
+            self.save_points_checkpoint(user_id, cp)
 
-        all_time_early, all_time_direct = calc_registration_counts(records_all, self._is_early_registration)
+        ps = cp.to_stats()
+        is_reset = ps["is_reset"]
+        reset_date = ps["reset_date"]
+        print("[DBG] user_id=", user_id, "records_all=", len(records_all), "records_for_points=", ps["cumulative_count"])
 
-        pc = calc_participation_and_cumulative(
-            records_all=records_all,
-            records_for_points=records_for_points,
-            rules=rules,
-            point_multiplier=point_multiplier,
-            is_early_registration_fn=self._is_early_registration,
-        )
-        participation_points = pc.get("participation_points", 0)
-        cumulative_count = pc.get("cumulative_count", 0)
-        cumulative_bonus_points = pc.get("cumulative_bonus_points", 0)
-        early_registration_count = pc.get("early_registration_count", 0)
-        direct_registration_count = pc.get("direct_registration_count", 0)
+        # ★リセットが発生している場合、手動ポイントもリセット
+        if reset_date:
+            print(f"[DBG] Reset occurred at {reset_date}, clearing manual_points")
+            manual_points = 0
 
-        monthly_bonus_points, monthly_bonuses = calc_monthly_bonus(records_for_points, point_multiplier)
+        all_time_early = ps["all_time_early_registration_count"]
+        all_time_direct = ps["all_time_direct_registration_count"]
+        participation_points = ps["participation_points"]
+        cumulative_count = ps["cumulative_count"]
+        cumulative_bonus_points = ps["cumulative_bonus_points"]
+        early_registration_count = ps["early_registration_count"]
+        direct_registration_count = ps["direct_registration_count"]
+        monthly_bonus_points = ps["monthly_bonus_points"]
+        monthly_bonuses = ps["monthly_bonuses"]
 
         print(f"[DBG] participation_points={participation_points}, cumulative_bonus={cumulative_bonus_points}")
         print(f"[DBG] monthly_bonus_points={monthly_bonus_points}")
 
-        # 連続ポイント        
-        today = datetime.now(JST).date()
-
-        if all_schedules is None:
-            all_schedules = self.get_all_past_schedules(today)
-            all_schedules.sort(key=lambda s: datetime.strptime(s["date"], "%Y-%m-%d").date())
-
-        if last_reset_index > 0 and records_for_points:
-            reset_date = records_for_points[0].event_date.strftime('%Y-%m-%d')
-            all_schedules = [s for s in all_schedules if s['date'] >= reset_date]
-            print(f"\n[DEBUG] 連続参加チェック（{reset_date} 以降のスケジュールのみ）")
-        else:
-            print(f"\n[DEBUG] 連続参加チェック（全スケジュール）")
-
-        # 連続参加は「日単位」で判定するため、同日複数スケジュールは1日1件に集約
-        seen_streak_dates: set = set()
-        all_schedules_for_streak = []
-        for s in all_schedules:
-            if s["date"] not in seen_streak_dates:
-                seen_streak_dates.add(s["date"])
-                all_schedules_for_streak.append(s)
-
-        streak_points, current_streak_count, max_streak, current_streak_start = calc_streak_points(
-            records_for_points=records_for_points,
-            all_schedules=all_schedules_for_streak,
-            rules=rules,
-            point_multiplier=point_multiplier,
-        )
+        streak_points = ps["streak_points"]
+        current_streak_count = ps["current_streak_count"]
+        current_streak_start = ps["current_streak_start"]
 
         print(f"[DBG] streak_points={streak_points}, current_streak={current_streak_count}")
 
@@ -1958,8 +2290,7 @@ class DynamoDB:
         if spends is None:
             spends = self.list_point_spends(user_id, limit=1000)
 
-        if last_reset_index > 0 and records_for_points:
-            reset_date = records_for_points[0].event_date.strftime('%Y-%m-%d')
+        if reset_date:
             spends_after_reset = [s for s in spends if (s.get("event_date", "") or "") >= reset_date]
             total_points_used = sum(_pick_spend_amount(s) for s in spends_after_reset)
             print(f"[DBG] Reset at {reset_date}: points_used={total_points_used} from {len(spends_after_reset)}/{len(spends)} records")
@@ -1968,7 +2299,7 @@ class DynamoDB:
             print(f"[DBG] total_points_used={total_points_used} from {len(spends)} records")
 
         last_dt = records_all[-1].event_date
-        days_until_reset = calc_days_until_reset(last_dt, rules.reset_days)
+        days_until_reset = ps["days_until_reset"]
 
         total_participation_all_time = len(records_all)
 
@@ -2105,42 +2436,6 @@ class DynamoDB:
         return user_data.get('points', 0)
     
 
-def record_spend(history_table, *, user_id: str, points_used: int,
-                 event_date: str, payment_type: str = "event_participation",
-                 reason: str | None = None, created_by: str | None = None):
-    """
-    bad-users-history に消費(spend)トランザクションを1件保存する。
-    """
-    now = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
-    tx_id = str(uuid4())
-    joined_at = f"points#spend#{now}#{tx_id}"  # ← 既存設計を維持するならそのまま
-
-    item = {
-        "user_id": user_id,
-        "joined_at": joined_at,
-        "tx_id": tx_id,
-        "kind": "spend",
-        "delta_points": -int(points_used),
-        "points_used": int(points_used),
-        "payment_type": payment_type,
-        "event_date": event_date,
-        "reason": reason or f"{event_date}の参加費",
-        "created_at": now,   # レコード作成時刻
-        "paid_at": now,      # ★支払い確定時刻（新規追加）
-        "entity_type": "point_transaction",
-        "version": 1,
-    }
-
-    if created_by is not None:
-        item["created_by"] = created_by
-
-    history_table.put_item(
-        Item=item,
-        ConditionExpression="attribute_not_exists(user_id) AND attribute_not_exists(joined_at)"
-    )
-    return item
-
-
 class PointTransaction:
     """ポイント取引のデータ構造を定義"""
     
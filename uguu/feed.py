@@ -0,0 +1,59 @@
+"""
+タイムラインの投稿一覧の組み立て（表示用の付加情報をまとめて取る）
+
+get_posts_page() の結果に対して
+- 投稿者（表示名・アイコン）: user_directory.get_many で BatchGet 1回（キャッシュ済みなら0回）
+- 閲覧者の「いいね済み」: uguu_post の LIKE# 行を BatchGet 1回
+をまとめて付け足す。投稿ごとの get_item / check_if_liked は行わない。
+"""
+
+from utils.user_directory import user_directory
+
+from .dynamo import db
+
+
+def profile_image_url(user):
+    url = (user.get("profile_image_url")
+           or user.get("profileImageUrl")
+           or user.get("large_image_url")
+           or "")
+    url = url.strip() if isinstance(url, str) else ""
+    return url if url and url.lower() != "none" else None
+
+
+def enrich_feed_posts(posts, viewer_id=None, is_admin=False):
+    """posts を書き換えて返す（投稿者情報・編集/削除可否・いいね済み）"""
+    if not posts:
+        return posts
+
+    authors = user_directory.get_many([p.get("user_id") for p in posts])
+
+    liked = set()
+    if viewer_id:
+        try:
+            liked = db.get_liked_post_ids([p.get("post_id") for p in posts], viewer_id)
+        except Exception as e:
+            print(f"[feed] いいね状態の取得に失敗: {e}")
+
+    for p in posts:
+        uid = p.get("user_id")
+        user = authors.get(str(uid)) if uid else None
+        user = user or {}
+
+        p["can_edit"] = bool(viewer_id and uid and viewer_id == uid)
+        p["display_name"] = p.get("display_name") or user.get("display_name") or "不明"
+        p["user_name"] = p.get("user_name") or user.get("user_name") or ""
+        p["profile_image_url"] = profile_image_url(user) if user else None
+
+        p.setdefault("replies", [])
+        p.setdefault("replies_count", 0)
+        p.setdefault("likes_count", 0)
+
+        # 返信ごとの削除可否（返信者本人 or 管理者）
+        for r in p.get("replies", []):
+            r_user_id = (r.get("user_id") or "").strip()
+            r["can_delete"] = bool(viewer_id and (viewer_id == r_user_id or is_admin))
+
+        p["is_liked_by_user"] = bool(p.get("post_id")) and p.get("post_id") in liked
+
+    return posts
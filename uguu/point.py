@@ -2,10 +2,10 @@ from __future__ import annotations
 
 from collections import defaultdict
 from dataclasses import dataclass
-from datetime import date, datetime, time
+from datetime import date, datetime, time, timedelta
 from decimal import Decimal, InvalidOperation
 from typing import Any, Dict, List, Optional, Set, Tuple
-from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.conditions import Key
 
 from utils.timezone import JST
 
@@ -586,15 +586,150 @@ def get_saved_point_snapshot(dynamodb, user_id: str) -> dict:
     return snapshot
 
 
+POINT_BALANCE_TABLE = "ugu_points_v2"
+HISTORY_TABLE = "bad-users-history"
+
+# ugu_points_v2 に持たせる「基準日以降の台帳集計」（put_ledger_item が ADD で更新し、
+# reconcile_point_balances.py が台帳と突き合わせて ledger_ready=True にする）
+LEDGER_BALANCE_FIELDS = (
+    "ledger_earned", "ledger_spent", "ledger_adjusted",
+    "ledger_earn_count", "ledger_spend_count", "ledger_adjust_count",
+    "ledger_zero_join_count",
+)
+JOIN_ACTIONS = ("join", "joined")
+
+
+def history_created_at(item):
+    return parse_iso_datetime(
+        item.get("created_at")
+        or item.get("joined_at")
+        or item.get("registered_at")
+    )
+
+
+def classify_history_item(item, cutoff_dt: Optional[datetime] = None) -> Optional[str]:
+    """
+    bad-users-history の1行を "earn" / "spend" / "adjust" に振り分ける
+    基準日より前・日時不明・ポイントに関係しない行は None
+    """
+    cutoff_dt = cutoff_dt or get_points_cutoff_datetime()
+    created_at = history_created_at(item)
+    if not created_at or created_at < cutoff_dt:
+        return None
+
+    action = str(item.get("action") or "").lower().strip()
+    kind = str(item.get("kind") or "").lower().strip()
+    source = str(item.get("source") or "").lower().strip()
+    marker = str(
+        item.get("joined_at")
+        or item.get("history_id")
+        or item.get("sk")
+        or item.get("created_at")
+        or ""
+    )
+
+    if (
+        kind == "earn"
+        or "points#earn#" in marker
+        or action in (
+            "earn", "point_earn", "admin_add", "admin_grant", "grant",
+            "participate", "participated", "join", "joined",
+            "register", "registered"
+        )
+        or source in ("participation", "schedule_participation", "event_participation")
+    ):
+        return "earn"
+
+    if (
+        kind == "spend"
+        or "points#spend#" in marker
+        or action in ("spend", "point_spend", "use", "consume")
+    ):
+        return "spend"
+
+    if (
+        action in ("adjust", "point_adjust", "admin_adjust")
+        or source == "admin_manual"
+    ):
+        return "adjust"
+
+    return None
+
+
+def read_history_points(item) -> Decimal:
+    val = (
+        item.get("delta_points")
+        or item.get("points")
+        or item.get("points_used")
+        or item.get("amount")
+        or item.get("point")
+    )
+    if val is not None:
+        return to_decimal(val)
+    return Decimal("0")
+
+
+def is_zero_point_join(item) -> bool:
+    """ポイント値を持たない join 行（参加ポイントは呼び出し側の participation_points で1回だけ付く）"""
+    action = str(item.get("action") or "").lower().strip()
+    return read_history_points(item) == 0 and action in JOIN_ACTIONS
+
+
+def ledger_balance_delta(item) -> Dict[str, Decimal]:
+    """
+    履歴1行が ugu_points_v2 の台帳集計に与える差分（ADD 用）
+    集計対象外の行は空 dict
+    """
+    bucket = classify_history_item(item)
+    if bucket is None:
+        return {}
+    p = read_history_points(item)
+    if bucket == "earn":
+        if is_zero_point_join(item):
+            return {"ledger_earn_count": Decimal(1), "ledger_zero_join_count": Decimal(1)}
+        return {"ledger_earned": p, "ledger_earn_count": Decimal(1)}
+    if bucket == "spend":
+        return {"ledger_spent": abs(p), "ledger_spend_count": Decimal(1)}
+    return {"ledger_adjusted": p, "ledger_adjust_count": Decimal(1)}
+
+
+def summarize_ledger(items) -> Dict[str, Decimal]:
+    """履歴の行リストから台帳集計（LEDGER_BALANCE_FIELDS）を作り直す（突き合わせ用）"""
+    totals = {f: Decimal("0") for f in LEDGER_BALANCE_FIELDS}
+    for item in items:
+        for k, v in ledger_balance_delta(item).items():
+            totals[k] += v
+    return totals
+
+
+def _delta_from_ledger_totals(raw_item: dict, participation_points=0) -> dict:
+    earned = to_decimal(raw_item.get("ledger_earned"))
+    if to_decimal(raw_item.get("ledger_zero_join_count")) > 0:
+        earned += to_decimal(participation_points)
+    return {
+        "earned_after_cutoff": earned,
+        "spent_after_cutoff": to_decimal(raw_item.get("ledger_spent")),
+        "adjusted_after_cutoff": to_decimal(raw_item.get("ledger_adjusted")),
+        "earn_count": int(to_decimal(raw_item.get("ledger_earn_count"))),
+        "spend_count": int(to_decimal(raw_item.get("ledger_spend_count"))),
+        "adjust_count": int(to_decimal(raw_item.get("ledger_adjust_count"))),
+    }
+
+
 def get_current_points_hybrid(dynamodb, user_id: str, participation_points=0) -> dict:
     snapshot = get_saved_point_snapshot(dynamodb=dynamodb, user_id=user_id)
-    
-    # 【修正】ここでも participation_points を次の関数へバケツリレーする
-    delta = sum_history_points_after_cutoff(
-        dynamodb=dynamodb, 
-        user_id=user_id, 
-        participation_points=participation_points
-    )
+    raw_item = snapshot.get("raw_item") or {}
+
+    if raw_item.get("ledger_ready"):
+        # 突き合わせ済みの台帳集計がある → snapshot の get_item 1回で完結
+        delta = _delta_from_ledger_totals(raw_item, participation_points)
+    else:
+        # 【修正】ここでも participation_points を次の関数へバケツリレーする
+        delta = sum_history_points_after_cutoff(
+            dynamodb=dynamodb,
+            user_id=user_id,
+            participation_points=participation_points
+        )
 
     base_points = to_decimal(snapshot.get("base_points", 0))
     earned_after = to_decimal(delta.get("earned_after_cutoff", 0))
@@ -628,105 +763,65 @@ def get_current_points_hybrid(dynamodb, user_id: str, participation_points=0) ->
     return result
 
 
-def sum_history_points_after_cutoff(dynamodb, user_id: str, participation_points=0) -> dict:
-    cutoff_dt = get_points_cutoff_datetime()
-    table = dynamodb.Table("bad-users-history")
+def history_sk_lower_bound(cutoff_dt: Optional[datetime] = None) -> str:
+    """
+    基準日以降の履歴を Query するための joined_at（SK）の下限
+    参加履歴の joined_at は UTC の ISO 文字列、ポイント取引は "points#..." で数字より後ろに並ぶ。
+    タイムゾーン差を吸収するため1日手前から読み、正確な判定は classify_history_item で行う。
+    """
+    cutoff_dt = cutoff_dt or get_points_cutoff_datetime()
+    return (cutoff_dt - timedelta(days=1)).date().isoformat()
 
-    resp = table.scan(
-        FilterExpression=Attr("user_id").eq(user_id)
-    )
-    items = resp.get("Items", []) or []
 
-    while "LastEvaluatedKey" in resp:
-        resp = table.scan(
-            FilterExpression=Attr("user_id").eq(user_id),
-            ExclusiveStartKey=resp["LastEvaluatedKey"]
-        )
+def query_history_after_cutoff(dynamodb, user_id: str) -> List[Dict[str, Any]]:
+    """1ユーザー分の基準日以降の履歴（user_id の Query + joined_at の範囲指定）"""
+    table = dynamodb.Table(HISTORY_TABLE)
+    kwargs = {
+        "KeyConditionExpression": Key("user_id").eq(user_id) & Key("joined_at").gte(history_sk_lower_bound())
+    }
+    items = []
+    while True:
+        resp = table.query(**kwargs)
         items.extend(resp.get("Items", []) or [])
+        lek = resp.get("LastEvaluatedKey")
+        if not lek:
+            return items
+        kwargs["ExclusiveStartKey"] = lek
+
+
+def sum_history_points_after_cutoff(dynamodb, user_id: str, participation_points=0) -> dict:
+    cutoff_dt = get_points_cutoff_datetime()
+    items = query_history_after_cutoff(dynamodb, user_id)
 
     print(f"[POINT_DELTA][RAW_ITEMS] user={user_id} count={len(items)}")
 
     earn_items = []
     spend_items = []
     adjust_items = []
+    buckets = {"earn": earn_items, "spend": spend_items, "adjust": adjust_items}
 
     for item in items:
-        created_at = parse_iso_datetime(
-            item.get("created_at")
-            or item.get("joined_at")
-            or item.get("registered_at")
-        )
-
-        if not created_at or created_at < cutoff_dt:
+        bucket = classify_history_item(item, cutoff_dt)
+        if bucket is None:
             continue
 
-        action = str(item.get("action") or "").lower().strip()
-        kind = str(item.get("kind") or "").lower().strip()
-        source = str(item.get("source") or "").lower().strip()
-        marker = str(
-            item.get("joined_at")
-            or item.get("history_id")
-            or item.get("sk")
-            or item.get("created_at")
-            or ""
-        )
-
         print(
             f"[POINT_DELTA][ITEM] "
-            f"created_at={created_at} action={action} kind={kind} source={source} "
-            f"history_id={item.get('history_id')} sk={item.get('sk')} "
+            f"created_at={history_created_at(item)} action={item.get('action')} kind={item.get('kind')} "
+            f"source={item.get('source')} history_id={item.get('history_id')} sk={item.get('sk')} "
             f"delta_points={item.get('delta_points')} points={item.get('points')}"
         )
-
-        if (
-            kind == "earn"
-            or "points#earn#" in marker
-            or action in (
-                "earn", "point_earn", "admin_add", "admin_grant", "grant",
-                "participate", "participated", "join", "joined",
-                "register", "registered"
-            )
-            or source in ("participation", "schedule_participation", "event_participation")
-        ):
-            earn_items.append(item)
-
-        elif (
-            kind == "spend"
-            or "points#spend#" in marker
-            or action in ("spend", "point_spend", "use", "consume")
-        ):
-            spend_items.append(item)
-
-        elif (
-            action in ("adjust", "point_adjust", "admin_adjust")
-            or source == "admin_manual"
-        ):
-            adjust_items.append(item)
-
-    applied_join_bonus = False
-
-    def _read_points(x):
-        val = (
-            x.get("delta_points")
-            or x.get("points")
-            or x.get("points_used")
-            or x.get("amount")
-            or x.get("point")
-        )
-        if val is not None:
-            return to_decimal(val)
-        return Decimal("0")
+        buckets[bucket].append(item)
 
     # 2. 獲得ポイントの集計（ここで1回だけ加算をコントロール）
     earned_after_cutoff = Decimal("0")
     join_bonus_done = False # この関数スコープで1回だけ
 
     for x in earn_items:
-        p = _read_points(x)
+        p = read_history_points(x)
         
         # DBが空（0）で、かつ join アクションの場合
-        action = str(x.get("action") or "").lower().strip()
-        if p == 0 and action in ("join", "joined"):
+        if is_zero_point_join(x):
             if not join_bonus_done:
                 p = to_decimal(participation_points) # 260Pをセット
                 join_bonus_done = True # 以降のjoinは0Pのまま
@@ -734,8 +829,8 @@ def sum_history_points_after_cutoff(dynamodb, user_id: str, participation_points
         earned_after_cutoff += p
 
     # 3. 支出と調整の集計（これらはそのまま）
-    spent_after_cutoff = sum((abs(_read_points(x)) for x in spend_items), Decimal("0"))
-    adjusted_after_cutoff = sum((_read_points(x) for x in adjust_items), Decimal("0"))
+    spent_after_cutoff = sum((abs(read_history_points(x)) for x in spend_items), Decimal("0"))
+    adjusted_after_cutoff = sum((read_history_points(x) for x in adjust_items), Decimal("0"))
 
     print(
         f"[POINT_DELTA] user={user_id} "
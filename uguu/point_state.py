@@ -0,0 +1,304 @@
+"""
+旧ルール(v1)ポイントの逐次計算（チェックポイント方式）
+
+calc_reset_index / calc_participation_and_cumulative / calc_monthly_bonus / calc_streak_points は
+毎回全履歴を先頭から数パス読み直す。ここでは同じ結果を「状態 + 1件ずつの畳み込み」で求める。
+
+- fold_record(rec)        : 参加記録1件を O(1) で反映（event_date の昇順で渡す）
+- fold_schedule_day(date) : 練習日1日を O(1) で反映（連続参加の判定用。日付の昇順・重複なし）
+  同じ日付なら参加記録 → 練習日の順に畳み込む
+- to_stats(now)           : get_user_stats と同じキーのポイント関連の値を返す
+- to_item / from_item     : bad-users に保存できる形（points_checkpoint 属性）
+
+順序が崩れる入力（過去日付の参加記録が後から来た等）は CheckpointRebuildRequired を投げるので、
+呼び出し側は replay_points() で作り直す。
+"""
+
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+
+from uguu.point import ParticipationRecord, PointRules
+
+CHECKPOINT_VERSION = 1
+
+STREAK_MILESTONES = {5: 400, 10: 800, 15: 1200, 20: 1600, 25: 2000}
+CUMULATIVE_BONUS_EVERY = 5
+CUMULATIVE_BONUS = 500
+
+
+class CheckpointRebuildRequired(Exception):
+    """チェックポイントに追記できない入力（作り直しが必要）"""
+
+
+def _monthly_bonus_base(count: int) -> int:
+    return 0 if count < 3 else 450 + (count - 3) * 150
+
+
+def _day(rec: ParticipationRecord) -> str:
+    return rec.event_date.date().isoformat()
+
+
+def record_key(rec: ParticipationRecord) -> str:
+    return f"{rec.event_date.isoformat()}|{rec.registered_at.isoformat()}"
+
+
+@dataclass
+class PointsCheckpoint:
+    # 計算条件（変わったら作り直し）
+    point_multiplier: float = 1.0
+    reset_days: int = 50
+    first_participation_points: int = 200
+    streak_per_participation_after_2: int = 50
+
+    # 全期間
+    first_ever_date: Optional[str] = None
+    last_date: Optional[str] = None            # 最後に畳み込んだ参加日（YYYY-MM-DD）
+    records_total: int = 0
+    all_time_early: int = 0
+    all_time_direct: int = 0
+    last_key: str = ""                         # 最後に畳み込んだ参加記録（追記判定用）
+
+    # 現在の区間（60日ルールのリセット以降）
+    reset_count: int = 0                       # リセット回数（>0 ならリセットあり）
+    segment_start: Optional[str] = None        # リセットマーカー（区間の最初の参加日）
+    segment_count: int = 0                     # = cumulative_count
+    segment_early: int = 0
+    segment_direct: int = 0
+    participation_points: int = 0
+    cumulative_bonus_points: int = 0
+    month_counts: Dict[str, int] = field(default_factory=dict)
+    monthly_bonus_points: int = 0
+
+    # 連続参加
+    last_schedule_date: Optional[str] = None
+    pending_dates: List[str] = field(default_factory=list)  # まだ練習日として畳み込んでいない区間の参加日
+    current_streak: int = 0
+    max_streak: int = 0
+    streak_start: Optional[str] = None
+    streak_points: int = 0
+
+    @classmethod
+    def start(cls, rules: PointRules, point_multiplier: float) -> "PointsCheckpoint":
+        return cls(
+            point_multiplier=float(point_multiplier),
+            reset_days=rules.reset_days,
+            first_participation_points=rules.first_participation_points,
+            streak_per_participation_after_2=rules.streak_per_participation_after_2,
+        )
+
+    def matches(self, rules: PointRules, point_multiplier: float) -> bool:
+        return (
+            self.point_multiplier == float(point_multiplier)
+            and self.reset_days == rules.reset_days
+            and self.first_participation_points == rules.first_participation_points
+            and self.streak_per_participation_after_2 == rules.streak_per_participation_after_2
+        )
+
+    # ---------------------------------------------
+    # 畳み込み
+    # ---------------------------------------------
+    def fold_record(self, rec: ParticipationRecord, early_base: int) -> None:
+        """
+        参加記録1件を反映する
+        early_base: _is_early_registration の戻り値（100 / 50 / それ以外）
+        """
+        d = _day(rec)
+        if self.last_date is not None and d < self.last_date:
+            raise CheckpointRebuildRequired(f"record {d} is older than {self.last_date}")
+        if self.last_schedule_date is not None and d <= self.last_schedule_date:
+            raise CheckpointRebuildRequired(f"record {d} is within folded schedules ({self.last_schedule_date})")
+
+        m = self.point_multiplier
+
+        # 60日ルール: 直前の参加から reset_days 超 → ここから新しい区間
+        if self.last_date is not None:
+            gap = (rec.event_date.date() - date.fromisoformat(self.last_date)).days
+            if gap > self.reset_days:
+                self._reset_segment(d)
+
+        if self.first_ever_date is None:
+            self.first_ever_date = d
+        if self.segment_start is None:
+            self.segment_start = d
+
+        if early_base == 100:
+            self.all_time_early += 1
+            self.segment_early += 1
+        elif early_base == 50:
+            self.all_time_direct += 1
+            self.segment_direct += 1
+
+        base = early_base if early_base in (100, 50) else 10
+        if d == self.first_ever_date or self.segment_count == 0:
+            self.participation_points += int(self.first_participation_points * m)
+        else:
+            self.participation_points += int(base * m)
+
+        self.segment_count += 1
+        if self.segment_count % CUMULATIVE_BONUS_EVERY == 0:
+            self.cumulative_bonus_points += int(CUMULATIVE_BONUS * m)
+
+        month = d[:7]
+        before = self.month_counts.get(month, 0)
+        self.monthly_bonus_points += (
+            int(_monthly_bonus_base(before + 1) * m) - int(_monthly_bonus_base(before) * m)
+        )
+        self.month_counts[month] = before + 1
+
+        if not self.pending_dates or self.pending_dates[-1] != d:
+            self.pending_dates.append(d)
+
+        self.records_total += 1
+        self.last_date = d
+        self.last_key = record_key(rec)
+
+    def fold_schedule_day(self, date_str: str) -> None:
+        """練習日1日分の連続参加判定（calc_streak_points の1ループ分）"""
+        d = str(date_str)[:10]
+        if self.last_schedule_date is not None and d <= self.last_schedule_date:
+            return  # 同日の重複スケジュールは1日1件
+        self.last_schedule_date = d
+
+        # リセット後の区間は区間開始日以降の練習日だけを見る
+        if self.reset_count > 0 and self.segment_start and d < self.segment_start:
+            return
+
+        participated = bool(self.pending_dates) and d in self.pending_dates
+        # 通り過ぎた参加日は以後参照しない
+        while self.pending_dates and self.pending_dates[0] <= d:
+            self.pending_dates.pop(0)
+
+        m = self.point_multiplier
+        if participated:
+            self.current_streak += 1
+            if self.streak_start is None:
+                self.streak_start = d
+            if self.current_streak >= 2:
+                self.streak_points += int(self.streak_per_participation_after_2 * m)
+            if self.current_streak in STREAK_MILESTONES:
+                self.streak_points += int(STREAK_MILESTONES[self.current_streak] * m)
+            self.max_streak = max(self.max_streak, self.current_streak)
+        else:
+            self.current_streak = 0
+            self.streak_start = None
+
+    def _reset_segment(self, new_start: str) -> None:
+        self.reset_count += 1
+        self.segment_start = new_start
+        self.segment_count = 0
+        self.segment_early = 0
+        self.segment_direct = 0
+        self.participation_points = 0
+        self.cumulative_bonus_points = 0
+        self.month_counts = {}
+        self.monthly_bonus_points = 0
+        self.pending_dates = []
+        self.current_streak = 0
+        self.max_streak = 0
+        self.streak_start = None
+        self.streak_points = 0
+
+    # ---------------------------------------------
+    # 出力
+    # ---------------------------------------------
+    def to_stats(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        now = now or datetime.now()
+        last_dt = datetime.strptime(self.last_date, "%Y-%m-%d") if self.last_date else None
+        days_since = (now - last_dt).days if last_dt else None
+        m = self.point_multiplier
+        return {
+            "participation_points": self.participation_points,
+            "cumulative_bonus_points": self.cumulative_bonus_points,
+            "cumulative_count": self.segment_count,
+            "early_registration_count": self.segment_early,
+            "direct_registration_count": self.segment_direct,
+            "all_time_early_registration_count": self.all_time_early,
+            "all_time_direct_registration_count": self.all_time_direct,
+            "monthly_bonus_points": self.monthly_bonus_points,
+            "monthly_bonuses": {
+                month: {"participation_count": c, "bonus_points": int(_monthly_bonus_base(c) * m)}
+                for month, c in sorted(self.month_counts.items())
+            },
+            "streak_points": self.streak_points,
+            "current_streak_count": self.current_streak,
+            "max_streak": self.max_streak,
+            "current_streak_start": self.streak_start or "",
+            "total_participation": self.records_total,
+            "last_participation_date": self.last_date,
+            "has_reset": self.reset_count > 0,
+            "reset_date": self.segment_start if self.reset_count > 0 else None,
+            "is_reset": days_since is not None and days_since > self.reset_days,
+            "days_until_reset": (self.reset_days - days_since) if days_since is not None else None,
+        }
+
+    def to_item(self) -> Dict[str, Any]:
+        """DynamoDB 保存用（float は使えないので倍率は文字列）"""
+        item = asdict(self)
+        item["point_multiplier"] = str(self.point_multiplier)
+        item["checkpoint_version"] = CHECKPOINT_VERSION
+        return item
+
+    @classmethod
+    def from_item(cls, item: Optional[Dict[str, Any]]) -> Optional["PointsCheckpoint"]:
+        if not item or int(item.get("checkpoint_version", 0)) != CHECKPOINT_VERSION:
+            return None
+        data = {k: item.get(k) for k in cls.__dataclass_fields__ if k in item}
+        for k in ("reset_days", "first_participation_points", "streak_per_participation_after_2",
+                  "records_total", "all_time_early", "all_time_direct", "reset_count",
+                  "segment_count", "segment_early", "segment_direct", "participation_points",
+                  "cumulative_bonus_points", "monthly_bonus_points", "current_streak",
+                  "max_streak", "streak_points"):
+            if k in data and data[k] is not None:
+                data[k] = int(data[k])
+        data["point_multiplier"] = float(data.get("point_multiplier") or 1.0)
+        data["month_counts"] = {k: int(v) for k, v in (data.get("month_counts") or {}).items()}
+        data["pending_dates"] = list(data.get("pending_dates") or [])
+        return cls(**data)
+
+
+def _fold_all(cp, records, schedule_dates, early_fn):
+    """参加記録と練習日を日付順にマージして畳み込む（同日は参加記録が先）"""
+    i = 0
+    for d in schedule_dates:
+        while i < len(records) and _day(records[i]) <= d:
+            rec = records[i]
+            cp.fold_record(rec, early_fn({"event_date": rec.event_date, "registered_at": rec.registered_at}))
+            i += 1
+        cp.fold_schedule_day(d)
+    for rec in records[i:]:
+        cp.fold_record(rec, early_fn({"event_date": rec.event_date, "registered_at": rec.registered_at}))
+    return cp
+
+
+def _schedule_days(all_schedules) -> List[str]:
+    return sorted({str(s["date"])[:10] for s in all_schedules or []})
+
+
+def replay_points(records, all_schedules, rules: PointRules, point_multiplier: float, early_fn) -> PointsCheckpoint:
+    """全履歴から1パスで作り直す（records は normalize_participation_history の結果）"""
+    cp = PointsCheckpoint.start(rules, point_multiplier)
+    return _fold_all(cp, records, _schedule_days(all_schedules), early_fn)
+
+
+def advance_points(cp: Optional[PointsCheckpoint], records, all_schedules, rules: PointRules,
+                   point_multiplier: float, early_fn) -> PointsCheckpoint:
+    """
+    保存済みチェックポイントに「増えた分」だけを畳み込む
+    - 条件（倍率・ルール）が違う / 既存の記録が変わった（キャンセル等）/ 順序が崩れる → 作り直し
+    """
+    if cp is None or not cp.matches(rules, point_multiplier) or cp.records_total > len(records):
+        return replay_points(records, all_schedules, rules, point_multiplier, early_fn)
+    # 途中の記録がキャンセルされると records_total 番目の記録がずれるので、最後の記録の一致で判定できる
+    if cp.records_total and record_key(records[cp.records_total - 1]) != cp.last_key:
+        return replay_points(records, all_schedules, rules, point_multiplier, early_fn)
+
+    new_records = records[cp.records_total:]
+    last = cp.last_schedule_date or ""
+    new_days = sorted({str(s["date"])[:10] for s in all_schedules or [] if str(s["date"])[:10] > last})
+    try:
+        return _fold_all(cp, new_records, new_days, early_fn)
+    except CheckpointRebuildRequired:
+        return replay_points(records, all_schedules, rules, point_multiplier, early_fn)
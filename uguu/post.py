@@ -3,8 +3,6 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import current_user, login_required
 from .dynamo import db
 from utils.s3 import upload_image_to_s3
-from uuid import uuid4
-from datetime import datetime, timezone
 from flask_wtf.csrf import generate_csrf
 
 
@@ -145,12 +143,23 @@ def edit_post(post_id):
 
     return render_template('uguu/edit_post.html', post=post_data)
 
+def _requested_like_state():
+    """押した後の状態（liked=true/false）が送られていれば返す。無ければ None（トグル）"""
+    data = request.get_json(silent=True) or {}
+    value = data.get("liked", request.form.get("liked"))
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in ("true", "1", "false", "0"):
+        return value.lower() in ("true", "1")
+    return None
+
+
 @post.route('/like/<post_id>', methods=['POST'])
 @login_required  # login_requiredを追加
 def like_post(post_id):
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         try:
-            is_liked = db.like_post(post_id, current_user.id)
+            is_liked = db.like_post(post_id, current_user.id, liked=_requested_like_state())
             likes_count = db.get_likes_count(post_id)
             return jsonify({
                 'is_liked': is_liked,
@@ -162,7 +171,7 @@ def like_post(post_id):
     else:
         # 通常のフォーム送信の場合
         try:
-            is_liked = db.like_post(post_id, current_user.id)
+            db.like_post(post_id, current_user.id, liked=_requested_like_state())
             return redirect(url_for('uguu.show_timeline'))
         except Exception as e:
             print(f"Error in like_post route: {e}")
@@ -178,20 +187,12 @@ def create_reply(post_id):
         return redirect(url_for('uguu.show_timeline'))
 
     try:
-        reply_id = str(uuid4())
-        now = datetime.now(timezone.utc).isoformat()
-
-        item = {
-            "post_id": post_id,                 
-            "sk": f"REPLY#{reply_id}",          
-            "reply_id": reply_id,
-            "user_id": str(current_user.id),
-            "content": content,
-            "created_at": now,
-            "display_name": getattr(current_user, "display_name", "不明"),
-        }
-
-        db.replies_table.put_item(Item=item)
+        db.create_reply(
+            post_id,
+            current_user.id,
+            content,
+            display_name=getattr(current_user, "display_name", "不明"),
+        )
         flash('返信を投稿しました', 'success')
 
     except Exception as e:
@@ -10,6 +10,9 @@ users = Blueprint('users', __name__)
 from .dynamo import db
 from utils.points import record_earn
 from uguu.point import get_current_points_hybrid
+from game.results_repository import query_player_results
+from utils.timezone import JST
+from utils.user_stats_cache import user_stats_cache
 
 print("[DEBUG] AWS_REGION =", os.getenv("AWS_REGION"))
 print("[DEBUG] DYNAMO_UGU_POINTS_TABLE =", os.getenv("DYNAMO_UGU_POINTS_TABLE", "ugu_points"))
@@ -70,6 +73,7 @@ def add_point(user_id):
             source="admin_manual",
             created_by=getattr(current_user, "email", "admin"),
         )
+        db.bump_stats_version(user_id)
         flash("ポイントを付与しました。", "success")
     except Exception:
         current_app.logger.exception("ポイント付与の保存に失敗")
@@ -78,6 +82,58 @@ def add_point(user_id):
     return redirect(url_for("users.user_profile", user_id=user_id))
 
 
+def _is_registered_history(rec: dict) -> bool:
+    st = (rec.get("status") or "").lower().strip()
+    if not st:
+        act = (rec.get("action") or "").lower().strip()
+        if act in ("tara_join", "join", "register", "registered"): st = "registered"
+        elif act in ("tara_cancel", "cancel", "cancelled", "canceled"): st = "cancelled"
+    return st == "registered"
+
+
+def _compute_profile_stats(user_id):
+    """
+    プロフィールの統計部分（参加履歴・支払い履歴の取得と get_user_stats）をまとめて計算する
+    結果は user_stats_cache に (user_id, stats_version, 日付) で保存される
+    """
+    raw_history = db.get_user_participation_history_with_timestamp(user_id) or []
+    point_spends = db.list_point_spends(user_id, limit=1000) or []
+
+    user_stats = db.get_user_stats(user_id, raw_history=raw_history, spends=point_spends) or {}
+
+    def _pick_spend_amount(s: dict) -> int:
+        for key in ["points_used", "delta_points", "amount"]:
+            v = s.get(key)
+            if v is not None:
+                try: return abs(int(v))
+                except: pass
+        return 0
+
+    registered = [r for r in raw_history if isinstance(r, dict) and _is_registered_history(r)]
+
+    # 最後に「参加(registered)」した日を特定
+    last_participation_date = None
+    for rec in sorted(registered, key=lambda x: str(x.get('date') or x.get('event_date') or ''), reverse=True):
+        last_participation_date = rec.get('date') or rec.get('event_date') or rec.get('eventDay')
+        break
+
+    registered_dates = []
+    for r in registered:
+        date_raw = r.get("date") or r.get("event_date") or r.get("eventDay")
+        if date_raw and _parse_ymd10(str(date_raw)):
+            registered_dates.append(str(date_raw)[:10])
+
+    return {
+        "user_stats": user_stats,
+        "official_count": len(registered),
+        "last_participation_date": last_participation_date,
+        "registered_dates": registered_dates,
+        "point_spends_preview": point_spends[:5],
+        "point_spends_total": len(point_spends),
+        "point_total_spent_recent": sum(_pick_spend_amount(s) for s in point_spends),
+    }
+
+
 @users.route('/user/<user_id>')
 def user_profile(user_id):
     try:
@@ -91,52 +147,34 @@ def user_profile(user_id):
         user_posts, _next_cursor = db.get_posts_by_user(user_id)
         user_posts = sorted(user_posts, key=lambda x: x.get('created_at', ''), reverse=True) if user_posts else []
 
-        # 3. 参加履歴・ポイント履歴取得
-        raw_history = db.get_user_participation_history_with_timestamp(user_id) or []
-        point_spends = db.list_point_spends(user_id, limit=1000) or []
-        point_spends_preview = point_spends[:5]
-
-        # 4. 統計計算（旧ルール計算結果を取得）
-        user_stats = db.get_user_stats(user_id, raw_history=raw_history, spends=point_spends) or {}
-
-        # 5. 支出計算
-        def _pick_spend_amount(s: dict) -> int:
-            for key in ["points_used", "delta_points", "amount"]:
-                v = s.get(key)
-                if v is not None:
-                    try: return abs(int(v))
-                    except: pass
-            return 0
-        point_total_spent_recent = sum(_pick_spend_amount(s) for s in point_spends)
-
-        # 6. 参加判定ヘルパー
-        def _is_registered(rec: dict) -> bool:
-            st = (rec.get("status") or "").lower().strip()
-            if not st:
-                act = (rec.get("action") or "").lower().strip()
-                if act in ("tara_join", "join", "register", "registered"): st = "registered"
-                elif act in ("tara_cancel", "cancel", "cancelled", "canceled"): st = "cancelled"
-            return st == "registered"
-
-        # 7. 参加回数カウント
-        official_count = sum(1 for r in raw_history if isinstance(r, dict) and _is_registered(r))
+        # 3. 統計（参加履歴・ポイント履歴から計算）
+        #    bad-users の stats_version と今日の日付が同じ間はキャッシュを使う
+        bad_users_table = current_app.dynamodb.Table("bad-users")
+        resp = bad_users_table.get_item(Key={"user#user_id": user_id}, ConsistentRead=True)
+        bad_user = resp.get("Item") or {}
+        stats_version = int(bad_user.get("stats_version", 0))
+        today_key = datetime.now(JST).date().isoformat()
+
+        profile_stats = user_stats_cache.get("profile", user_id, stats_version, today_key)
+        if profile_stats is None:
+            profile_stats = _compute_profile_stats(user_id)
+            user_stats_cache.put("profile", user_id, stats_version, today_key, profile_stats)
+
+        user_stats = profile_stats["user_stats"]
+        official_count = profile_stats["official_count"]
+        point_spends_preview = profile_stats["point_spends_preview"]
+        point_total_spent_recent = profile_stats["point_total_spent_recent"]
 
         # ==========================================================
         # ★ 厳格な60日ルール適用（バイパスモード + 自動没収）
         # ==========================================================
-        from datetime import datetime, date
+        from datetime import date
 
         # 全履歴から計算された合計ポイント（暫定値）
         calculated_total = int(user_stats.get('uguu_points', 0))
 
-        # 最後に「参加(registered)」した日を特定
-        last_participation_date = None
-        sorted_history = sorted(raw_history, key=lambda x: str(x.get('date') or x.get('event_date') or ''), reverse=True)
-        
-        for rec in sorted_history:
-            if _is_registered(rec):
-                last_participation_date = rec.get('date') or rec.get('event_date') or rec.get('eventDay')
-                break
+        # 最後に「参加(registered)」した日
+        last_participation_date = profile_stats["last_participation_date"]
 
         # 没収判定
         is_expired = False
@@ -172,9 +210,6 @@ def user_profile(user_id):
 
         # 8. 管理者用・スキルスコア・参加日リスト
         is_admin = bool(getattr(current_user, "administrator", False))
-        bad_users_table = current_app.dynamodb.Table("bad-users")
-        resp = bad_users_table.get_item(Key={"user#user_id": user_id}, ConsistentRead=True)
-        bad_user = resp.get("Item") or {}
         
         def _to_float_or_none(v):
             try: return float(v) if v is not None else None
@@ -186,13 +221,9 @@ def user_profile(user_id):
             try:
                 youbi = ['月', '火', '水', '木', '金', '土', '日']
                 formatted = []
-                from uguu.users import _parse_ymd10 as _parse_ymd10
-                for r in raw_history:
-                    if not isinstance(r, dict) or not _is_registered(r): continue
-                    date_raw = r.get("date") or r.get("event_date") or r.get("eventDay")
-                    dt = datetime.strptime(str(date_raw)[:10], '%Y-%m-%d') if date_raw else None
-                    if dt:
-                        formatted.append(f"{dt.strftime('%Y年%m月%d日')}（{youbi[dt.weekday()]}）")
+                for date_raw in profile_stats["registered_dates"]:
+                    dt = datetime.strptime(str(date_raw)[:10], '%Y-%m-%d')
+                    formatted.append(f"{dt.strftime('%Y年%m月%d日')}（{youbi[dt.weekday()]}）")
                 admin_participation_dates = sorted(list(set(formatted)))
             except Exception as e:
                 print(f"[WARN] failed to build admin_participation_dates: {e}")
@@ -214,7 +245,7 @@ def user_profile(user_id):
             days_until_reset=60 - days_since_last if not is_expired else 0, # 残り日数表示用
             upcoming_schedules=db.get_upcoming_schedules(),
             point_spends=point_spends_preview,
-            point_spends_total=len(point_spends),
+            point_spends_total=profile_stats["point_spends_total"],
             point_total_spent_recent=point_total_spent_recent,
             skill_score=skill_score,
             points_info=points_info,
@@ -289,7 +320,7 @@ def point_participation():
             return jsonify({'error': 'イベント日の形式が不正です（YYYY-MM-DD）'}), 400
 
         # 現在ポイント
-        stats = db.get_user_stats(user_id) or {}
+        stats = db.get_user_stats_cached(user_id) or {}
         current_points = int(stats.get('uguu_points', 0))
         print(f"[TRACE] current_points={current_points}")
 
@@ -338,49 +369,9 @@ def my_stats():
     except Exception:
         current_app.logger.exception("[my_stats] last_visited_my_stats 更新失敗")
 
-    # bad-game-results を全スキャン（自分が含まれるレコードのみ）
-    results_table = current_app.dynamodb.Table("bad-game-results")
-    all_items = []
-    kwargs = {}
-    while True:
-        resp = results_table.scan(**kwargs)
-        all_items.extend(resp.get("Items", []))
-        lek = resp.get("LastEvaluatedKey")
-        if not lek:
-            break
-        kwargs["ExclusiveStartKey"] = lek
-
-    # Pythonで自分が含まれるレコードだけ絞り込む
-    def contains_me(team):
-        if not isinstance(team, list):
-            return False
-        return any(
-            isinstance(p, dict) and p.get("user_id") == my_uid
-            for p in team
-        )
-
-    items = [r for r in all_items if contains_me(r.get("team_a")) or contains_me(r.get("team_b"))]
-    current_app.logger.info("[my_stats] 全件=%d 自分含む=%d", len(all_items), len(items))
-    if items:
-        sample = items[0]
-        current_app.logger.info("[my_stats] サンプル team_a type=%s value=%s",
-                                type(sample.get("team_a")).__name__,
-                                sample.get("team_a"))
-        current_app.logger.info("[my_stats] サンプル team_b type=%s value=%s",
-                                type(sample.get("team_b")).__name__,
-                                sample.get("team_b"))
-    else:
-        # 件数0の場合、contains なしで1件だけ取ってフォーマット確認
-        probe = results_table.scan(Limit=1)
-        probe_items = probe.get("Items", [])
-        if probe_items:
-            p = probe_items[0]
-            current_app.logger.info("[my_stats] probe team_a type=%s value=%s",
-                                    type(p.get("team_a")).__name__,
-                                    p.get("team_a"))
-            current_app.logger.info("[my_stats] probe team_b type=%s value=%s",
-                                    type(p.get("team_b")).__name__,
-                                    p.get("team_b"))
+    # プレイヤー別インデックスから自分の行だけを取得（1本のページング Query）
+    items = query_player_results(my_uid)
+    current_app.logger.info("[my_stats] 自分の結果=%d", len(items))
 
     # match_id + court_number でソート
     items.sort(key=lambda x: (x.get("match_id", ""), int(x.get("court_number", 0))))
@@ -396,11 +387,11 @@ def my_stats():
         team_b = r.get("team_b", [])
         winner = r.get("winner", "")
 
-        in_a = any(
+        my_team = r.get("team") or ("A" if any(
             (p.get("user_id") == my_uid if isinstance(p, dict) else False)
             for p in (team_a if isinstance(team_a, list) else [])
-        )
-        my_team = "A" if in_a else "B"
+        ) else "B")
+        in_a = my_team == "A"
         won = (winner == my_team)
 
         if won:
@@ -2,10 +2,11 @@ import boto3
 import logging
 import os
 from dateutil import parser
-from boto3.dynamodb.types import TypeDeserializer
 logger = logging.getLogger(__name__)
 
 from uguu.dynamo import DynamoDB   
+from utils.user_directory import user_directory
+from utils.schedule_repository import schedule_repository
 _db = DynamoDB() 
 
 def cancel_participation(user_id: str, date_str: str, schedule_id: str = None):
@@ -35,152 +36,145 @@ TEAM_MAP = {
     't999': 'かわせみバド倶楽部'
 }   
 
+def _format_schedule(schedule):
+    """index / 一覧用（チーム名・adjusted_max 付き）"""
+    date_obj = parser.parse(schedule['date'])
+    formatted_date = f"{date_obj.month:02d}/{date_obj.day:02d}({schedule['day_of_week']})"
+
+    # 軽量化: 参加者の詳細情報は取得せず、カウントのみ
+    participants = schedule.get('participants', [])
+
+    # ★ team_idを取得
+    tid = schedule.get('team_id', 't000')
+
+    return {
+        'schedule_id': schedule.get('schedule_id'),
+        'team_id': schedule.get('team_id') or 't000',
+        'team_name': TEAM_MAP.get(tid, '未設定'),
+        'title': schedule.get('title'),
+        'date': schedule.get('date'),
+        'day_of_week': schedule.get('day_of_week'),
+        'formatted_date': formatted_date,
+        'start_time': schedule.get('start_time', ''),
+        'end_time': schedule.get('end_time', ''),
+        'venue': schedule.get('venue', ''),
+        'court': schedule.get('court', ''),
+        'max_participants': int(schedule.get('max_participants', 10)),
+        'adjusted_max': int(schedule['adjusted_max']) if schedule.get('adjusted_max') else None,
+        'participants_count': len(participants),
+        'participants': participants,  # IDのみ保持
+        'status': schedule.get('status', 'active'),
+        'description': schedule.get('description', ''),
+        'comment': schedule.get('comment', ''),
+        'tara_participants': schedule.get('tara_participants', []),
+        'tara_count': len(schedule.get('tara_participants', [])),
+        'display_name': schedule.get('display_name', '管理者'),
+        'is_pinned': schedule.get('is_pinned', False),
+        'updated_at': schedule.get('updated_at', ''),
+    }
+
+
+def _format_schedules(items, formatter=_format_schedule):
+    formatted_schedules = []
+    for schedule in items:
+        try:
+            formatted_schedules.append(formatter(schedule))
+        except Exception as e:
+            logger.error(f"Error processing schedule: {e}")
+            continue
+    return formatted_schedules
+
+
 def get_schedules_with_formatting():
-    """スケジュール一覧を取得してフォーマットする（最適化版）"""
+    """今後のスケジュール一覧を取得してフォーマットする（今日以降だけを GSI で読む）"""
     logger.info("Cache: Attempting to get formatted schedules")
-    
+
     try:
-        schedule_table = get_schedule_table()
-        response = schedule_table.scan()
-        
-        # アクティブなスケジュールのみをフィルタリングしてからソート
-        active_schedules = [
-            schedule for schedule in response.get('Items', [])
-            if schedule.get('status', 'active') == 'active'
-        ]
-        
+        # 今後の分だけ（件数は多くないので全件読んでからピン留めを先頭に並べ替える）
+        upcoming = schedule_repository.upcoming()
+
         # ピン留めを先頭、その後 date 昇順
         schedules = sorted(
-            active_schedules,
+            upcoming,
             key=lambda x: (not x.get('is_pinned', False), x.get('date', ''))
         )[:10]
-        
-        formatted_schedules = []
-        for schedule in schedules:
-            try:
-                date_obj = parser.parse(schedule['date'])
-                formatted_date = f"{date_obj.month:02d}/{date_obj.day:02d}({schedule['day_of_week']})"
-                
-                # 軽量化: 参加者の詳細情報は取得せず、カウントのみ
-                participants = schedule.get('participants', [])
-                
-                # ★ team_idを取得
-                tid = schedule.get('team_id', 't000')
-                
-                formatted_schedule = {
-                    'schedule_id': schedule.get('schedule_id'),
-                    'team_id': schedule.get('team_id') or 't000',
-                    'team_name': TEAM_MAP.get(tid, '未設定'),
-                    'title': schedule.get('title'),
-                    'date': schedule.get('date'),
-                    'day_of_week': schedule.get('day_of_week'),
-                    'formatted_date': formatted_date,
-                    'start_time': schedule.get('start_time', ''),  
-                    'end_time': schedule.get('end_time', ''),      
-                    'venue': schedule.get('venue', ''),            
-                    'court': schedule.get('court', ''),          
-                    'max_participants': int(schedule.get('max_participants', 10)),
-                    'adjusted_max': int(schedule['adjusted_max']) if schedule.get('adjusted_max') else None,
-                    'participants_count': len(participants),
-                    'participants': participants,  # IDのみ保持
-                    'status': schedule.get('status', 'active'),
-                    'description': schedule.get('description', ''),
-                    'comment': schedule.get('comment', ''),
-                    'tara_participants': schedule.get('tara_participants', []),
-                    'tara_count': len(schedule.get('tara_participants', [])),
-                    'display_name': schedule.get('display_name', '管理者'),
-                    'is_pinned': schedule.get('is_pinned', False),
-                }
-
-                formatted_schedules.append(formatted_schedule)
-                
-            except Exception as e:
-                logger.error(f"Error processing schedule: {e}")
-                continue
-        
+
+        formatted_schedules = _format_schedules(schedules)
         logger.info(f"Cache: Successfully processed {len(formatted_schedules)} schedules")
         return formatted_schedules
-        
+
     except Exception as e:
         logger.error(f"Error in get_schedules_with_formatting: {str(e)}")
         return []
-    
-def get_schedules_with_formatting_all():
-    """すべてのスケジュールを取得（制限なし）"""
+
+
+def get_schedules_by_date(date_str):
+    """指定日のスケジュール（参加者一覧・参加者削除用）"""
     try:
-        schedule_table = get_schedule_table()
-        response = schedule_table.scan()
+        return _format_schedules(schedule_repository.range(date_str, date_str))
+    except Exception as e:
+        logger.error(f"[get_schedules_by_date] スケジュール取得失敗: {e}")
+        return []
 
-        active_schedules = [
-            schedule for schedule in response.get('Items', [])
-            if schedule.get('status', 'active') == 'active'
-        ]
 
-        # ピン留めを先頭、その後 date 昇順
+def _format_schedule_all(schedule):
+    date_obj = parser.parse(schedule['date'])
+    formatted_date = f"{date_obj.month:02d}/{date_obj.day:02d}({schedule['day_of_week']})"
+
+    return {
+        'schedule_id': schedule.get('schedule_id'),
+        'title': schedule.get('title'),
+        'date': schedule.get('date'),
+        'day_of_week': schedule.get('day_of_week'),
+        'formatted_date': formatted_date,
+        'start_time': schedule.get('start_time', ''),
+        'end_time': schedule.get('end_time', ''),
+        'venue': schedule.get('venue', ''),
+        'court': schedule.get('court', ''),
+        'max_participants': int(schedule.get('max_participants', 10)),
+        'participants_count': len(schedule.get('participants', [])),
+        'participants': schedule.get('participants', []),
+        'status': schedule.get('status', 'active'),
+        'description': schedule.get('description', ''),
+        'comment': schedule.get('comment', ''),
+        'tara_participants': schedule.get('tara_participants', []),
+        'tara_count': len(schedule.get('tara_participants', [])),
+        'display_name': schedule.get('display_name', '管理者'),
+        'is_pinned': schedule.get('is_pinned', False),
+        'updated_at': schedule.get('updated_at', ''),
+    }
+
+
+def get_schedules_with_formatting_all(start=None, end=None):
+    """
+    スケジュールを取得（件数制限なし）
+    start / end（date or 'YYYY-MM-DD'、両端含む）を渡すとその期間だけを読む
+    """
+    try:
         schedules = sorted(
-            active_schedules,
+            schedule_repository.range(start, end),
             key=lambda x: (not x.get('is_pinned', False), x.get('date', ''))
         )
+        return [_format_schedule_all(schedule) for schedule in schedules]
 
-        formatted_schedules = []
-        for schedule in schedules:
-            date_obj = parser.parse(schedule['date'])
-            formatted_date = f"{date_obj.month:02d}/{date_obj.day:02d}({schedule['day_of_week']})"
-
-            formatted_schedules.append({
-                'schedule_id': schedule.get('schedule_id'),
-                'title': schedule.get('title'),
-                'date': schedule.get('date'),
-                'day_of_week': schedule.get('day_of_week'),
-                'formatted_date': formatted_date,
-                'start_time': schedule.get('start_time', ''),  
-                'end_time': schedule.get('end_time', ''),      
-                'venue': schedule.get('venue', ''),            
-                'court': schedule.get('court', ''),          
-                'max_participants': int(schedule.get('max_participants', 10)),
-                'participants_count': len(schedule.get('participants', [])),
-                'participants': schedule.get('participants', []),
-                'status': schedule.get('status', 'active'),
-                'description': schedule.get('description', ''),
-                'comment': schedule.get('comment', ''),
-                'tara_participants': schedule.get('tara_participants', []),
-                'tara_count': len(schedule.get('tara_participants', [])),
-                'display_name': schedule.get('display_name', '管理者'),
-                'is_pinned': schedule.get('is_pinned', False),
-            })
+    except Exception as e:
+        logger.error(f"[get_all_schedules] スケジュール取得失敗: {e}")
+        return []
 
-        return formatted_schedules
 
+def get_schedules_for_month(year, month):
+    """カレンダー表示用: 指定月のスケジュールだけ"""
+    try:
+        return [_format_schedule_all(schedule) for schedule in schedule_repository.month(year, month)]
     except Exception as e:
-        logger.error(f"[get_all_schedules] スケジュール取得失敗: {e}")
+        logger.error(f"[get_schedules_for_month] スケジュール取得失敗: {e}")
         return []
 
 def get_users_batch(user_ids):
-    """ユーザー情報を一括取得する関数（正しくデシリアライズ）"""
+    """ユーザー情報を一括取得する関数（UserDirectory 経由・キャッシュ/再試行込み）"""
     try:
-        dynamodb = boto3.client('dynamodb', region_name=os.getenv('AWS_REGION', 'ap-northeast-1'))
-        keys = [{'user#user_id': {'S': user_id}} for user_id in user_ids]
-
-        response = dynamodb.batch_get_item(
-            RequestItems={
-                'bad-users': {
-                    'Keys': keys
-                }
-            }
-        )
-
-        deserializer = TypeDeserializer()
-        users = {}
-
-        if 'Responses' in response:
-            for user in response['Responses']['bad-users']:
-                # 🔽 ここでネストされた DynamoDB形式 → 通常の dict に変換
-                deserialized_user = {k: deserializer.deserialize(v) for k, v in user.items()}
-                user_id = deserialized_user['user#user_id']
-                users[user_id] = deserialized_user
-
-        return users
+        return user_directory.get_many(user_ids)
 
     except Exception as e:
         logger.error(f"Error batch getting users: {e}")
-        return {}
\ No newline at end of file
+        return {}
@@ -0,0 +1,87 @@
+import logging
+import threading
+from collections import Counter
+
+from utils.shared_cache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+
+class FragmentCache:
+    """
+    トップページ / カレンダーの描画済み断片（HTML）のキャッシュ
+
+    - 種類（kind）ごとに key -> (stamp, value) を SharedCache に置く（gunicorn の全ワーカーで共有）
+      - "index_participants" / "koyomi_participants": スケジュールごとの参加者アイコン欄（key = schedule_id#date）
+      - "koyomi_grid": 月のカレンダー表（key = YYYY-MM|閲覧者の区分）
+    - stamp はスケジュールの updated_at（と参加者の並び）から作る。取得時に stamp が違えば作り直す
+    - 参加/たら/削除/編集の直後は invalidate_schedule で該当分を落とす（書き込み側からの明示的な無効化）
+      名前空間（スケジュールごと "frag:s:<id>" / 月ごと "frag:m:<YYYY-MM>"）のバージョンを進めるので、
+      他のワーカーに残っている分も参照されなくなる
+    - プロフィール画像の変更などスケジュールに現れない変化は TTL で拾う
+    """
+
+    def __init__(self, ttl: int = 600, cache=None):
+        self.ttl = ttl
+        self._shared = cache or shared_cache
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+        self.invalidations = 0
+
+    @staticmethod
+    def _namespace(kind: str, key: str) -> str:
+        if kind == "koyomi_grid":
+            return f"frag:m:{key[:7]}"
+        return f"frag:s:{key.split('#', 1)[0]}"
+
+    def get(self, kind: str, key: str, stamp):
+        entry = self._shared.get(self._namespace(kind, key), f"{kind}:{key}")
+        with self._lock:
+            if entry is not None and entry[0] == stamp:
+                self.hits[kind] += 1
+                return entry[1]
+            self.misses[kind] += 1
+            return None
+
+    def put(self, kind: str, key: str, stamp, value):
+        self._shared.set(self._namespace(kind, key), f"{kind}:{key}", (stamp, value), timeout=self.ttl)
+
+    def get_or_build(self, kind: str, key: str, stamp, build):
+        value = self.get(kind, key, stamp)
+        if value is None:
+            value = build()
+            self.put(kind, key, stamp, value)
+        return value
+
+    def invalidate_schedule(self, schedule_id, date=None):
+        """スケジュール1件分の参加者欄と、その月のカレンダー表を落とす"""
+        self._shared.bump(f"frag:s:{schedule_id}")
+        if date:
+            self._shared.bump(f"frag:m:{str(date)[:7]}")
+        with self._lock:
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        kinds = {}
+        with self._lock:
+            for kind in sorted(set(self.hits) | set(self.misses)):
+                total = self.hits[kind] + self.misses[kind]
+                kinds[kind] = {
+                    "hits": self.hits[kind],
+                    "misses": self.misses[kind],
+                    "hit_rate": round(self.hits[kind] / total, 3) if total else None,
+                }
+        return {"invalidations": self.invalidations, "kinds": kinds}
+
+
+def schedule_stamp(schedule: dict):
+    """断片の鍵: updated_at に加えて参加者/たらの並び（updated_at を付けない古い書き込みにも追従する）"""
+    return (
+        schedule.get("updated_at") or "",
+        tuple(schedule.get("participants") or []),
+        tuple(schedule.get("tara_participants") or []),
+    )
+
+
+fragment_cache = FragmentCache()
@@ -1,6 +1,10 @@
 from uuid import uuid4
 from datetime import datetime, timezone
 
+from boto3.dynamodb.types import TypeSerializer
+
+from uguu.point import POINT_BALANCE_TABLE, ledger_balance_delta
+
 KIND_EARN   = "earn"
 KIND_SPEND  = "spend"
 KIND_ADJUST = "adjust"
@@ -37,12 +41,104 @@ def build_point_tx(*, user_id: str, kind: str, delta_points: int,
     if meta:        item["meta"] = meta
     return item
 
-def put_point_tx(table, item):
-    table.put_item(
-        Item=item,
-        ConditionExpression="attribute_not_exists(user_id) AND attribute_not_exists(joined_at)"
+_serializer = TypeSerializer()
+TX_UNIQUE_CONDITION = "attribute_not_exists(user_id) AND attribute_not_exists(joined_at)"
+
+
+def ledger_tx_items(history_table_name, item, condition=None):
+    """
+    bad-users-history への1行の Put と、ポイント対象行なら ugu_points_v2 の台帳集計 ADD を
+    TransactWriteItems の要素（低レベル形式）として返す。
+    他の更新（座席予約など）と同じトランザクションに入れたい場合に使う。
+    """
+    put = {
+        "TableName": history_table_name,
+        "Item": {k: _serializer.serialize(v) for k, v in item.items()},
+    }
+    if condition:
+        put["ConditionExpression"] = condition
+    tx_items = [{"Put": put}]
+
+    delta = ledger_balance_delta(item)
+    if delta:
+        adds = ", ".join(f"{k} :{k}" for k in delta)
+        values = {f":{k}": _serializer.serialize(v) for k, v in delta.items()}
+        values[":one"] = {"N": "1"}
+        values[":now"] = {"S": _now_iso()}
+        tx_items.append({"Update": {
+            "TableName": POINT_BALANCE_TABLE,
+            "Key": {"user_id": {"S": str(item["user_id"])}},
+            "UpdateExpression": f"ADD {adds}, ledger_version :one SET ledger_updated_at = :now",
+            "ExpressionAttributeValues": values,
+        }})
+    return tx_items
+
+
+def ledger_delete_tx_items(history_table_name, item):
+    """
+    bad-users-history の1行の Delete と、その行が台帳集計に足していた分を引く ADD（負の差分）を
+    TransactWriteItems の要素（低レベル形式）として返す。item は削除する行そのもの（Query 結果など）。
+    """
+    tx_items = [{"Delete": {
+        "TableName": history_table_name,
+        "Key": {
+            "user_id": _serializer.serialize(item["user_id"]),
+            "joined_at": _serializer.serialize(item["joined_at"]),
+        },
+        # 同時に別の削除が走っても二重に引かないよう、行がある時だけ
+        "ConditionExpression": "attribute_exists(user_id)",
+    }}]
+
+    delta = ledger_balance_delta(item)
+    if delta:
+        adds = ", ".join(f"{k} :{k}" for k in delta)
+        values = {f":{k}": _serializer.serialize(-v) for k, v in delta.items()}
+        values[":one"] = {"N": "1"}
+        values[":now"] = {"S": _now_iso()}
+        tx_items.append({"Update": {
+            "TableName": POINT_BALANCE_TABLE,
+            "Key": {"user_id": {"S": str(item["user_id"])}},
+            "UpdateExpression": f"ADD {adds}, ledger_version :one SET ledger_updated_at = :now",
+            "ExpressionAttributeValues": values,
+        }})
+    return tx_items
+
+
+def delete_ledger_item(history_table, item):
+    """
+    bad-users-history の1行を消し、ポイント対象行なら台帳集計（ledger_*）からも
+    同じトランザクションで引く。対象外の行は普通の delete_item。
+    """
+    if not ledger_balance_delta(item):
+        history_table.delete_item(Key={"user_id": item["user_id"], "joined_at": item["joined_at"]})
+        return
+
+    history_table.meta.client.transact_write_items(
+        TransactItems=ledger_delete_tx_items(history_table.name, item)
     )
 
+
+def put_ledger_item(history_table, item, condition=None):
+    """
+    bad-users-history に1行書き、基準日以降のポイント対象行なら
+    ugu_points_v2 の台帳集計（ledger_*）も同じトランザクションで ADD する。
+    対象外の行（キャンセル・たら等）は普通の put_item。
+    """
+    if not ledger_balance_delta(item):
+        kwargs = {"Item": item}
+        if condition:
+            kwargs["ConditionExpression"] = condition
+        history_table.put_item(**kwargs)
+        return
+
+    history_table.meta.client.transact_write_items(
+        TransactItems=ledger_tx_items(history_table.name, item, condition)
+    )
+
+
+def put_point_tx(table, item):
+    put_ledger_item(table, item, condition=TX_UNIQUE_CONDITION)
+
 def record_earn(table, *, user_id: str, points: int, event_date: str,
                 reason=None, source=None, schedule_id=None, created_by=None, meta=None):
     put_point_tx(table, build_point_tx(
@@ -72,13 +168,13 @@ def record_spend(history_table, *, user_id: str, points_used: int,
         "event_date": event_date,
         "reason": reason or f"{event_date}の参加費",
         "created_at": now,
+        "paid_at": now,                      # 支払い確定時刻
         "entity_type": "point_transaction",
         "version": 1,
     }
+    if created_by is not None:
+        item["created_by"] = created_by
 
-    # 一意化（同じPK/SKの重複防止）
-    history_table.put_item(
-        Item=item,
-        ConditionExpression="attribute_not_exists(user_id) AND attribute_not_exists(joined_at)"
-    )
-    return item
\ No newline at end of file
+    # 一意化（同じPK/SKの重複防止）+ 台帳集計の更新
+    put_point_tx(history_table, item)
+    return item
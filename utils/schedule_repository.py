@@ -0,0 +1,131 @@
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import boto3
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+from utils.timezone import JST
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_STATUS_INDEX = "status-date-index"   # PK=status, SK=date（create_gsi_schedule_status.py で作成）
+ACTIVE = "active"
+_INDEX_RETRY_SEC = 300
+
+
+class ScheduleRepository:
+    """
+    bad_schedules を日付範囲で読むためのリポジトリ
+
+    - status-date-index（GSI）を status=active + date の範囲で Query する（LastEvaluatedKey を最後まで辿る）
+    - upcoming(limit): 今日以降を日付順に limit 件
+    - month(year, month) / range(start, end): その期間だけ
+    - GSI が無い/作成中の環境では、同じ条件の FilterExpression 付き Scan（ページング込み）に戻す
+    返すのは bad_schedules の生アイテム（表示用の整形は utils/db 側）
+    """
+
+    def __init__(self):
+        self._table = None
+        self._lock = threading.Lock()
+        self._index_missing_at = None
+        self.queries = 0
+        self.scans = 0
+
+    # ---------------------------------------------
+    # 取得
+    # ---------------------------------------------
+    def upcoming(self, limit=None, today=None) -> list:
+        """今日（JST）以降のアクティブなスケジュールを日付の昇順で（limit 指定時は最大 limit 件）"""
+        start = _iso(today or datetime.now(JST).date())
+        return self._query(Key("status").eq(ACTIVE) & Key("date").gte(start),
+                           Attr("date").gte(start), limit=limit)
+
+    def month(self, year: int, month: int) -> list:
+        """指定月のアクティブなスケジュール（カレンダー1か月分）"""
+        first = date(year, month, 1)
+        last = (first.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+        return self.range(first, last)
+
+    def range(self, start=None, end=None) -> list:
+        """start〜end（両端含む、None は無制限）のアクティブなスケジュールを日付の昇順で"""
+        start_s = _iso(start) if start else None
+        end_s = _iso(end) if end else None
+
+        key = Key("status").eq(ACTIVE)
+        filt = None
+        if start_s and end_s:
+            key &= Key("date").between(start_s, end_s)
+            filt = Attr("date").between(start_s, end_s)
+        elif start_s:
+            key &= Key("date").gte(start_s)
+            filt = Attr("date").gte(start_s)
+        elif end_s:
+            key &= Key("date").lte(end_s)
+            filt = Attr("date").lte(end_s)
+        return self._query(key, filt)
+
+    def stats(self) -> dict:
+        return {"queries": self.queries, "scans": self.scans,
+                "index_available": self._index_missing_at is None}
+
+    # ---------------------------------------------
+    # 内部
+    # ---------------------------------------------
+    def _get_table(self):
+        with self._lock:
+            if self._table is None:
+                region = os.getenv('AWS_REGION', 'ap-northeast-1')
+                table_name = os.getenv('DYNAMODB_TABLE_NAME', 'bad_schedules')
+                self._table = boto3.resource('dynamodb', region_name=region).Table(table_name)
+            return self._table
+
+    def _query(self, key_condition, date_filter, limit=None) -> list:
+        table = self._get_table()
+        items = None
+
+        if self._index_missing_at is None or time.monotonic() - self._index_missing_at > _INDEX_RETRY_SEC:
+            try:
+                kwargs = {"IndexName": SCHEDULE_STATUS_INDEX, "KeyConditionExpression": key_condition}
+                if limit:
+                    kwargs["Limit"] = limit
+                items = self._paginate(table.query, kwargs, limit)
+                self.queries += 1
+                self._index_missing_at = None
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in ("ValidationException", "ResourceNotFoundException"):
+                    raise
+                self._index_missing_at = time.monotonic()
+                logger.warning("[schedules] %s が使えないため Scan します: %s", SCHEDULE_STATUS_INDEX, e)
+
+        if items is None:
+            # status 未設定の古い行は active 扱い（従来の get_schedules_with_formatting と同じ）
+            filt = Attr("status").eq(ACTIVE) | Attr("status").not_exists()
+            if date_filter is not None:
+                filt = filt & date_filter
+            items = self._paginate(table.scan, {"FilterExpression": filt}, None)
+            self.scans += 1
+
+        items.sort(key=lambda s: s.get("date", ""))
+        return items[:limit] if limit else items
+
+    @staticmethod
+    def _paginate(op, kwargs, limit):
+        items = []
+        while True:
+            resp = op(**kwargs)
+            items.extend(resp.get("Items", []))
+            lek = resp.get("LastEvaluatedKey")
+            if not lek or (limit and len(items) >= limit):
+                return items
+            kwargs["ExclusiveStartKey"] = lek
+
+
+def _iso(d) -> str:
+    return d.isoformat() if isinstance(d, (date, datetime)) else str(d)[:10]
+
+
+schedule_repository = ScheduleRepository()
@@ -0,0 +1,230 @@
+"""
+練習会の座席予約（bad_schedules.participants）を条件付き更新で行う
+
+join_schedule は以前「スケジュールを読む → Python でリストを書き換える → リストごと上書き」だったため、
+募集開始直後の同時申し込みで後勝ちの上書きが起き、参加が消えることがあった。
+ここでは参加者リストの読み書きを DynamoDB 側の条件式で行う。
+
+- reserve_seat: 「未参加」かつ「定員未満（adjusted_max > 0 ならそれ、なければ max_participants、無ければ 15）」の
+  ときだけ list_append。履歴の Put・台帳集計・practice_count の加算（extra_tx_items）も同じトランザクション
+- release_seat: participants[i] が本人であることを条件に REMOVE（位置がずれていたら読み直して再試行）
+- 条件不成立時は ReturnValuesOnConditionCheckFailure=ALL_OLD で返る現在の値から、
+  「既に参加済み / 満員 / スケジュール無し / 未参加」を判定する（事前の読み取りは不要）
+- 同じスケジュールへの同時トランザクションは TransactionConflict になるので、ジッター付きで再試行する
+"""
+
+import logging
+import random
+import time
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PARTICIPANTS = 15
+MAX_ATTEMPTS = 8
+
+NOT_FOUND = "not_found"
+FULL = "full"
+ALREADY_JOINED = "already_joined"
+NOT_JOINED = "not_joined"
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+_NAMES = {
+    "#sid": "schedule_id",
+    "#p": "participants",
+    "#pc": "participants_count",
+    "#am": "adjusted_max",
+    "#mp": "max_participants",
+    "#ua": "updated_at",
+}
+
+_HAS_ROOM = "(attribute_not_exists(#p) OR size(#p) < {limit})"
+RESERVE_CONDITION = (
+    "attribute_exists(#sid) AND NOT contains(#p, :uid) AND ("
+    f"(attribute_exists(#am) AND #am > :zero AND {_HAS_ROOM.format(limit='#am')})"
+    " OR ((attribute_not_exists(#am) OR #am <= :zero) AND ("
+    f"(attribute_exists(#mp) AND #mp > :zero AND {_HAS_ROOM.format(limit='#mp')})"
+    f" OR ((attribute_not_exists(#mp) OR #mp <= :zero) AND {_HAS_ROOM.format(limit=':default_max')})"
+    ")))"
+)
+
+
+class SeatConflict(Exception):
+    """予約/取り消しの条件が成立しなかった（reason は FULL / ALREADY_JOINED / NOT_FOUND / NOT_JOINED）"""
+
+    def __init__(self, reason, item=None, failed_index=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.item = item or {}
+        self.failed_index = failed_index
+
+
+def _key(schedule_id, date):
+    return {"schedule_id": {"S": str(schedule_id)}, "date": {"S": str(date)}}
+
+
+def _values(**kwargs):
+    return {f":{k}": _serializer.serialize(v) for k, v in kwargs.items()}
+
+
+def _transact(client, tx_items):
+    """
+    TransactionConflict は再試行し、条件不成立は (index, 現在の値) を返す
+    Returns: None（成功）/ (failed_index, item)
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            client.transact_write_items(TransactItems=tx_items)
+            return None
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code != "TransactionCanceledException":
+                raise
+            reasons = e.response.get("CancellationReasons") or []
+            for i, r in enumerate(reasons):
+                if r.get("Code") == "ConditionalCheckFailed":
+                    raw = r.get("Item") or {}
+                    return i, {k: _deserializer.deserialize(v) for k, v in raw.items()}
+            if not any(r.get("Code") == "TransactionConflict" for r in reasons) or attempt == MAX_ATTEMPTS - 1:
+                raise
+        time.sleep(random.uniform(0, 0.02 * (2 ** attempt)))
+
+
+def reserve_seat(client, table_name, schedule_id, date, user_id, extra_tx_items=(), now_iso=""):
+    """
+    participants に user_id を追加（定員・重複はサーバー側で判定）
+    extra_tx_items: 同じトランザクションに入れる項目（履歴の Put / practice_count の Update 等）
+    失敗時は SeatConflict
+    """
+    update = {
+        "TableName": table_name,
+        "Key": _key(schedule_id, date),
+        "UpdateExpression": "SET #p = list_append(if_not_exists(#p, :empty), :me), #ua = :ua ADD #pc :one",
+        "ConditionExpression": RESERVE_CONDITION,
+        "ExpressionAttributeNames": _NAMES,
+        "ExpressionAttributeValues": _values(
+            empty=[], me=[str(user_id)], uid=str(user_id), ua=now_iso, one=1, zero=0,
+            default_max=DEFAULT_MAX_PARTICIPANTS,
+        ),
+        "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
+    }
+    failed = _transact(client, [{"Update": update}, *extra_tx_items])
+    if failed is None:
+        return
+
+    index, item = failed
+    if index != 0:
+        raise SeatConflict(None, item, failed_index=index)
+    if not item:
+        raise SeatConflict(NOT_FOUND)
+    if str(user_id) in (item.get("participants") or []):
+        raise SeatConflict(ALREADY_JOINED, item)
+    raise SeatConflict(FULL, item)
+
+
+def release_seat(client, table_name, schedule_id, date, user_id, current=None, extra_tx_items=(), now_iso=""):
+    """
+    participants から user_id を取り除く（participants[i] = user_id を条件に REMOVE）
+    current: 直前に分かっている現在の値（reserve_seat の SeatConflict.item 等）。無ければ1回読む
+    """
+    item = current
+    for _ in range(MAX_ATTEMPTS):
+        if item is None:
+            resp = client.get_item(
+                TableName=table_name,
+                Key=_key(schedule_id, date),
+                ProjectionExpression="#p",
+                ExpressionAttributeNames={"#p": "participants"},
+                ConsistentRead=True,
+            )
+            raw = resp.get("Item")
+            if raw is None:
+                raise SeatConflict(NOT_FOUND)
+            item = {k: _deserializer.deserialize(v) for k, v in raw.items()}
+
+        participants = [str(p) for p in item.get("participants") or []]
+        if str(user_id) not in participants:
+            raise SeatConflict(NOT_JOINED, item)
+        pos = participants.index(str(user_id))
+
+        update = {
+            "TableName": table_name,
+            "Key": _key(schedule_id, date),
+            # リストの位置は式に直接書く（プレースホルダは使えない）
+            "UpdateExpression": f"REMOVE #p[{pos}] SET #ua = :ua ADD #pc :minus",
+            "ConditionExpression": f"#p[{pos}] = :uid",
+            "ExpressionAttributeNames": {"#p": "participants", "#pc": "participants_count", "#ua": "updated_at"},
+            "ExpressionAttributeValues": _values(uid=str(user_id), ua=now_iso, minus=-1),
+            "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
+        }
+        failed = _transact(client, [{"Update": update}, *extra_tx_items])
+        if failed is None:
+            return
+        index, item = failed
+        if index != 0:
+            raise SeatConflict(None, item, failed_index=index)
+        if not item:
+            raise SeatConflict(NOT_FOUND)
+        # 他の人の取り消しで位置がずれた → 返ってきた値で再試行
+
+    raise SeatConflict(NOT_JOINED, item)
+
+
+def remove_from_list(client, table_name, schedule_id, date, attr, user_id, item):
+    """tara_participants などのリストから user_id を取り除く（位置を条件に、ずれたら再試行）"""
+    for _ in range(MAX_ATTEMPTS):
+        values = [str(v) for v in item.get(attr) or []]
+        if str(user_id) not in values:
+            return False
+        pos = values.index(str(user_id))
+        try:
+            client.update_item(
+                TableName=table_name,
+                Key=_key(schedule_id, date),
+                UpdateExpression=f"REMOVE #a[{pos}]",
+                ConditionExpression=f"#a[{pos}] = :uid",
+                ExpressionAttributeNames={"#a": attr},
+                ExpressionAttributeValues=_values(uid=str(user_id)),
+            )
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            item = read_seats(client, table_name, schedule_id, date)
+    logger.warning("[seat] %s から %s を外せませんでした (schedule_id=%s)", attr, user_id, schedule_id)
+    return False
+
+
+def read_seats(client, table_name, schedule_id, date):
+    """確定後の参加者・たら・人数（強い整合性の読み取り、必要な属性だけ）"""
+    resp = client.get_item(
+        TableName=table_name,
+        Key=_key(schedule_id, date),
+        ProjectionExpression="#p, #t, #pc",
+        ExpressionAttributeNames={"#p": "participants", "#t": "tara_participants", "#pc": "participants_count"},
+        ConsistentRead=True,
+    )
+    return {k: _deserializer.deserialize(v) for k, v in (resp.get("Item") or {}).items()}
+
+
+def repair_participants_count(client, table_name, schedule_id, date, item):
+    """participants_count が実際の人数とずれていたら（移行前のデータ等）揃える"""
+    n = len(item.get("participants") or [])
+    if int(item.get("participants_count", -1)) == n:
+        return
+    try:
+        client.update_item(
+            TableName=table_name,
+            Key=_key(schedule_id, date),
+            UpdateExpression="SET #pc = :n",
+            ConditionExpression="size(#p) = :n",
+            ExpressionAttributeNames={"#p": "participants", "#pc": "participants_count"},
+            ExpressionAttributeValues=_values(n=n),
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
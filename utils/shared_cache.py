@@ -0,0 +1,228 @@
+import functools
+import logging
+import os
+import threading
+import uuid
+from collections import Counter
+
+from cachelib import SimpleCache
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class SharedCache:
+    """
+    gunicorn の複数ワーカーで共有するキャッシュ層
+
+    - 実体は Flask-Caching の backend（CACHE_TYPE で切り替え）
+      - FileSystemCache: 同じホストのワーカー間で共有（CACHE_DIR）
+      - RedisCache: CACHE_REDIS_URL=unix:///path/to/redis.sock のようにローカルソケットでも可
+      - SimpleCache: プロセス内（init_app 前/単体スクリプトではこれをプロセス内の代役として使う）
+    - キーは「名前空間:バージョン:キー」。bump(ns) でバージョン（ランダムなトークン）を差し替えると
+      その名前空間の古いキーはどのワーカーからも参照されなくなる（削除はせず TTL で消える）
+    - publish / changes_since: 名前空間ごとの変更ログ（どのIDが変わったか）を他ワーカーへ伝える
+      （各トークンの後継を1件だけ確保する鎖。確保できない backend で枝分かれしたら changes_since が None を返す）
+    - ヒット率は名前空間の先頭（"frag:s:..." なら "frag"）ごとに数える（プロセス単位）
+    """
+
+    VERSION_KEY = "__v__"
+    LOG_MAX_STEPS = 64
+
+    def __init__(self, backend=None, prefix: str = "shared:", default_timeout: int = 600):
+        self._backend = backend
+        self.prefix = prefix
+        self.default_timeout = default_timeout
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+        self.bumps = Counter()
+
+    def init_app(self, app, cache):
+        """Flask-Caching の backend を共有する（cache.init_app の後に呼ぶ）"""
+        self._backend = cache.cache
+        self.default_timeout = app.config.get("CACHE_DEFAULT_TIMEOUT", self.default_timeout)
+        logger.info("[SharedCache] backend=%s", type(self._backend).__name__)
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = SimpleCache(threshold=2048, default_timeout=self.default_timeout)
+        return self._backend
+
+    # ---------------------------------------------
+    # バージョン
+    # ---------------------------------------------
+    def _vkey(self, ns):
+        return f"{self.prefix}{ns}:{self.VERSION_KEY}"
+
+    def version(self, ns: str) -> str:
+        token = self.backend.get(self._vkey(ns))
+        if token is None:
+            token = uuid.uuid4().hex
+            # 同時に作られた場合は先に書かれた方を使う
+            if not self._claim(self._vkey(ns), token, 0):
+                token = self.backend.get(self._vkey(ns)) or token
+        return token
+
+    def bump(self, ns: str) -> str:
+        """名前空間を無効化する（新しいトークンを書くだけなので競合しても無効化は失われない）"""
+        token = uuid.uuid4().hex
+        self.backend.set(self._vkey(ns), token, timeout=0)
+        self.bumps[_group(ns)] += 1
+        return token
+
+    # ---------------------------------------------
+    # 値
+    # ---------------------------------------------
+    def _key(self, ns, key, version=None):
+        return f"{self.prefix}{ns}:{version or self.version(ns)}:{key}"
+
+    def get(self, ns: str, key: str, default=None):
+        value = self.backend.get(self._key(ns, key))
+        if value is None:
+            self.misses[_group(ns)] += 1
+            return default
+        self.hits[_group(ns)] += 1
+        return value
+
+    def set(self, ns: str, key: str, value, timeout=None):
+        self.backend.set(self._key(ns, key), value,
+                         timeout=self.default_timeout if timeout is None else timeout)
+
+    def get_or_set(self, ns: str, key: str, build, timeout=None):
+        value = self.get(ns, key, _MISSING)
+        if value is _MISSING:
+            value = build()
+            if value is not None:
+                self.set(ns, key, value, timeout)
+        return value
+
+    def memoize(self, ns: str, timeout=None):
+        """関数の結果を ns に置く（引数の repr をキーにする）。bump(ns) で全引数分まとめて無効化"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                key = f"{fn.__module__}.{fn.__qualname__}:{args!r}:{sorted(kwargs.items())!r}"
+                return self.get_or_set(ns, key, lambda: fn(*args, **kwargs), timeout)
+            wrapper.uncached = fn
+            return wrapper
+        return decorator
+
+    # ---------------------------------------------
+    # 変更ログ
+    # ---------------------------------------------
+    def _log_key(self, ns, token):
+        return f"{self.prefix}{ns}:log:{token}"
+
+    def _next_key(self, ns, token):
+        return f"{self.prefix}{ns}:next:{token}"
+
+    def _claim(self, key, value, timeout):
+        """key がまだ無ければ value を書いて True（複数ワーカーが同時に呼んでも成功するのは1件だけ）"""
+        get_filename = getattr(self.backend, "_get_filename", None)
+        if get_filename is None:
+            # RedisCache は SETNX、SimpleCache はプロセス内なので add で足りる
+            return self.backend.add(key, value, timeout=timeout)
+        # FileSystemCache.add は存在確認と書き込みの間に隙間があるので、
+        # 一時キーに書いてから os.link で置く（既にあれば FileExistsError になり、link 自体は原子的）
+        tmp = f"{key}:claim:{uuid.uuid4().hex}"
+        if not self.backend.set(tmp, value, timeout=timeout):
+            return False
+        try:
+            os.link(get_filename(tmp), get_filename(key))
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            self.backend.delete(tmp)
+
+    def _tail(self, ns, token):
+        """token から後継を辿った鎖の末尾"""
+        for _ in range(self.LOG_MAX_STEPS):
+            nxt = self.backend.get(self._next_key(ns, token))
+            if nxt is None:
+                break
+            token = nxt
+        return token
+
+    def publish(self, ns: str, ids) -> str:
+        """
+        ids が変わったことを記録して名前空間のバージョンを進める
+
+        ログは1本の鎖にする: 各トークンの後ろに繋げるのは「後継」を _claim で確保できた1件だけ。
+        別のワーカーが同じ prev から先に publish していたら、その後継を辿って末尾に繋ぐ
+        （read-then-set だと同じ prev から枝分かれし、負けた方の ids が読まれなくなる）
+        """
+        ids = sorted({str(i) for i in ids if i})
+        timeout = self.default_timeout * 6
+        token = uuid.uuid4().hex
+        prev = self.version(ns)
+        for _ in range(self.LOG_MAX_STEPS):
+            self.backend.set(self._log_key(ns, token), (prev, ids), timeout=timeout)
+            if self._claim(self._next_key(ns, prev), token, timeout):
+                break
+            prev = self._tail(ns, self.backend.get(self._next_key(ns, prev)) or self.version(ns))
+        else:
+            # 繋げなかった（想定外）。読む側は changes_since で枝を検出して全件読み直しになる
+            logger.warning("[SharedCache] publish: 変更ログに繋げませんでした ns=%s", ns)
+
+        self.backend.set(self._vkey(ns), token, timeout=0)
+        # 後ろの publish が先にバージョンを書いていたら、古い方に戻さないよう末尾まで進める
+        tail = self._tail(ns, token)
+        if tail != token:
+            self.backend.set(self._vkey(ns), tail, timeout=0)
+        self.bumps[_group(ns)] += 1
+        return tail
+
+    def changes_since(self, ns: str, seen: str):
+        """
+        seen 以降に publish された ID を返す: (現在のトークン, ids)
+        ログを辿れなかった（期限切れ・bump・枝分かれ）ときは ids=None（呼び出し側で全件読み直す）
+        """
+        current = self.version(ns)
+        if seen is None:
+            return current, None
+        if current == seen:
+            return current, set()
+
+        changed = set()
+        token = current
+        for _ in range(self.LOG_MAX_STEPS):
+            entry = self.backend.get(self._log_key(ns, token))
+            if entry is None:
+                return current, None
+            prev, ids = entry
+            # prev の後継として確保されたのが自分でなければ枝分かれ（add が原子的でない backend 等）
+            if self.backend.get(self._next_key(ns, prev)) != token:
+                return current, None
+            changed.update(ids)
+            if prev == seen:
+                return current, changed
+            token = prev
+        return current, None
+
+    # ---------------------------------------------
+    # メトリクス
+    # ---------------------------------------------
+    def stats(self) -> dict:
+        groups = {}
+        for group in sorted(set(self.hits) | set(self.misses) | set(self.bumps)):
+            total = self.hits[group] + self.misses[group]
+            groups[group] = {
+                "hits": self.hits[group],
+                "misses": self.misses[group],
+                "hit_rate": round(self.hits[group] / total, 3) if total else None,
+                "bumps": self.bumps[group],
+            }
+        return {"backend": type(self.backend).__name__, "namespaces": groups}
+
+
+def _group(ns: str) -> str:
+    return ns.split(":", 1)[0]
+
+
+shared_cache = SharedCache()
@@ -0,0 +1,245 @@
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, has_app_context
+
+from utils.shared_cache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+BATCH_GET_LIMIT = 100
+
+
+class UserDirectory:
+    """
+    bad-users の BatchGet を一本化するサービス
+
+    - プロセス内キャッシュ（TTL + LRU）
+    - リクエスト内の重複排除（flask.g に同一リクエストで取得済みのユーザーを保持）
+    - 100件ずつの分割と UnprocessedKeys の指数バックオフ再試行
+    - 更新系からの明示的な invalidate()（SharedCache の "users" 変更ログにも載せ、他ワーカーでもそのユーザーだけ捨てさせる）
+
+    キャッシュ済みのユーザーは DynamoDB に問い合わせないので、
+    温まった状態ではトップページ・カレンダーの描画は最大1往復で済む。
+    """
+
+    def __init__(self, ttl: float = 120.0, maxsize: int = 2048,
+                 max_retries: int = 6, base_delay: float = 0.05, max_delay: float = 1.6):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._cache = OrderedDict()  # user_id -> (expires_at, item)
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._shared_version = None
+        self.hits = 0
+        self.misses = 0
+        self.round_trips = 0
+
+    # ---------------------------------------------
+    # 取得
+    # ---------------------------------------------
+    def get(self, user_id):
+        """1ユーザー取得（存在しなければ None）"""
+        if not user_id:
+            return None
+        return self.get_many([user_id]).get(str(user_id))
+
+    def get_many(self, user_ids, fresh: bool = False) -> dict:
+        """
+        user_id -> bad-users アイテム の dict を返す
+        存在しないユーザーは含まれない（呼び出し側で「削除されたユーザー」等に振り分ける）
+
+        fresh=True のときはキャッシュを使わず必ず DynamoDB から読む（取得結果でキャッシュは更新する）。
+        スキル計算のように古い値を使うと困る処理向け。
+        """
+        ids = []
+        seen = set()
+        for uid in user_ids or []:
+            if not uid:
+                continue
+            s = str(uid)
+            if s not in seen:
+                seen.add(s)
+                ids.append(s)
+
+        if not ids:
+            return {}
+
+        result = {}
+        request_memo = self._request_memo()
+
+        # 1) リクエスト内メモ
+        pending = []
+        for uid in ids:
+            if not fresh and request_memo is not None and uid in request_memo:
+                if request_memo[uid] is not None:
+                    result[uid] = request_memo[uid]
+            else:
+                pending.append(uid)
+
+        # 2) プロセス内キャッシュ（他ワーカーで更新されたユーザーは先に落とす）
+        self._sync_shared_version()
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for uid in pending:
+                entry = self._cache.get(uid)
+                if entry and entry[0] > now and not fresh:
+                    self._cache.move_to_end(uid)
+                    result[uid] = entry[1]
+                    self.hits += 1
+                else:
+                    if entry:
+                        del self._cache[uid]
+                    missing.append(uid)
+                    self.misses += 1
+
+        # 3) DynamoDB
+        if missing:
+            fetched = self._batch_get(missing)
+            expires_at = time.monotonic() + self.ttl
+            with self._lock:
+                for uid, item in fetched.items():
+                    self._cache[uid] = (expires_at, item)
+                    self._cache.move_to_end(uid)
+                while len(self._cache) > self.maxsize:
+                    self._cache.popitem(last=False)
+            result.update(fetched)
+
+        if request_memo is not None:
+            for uid in pending:
+                request_memo[uid] = result.get(uid)
+
+        # 呼び出し側が dict を書き換えてもキャッシュを汚さないようにコピーで返す
+        return {uid: dict(item) for uid, item in result.items()}
+
+    # ---------------------------------------------
+    # 無効化
+    # ---------------------------------------------
+    def invalidate(self, *user_ids):
+        """更新したユーザーをキャッシュから落とす"""
+        request_memo = self._request_memo()
+        with self._lock:
+            for uid in user_ids:
+                if uid:
+                    self._cache.pop(str(uid), None)
+        if request_memo is not None:
+            for uid in user_ids:
+                if uid:
+                    request_memo.pop(str(uid), None)
+        for listener in self._listeners:
+            try:
+                listener(*user_ids)
+            except Exception as e:
+                logger.warning("[UserDirectory] invalidate リスナーでエラー: %s", e)
+        try:
+            shared_cache.publish("users", user_ids)
+        except Exception as e:
+            logger.warning("[UserDirectory] 変更ログの書き込みに失敗: %s", e)
+
+    def add_invalidation_listener(self, fn):
+        """invalidate() されたユーザーIDを受け取るコールバックを登録（スナップショット等の差分更新用）"""
+        self._listeners.append(fn)
+
+    def invalidate_all(self):
+        with self._lock:
+            self._cache.clear()
+        if has_app_context():
+            g.pop("_user_directory_memo", None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._cache)
+        total = self.hits + self.misses
+        return {
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+            "round_trips": self.round_trips,
+        }
+
+    # ---------------------------------------------
+    # 内部
+    # ---------------------------------------------
+    def _request_memo(self):
+        if not has_app_context():
+            return None
+        memo = g.get("_user_directory_memo")
+        if memo is None:
+            memo = {}
+            g._user_directory_memo = memo
+        return memo
+
+    def _sync_shared_version(self):
+        """他ワーカーが invalidate() したユーザーだけ落とす（変更ログを辿れない時だけ丸ごと捨てる）"""
+        if self._shared_version is None:
+            try:
+                self._shared_version = shared_cache.version("users")
+            except Exception as e:
+                logger.warning("[UserDirectory] 共有キャッシュのバージョン取得に失敗: %s", e)
+            return
+        try:
+            version, changed = shared_cache.changes_since("users", self._shared_version)
+        except Exception as e:
+            logger.warning("[UserDirectory] 変更ログの取得に失敗: %s", e)
+            return
+        if version == self._shared_version:
+            return
+        with self._lock:
+            if changed is None:
+                self._cache.clear()
+            else:
+                for uid in changed:
+                    self._cache.pop(str(uid), None)
+            self._shared_version = version
+
+    def _table_name(self):
+        return current_app.config.get("TABLE_NAME_USER") or "bad-users"
+
+    def _batch_get(self, user_ids) -> dict:
+        table_name = self._table_name()
+        dynamodb = current_app.dynamodb
+        found = {}
+
+        for i in range(0, len(user_ids), BATCH_GET_LIMIT):
+            chunk = user_ids[i:i + BATCH_GET_LIMIT]
+            request_items = {table_name: {"Keys": [{"user#user_id": uid} for uid in chunk]}}
+
+            for attempt in range(self.max_retries + 1):
+                try:
+                    resp = dynamodb.batch_get_item(RequestItems=request_items)
+                except Exception as e:
+                    logger.error("[UserDirectory] batch_get_item エラー: %s", e)
+                    break
+                self.round_trips += 1
+
+                for item in resp.get("Responses", {}).get(table_name, []):
+                    uid = item.get("user#user_id")
+                    if uid:
+                        found[uid] = item
+
+                request_items = resp.get("UnprocessedKeys") or {}
+                if not request_items:
+                    break
+
+                if attempt == self.max_retries:
+                    left = len(request_items.get(table_name, {}).get("Keys", []))
+                    logger.warning("[UserDirectory] 未処理キーが残りました: %d件", left)
+                    break
+
+                # 指数バックオフ（full jitter）
+                delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+                time.sleep(random.uniform(0, delay))
+
+        return found
+
+
+user_directory = UserDirectory()
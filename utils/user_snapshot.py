@@ -0,0 +1,201 @@
+import logging
+import sys
+import threading
+import time
+from decimal import Decimal
+
+from flask import current_app
+
+from utils.shared_cache import shared_cache
+from utils.user_directory import user_directory
+
+logger = logging.getLogger(__name__)
+
+
+class UserRecord:
+    """スナップショット1件分（id / 表示名 / スキルだけを持つ軽量レコード）"""
+
+    __slots__ = ("user_id", "display_name", "skill_score")
+
+    def __init__(self, user_id: str, display_name: str, skill_score):
+        self.user_id = user_id
+        self.display_name = display_name
+        self.skill_score = skill_score
+
+    @classmethod
+    def from_item(cls, item: dict):
+        raw_score = item.get("skill_score")
+        if isinstance(raw_score, (int, float, Decimal)):
+            skill_score = int(raw_score)
+        else:
+            skill_score = None
+        return cls(item.get("user#user_id"), item.get("display_name", "名前なし"), skill_score)
+
+    def to_dict(self) -> dict:
+        return {
+            "user_id": self.user_id,
+            "display_name": self.display_name,
+            "skill_score": self.skill_score,
+        }
+
+
+class UserSnapshot:
+    """
+    bad-users 全体の軽量スナップショット
+
+    - 初回（と full_refresh_interval 経過後）だけ LastEvaluatedKey を辿って全件scan
+    - それ以外は変更ログ（UserDirectory.invalidate で通知されたユーザーID）だけを
+      BatchGet で取り直す差分更新
+    - 他のワーカーでの更新は SharedCache の "users" 変更ログから取り込む（ログを辿れなければ全件scan）
+    - バッチスクリプトからの更新は次回の全件scanで取り込む
+    """
+
+    PROJECTION = "#uid, display_name, skill_score"
+
+    def __init__(self, full_refresh_interval: float = 3600.0):
+        self.full_refresh_interval = full_refresh_interval
+
+        self._records = {}        # user_id -> UserRecord
+        self._dirty = set()       # 変更ログ（次回アクセス時に取り直すID）
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._shared_version = None
+
+        self.full_loads = 0
+        self.incremental_refreshes = 0
+        self.last_full_load = {}
+        self.last_incremental = {}
+
+    # ---------------------------------------------
+    # 参照
+    # ---------------------------------------------
+    def get(self, user_id):
+        self.ensure_fresh()
+        return self._records.get(user_id)
+
+    def as_dict(self) -> dict:
+        """旧 get_all_users_dict と同じ形の dict を返す"""
+        self.ensure_fresh()
+        with self._lock:
+            return {uid: rec.to_dict() for uid, rec in self._records.items()}
+
+    # ---------------------------------------------
+    # 更新
+    # ---------------------------------------------
+    def mark_dirty(self, *user_ids):
+        with self._lock:
+            self._dirty.update(str(u) for u in user_ids if u)
+
+    def ensure_fresh(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.full_refresh_interval:
+            self.full_load()
+            return
+
+        try:
+            version, changed = shared_cache.changes_since("users", self._shared_version)
+        except Exception as e:
+            logger.warning("[UserSnapshot] 変更ログの取得に失敗: %s", e)
+            version, changed = self._shared_version, set()
+        if version != self._shared_version:
+            if changed is None:
+                self.full_load()
+                return
+            self.mark_dirty(*changed)
+            self._shared_version = version
+        if self._dirty:
+            self.refresh_dirty()
+
+    def full_load(self):
+        start = time.perf_counter()
+        try:
+            shared_version = shared_cache.version("users")
+        except Exception:
+            shared_version = None
+        table = current_app.dynamodb.Table(current_app.config.get("TABLE_NAME_USER") or "bad-users")
+        kwargs = {
+            "ProjectionExpression": self.PROJECTION,
+            "ExpressionAttributeNames": {"#uid": "user#user_id"},
+        }
+
+        records = {}
+        pages = 0
+        while True:
+            resp = table.scan(**kwargs)
+            pages += 1
+            for item in resp.get("Items", []):
+                rec = UserRecord.from_item(item)
+                if rec.user_id:
+                    records[rec.user_id] = rec
+            lek = resp.get("LastEvaluatedKey")
+            if not lek:
+                break
+            kwargs["ExclusiveStartKey"] = lek
+
+        with self._lock:
+            self._records = records
+            self._dirty.clear()
+            self._loaded_at = time.monotonic()
+            self._shared_version = shared_version
+
+        self.full_loads += 1
+        self.last_full_load = {
+            "pages": pages,
+            "items": len(records),
+            "seconds": round(time.perf_counter() - start, 4),
+        }
+        logger.info("[UserSnapshot] 全件ロード: %d人 (%dページ, %.3f秒)",
+                    len(records), pages, self.last_full_load["seconds"])
+
+    def refresh_dirty(self):
+        start = time.perf_counter()
+        with self._lock:
+            dirty = list(self._dirty)
+            self._dirty.clear()
+        if not dirty:
+            return
+
+        items = user_directory.get_many(dirty)
+        with self._lock:
+            for uid in dirty:
+                item = items.get(uid)
+                if item:
+                    self._records[uid] = UserRecord.from_item(item)
+                else:
+                    # 削除されたユーザー
+                    self._records.pop(uid, None)
+
+        self.incremental_refreshes += 1
+        self.last_incremental = {
+            "items": len(dirty),
+            "seconds": round(time.perf_counter() - start, 4),
+        }
+
+    # ---------------------------------------------
+    # メトリクス
+    # ---------------------------------------------
+    def metrics(self) -> dict:
+        with self._lock:
+            records = list(self._records.values())
+            dirty = len(self._dirty)
+            loaded_at = self._loaded_at
+
+        approx_bytes = sys.getsizeof(self._records)
+        for rec in records:
+            approx_bytes += sys.getsizeof(rec) + sys.getsizeof(rec.user_id) + sys.getsizeof(rec.display_name)
+
+        return {
+            "records": len(records),
+            "dirty": dirty,
+            "approx_bytes": approx_bytes,
+            "age_seconds": round(time.monotonic() - loaded_at, 1) if loaded_at else None,
+            "full_loads": self.full_loads,
+            "incremental_refreshes": self.incremental_refreshes,
+            "last_full_load": self.last_full_load,
+            "last_incremental": self.last_incremental,
+        }
+
+
+user_snapshot = UserSnapshot()
+
+# ユーザー更新時の invalidate をそのまま変更ログとして受け取る
+user_directory.add_invalidation_listener(user_snapshot.mark_dirty)
@@ -0,0 +1,75 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class UserStatsCache:
+    """
+    get_user_stats（旧ルールのポイント計算）の結果キャッシュ
+
+    - キーは (用途, user_id)。値には「計算に使った履歴バージョン」と「計算日(JST)」を添える
+    - 取得時にバージョンか日付が違えば捨てて再計算させる
+      （参加・たら・キャンセル・ポイント支払い等で bad-users の stats_version が上がる）
+    - 日付をまたぐとリセット残日数や連続参加の判定が変わるので日付もキーの一部
+    - バージョンの付け忘れに備えて TTL でも期限切れにする
+    """
+
+    def __init__(self, ttl: float = 600.0, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._cache = OrderedDict()  # (kind, user_id) -> (expires_at, version, day, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind: str, user_id: str, version, day: str):
+        key = (kind, str(user_id))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and entry[0] > now and entry[1] == version and entry[2] == day:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return entry[3]
+            if entry:
+                del self._cache[key]
+            self.misses += 1
+            return None
+
+    def put(self, kind: str, user_id: str, version, day: str, value):
+        key = (kind, str(user_id))
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl, version, day, value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def invalidate(self, *user_ids):
+        """このプロセス内の該当ユーザー分を全用途まとめて落とす"""
+        targets = {str(u) for u in user_ids if u}
+        if not targets:
+            return
+        with self._lock:
+            for key in [k for k in self._cache if k[1] in targets]:
+                del self._cache[key]
+
+    def invalidate_all(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._cache)
+        total = self.hits + self.misses
+        return {
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
+
+
+user_stats_cache = UserStatsCache()